@@ -10,6 +10,8 @@ Released under GPL3
 """
 
 import os
+import json
+import numpy as np
 import pandas as pd
 import fiona
 from shapely.geometry import shape, Polygon, Point, LineString
@@ -371,11 +373,171 @@ def GetTicksForUTMNoInversion(FileName,x_max,x_min,y_max,y_min,n_target_tics):
 #==============================================================================
 
 
+#=============================================================================
+# CSV CACHE
+# LSDTopoTools csv files can be several GB. The first time one is read a binary
+# copy (feather if you have pyarrow, otherwise an npz of plain arrays) is written next to it and
+# that is read from then on, until the csv changes.
+#=============================================================================
+try:
+    import pyarrow as _pa
+    import pyarrow.feather as _feather
+except ImportError:
+    _pa = None
+
+# Coordinates keep double precision, a float32 northing is only good to half a metre
+_DOUBLE_PRECISION_COLUMNS = ("latitude", "longitude", "easting", "northing")
+
+def _CSVCacheName(csv_fname, float32):
+    """The name of the binary cache of a csv file"""
+    if float32:
+        suffix = ".f32"
+    else:
+        suffix = ""
+    if _pa is not None:
+        return csv_fname+".lsdcache"+suffix+".feather"
+    else:
+        return csv_fname+".lsdcache"+suffix+".npz"
+
+def _WriteNPZCache(df, cache_fname, source):
+    """
+    Writes a dataframe to a .npz file with a json manifest of the columns, for when
+    pyarrow isn't there. Nothing is pickled, so reading it back can't run any code.
+    Only numeric, boolean and datetime columns can be stored like this.
+
+    Returns:
+        bool: False if the dataframe has columns that can't be stored
+    """
+    arrays = {}
+    for i, column in enumerate(df.columns):
+        values = df[column].to_numpy()
+        if values.dtype.kind not in "biufcmM":
+            return False
+        arrays["column_"+str(i)] = values
+    manifest = {"source": source,
+                "columns": [str(column) for column in df.columns],
+                "dtypes": [df[column].dtype.str for column in df.columns]}
+    arrays["manifest"] = np.array(json.dumps(manifest))
+    with open(cache_fname, "wb") as cache_file:
+        np.savez(cache_file, **arrays)
+    return True
+
+def _ReadNPZCache(cache_fname, source, columns = None):
+    """
+    Reads a cache written by _WriteNPZCache, without allowing pickles.
+
+    Returns:
+        the dataframe, or None if the cache is for another version of the csv
+    """
+    with np.load(cache_fname, allow_pickle = False) as cache:
+        manifest = json.loads(str(cache["manifest"]))
+        if manifest["source"] != source:
+            return None
+        names = manifest["columns"]
+        if columns is None:
+            columns = names
+        data = {}
+        for column in columns:
+            i = names.index(column)
+            data[column] = cache["column_"+str(i)].astype(manifest["dtypes"][i], copy = False)
+    return pd.DataFrame(data)
+
+def SetCSVDtypes(df, float32 = False):
+    """
+    Makes integer columns int32 (if the values fit) and, if you want,
+    float columns float32, except the coordinates.
+
+    Args:
+        df (pandas dataframe): the dataframe. It is changed in place.
+        float32 (bool): if true, floats are converted to float32
+
+    Returns:
+        The dataframe
+
+    Author: SMM
+    """
+    for column in df.columns:
+        dtype = df[column].dtype
+        if pd.api.types.is_integer_dtype(dtype) and dtype.itemsize > 4:
+            values = df[column].values
+            if len(values) == 0 or (values.min() >= -2**31 and values.max() < 2**31):
+                df[column] = values.astype("int32")
+        elif float32 and pd.api.types.is_float_dtype(dtype) and dtype.itemsize > 4:
+            lower_name = str(column).lower()
+            if not any(name in lower_name for name in _DOUBLE_PRECISION_COLUMNS) and lower_name not in ("x", "y"):
+                df[column] = df[column].values.astype("float32")
+    return df
+
+def ReadCachedCSV(csv_fname, columns = None, float32 = False, use_cache = True):
+    """
+    Reads a csv file into a pandas dataframe through a binary cache.
+    The cache is written the first time the csv is read and is remade if the
+    modification time or size of the csv changes.
+    Integer columns are int32, and if float32 is true floats (other than coordinates) are float32.
+
+    Args:
+        csv_fname (str): the csv file with path
+        columns (list): the columns you want. None for all of them.
+        float32 (bool): if true, floats are converted to float32
+        use_cache (bool): if false, just read the csv
+
+    Returns:
+        pandas dataframe with the csv file
+
+    Author: SMM
+    """
+    if not use_cache:
+        return SetCSVDtypes(pd.read_csv(csv_fname, usecols=columns), float32)
+
+    stat = os.stat(csv_fname)
+    source = str(stat.st_mtime_ns)+" "+str(stat.st_size)
+    cache_fname = _CSVCacheName(csv_fname, float32)
+
+    # Try the cache
+    if os.path.isfile(cache_fname):
+        try:
+            if _pa is not None:
+                table = _feather.read_table(cache_fname, columns=columns, memory_map=True)
+                metadata = table.schema.metadata or {}
+                if metadata.get(b"lsdmt_source", b"").decode() == source:
+                    return table.to_pandas()
+            else:
+                df = _ReadNPZCache(cache_fname, source, columns)
+                if df is not None:
+                    return df
+        except Exception as e:
+            print("I couldn't read the cache of "+csv_fname+", I'll make it again: "+str(e))
+
+    # Read the csv and write the cache. The whole file is cached so any columns can come from it later.
+    df = SetCSVDtypes(pd.read_csv(csv_fname), float32)
+    tmp_fname = cache_fname+"."+str(os.getpid())+".tmp"
+    try:
+        if _pa is not None:
+            table = _pa.Table.from_pandas(df, preserve_index=False)
+            metadata = dict(table.schema.metadata or {})
+            metadata[b"lsdmt_source"] = source.encode()
+            _feather.write_feather(table.replace_schema_metadata(metadata), tmp_fname)
+        elif not _WriteNPZCache(df, tmp_fname, source):
+            # Some columns are text, these files are just read from the csv
+            tmp_fname = None
+        if tmp_fname is not None:
+            os.replace(tmp_fname, cache_fname)
+    except Exception as e:
+        print("I couldn't write the cache of "+csv_fname+": "+str(e))
+        if tmp_fname is not None and os.path.isfile(tmp_fname):
+            os.remove(tmp_fname)
+
+    if columns is not None:
+        df = df[list(columns)]
+    return df
+#=============================================================================
+
+
 #=============================================================================
 # CSV READERS
 # Read in the csv files to pandas dataframes
 #=============================================================================
-def ReadBaselevelKeysCSV(DataDirectory, fname_prefix):
+def ReadBaselevelKeysCSV(DataDirectory, fname_prefix, columns = None):
     """
     This function reads in the file with the suffix '__BaselevelKeys.csv'
     to a pandas dataframe
@@ -383,6 +545,7 @@ def ReadBaselevelKeysCSV(DataDirectory, fname_prefix):
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
 
     Returns:
         pandas dataframe with the csv file
@@ -393,11 +556,11 @@ def ReadBaselevelKeysCSV(DataDirectory, fname_prefix):
     baselevel_suffix = '_BaselevelKeys.csv'
     fname = fname_prefix+baselevel_suffix
     # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns)
 
     return df
 
-def ReadSourceKeysCSV(DataDirectory, fname_prefix):
+def ReadSourceKeysCSV(DataDirectory, fname_prefix, columns = None):
     """
     This function reads in the file with the suffix '_SourceKeys.csv'
     to a pandas dataframe
@@ -405,6 +568,7 @@ def ReadSourceKeysCSV(DataDirectory, fname_prefix):
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
 
     Returns:
         pandas dataframe with the csv file
@@ -416,11 +580,11 @@ def ReadSourceKeysCSV(DataDirectory, fname_prefix):
     source_keys_suffix = '_SourceKeys.csv'
     fname = fname_prefix+source_keys_suffix
     # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns)
 
     return df
 
-def ReadBasinInfoCSV(DataDirectory, fname_prefix):
+def ReadBasinInfoCSV(DataDirectory, fname_prefix, columns = None):
     """
     This function reads in the file with the suffix '_AllBasinsInfo.csv'
     to a pandas dataframe
@@ -428,6 +592,7 @@ def ReadBasinInfoCSV(DataDirectory, fname_prefix):
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
 
     Returns:
         pandas dataframe with the csv file
@@ -439,11 +604,11 @@ def ReadBasinInfoCSV(DataDirectory, fname_prefix):
     basin_suffix = '_AllBasinsInfo.csv'
     fname = fname_prefix+basin_suffix
     # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns)
 
     return df
 
-def ReadFullStatsCSV(DataDirectory, fname_prefix, m_over_n):
+def ReadFullStatsCSV(DataDirectory, fname_prefix, m_over_n, columns = None):
     """
     This function reads in the file with the suffix '_fullstats.csv'
     to a pandas dataframe. Must specify the m/n value as an argument
@@ -452,6 +617,7 @@ def ReadFullStatsCSV(DataDirectory, fname_prefix, m_over_n):
         DataDirectory: the data directory
         fname_prefix: the file name prefix
         m_over_n: the m/n value
+        columns: the columns you want, None for all of them
 
     Returns:
         pandas dataframe with the csv file
@@ -463,11 +629,11 @@ def ReadFullStatsCSV(DataDirectory, fname_prefix, m_over_n):
     fullstats_suffix = '_movernstats_%s_fullstats.csv' % m_over_n
     fname = fname_prefix+fullstats_suffix
     # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns)
 
     return df
 
-def ReadChiProfileCSV(DataDirectory, fname_prefix):
+def ReadChiProfileCSV(DataDirectory, fname_prefix, columns = None, float32 = False):
     """
     This function reads in the file with the suffix '_movern.csv', which
     contains the data for the full chi profiles, to a pandas dataframe.
@@ -475,6 +641,8 @@ def ReadChiProfileCSV(DataDirectory, fname_prefix):
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
+        float32: if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the csv file
@@ -496,10 +664,10 @@ def ReadChiProfileCSV(DataDirectory, fname_prefix):
         print("Reading the burned csv...")
 
     # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns, float32 = float32)
     return df
 
-def ReadBasinStatsCSV(DataDirectory, fname_prefix):
+def ReadBasinStatsCSV(DataDirectory, fname_prefix, columns = None):
     """
     This function reads in the file with the suffix '_disorder_basinstats.csv'
     to a pandas dataframe
@@ -507,6 +675,7 @@ def ReadBasinStatsCSV(DataDirectory, fname_prefix):
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
 
     Returns:
         pandas dataframe with the csv file
@@ -518,11 +687,11 @@ def ReadBasinStatsCSV(DataDirectory, fname_prefix):
     basin_stats_suffix = '_disorder_basinstats.csv'
     fname = fname_prefix+basin_stats_suffix
     # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns)
 
     return df
 
-def AppendBasinStatsCSVs(DataDirectory, FilenamePrefix):
+def AppendBasinStatsCSVs(DataDirectory, FilenamePrefix, n_workers = None, progress_hook = None):
     """
     This function reads in the files with the prefic "basin"
     and the suffix '_movernstats_basinstats.csv'
@@ -530,6 +699,8 @@ def AppendBasinStatsCSVs(DataDirectory, FilenamePrefix):
 
     Args:
         DataDirectory: the data directory
+        n_workers: the number of files read at once. Defaults to the number of CPUs.
+        progress_hook: called as progress_hook(n_done, n_files, fname, seconds) after each file is read
 
     Returns:
         pandas dataframe with the csv file
@@ -540,24 +711,11 @@ def AppendBasinStatsCSVs(DataDirectory, FilenamePrefix):
     # get the csv filename
     basin_stats_suffix = '_disorder_basinstats.csv'
 
-    # decclare empty data frame
-    MasterDF = pd.DataFrame()
-
-    # get the list of basins as a dict
-    basin_dict = MapBasinsToKeysFromJunctionList(DataDirectory,FilenamePrefix)
-
-    # loop through and get each basin csv
-    for outlet_jn, basin_key in basin_dict.iteritems():
-        print ((outlet_jn, basin_key))
-        this_fname = "basin"+str(outlet_jn)+basin_stats_suffix
-        df = pd.read_csv(DataDirectory+this_fname)
-        df = df[df['basin_key'] == 0]
-        df['basin_key'] = basin_key
-        MasterDF = MasterDF.append(df, ignore_index = True)
+    MasterDF = AppendBasinCSVsParallel(DataDirectory, FilenamePrefix, basin_stats_suffix, n_workers = n_workers, progress_hook = progress_hook)
 
     return MasterDF
 
-def ReadBasinStatsPointCSV(DataDirectory, fname_prefix):
+def ReadBasinStatsPointCSV(DataDirectory, fname_prefix, columns = None):
     """
     This function reads in the file with the suffix '_point_movernstats_basinstats.csv'
     to a pandas dataframe
@@ -565,6 +723,7 @@ def ReadBasinStatsPointCSV(DataDirectory, fname_prefix):
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
 
     Returns:
         pandas dataframe with the csv file
@@ -575,11 +734,11 @@ def ReadBasinStatsPointCSV(DataDirectory, fname_prefix):
     csv_suffix = '_point_movernstats_basinstats.csv'
     fname = fname_prefix+csv_suffix
     # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns)
 
     return df
 
-def ReadChainCSV(DataDirectory, fname_prefix, basin_key):
+def ReadChainCSV(DataDirectory, fname_prefix, basin_key, columns = None):
     """
     This function reads in the file with the suffix '_BasinX_chain.csv'
     to a pandas dataframe, where X is the basin key
@@ -588,6 +747,7 @@ def ReadChainCSV(DataDirectory, fname_prefix, basin_key):
         DataDirectory: the data directory
         fname_prefix: the file name prefix
         basin_key: the basin key
+        columns: the columns you want, None for all of them
 
     Returns:
         pandas dataframe with the csv file
@@ -598,11 +758,11 @@ def ReadChainCSV(DataDirectory, fname_prefix, basin_key):
     chain_suffix = '_Basin%s_chain.csv' %str(basin_key)
     fname = fname_prefix+chain_suffix
     # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns)
 
     return df
 
-def ReadMCPointsCSV(DataDirectory, fname_prefix):
+def ReadMCPointsCSV(DataDirectory, fname_prefix, columns = None):
     """
     This function reads in the file with the suffix
     '_MCpoint__points_MC_basinstats.csv'
@@ -610,6 +770,7 @@ def ReadMCPointsCSV(DataDirectory, fname_prefix):
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
 
     Returns:
         pandas dataframe with the csv file
@@ -620,12 +781,12 @@ def ReadMCPointsCSV(DataDirectory, fname_prefix):
     mc_points_suffix = '_MCpoint_points_MC_basinstats.csv'
     fname = fname_prefix+mc_points_suffix
     # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns)
 
     return df
 
 
-def ReadMChiSegCSV(DataDirectory, fname_prefix, type = "Normal"):
+def ReadMChiSegCSV(DataDirectory, fname_prefix, type = "Normal", columns = None, float32 = False):
     """
     This function reads in the file with the suffix
     '_MChiSegmented.csv'
@@ -634,6 +795,8 @@ def ReadMChiSegCSV(DataDirectory, fname_prefix, type = "Normal"):
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
+        float32: if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the csv file
@@ -648,22 +811,29 @@ def ReadMChiSegCSV(DataDirectory, fname_prefix, type = "Normal"):
     elif(type == "knickpoint"):
         suffix = "_ksnkp_mchi.csv"
     fname = fname_prefix+suffix
-    # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    # read in the dataframe using pandas. We need chi to get rid of the nodata,
+    # but you only get it back if you asked for it
+    drop_chi = columns is not None and "chi" not in columns
+    if drop_chi:
+        columns = list(columns)+["chi"]
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns, float32 = float32)
 
     # Getting rid of NoData
 
     df = df[df["chi"] >= 0]
+    if drop_chi:
+        df = df.drop(columns = "chi")
 
     return df
 
-def ReadDisorderCSV(DataDirectory, fname_prefix):
+def ReadDisorderCSV(DataDirectory, fname_prefix, columns = None):
     """
     Function to read in the CSV from the chi disorder
     analysis
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
 
     Returns:
         pandas dataframe with the csv file
@@ -674,17 +844,18 @@ def ReadDisorderCSV(DataDirectory, fname_prefix):
     mc_points_suffix = '_disorder_movernstats_disorder_basinstats.csv'
     fname = fname_prefix+mc_points_suffix
     # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns)
 
     return df
 
-def ReadDisorderUncertCSV(DataDirectory, fname_prefix):
+def ReadDisorderUncertCSV(DataDirectory, fname_prefix, columns = None):
     """
     Function to read in the CSV from the chi disorder
     analysis
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
 
     Returns:
         pandas dataframe with the csv file
@@ -695,17 +866,19 @@ def ReadDisorderUncertCSV(DataDirectory, fname_prefix):
     mc_points_suffix = '_fullstats_disorder_uncert.csv'
     fname = fname_prefix+mc_points_suffix
     # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns)
 
     return df
 
-def AppendDisorderCSV(DataDirectory, FilenamePrefix):
+def AppendDisorderCSV(DataDirectory, FilenamePrefix, n_workers = None, progress_hook = None):
     """
     This function reads in a series of disorder csvs and appends them together
     into one function for plotting
 
     Args:
         DataDirectory (str): the data DataDirectory
+        n_workers (int): the number of files read at once. Defaults to the number of CPUs.
+        progress_hook (function): called as progress_hook(n_done, n_files, fname, seconds) after each file is read
 
     Returns:
         pandas dataframe with the appended fullstats csvs
@@ -715,21 +888,11 @@ def AppendDisorderCSV(DataDirectory, FilenamePrefix):
     # get the csv filename
     csv_suffix =  '_fullstats_disorder_uncert.csv'
 
-    MasterDF = pd.DataFrame()
-    basin_dict = MapBasinsToKeysFromJunctionList(DataDirectory, FilenamePrefix)
-
-    # loop through and get each basin csv
-    for outlet_jn, basin_key in basin_dict.iteritems():
-        this_fname = "basin"+str(outlet_jn)+csv_suffix
-        # append to master DF and change the basin key and the junction
-        df = pd.read_csv(DataDirectory+this_fname)
-        df = df[df['basin_key'] == 0]
-        df['basin_key'] = basin_key
-        MasterDF = MasterDF.append(df, ignore_index = True)
+    MasterDF = AppendBasinCSVsParallel(DataDirectory, FilenamePrefix, csv_suffix, n_workers = n_workers, progress_hook = progress_hook)
 
     return MasterDF
 
-def readSKKPstats(DataDirectory, fname_prefix):
+def readSKKPstats(DataDirectory, fname_prefix, columns = None):
     """
     This function reads in the file with the suffix
     '_KsnKn.csv'
@@ -738,6 +901,7 @@ def readSKKPstats(DataDirectory, fname_prefix):
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
 
     Returns:
         pandas dataframe with the csv file
@@ -748,11 +912,11 @@ def readSKKPstats(DataDirectory, fname_prefix):
     suffix = '_ksnkp_SK.csv'
     fname = fname_prefix+suffix
     # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns)
 
     return df
 
-def ReadKnickpointCSV(DataDirectory, fname_prefix, ftype = "normal"):
+def ReadKnickpointCSV(DataDirectory, fname_prefix, ftype = "normal", columns = None, float32 = False):
     """
     This function reads in the file with the suffix
     '_KsnKn.csv'
@@ -761,6 +925,8 @@ def ReadKnickpointCSV(DataDirectory, fname_prefix, ftype = "normal"):
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
+        float32: if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the csv file
@@ -774,11 +940,11 @@ def ReadKnickpointCSV(DataDirectory, fname_prefix, ftype = "normal"):
         suffix = '_ksnkp.csv'
     fname = fname_prefix+suffix
     # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns, float32 = float32)
 
     return df
 
-def ReadKnickzoneCSV(DataDirectory, fname_prefix):
+def ReadKnickzoneCSV(DataDirectory, fname_prefix, columns = None, float32 = False):
     """
     This function reads in the file with the suffix
     '_KsnKn.csv'
@@ -787,6 +953,8 @@ def ReadKnickzoneCSV(DataDirectory, fname_prefix):
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
+        float32: if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the csv file
@@ -797,11 +965,11 @@ def ReadKnickzoneCSV(DataDirectory, fname_prefix):
     suffix = '_KsnKz.csv'
     fname = fname_prefix+suffix
     # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns, float32 = float32)
 
     return df
 
-def ReadChiResidualsCSVs(DataDirectory, fname_prefix):
+def ReadChiResidualsCSVs(DataDirectory, fname_prefix, columns = None):
     """
     This function reads in the 3 CSV files for the residuals analysis
     They have the format:
@@ -812,6 +980,7 @@ def ReadChiResidualsCSVs(DataDirectory, fname_prefix):
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
 
     Returns:
         list of pandas dataframes with the csv files. List format is:
@@ -827,17 +996,19 @@ def ReadChiResidualsCSVs(DataDirectory, fname_prefix):
     dfs = []
     for f in fnames:
         fname = fname_prefix+f
-        dfs.append(pd.read_csv(DataDirectory+fname))
+        dfs.append(ReadCachedCSV(DataDirectory+fname, columns = columns))
 
     return dfs
 
-def ReadRawSAData(DataDirectory, fname_prefix):
+def ReadRawSAData(DataDirectory, fname_prefix, columns = None, float32 = False):
     """
     This function reads in the raw SA data to a pandas dataframe
 
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
+        float32: if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the raw SA data
@@ -848,11 +1019,11 @@ def ReadRawSAData(DataDirectory, fname_prefix):
     # get the csv filename
     fname_suffix = "_SAvertical.csv"
     fname = fname_prefix+fname_suffix
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns, float32 = float32)
 
     return df
 
-def AppendRawSAData(DataDirectory, FilenamePrefix):
+def AppendRawSAData(DataDirectory, FilenamePrefix, n_workers = None, progress_hook = None, float32 = False):
     """
     This function reads in the raw SA data to a pandas dataframe
     from multiple CSV files with the filename prefix "basin"
@@ -860,6 +1031,9 @@ def AppendRawSAData(DataDirectory, FilenamePrefix):
 
     Args:
         DataDirectory: the data directory
+        n_workers: the number of files read at once. Defaults to the number of CPUs.
+        progress_hook: called as progress_hook(n_done, n_files, fname, seconds) after each file is read
+        float32: if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the raw SA data
@@ -870,26 +1044,19 @@ def AppendRawSAData(DataDirectory, FilenamePrefix):
     # get the csv filename
     csv_suffix = "_SAvertical.csv"
 
-    MasterDF = pd.DataFrame()
-    basin_dict = MapBasinsToKeysFromJunctionList(DataDirectory, FilenamePrefix)
-
-    # loop through and get each basin csv
-    for outlet_jn, basin_key in basin_dict.iteritems():
-        this_fname = "basin"+str(outlet_jn)+csv_suffix
-        df = pd.read_csv(DataDirectory+this_fname)
-        df = df[df['basin_key'] == 0]
-        df['basin_key'] = basin_key
-        MasterDF = MasterDF.append(df, ignore_index = True)
+    MasterDF = AppendBasinCSVsParallel(DataDirectory, FilenamePrefix, csv_suffix, float32 = float32, n_workers = n_workers, progress_hook = progress_hook)
 
     return MasterDF
 
-def ReadSegmentedSAData(DataDirectory, fname_prefix):
+def ReadSegmentedSAData(DataDirectory, fname_prefix, columns = None, float32 = False):
     """
     This function reads in the segmented SA data to a pandas dataframe
 
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
+        float32: if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the segmented SA data
@@ -900,11 +1067,11 @@ def ReadSegmentedSAData(DataDirectory, fname_prefix):
     # get the csv filename
     fname_suffix = "_SAsegmented.csv"
     fname = fname_prefix+fname_suffix
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns, float32 = float32)
 
     return df
 
-def ReadBinnedSAData(DataDirectory, fname_prefix):
+def ReadBinnedSAData(DataDirectory, fname_prefix, columns = None, float32 = False):
     """
     This function reads in the binned SA data to a pandas dataframe
     csv with the suffix "_SAbinned.csv"
@@ -912,6 +1079,8 @@ def ReadBinnedSAData(DataDirectory, fname_prefix):
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
+        float32: if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the segmented SA data
@@ -922,12 +1091,12 @@ def ReadBinnedSAData(DataDirectory, fname_prefix):
     # get the csv filename
     fname_suffix = "_SAbinned.csv"
     fname = fname_prefix+fname_suffix
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns, float32 = float32)
 
     return df
 
 
-def ReadMOverNSummaryCSV(DataDirectory, fname_prefix):
+def ReadMOverNSummaryCSV(DataDirectory, fname_prefix, columns = None):
     """
     This function reads in the summary csv with the best fit movern info
     to a pandas dataframe
@@ -935,6 +1104,7 @@ def ReadMOverNSummaryCSV(DataDirectory, fname_prefix):
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
 
     Returns:
         pandas dataframe with the segmented SA data
@@ -944,17 +1114,19 @@ def ReadMOverNSummaryCSV(DataDirectory, fname_prefix):
     # get the csv filename
     fname_suffix = "_movern_summary.csv"
     fname = fname_prefix+fname_suffix
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns)
 
     return df
 
-def ReadChannelNetworkCSV(DataDirectory, fname_prefix):
+def ReadChannelNetworkCSV(DataDirectory, fname_prefix, columns = None, float32 = False):
     """
     This function reads in the channel network csv to a df
 
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
+        float32: if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the channel network
@@ -964,17 +1136,19 @@ def ReadChannelNetworkCSV(DataDirectory, fname_prefix):
     # get the csv filename
     fname_suffix = "_CN.csv"
     fname = fname_prefix+fname_suffix
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns, float32 = float32)
 
     return df
 
-def ReadChiDataMapCSV(DataDirectory, fname_prefix):
+def ReadChiDataMapCSV(DataDirectory, fname_prefix, columns = None, float32 = False):
     """
     This function reads in the chi data map csv to a df
 
     Args:
         DataDirectory: the data directory
         fname_prefix: the file name prefix
+        columns: the columns you want, None for all of them
+        float32: if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the chi map
@@ -984,7 +1158,7 @@ def ReadChiDataMapCSV(DataDirectory, fname_prefix):
     # get the csv filename
     fname_suffix = "_chi_data_map.csv"
     fname = fname_prefix+fname_suffix
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns, float32 = float32)
 
     return df
 
@@ -993,7 +1167,7 @@ def ReadChiDataMapCSV(DataDirectory, fname_prefix):
 # Terraces
 #--------------------------------------------------------------------------------#
 
-def read_terrace_csv(DataDirectory,fname_prefix):
+def read_terrace_csv(DataDirectory,fname_prefix, columns = None, float32 = False):
     """
     This function reads in the csv file with the extension "_terrace_info.csv"
     and returns it as a pandas dataframe
@@ -1001,6 +1175,8 @@ def read_terrace_csv(DataDirectory,fname_prefix):
     Args:
         DataDirectory (str): the data directory
         fname_prefix (str): the name of the DEM
+        columns (list): the columns you want, None for all of them
+        float32 (bool): if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the terrace info
@@ -1010,11 +1186,11 @@ def read_terrace_csv(DataDirectory,fname_prefix):
     csv_suffix = '_terrace_info.csv'
     fname = DataDirectory+fname_prefix+csv_suffix
 
-    df = pd.read_csv(fname)
+    df = ReadCachedCSV(fname, columns = columns, float32 = float32)
 
     return df
 
-def read_channel_csv(DataDirectory,fname_prefix):
+def read_channel_csv(DataDirectory,fname_prefix, columns = None, float32 = False):
     """
     This function reads in the csv file with the extension "_baseline_channel_info.csv"
     and returns it as a pandas dataframe
@@ -1022,6 +1198,8 @@ def read_channel_csv(DataDirectory,fname_prefix):
     Args:
         DataDirectory (str): the data directory
         fname_prefix (str): the name of the DEM
+        columns (list): the columns you want, None for all of them
+        float32 (bool): if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the channel info
@@ -1031,11 +1209,11 @@ def read_channel_csv(DataDirectory,fname_prefix):
     csv_suffix = '_baseline_channel_info.csv'
     fname = DataDirectory+fname_prefix+csv_suffix
 
-    df = pd.read_csv(fname)
+    df = ReadCachedCSV(fname, columns = columns, float32 = float32)
 
     return df
 
-def read_index_channel_csv(DataDirectory,fname_prefix):
+def read_index_channel_csv(DataDirectory,fname_prefix, columns = None, float32 = False):
     """
     This function reads in the csv file with the extension "_index_chan.csv"
     and returns it as a pandas dataframe
@@ -1043,6 +1221,8 @@ def read_index_channel_csv(DataDirectory,fname_prefix):
     Args:
         DataDirectory (str): the data directory
         fname_prefix (str): the name of the DEM
+        columns (list): the columns you want, None for all of them
+        float32 (bool): if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the channel info
@@ -1052,7 +1232,7 @@ def read_index_channel_csv(DataDirectory,fname_prefix):
     csv_suffix = '_index_chan.csv'
     fname = DataDirectory+fname_prefix+csv_suffix
 
-    df = pd.read_csv(fname)
+    df = ReadCachedCSV(fname, columns = columns, float32 = float32)
 
     return df
 
@@ -1099,13 +1279,14 @@ def read_terrace_centrelines(DataDirectory, shapefile_name):
             Lines[this_id] = this_line
     return Lines
 
-def ReadModelCSV(DataDirectory, Base_file):
+def ReadModelCSV(DataDirectory, Base_file, columns = None):
     """
     This function reads in the csv file from the model run to a pandas dataframe
 
     Args:
         DataDirectory (str): the data directory
         Base_file (str): the base file prefix
+        columns (list): the columns you want, None for all of them
 
     Returns:
         pandas dataframe with the csv file info
@@ -1117,19 +1298,21 @@ def ReadModelCSV(DataDirectory, Base_file):
 
     fname = Base_file+csv_suffix
     # read in the dataframe using pandas
-    df = pd.read_csv(DataDirectory+fname)
+    df = ReadCachedCSV(DataDirectory+fname, columns = columns)
     return df
 
 #-----------------------------------------------------------------------------#
 # Drainage capture metrics
 #-----------------------------------------------------------------------------#
-def ReadPerimeterCSV(DataDirectory, fname_prefix):
+def ReadPerimeterCSV(DataDirectory, fname_prefix, columns = None, float32 = False):
     """
     This function reads in the csv file with the perimeter info
 
     Args:
         DataDirectory (str): the data directory
         fname_prefix (str): the base file prefix
+        columns (list): the columns you want, None for all of them
+        float32 (bool): if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the csv file info
@@ -1137,7 +1320,7 @@ def ReadPerimeterCSV(DataDirectory, fname_prefix):
     Author: FJC
     """
     csv_suffix = '_Perimeters.csv'
-    df = pd.read_csv(DataDirectory+fname_prefix+csv_suffix)
+    df = ReadCachedCSV(DataDirectory+fname_prefix+csv_suffix, columns = columns, float32 = float32)
     return df
 
 #-----------------------------------------------------------------------------#
@@ -1145,13 +1328,94 @@ def ReadPerimeterCSV(DataDirectory, fname_prefix):
 # FJC 19/10/17
 #-----------------------------------------------------------------------------#
 
-def AppendBasinCSVs(DataDirectory, FilenamePrefix):
+def _ReadBasinCSV(task):
+    """
+    Reads one of the per-basin csv files and gives it its basin key.
+    This is the work done on each thread or process by AppendBasinCSVsParallel.
+
+    Author: SMM
+    """
+    fname, outlet_jn, basin_key, outlet_column, first_row_only, float32 = task
+    df = ReadCachedCSV(fname, float32 = float32)
+    if first_row_only:
+        df = df.iloc[[0]].copy()
+    else:
+        df = df[df['basin_key'] == 0].copy()
+    df['basin_key'] = basin_key
+    if outlet_column is not None:
+        df[outlet_column] = outlet_jn
+    return df
+
+def AppendBasinCSVsParallel(DataDirectory, FilenamePrefix, csv_suffix, outlet_column = None,
+                            first_row_only = False, float32 = False, n_workers = None,
+                            use_processes = False, progress_hook = None):
+    """
+    This reads the csv files from a parallel chi_mapping_tool run (one for each
+    basin, called "basin"+outlet junction+csv_suffix) on a pool of threads or
+    processes and appends them together. Each basin gets the key of its junction
+    in the junctions list. The frames are concatenated once at the end.
+
+    Args:
+        DataDirectory (str): the data directory
+        FilenamePrefix (str): prefix of the DEM, should be the same as the junctions.list file.
+        csv_suffix (str): the suffix of the basin csv files
+        outlet_column (str): if not None, a column with this name gets the outlet junction
+        first_row_only (bool): if true, only the first row of each file is kept, otherwise the rows with basin_key 0
+        float32 (bool): if true floats (other than coordinates) are float32, see ReadCachedCSV
+        n_workers (int): the number of threads or processes. Defaults to the number of CPUs.
+        use_processes (bool): if true use processes rather than threads
+        progress_hook (function): if not None, called as progress_hook(n_done, n_files, fname, seconds) after each file is read
+
+    Returns:
+        pandas dataframe with the appended csvs
+
+    Author: SMM
+    """
+    import time
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+    basin_dict = MapBasinsToKeysFromJunctionList(DataDirectory, FilenamePrefix)
+    tasks = [(DataDirectory+"basin"+str(outlet_jn)+csv_suffix, outlet_jn, basin_key, outlet_column, first_row_only, float32)
+             for outlet_jn, basin_key in basin_dict.items()]
+    if len(tasks) == 0:
+        return pd.DataFrame()
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = max(1, min(n_workers, len(tasks)))
+
+    # The frames go back in junction list order whatever order they are read in
+    frames = [None]*len(tasks)
+    start_time = time.time()
+    if n_workers == 1:
+        for i, task in enumerate(tasks):
+            frames[i] = _ReadBasinCSV(task)
+            if progress_hook is not None:
+                progress_hook(i+1, len(tasks), task[0], time.time()-start_time)
+    else:
+        if use_processes:
+            Executor = ProcessPoolExecutor
+        else:
+            Executor = ThreadPoolExecutor
+        with Executor(max_workers=n_workers) as pool:
+            futures = {pool.submit(_ReadBasinCSV, task): i for i, task in enumerate(tasks)}
+            for n_done, future in enumerate(as_completed(futures)):
+                i = futures[future]
+                frames[i] = future.result()
+                if progress_hook is not None:
+                    progress_hook(n_done+1, len(tasks), tasks[i][0], time.time()-start_time)
+
+    return pd.concat(frames, ignore_index = True)
+
+def AppendBasinCSVs(DataDirectory, FilenamePrefix, n_workers = None, progress_hook = None):
     """
     This function reads in a series of basin csv files and appends them together
     into one function for plotting
 
     Args:
         DataDirectory (str): the data DataDirectory
+        n_workers (int): the number of files read at once. Defaults to the number of CPUs.
+        progress_hook (function): called as progress_hook(n_done, n_files, fname, seconds) after each file is read
 
     Returns:
         pandas dataframe with the appended basin csvs
@@ -1162,21 +1426,11 @@ def AppendBasinCSVs(DataDirectory, FilenamePrefix):
     # get the csv filename
     csv_suffix = "_movernstats_basinstats.csv"
 
-    MasterDF = pd.DataFrame()
-    basin_dict = MapBasinsToKeysFromJunctionList(DataDirectory,FilenamePrefix)
-
-    # loop through and get each basin csv
-    for outlet_jn, basin_key in basin_dict.iteritems():
-        this_fname = "basin"+str(outlet_jn)+csv_suffix
-        # append to master DF and change the basin key and the junction
-        df = pd.read_csv(DataDirectory+this_fname)
-        df.ix[0, 'basin_key'] = basin_key
-        df.ix[0, 'outlet_jn'] = outlet_jn
-        MasterDF = MasterDF.append(df.iloc[0], ignore_index = True)
+    MasterDF = AppendBasinCSVsParallel(DataDirectory, FilenamePrefix, csv_suffix, outlet_column = 'outlet_jn', first_row_only = True, n_workers = n_workers, progress_hook = progress_hook)
 
     return MasterDF
 
-def AppendFullStatsCSVs(DataDirectory, m_over_n, FilenamePrefix):
+def AppendFullStatsCSVs(DataDirectory, m_over_n, FilenamePrefix, n_workers = None, progress_hook = None):
     """
     This function reads in a series of full stats csvs and appends them together
     into one function for plotting
@@ -1184,6 +1438,8 @@ def AppendFullStatsCSVs(DataDirectory, m_over_n, FilenamePrefix):
     Args:
         DataDirectory (str): the data DataDirectory
         m_over_n (float): the m/n value
+        n_workers (int): the number of files read at once. Defaults to the number of CPUs.
+        progress_hook (function): called as progress_hook(n_done, n_files, fname, seconds) after each file is read
 
     Returns:
         pandas dataframe with the appended fullstats csvs
@@ -1193,27 +1449,18 @@ def AppendFullStatsCSVs(DataDirectory, m_over_n, FilenamePrefix):
     # get the csv filename
     csv_suffix =  '_movernstats_%s_fullstats.csv' % m_over_n
 
-    MasterDF = pd.DataFrame()
-    basin_dict = MapBasinsToKeysFromJunctionList(DataDirectory, FilenamePrefix)
-
-    # loop through and get each basin csv
-    for outlet_jn, basin_key in basin_dict.iteritems():
-        this_fname = "basin"+str(outlet_jn)+csv_suffix
-        # append to master DF and change the basin key and the junction
-        df = pd.read_csv(DataDirectory+this_fname)
-        df = df[df['basin_key'] == 0]
-        df['basin_key'] = basin_key
-        MasterDF = MasterDF.append(df, ignore_index = True)
+    MasterDF = AppendBasinCSVsParallel(DataDirectory, FilenamePrefix, csv_suffix, n_workers = n_workers, progress_hook = progress_hook)
 
     return MasterDF
 
-def ReadMovernCSV(DataDirectory, fname_prefix):
+def ReadMovernCSV(DataDirectory, fname_prefix, columns = None):
     """
     This function reads in a the movern csv with the suffix "_movern"
 
     Args:
         DataDirectory (str): the data DataDirectory
         fname_prefix
+        columns (list): the columns you want, None for all of them
     Returns:
         pandas dataframe with the appended movern csvs
 
@@ -1223,17 +1470,19 @@ def ReadMovernCSV(DataDirectory, fname_prefix):
     # get the csv filename
     csv_suffix = '_movern.csv'
 
-    df = pd.read_csv(DataDirectory+fname_prefix+csv_suffix)
+    df = ReadCachedCSV(DataDirectory+fname_prefix+csv_suffix, columns = columns)
 
     return df
 
-def AppendMovernCSV(DataDirectory, FilenamePrefix):
+def AppendMovernCSV(DataDirectory, FilenamePrefix, n_workers = None, progress_hook = None):
     """
     This function reads in a series of csvs with the suffix "_movern"
     and appends them together into one function for plotting
 
     Args:
         DataDirectory (str): the data DataDirectory
+        n_workers (int): the number of files read at once. Defaults to the number of CPUs.
+        progress_hook (function): called as progress_hook(n_done, n_files, fname, seconds) after each file is read
 
     Returns:
         pandas dataframe with the appended movern csvs
@@ -1244,27 +1493,19 @@ def AppendMovernCSV(DataDirectory, FilenamePrefix):
     # get the csv filename
     csv_suffix =  '_movern.csv'
 
-    MasterDF = pd.DataFrame()
-    basin_dict = MapBasinsToKeysFromJunctionList(DataDirectory,FilenamePrefix)
-
-    # loop through and get each basin csv
-    for outlet_jn, basin_key in basin_dict.iteritems():
-        this_fname = "basin"+str(outlet_jn)+csv_suffix
-        # append to master DF and change the basin key and the junction
-        df = pd.read_csv(DataDirectory+this_fname)
-        df = df[df['basin_key'] == 0]
-        df['basin_key'] = basin_key
-        MasterDF = MasterDF.append(df, ignore_index = True)
+    MasterDF = AppendBasinCSVsParallel(DataDirectory, FilenamePrefix, csv_suffix, n_workers = n_workers, progress_hook = progress_hook)
 
     return MasterDF
 
-def AppendBasinInfoCSVs(DataDirectory, FilenamePrefix):
+def AppendBasinInfoCSVs(DataDirectory, FilenamePrefix, n_workers = None, progress_hook = None):
     """
     This function reads in a series of csvs with the suffix "_AllBasinsInfo"
     and appends them together into one function for plotting
 
     Args:
         DataDirectory (str): the data DataDirectory
+        n_workers (int): the number of files read at once. Defaults to the number of CPUs.
+        progress_hook (function): called as progress_hook(n_done, n_files, fname, seconds) after each file is read
 
     Returns:
         pandas dataframe with the appended movern csvs
@@ -1275,28 +1516,20 @@ def AppendBasinInfoCSVs(DataDirectory, FilenamePrefix):
     # get the csv filename
     csv_suffix =  '_AllBasinsInfo.csv'
 
-    MasterDF = pd.DataFrame()
-    basin_dict = MapBasinsToKeysFromJunctionList(DataDirectory, FilenamePrefix)
-
-    # loop through and get each basin csv
-    for outlet_jn, basin_key in basin_dict.iteritems():
-        this_fname = "basin"+str(outlet_jn)+csv_suffix
-        # append to master DF and change the basin key and the junction
-        df = pd.read_csv(DataDirectory+this_fname)
-        df = df[df['basin_key'] == 0]
-        df['basin_key'] = basin_key
-        df['outlet_junction'] = outlet_jn
-        MasterDF = MasterDF.append(df, ignore_index = True)
+    MasterDF = AppendBasinCSVsParallel(DataDirectory, FilenamePrefix, csv_suffix, outlet_column = 'outlet_junction', n_workers = n_workers, progress_hook = progress_hook)
 
     return MasterDF
 
-def AppendChiDataMapCSVs(DataDirectory, FilenamePrefix):
+def AppendChiDataMapCSVs(DataDirectory, FilenamePrefix, n_workers = None, progress_hook = None, float32 = False):
     """
     This function reads in a series of csvs with the suffix "_chi_data_map"
     and appends them together into one function for plotting
 
     Args:
         DataDirectory (str): the data DataDirectory
+        n_workers (int): the number of files read at once. Defaults to the number of CPUs.
+        progress_hook (function): called as progress_hook(n_done, n_files, fname, seconds) after each file is read
+        float32 (bool): if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the appended csvs
@@ -1307,27 +1540,20 @@ def AppendChiDataMapCSVs(DataDirectory, FilenamePrefix):
     # get the csv filename
     csv_suffix =  '_chi_data_map.csv'
 
-    MasterDF = pd.DataFrame()
-    basin_dict = MapBasinsToKeysFromJunctionList(DataDirectory, FilenamePrefix)
-
-    # loop through and get each basin csv
-    for outlet_jn, basin_key in basin_dict.iteritems():
-        this_fname = "basin"+str(outlet_jn)+csv_suffix
-        # append to master DF and change the basin key and the junction
-        df = pd.read_csv(DataDirectory+this_fname)
-        df = df[df['basin_key'] == 0]
-        df['basin_key'] = basin_key
-        MasterDF = MasterDF.append(df, ignore_index = True)
+    MasterDF = AppendBasinCSVsParallel(DataDirectory, FilenamePrefix, csv_suffix, float32 = float32, n_workers = n_workers, progress_hook = progress_hook)
 
     return MasterDF
 
-def AppendSABinnedCSVs(DataDirectory, fname_prefix):
+def AppendSABinnedCSVs(DataDirectory, fname_prefix, n_workers = None, progress_hook = None, float32 = False):
     """
     This function reads in a series of csvs with the suffix "_SAbinned"
     and appends them together into one function for plotting
 
     Args:
         DataDirectory (str): the data directory
+        n_workers (int): the number of files read at once. Defaults to the number of CPUs.
+        progress_hook (function): called as progress_hook(n_done, n_files, fname, seconds) after each file is read
+        float32 (bool): if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the appended csvs
@@ -1338,30 +1564,23 @@ def AppendSABinnedCSVs(DataDirectory, fname_prefix):
     # get the csv filename
     csv_suffix =  '_SAbinned.csv'
 
-    MasterDF = pd.DataFrame()
-    basin_dict = MapBasinsToKeysFromJunctionList(DataDirectory, fname_prefix)
-
-    # loop through and get each basin csv
-    for outlet_jn, basin_key in basin_dict.iteritems():
-        this_fname = "basin"+str(outlet_jn)+csv_suffix
-        # append to master DF and change the basin key and the junction
-        df = pd.read_csv(DataDirectory+this_fname)
-        df = df[df['basin_key'] == 0]
-        df['basin_key'] = basin_key
-        MasterDF = MasterDF.append(df, ignore_index = True)
+    MasterDF = AppendBasinCSVsParallel(DataDirectory, fname_prefix, csv_suffix, float32 = float32, n_workers = n_workers, progress_hook = progress_hook)
 
     # write to a new csv
     MasterDF.to_csv(DataDirectory+fname_prefix+csv_suffix)
 
     return MasterDF
 
-def AppendSASegmentedCSVs(DataDirectory, fname_prefix):
+def AppendSASegmentedCSVs(DataDirectory, fname_prefix, n_workers = None, progress_hook = None, float32 = False):
     """
     This function reads in a series of csvs with the suffix "_SAsegmented"
     and appends them together into one function for plotting
 
     Args:
         DataDirectory (str): the data directory
+        n_workers (int): the number of files read at once. Defaults to the number of CPUs.
+        progress_hook (function): called as progress_hook(n_done, n_files, fname, seconds) after each file is read
+        float32 (bool): if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the appended csvs
@@ -1372,30 +1591,23 @@ def AppendSASegmentedCSVs(DataDirectory, fname_prefix):
     # get the csv filename
     csv_suffix =  '_SAsegmented.csv'
 
-    MasterDF = pd.DataFrame()
-    basin_dict = MapBasinsToKeysFromJunctionList(DataDirectory, fname_prefix)
-
-    # loop through and get each basin csv
-    for outlet_jn, basin_key in basin_dict.iteritems():
-        this_fname = "basin"+str(outlet_jn)+csv_suffix
-        # append to master DF and change the basin key and the junction
-        df = pd.read_csv(DataDirectory+this_fname)
-        df = df[df['basin_key'] == 0]
-        df['basin_key'] = basin_key
-        MasterDF = MasterDF.append(df, ignore_index = True)
+    MasterDF = AppendBasinCSVsParallel(DataDirectory, fname_prefix, csv_suffix, float32 = float32, n_workers = n_workers, progress_hook = progress_hook)
 
     # write to a new csv
     MasterDF.to_csv(DataDirectory+fname_prefix+csv_suffix)
 
     return MasterDF
 
-def AppendSAVerticalCSVs(DataDirectory, fname_prefix):
+def AppendSAVerticalCSVs(DataDirectory, fname_prefix, n_workers = None, progress_hook = None, float32 = False):
     """
     This function reads in a series of csvs with the suffix "_SAvertical"
     and appends them together into one function for plotting
 
     Args:
         DataDirectory (str): the data directory
+        n_workers (int): the number of files read at once. Defaults to the number of CPUs.
+        progress_hook (function): called as progress_hook(n_done, n_files, fname, seconds) after each file is read
+        float32 (bool): if true floats (other than coordinates) are float32, see ReadCachedCSV
 
     Returns:
         pandas dataframe with the appended csvs
@@ -1406,24 +1618,14 @@ def AppendSAVerticalCSVs(DataDirectory, fname_prefix):
     # get the csv filename
     csv_suffix =  '_SAvertical.csv'
 
-    MasterDF = pd.DataFrame()
-    basin_dict = MapBasinsToKeysFromJunctionList(DataDirectory, fname_prefix)
-
-    # loop through and get each basin csv
-    for outlet_jn, basin_key in basin_dict.iteritems():
-        this_fname = "basin"+str(outlet_jn)+csv_suffix
-        # append to master DF and change the basin key and the junction
-        df = pd.read_csv(DataDirectory+this_fname)
-        df = df[df['basin_key'] == 0]
-        df['basin_key'] = basin_key
-        MasterDF = MasterDF.append(df, ignore_index = True)
+    MasterDF = AppendBasinCSVsParallel(DataDirectory, fname_prefix, csv_suffix, float32 = float32, n_workers = n_workers, progress_hook = progress_hook)
 
     # write to a new csv
     MasterDF.to_csv(DataDirectory+fname_prefix+csv_suffix)
 
     return MasterDF
 
-def AppendBasinPointCSVs(DataDirectory, FilenamePrefix):
+def AppendBasinPointCSVs(DataDirectory, FilenamePrefix, n_workers = None, progress_hook = None):
     """
     This function reads in a series of csvs with the suffix
      "_MCpoint_points_MC_basinstats" and appends them together
@@ -1431,6 +1633,8 @@ def AppendBasinPointCSVs(DataDirectory, FilenamePrefix):
 
     Args:
         DataDirectory (str): the data directory
+        n_workers (int): the number of files read at once. Defaults to the number of CPUs.
+        progress_hook (function): called as progress_hook(n_done, n_files, fname, seconds) after each file is read
 
     Returns:
         pandas dataframe with the appended csvs
@@ -1441,28 +1645,19 @@ def AppendBasinPointCSVs(DataDirectory, FilenamePrefix):
     # get the csv filename
     csv_suffix =  '_MCpoint_points_MC_basinstats.csv'
 
-    MasterDF = pd.DataFrame()
-    basin_dict = MapBasinsToKeysFromJunctionList(DataDirectory, FilenamePrefix)
-
-    # loop through and get each basin csv
-    for outlet_jn, basin_key in basin_dict.iteritems():
-        this_fname = "basin"+str(outlet_jn)+csv_suffix
-        # append to master DF and change the basin key and the junction
-        df = pd.read_csv(DataDirectory+this_fname)
-        df = df[df['basin_key'] == 0]
-        df['basin_key'] = basin_key
-        df['outlet_jn'] = outlet_jn
-        MasterDF = MasterDF.append(df, ignore_index = True)
+    MasterDF = AppendBasinCSVsParallel(DataDirectory, FilenamePrefix, csv_suffix, outlet_column = 'outlet_jn', n_workers = n_workers, progress_hook = progress_hook)
 
     return MasterDF
 
-def AppendChiResidualsCSVs(DataDirectory, FilenamePrefix):
+def AppendChiResidualsCSVs(DataDirectory, FilenamePrefix, n_workers = None, progress_hook = None):
     """
     This function reads in a series of 3 csvs with the residuals data
      and appends them together into one function for plotting
 
     Args:
         DataDirectory (str): the data directory
+        n_workers (int): the number of files read at once. Defaults to the number of CPUs.
+        progress_hook (function): called as progress_hook(n_done, n_files, fname, seconds) after each file is read
 
     Returns:
         pandas dataframe with the appended csvs
@@ -1474,21 +1669,9 @@ def AppendChiResidualsCSVs(DataDirectory, FilenamePrefix):
     fnames = ["_residual_movernstats_movern_residuals_median.csv","_residual_movernstats_movern_residuals_Q1.csv","_residual_movernstats_movern_residuals_Q3.csv"]
 
     MasterDFs = []
-
-    MasterDF = pd.DataFrame()
-    basin_dict = MapBasinsToKeysFromJunctionList(DataDirectory, FilenamePrefix)
-
     for f in fnames:
-        # loop through and get each basin csv
-        for outlet_jn, basin_key in basin_dict.iteritems():
-            this_fname = "basin"+str(outlet_jn)+f
-            # append to master DF and change the basin key and the junction
-            df = pd.read_csv(DataDirectory+this_fname)
-            df = df[df['basin_key'] == 0]
-            df['basin_key'] = basin_key
-            df['outlet_jn'] = outlet_jn
-            MasterDF = MasterDF.append(df, ignore_index = True)
-        MasterDFs.append(MasterDF)
+        MasterDFs.append(AppendBasinCSVsParallel(DataDirectory, FilenamePrefix, f, outlet_column = 'outlet_jn',
+                                                 n_workers = n_workers, progress_hook = progress_hook))
 
     return MasterDFs
 
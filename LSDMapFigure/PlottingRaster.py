@@ -40,25 +40,61 @@ class BaseRaster(object):
         RasterName (str): The name of the rasters (with extension). It is read by gdal so should cope with mulitple formats
         Directory (str): The path to the raster. Needs to have the trailing slash
         NFF_opti (bool): experimental test of reading raster using numpy.fromfile() which a super efficient binary reader
+        memmap (bool): If true, and the raster is an ENVI raster (e.g. a .bil), it is memory mapped rather than read, so it can be larger than your RAM.
+        extent (list): [xmin,xmax,ymin,ymax]. If given, only the part of the raster covering this extent is read.
 
     Author: DAV and SMM
     """
-    def __init__(self, RasterName, Directory, NFF_opti = False, alpha = 1):
+    def __init__(self, RasterName, Directory, NFF_opti = False, alpha = 1, memmap = True, extent = None):
 
         self._RasterFileName = RasterName
         self._RasterDirectory = Directory
         self._FullPathRaster = self._RasterDirectory + self._RasterFileName
 
-        # I think the BaseRaster should contain a numpy array of the Raster
-        if(NFF_opti):
-            self._RasterArray = LSDP.ReadRasterArrayBlocks_numpy(self._FullPathRaster)
+        # The raster data is kept in its native type. If it is memory mapped nothing is
+        # read until it is used. _RasterArray is the float version with NaN as nodata,
+        # and it is only built if somebody asks for it.
+        # Everything goes through the shared raster cache, so drapes and figures that
+        # use the same file don't read it again. Cached arrays are read only.
+        # _FullRasterData is the whole raster, if we have it, and _RasterData the part
+        # in the current window (see set_window)
+        cache = LSDP.LSDMap_IO.raster_cache
+        self._window = None
+        if memmap and LSDP.LSDMap_IO.IsENVIRaster(self._FullPathRaster):
+            self._FullRasterData = cache.get(self._FullPathRaster, "memmap",
+                                             lambda: LSDP.ReadRasterArrayMemmap(self._FullPathRaster, mode="r"))
+            self._NoDataValue = LSDP.LSDMap_IO.ReadENVIHeader(self._FullPathRaster)["NoDataValue"]
+        elif extent is not None:
+            # We'll only read the window
+            self._FullRasterData = None
         else:
-            self._RasterArray = LSDP.ReadRasterArrayBlocks(self._FullPathRaster)
+            if(NFF_opti):
+                self._FullRasterData = cache.get(self._FullPathRaster, "nff_array",
+                                                 lambda: LSDP.ReadRasterArrayBlocks_numpy(self._FullPathRaster))
+            else:
+                self._FullRasterData = cache.get(self._FullPathRaster, "array",
+                                                 lambda: LSDP.ReadRasterArrayBlocks(self._FullPathRaster))
+            self._NoDataValue = None
+        self._RasterData = self._FullRasterData
+        self._RasterArrayCache = None
+
+        # If this is set (azimuth, angle_altitude, z_factor) the raster is a DEM that is drawn
+        # as a hillshade (see make_hillshade)
+        self._hillshade_parameters = None
+
+        # This is set once the raster array has been changed (masked, values replaced, etc.)
+        # after which overviews have to be made from the array rather than the file
+        self._modified = False
 
         # Get the extents as a list
         self._RasterExtents = LSDP.GetRasterExtent(self._FullPathRaster)
         self._RasterAspectRatio = (self._RasterExtents[1]-self._RasterExtents[0])/(self._RasterExtents[3]-self._RasterExtents[2])
 
+        if extent is not None:
+            self.set_window(extent)
+        else:
+            self._reset_data()
+
         # set the default colourmap
         self._colourmap = "gray"
 
@@ -69,6 +105,109 @@ class BaseRaster(object):
         self._EPSGString = LSDP.LSDMap_IO.GetUTMEPSG(self._FullPathRaster)
         #print("The EPSGString is: "+ self._EPSGString)
 
+    @property
+    def _RasterArray(self):
+        # Built on first use from the (possibly memory mapped) raster data
+        if self._RasterArrayCache is None:
+            self._RasterArrayCache = LSDP.LSDMap_IO.raster_cache.get(self._FullPathRaster, "nan_array"+str(self._window),
+                                         lambda: LSDP.MemmapToNaNArray(self._RasterData, self._NoDataMask))
+        return self._RasterArrayCache
+
+    def _reset_data(self):
+        """
+        Resets the mask and the float array after _RasterData has changed.
+        Arrays from ReadRasterArrayBlocks are already floats with NaN nodata.
+        If the raster is drawn as a hillshade, the hillshade of the new data is computed.
+
+        Author: SMM
+        """
+        NoDataValue = self._NoDataValue
+        if self._hillshade_parameters is not None:
+            GeoT = LSDP.LSDMap_IO.GetGeoInfo(self._FullPathRaster)[3]
+            azimuth, angle_altitude, z_factor = self._hillshade_parameters
+            self._RasterData = LSDP.LSDMap_IO.raster_cache.get(self._FullPathRaster,
+                                   "hillshade"+str(self._hillshade_parameters)+str(self._window),
+                                   lambda: LSDP.Hillshade(self._RasterData, azimuth, angle_altitude, NoDataValue,
+                                                          z_factor, DataResolution = (GeoT[1], GeoT[5])))
+            NoDataValue = None
+
+        self._NoDataMask = LSDP.LazyNoDataMask(self._RasterData, NoDataValue)
+        if NoDataValue is None and np.issubdtype(self._RasterData.dtype, np.floating) \
+           and not isinstance(self._RasterData, np.memmap):
+            self._RasterArrayCache = self._RasterData
+        else:
+            self._RasterArrayCache = None
+
+    def set_window(self, extent):
+        """
+        Restricts the raster to the pixels covering an extent. Memory mapped rasters are
+        just sliced, other rasters are read with a windowed GDAL read if we don't
+        have the whole thing. If the raster has been modified (e.g. values replaced) the
+        modified values are kept, as long as the new window is inside the old one.
+
+        Args:
+            extent (list): [xmin,xmax,ymin,ymax] in map coordinates
+
+        Author: SMM
+        """
+        window, window_extent = LSDP.GetRasterWindow(self._FullPathRaster, extent)
+        xoff, yoff, cols, rows = window
+
+        if self._modified:
+            if self._window is None:
+                old_xoff, old_yoff, old_cols, old_rows = (0, 0, self._RasterData.shape[1], self._RasterData.shape[0])
+            else:
+                old_xoff, old_yoff, old_cols, old_rows = self._window
+            if xoff < old_xoff or yoff < old_yoff or xoff+cols > old_xoff+old_cols or yoff+rows > old_yoff+old_rows:
+                raise Exception("This raster has been modified so I can only shrink its window, not grow it.")
+            modified_array = self._RasterArray[yoff-old_yoff:yoff-old_yoff+rows, xoff-old_xoff:xoff-old_xoff+cols]
+
+        if self._FullRasterData is not None:
+            self._RasterData = self._FullRasterData[yoff:yoff+rows, xoff:xoff+cols]
+        else:
+            self._RasterData, self._NoDataValue = LSDP.LSDMap_IO.raster_cache.get(self._FullPathRaster, "window"+str(window),
+                                         lambda: LSDP.ReadRasterArrayWindow(self._FullPathRaster, extent)[:2])
+        self._window = window
+        self._reset_data()
+        if self._modified:
+            self._RasterArrayCache = modified_array
+
+        self._RasterExtents = window_extent
+        self._RasterAspectRatio = (self._RasterExtents[1]-self._RasterExtents[0])/(self._RasterExtents[3]-self._RasterExtents[2])
+
+    def make_hillshade(self, azimuth = 315, angle_altitude = 45, z_factor = 1):
+        """
+        Turns this raster, which should be a DEM, into its hillshade, so you don't need a _hs.bil.
+        The hillshade is computed for the current window, and again if the window changes.
+
+        Args:
+            azimuth (float): Azimuth of sunlight
+            angle_altitude (float): Angle altitude of sun
+            z_factor (float): Vertical exaggeration
+
+        Author: SMM
+        """
+        if self._hillshade_parameters is not None:
+            raise Exception("This raster is already a hillshade.")
+        if self._modified:
+            raise Exception("This raster has been modified, I can only hillshade the DEM from the file.")
+        self._hillshade_parameters = (azimuth, angle_altitude, z_factor)
+        self._reset_data()
+
+    def _writable_array(self):
+        """
+        The raster array might be shared through the raster cache, in which case it is
+        read only. This swaps in a private copy before it is modified.
+        """
+        if not self._RasterArray.flags.writeable:
+            self._RasterArray = self._RasterArray.copy()
+        return self._RasterArray
+
+    @_RasterArray.setter
+    def _RasterArray(self, value):
+        self._RasterArrayCache = value
+        self._modified = True
+
     @property
     def extents(self):
         return self._RasterExtents
@@ -165,7 +304,7 @@ class BaseRaster(object):
         Author: DAV
         """
         low_values_index = self._RasterArray < self._drapeminthreshold
-        self._RasterArray[low_values_index] = np.nan
+        self._writable_array()[low_values_index] = np.nan
 
     def mask_high_values(self):
         """
@@ -174,7 +313,7 @@ class BaseRaster(object):
         Author: DAV
         """
         high_values_index = self._RasterArray < self._drapemaxthreshold
-        self._RasterArray[high_values_index] = np.nan
+        self._writable_array()[high_values_index] = np.nan
 
     def mask_middle_values(self):
         """
@@ -184,7 +323,7 @@ class BaseRaster(object):
         """
         masked_mid_values_index = (np.logical_and(self._RasterArray > self._middlemaskrange[0],
                                    self._RasterArray < self._middlemaskrange[1]))
-        self._RasterArray[masked_mid_values_index] = np.nan
+        self._writable_array()[masked_mid_values_index] = np.nan
 
     def show_raster(self):
         """
@@ -213,9 +352,10 @@ class BaseRaster(object):
 
         Date: 17/06/17
         """
+        raster_array = self._writable_array()
         for idx, value in enumerate(old_values):
-            old_values_index = self._RasterArray == value
-            self._RasterArray[old_values_index] = new_values[idx]
+            old_values_index = raster_array == value
+            raster_array[old_values_index] = new_values[idx]
         #print self._RasterArray
 
         
@@ -228,11 +368,59 @@ class BaseRaster(object):
         Date: 17/03/19
         """
         
-        zmin = np.nanmin(self._RasterArray)
-        zmax = np.nanmax(self._RasterArray)
+        # If the float array hasn't been built we go through the data in strips
+        if self._RasterArrayCache is not None:
+            zmin = np.nanmin(self._RasterArray)
+            zmax = np.nanmax(self._RasterArray)
+        else:
+            mins = []
+            maxs = []
+            block_rows = 1024
+            for i in range(0, self._RasterData.shape[0], block_rows):
+                block = self._RasterData[i:i+block_rows]
+                valid = block[~self._NoDataMask[i:i+block_rows]]
+                if valid.size > 0:
+                    mins.append(valid.min())
+                    maxs.append(valid.max())
+            zmin = min(mins) if mins else np.nan
+            zmax = max(maxs) if maxs else np.nan
         
         return([zmin,zmax])
     
+    def get_render_array(self, target_shape, resampling = "mean"):
+        """
+        Gets a version of the raster with about as many pixels as will be drawn.
+        There is no point handing imshow a 40000x40000 array for a figure that is 1500 pixels wide.
+        If the raster hasn't been changed the overview comes from the file (GDAL overviews or a
+        block mean pyramid cached on disk), otherwise it is computed from the array.
+
+        Args:
+            target_shape (tuple): the (rows, cols) of the image in the figure
+            resampling (str): "mean" for continuous data, "nearest" for categories
+
+        Returns:
+            The array to draw and its extent [xmin,xmax,ymin,ymax]
+
+        Author: SMM
+        """
+        factor = LSDP.GetOverviewFactor(self._RasterData.shape, target_shape)
+        if factor == 1:
+            return self._RasterArray, self.extents
+
+        if self._modified or self._window is not None or self._hillshade_parameters is not None:
+            if self._modified:
+                overview = LSDP.BlockReduceArray(self._RasterArray, factor, resampling)
+            else:
+                overview = LSDP.BlockReduceArray(self._RasterData, factor, resampling, self._NoDataMask)
+            x_res = (self._RasterExtents[1]-self._RasterExtents[0])/self._RasterData.shape[1]
+            y_res = (self._RasterExtents[3]-self._RasterExtents[2])/self._RasterData.shape[0]
+            extent = [self._RasterExtents[0], self._RasterExtents[0]+overview.shape[1]*factor*x_res,
+                      self._RasterExtents[3]-overview.shape[0]*factor*y_res, self._RasterExtents[3]]
+        else:
+            overview, extent = LSDP.GetOverviewArray(self._FullPathRaster, factor, resampling)
+        print("I am drawing "+self._RasterFileName+" from an overview decimated by a factor of "+str(factor))
+        return overview, extent
+
     def get_unique(self):
         """
         Gets unique values from the raster. Used for categorised plotting
@@ -254,7 +442,9 @@ class MapFigure(object):
     etc.
     """
     def __init__(self, BaseRasterName, Directory,
-                 coord_type="UTM", colourbar_location = "None", basemap_colourmap = "gray", plot_title = "None", NFF_opti = False,alpha = 1,*args, **kwargs):
+                 coord_type="UTM", colourbar_location = "None", basemap_colourmap = "gray", plot_title = "None", NFF_opti = False,alpha = 1,
+                 max_render_pixels = 2048, extent = None, defer_loading = False,
+                 compute_hillshade = False, azimuth = 315, angle_altitude = 45, z_factor = 1, *args, **kwargs):
         """
         Initiates the object.
 
@@ -266,6 +456,13 @@ class MapFigure(object):
             basemap_colourmap (string or colormap): The colourmap of the base raster.
             plot_title (string): The title of the plot, if "None" then will not be plotted.
             NFF_opti (bool): If true, use a fast python native file loading. Much faster but not completely tested.
+            max_render_pixels (int): Rasters are drawn from overviews with about this many pixels across until the figure is saved, when the overview that matches the output size is used.
+            extent (list): [xmin, xmax, ymin, ymax] in map coordinates. If given only this window of every raster is read.
+            defer_loading (bool): If true the base image is not drawn until SetCustomExtent is called, so you can set the window without reading the whole raster.
+            compute_hillshade (bool): If true the base raster is a DEM and its hillshade is computed on the fly, so you don't need a _hs.bil.
+            azimuth (float): Azimuth of sunlight for compute_hillshade
+            angle_altitude (float): Angle altitude of sun for compute_hillshade
+            z_factor (float): Vertical exaggeration for compute_hillshade
 
         Author: SMM and DAV
 
@@ -314,12 +511,16 @@ class MapFigure(object):
         # The way this is going to work is that you can have many rasters in the
         # plot that get appended into a list. Each one has its own colourmap
         # and properties
+        # If there is an extent, only that window of the rasters is read.
+        self._window_extent = extent
         self._RasterList = []
         if basemap_colourmap == "gray":
-            self._RasterList.append(BaseRaster(BaseRasterName,Directory, NFF_opti = NFF_opti, alpha = alpha))
+            self._RasterList.append(BaseRaster(BaseRasterName,Directory, NFF_opti = NFF_opti, alpha = alpha, extent = extent))
         else:
-            self._RasterList.append(BaseRaster(BaseRasterName,Directory, NFF_opti = NFF_opti, alpha = alpha))
+            self._RasterList.append(BaseRaster(BaseRasterName,Directory, NFF_opti = NFF_opti, alpha = alpha, extent = extent))
             self._RasterList[-1].set_colourmap(basemap_colourmap)
+        if compute_hillshade:
+            self._RasterList[0].make_hillshade(azimuth, angle_altitude, z_factor)
 
         # The coordinate type. UTM and UTM with tick in km are supported at the moment
         self._set_coord_type(coord_type)
@@ -329,16 +530,26 @@ class MapFigure(object):
         self._ymin = self._RasterList[0].ymin
         self._xmax = self._RasterList[0].xmax
         self._ymax = self._RasterList[0].ymax
+        if extent is not None:
+            self._xmin,self._xmax,self._ymin,self._ymax = extent
         self._n_target_ticks = 5
         self.make_ticks()
 
+        # Rasters are drawn from overviews. This keeps track of the images, their
+        # rasters and the resampling so they can be redrawn at the output resolution
+        self._render_shape = (max_render_pixels, max_render_pixels)
+        self._render_list = []
+
         self._num_drapes = 0  # Number of drapes in the image.
         # We will increase this everytime we call ax.imshow.
 
         # Stores the Image instances generated from imshow()
         self._drape_list = []
 
-        self.ax_list = self.make_base_image(self.ax_list)
+        # You can defer drawing the base image until SetCustomExtent has set the window
+        self._base_image_deferred = defer_loading
+        if not defer_loading:
+            self.ax_list = self.make_base_image(self.ax_list)
         print(self.ax_list[0])
 
         # A title if needed
@@ -357,6 +568,10 @@ class MapFigure(object):
           ymin: the minimum extent in northing
           ymax: the maximum extent in northing
 
+        Rasters that have not been modified are re-read from disk for the new window.
+        If the rasters have been masked or had values replaced, the new extent needs
+        to lie within the previous one.
+
         Author: MDH
         """
         # Get the tick properties
@@ -366,10 +581,27 @@ class MapFigure(object):
         self._ymax = ymax
         self.make_ticks()
 
+        # Read only the window of each raster and redraw the images already on the map
+        self._window_extent = [xmin,xmax,ymin,ymax]
+        windowed_rasters = []
+        for Raster in self._RasterList + [Raster for im, Raster, resampling in self._render_list]:
+            if not any(Raster is done for done in windowed_rasters):
+                Raster.set_window(self._window_extent)
+                windowed_rasters.append(Raster)
+        for im, Raster, resampling in self._render_list:
+            render_array, render_extent = Raster.get_render_array(self._render_shape, resampling)
+            im.set_data(render_array)
+            im.set_extent(render_extent)
+
+        if self._base_image_deferred:
+            self._base_image_deferred = False
+            self.ax_list = self.make_base_image(self.ax_list)
+        else:
+            self.ax_list[0] = self.add_ticks_to_axis(self.ax_list[0])
+
         # Annoying but the scatter plot resets the extents so you need to reassert them
         self.ax_list[0].set_xlim(self._xmin,self._xmax)
         self.ax_list[0].set_ylim(self._ymin,self._ymax)
-        self.ax_list = self.make_base_image(self.ax_list)
 
 
     def make_ticks(self):
@@ -419,10 +651,10 @@ class MapFigure(object):
 
         Author: SMM
         """
-        ax.set_xticklabels(self.tick_x_labels)
-        ax.set_yticklabels(self.tick_y_labels)
         ax.set_xticks(self.tick_xlocs)
         ax.set_yticks(self.tick_ylocs)
+        ax.set_xticklabels(self.tick_x_labels)
+        ax.set_yticklabels(self.tick_y_labels)
         ax.set_xlabel(self._xaxis_label)
         ax.set_ylabel(self._yaxis_label)
 
@@ -508,7 +740,7 @@ class MapFigure(object):
         #self.ax = self.fig.add_axes([0.1,0.1,0.7,0.7])
 
         print("This colourmap is: "+ self._RasterList[0]._colourmap)
-        im = self.ax_list[0].imshow(self._RasterList[0]._RasterArray, self._RasterList[0]._colourmap, extent = self._RasterList[0].extents, interpolation="nearest", alpha = self._RasterList[0]._alpha)
+        im = self._imshow_raster(self._RasterList[0], "mean", alpha = self._RasterList[0]._alpha)
 
         # This affects all axes because we set share_all = True.
         #ax.set_xlim(self._xmin,self._xmax)
@@ -521,6 +753,56 @@ class MapFigure(object):
         print(self.ax_list[0])
         return self.ax_list
 
+    def _imshow_raster(self, Raster, resampling = "mean", **kwargs):
+        """
+        Draws a raster on the map axis from the overview that suits the current render size,
+        and remembers it so save_fig can swap in the overview for the output resolution.
+
+        Args:
+            Raster (BaseRaster): the raster to draw
+            resampling (str): "mean" for continuous data, "nearest" for categorical data
+            kwargs: passed to imshow
+
+        Returns:
+            The image object
+
+        Author: SMM
+        """
+        render_array, render_extent = Raster.get_render_array(self._render_shape, resampling)
+        im = self.ax_list[0].imshow(render_array, Raster._colourmap, extent = render_extent,
+                                    interpolation="nearest", **kwargs)
+        self._render_list.append((im, Raster, resampling))
+        return im
+
+    def update_render_resolution(self, map_width_pixels, map_height_pixels):
+        """
+        Redraws the rasters from the overview that matches the size, in pixels, of the map axis.
+        Called by save_fig, but you can call it yourself if you are using return_fig.
+
+        Args:
+            map_width_pixels (float): the width of the map axis in pixels
+            map_height_pixels (float): the height of the map axis in pixels
+
+        Author: SMM
+        """
+        this_xlim = self.ax_list[0].get_xlim()
+        this_ylim = self.ax_list[0].get_ylim()
+        visible_width = abs(this_xlim[1]-this_xlim[0])
+        visible_height = abs(this_ylim[1]-this_ylim[0])
+
+        for im, Raster, resampling in self._render_list:
+            # If you have zoomed in you need more of the raster's pixels
+            extents = Raster.extents
+            target_cols = map_width_pixels*(extents[1]-extents[0])/visible_width
+            target_rows = map_height_pixels*(extents[3]-extents[2])/visible_height
+            render_array, render_extent = Raster.get_render_array((target_rows, target_cols), resampling)
+            im.set_data(render_array)
+            im.set_extent(render_extent)
+
+        # Annoying but set_extent resets the extents so you need to reassert them
+        self.ax_list[0].set_xlim(this_xlim)
+        self.ax_list[0].set_ylim(this_ylim)
+
     def add_drape_image(self,RasterName,Directory,colourmap = "gray",
                         alpha=0.5,
                         show_colourbar = False,
@@ -590,7 +872,7 @@ class MapFigure(object):
         
         Date: 23/03/2020
         """
-        Raster = BaseRaster(RasterName,Directory, NFF_opti = NFF_opti)
+        Raster = BaseRaster(RasterName,Directory, NFF_opti = NFF_opti, extent = self._window_extent)
         
         
         # Get unique values
@@ -644,8 +926,9 @@ class MapFigure(object):
         if len(custom_min_max)!=0:
             if len(custom_min_max)== 2:
                 print("I am setting customisable minimum and maximum values: "+str(custom_min_max[0])+", "+str(custom_min_max[1]))
-                self._RasterList[-1]._RasterArray[self._RasterList[-1]._RasterArray<custom_min_max[0]] = custom_min_max[0]
-                self._RasterList[-1]._RasterArray[self._RasterList[-1]._RasterArray>custom_min_max[1]] = custom_min_max[1]
+                raster_array = self._RasterList[-1]._writable_array()
+                raster_array[raster_array<custom_min_max[0]] = custom_min_max[0]
+                raster_array[raster_array>custom_min_max[1]] = custom_min_max[1]
             else:
                 print("I cannot customize your minimum and maximum because I don't understand your input. It should be [min,max] with min max as integers or floats")
         else:
@@ -653,6 +936,7 @@ class MapFigure(object):
 
         # We need to initiate with a figure
         #self.ax = self.fig.add_axes([0.1,0.1,0.7,0.7])
+        this_norm = None
         if len(colour_min_max)!=0:
             if len(colour_min_max)== 2:
                 print("custom min and max are:")
@@ -660,21 +944,20 @@ class MapFigure(object):
                 print(colour_min_max[1])
                 print("I am setting customisable colourbar minimum and maximum values: "+str(colour_min_max[0])+","+str(colour_min_max[1]))
                 if(norm == "LogNorm"):
-                    im = self.ax_list[0].imshow(self._RasterList[-1]._RasterArray, self._RasterList[-1]._colourmap, extent = self._RasterList[0].extents, interpolation="nearest",alpha = alpha, norm = mpl.colors.LogNorm(vmin=colour_min_max[0], vmax=colour_min_max[1]),zorder=zorder)
+                    this_norm = mpl.colors.LogNorm(vmin=colour_min_max[0], vmax=colour_min_max[1])
                 elif(norm == "PowerNorm"):
-                    im = self.ax_list[0].imshow(self._RasterList[-1]._RasterArray, self._RasterList[-1]._colourmap, extent = self._RasterList[0].extents, interpolation="nearest",alpha = alpha, norm = mpl.colors.PowerNorm(gamma=1. / 2.),zorder=zorder) 
+                    this_norm = mpl.colors.PowerNorm(gamma=1. / 2.)
                 else:
-                    im = self.ax_list[0].imshow(self._RasterList[-1]._RasterArray, self._RasterList[-1]._colourmap, extent = self._RasterList[0].extents, interpolation="nearest",alpha = alpha, norm = mpl.colors.Normalize(vmin=colour_min_max[0], vmax=colour_min_max[1]),zorder=zorder)                    
+                    this_norm = mpl.colors.Normalize(vmin=colour_min_max[0], vmax=colour_min_max[1])
             else:
                 print("I cannot customize your colour minimum and maximum because I don't understand your input. It should be [min,max] with min max as integers or floats")
         else:
             if(norm == "LogNorm"):
-                im = self.ax_list[0].imshow(self._RasterList[-1]._RasterArray, self._RasterList[-1]._colourmap, extent = self._RasterList[0].extents,interpolation="nearest",alpha = alpha, norm=colors.LogNorm(vmin=rmin, vmax=rmax), zorder=zorder)
+                this_norm = colors.LogNorm(vmin=rmin, vmax=rmax)
             elif(norm == "PowerNorm"):
-                im = self.ax_list[0].imshow(self._RasterList[-1]._RasterArray, self._RasterList[-1]._colourmap, extent = self._RasterList[0].extents,interpolation="nearest",alpha = alpha, norm=colors.PowerNorm(gamma=1. / 2.), zorder=zorder)
-            else:
-                im = self.ax_list[0].imshow(self._RasterList[-1]._RasterArray, self._RasterList[-1]._colourmap,extent = self._RasterList[0].extents, interpolation="nearest",alpha = alpha, zorder=zorder)
-                
+                this_norm = colors.PowerNorm(gamma=1. / 2.)
+
+        im = self._imshow_raster(self._RasterList[-1], "nearest", alpha = alpha, norm = this_norm, zorder=zorder)
 
         # This affects all axes because we set share_all = True.
         #ax.set_xlim(self._xmin,self._xmax)
@@ -729,10 +1012,16 @@ class MapFigure(object):
 
         Author: SMM
         """
-        Raster = BaseRaster(RasterName,Directory, NFF_opti = NFF_opti)
+        Raster = BaseRaster(RasterName,Directory, NFF_opti = NFF_opti, extent = self._window_extent)
         if modify_raster_values == True:
             Raster.replace_raster_values(old_values, new_values)
 
+        # Averaging only makes sense for continuous data
+        if discrete_cmap or modify_raster_values:
+            render_resampling = "nearest"
+        else:
+            render_resampling = "mean"
+
         if discrete_cmap == True:
             print("N colours: "+str(n_colours))
             colourmap = self.cmap_discretize(colourmap, n_colours)
@@ -760,8 +1049,9 @@ class MapFigure(object):
         if len(custom_min_max)!=0:
             if len(custom_min_max)== 2:
                 print("I am setting customisable minimum and maximum values: "+str(custom_min_max[0])+", "+str(custom_min_max[1]))
-                self._RasterList[-1]._RasterArray[self._RasterList[-1]._RasterArray<custom_min_max[0]] = custom_min_max[0]
-                self._RasterList[-1]._RasterArray[self._RasterList[-1]._RasterArray>custom_min_max[1]] = custom_min_max[1]
+                raster_array = self._RasterList[-1]._writable_array()
+                raster_array[raster_array<custom_min_max[0]] = custom_min_max[0]
+                raster_array[raster_array>custom_min_max[1]] = custom_min_max[1]
             else:
                 print("I cannot customize your minimum and maximum because I don't understand your input. It should be [min,max] with min max as integers or floats")
         else:
@@ -769,6 +1059,7 @@ class MapFigure(object):
 
         # We need to initiate with a figure
         #self.ax = self.fig.add_axes([0.1,0.1,0.7,0.7])
+        this_norm = None
         if len(colour_min_max)!=0:
             if len(colour_min_max)== 2:
                 print("custom min and max are:")
@@ -776,21 +1067,20 @@ class MapFigure(object):
                 print(colour_min_max[1])
                 print("I am setting customisable colourbar minimum and maximum values: "+str(colour_min_max[0])+","+str(colour_min_max[1]))
                 if(nroma == "LogNorm"):
-                    im = self.ax_list[0].imshow(self._RasterList[-1]._RasterArray, self._RasterList[-1]._colourmap, extent = self._RasterList[0].extents, interpolation="nearest",alpha = alpha, norm = mpl.colors.LogNorm(vmin=colour_min_max[0], vmax=colour_min_max[1]),zorder=zorder)
+                    this_norm = mpl.colors.LogNorm(vmin=colour_min_max[0], vmax=colour_min_max[1])
                 elif(nroma == "PowerNorm"):
-                    im = self.ax_list[0].imshow(self._RasterList[-1]._RasterArray, self._RasterList[-1]._colourmap, extent = self._RasterList[0].extents, interpolation="nearest",alpha = alpha, norm = mpl.colors.PowerNorm(gamma=1. / 2.),zorder=zorder) 
+                    this_norm = mpl.colors.PowerNorm(gamma=1. / 2.)
                 else:
-                    im = self.ax_list[0].imshow(self._RasterList[-1]._RasterArray, self._RasterList[-1]._colourmap, extent = self._RasterList[0].extents, interpolation="nearest",alpha = alpha, norm = mpl.colors.Normalize(vmin=colour_min_max[0], vmax=colour_min_max[1]),zorder=zorder)                    
+                    this_norm = mpl.colors.Normalize(vmin=colour_min_max[0], vmax=colour_min_max[1])
             else:
                 print("I cannot customize your colour minimum and maximum because I don't understand your input. It should be [min,max] with min max as integers or floats")
         else:
             if(nroma == "LogNorm"):
-                im = self.ax_list[0].imshow(self._RasterList[-1]._RasterArray, self._RasterList[-1]._colourmap, extent = self._RasterList[0].extents,interpolation="nearest",alpha = alpha, norm=colors.LogNorm(vmin=rmin, vmax=rmax), zorder=zorder)
+                this_norm = colors.LogNorm(vmin=rmin, vmax=rmax)
             elif(nroma == "PowerNorm"):
-                im = self.ax_list[0].imshow(self._RasterList[-1]._RasterArray, self._RasterList[-1]._colourmap, extent = self._RasterList[0].extents,interpolation="nearest",alpha = alpha, norm=colors.PowerNorm(gamma=1. / 2.), zorder=zorder)
-            else:
-                im = self.ax_list[0].imshow(self._RasterList[-1]._RasterArray, self._RasterList[-1]._colourmap,extent = self._RasterList[0].extents, interpolation="nearest",alpha = alpha, zorder=zorder)
-                
+                this_norm = colors.PowerNorm(gamma=1. / 2.)
+
+        im = self._imshow_raster(self._RasterList[-1], render_resampling, alpha = alpha, norm = this_norm, zorder=zorder)
 
         # This affects all axes because we set share_all = True.
         #ax.set_xlim(self._xmin,self._xmax)
@@ -859,10 +1149,14 @@ class MapFigure(object):
         # Get the basin outlines
         # Basins referes to a dict where the key is the junction index and the
         # value is a shapely polygon object
+        # The outlines don't need more detail than the rasters are drawn with, so
+        # simplify them to half a pixel of the render resolution
+        base_extents = self._RasterList[0].extents
+        render_cell = max(base_extents[1]-base_extents[0], base_extents[3]-base_extents[2])/float(max(self._render_shape))
         if not parallel:
-          Basins = LSDP.GetBasinOutlines(Directory, RasterName)
+          Basins = LSDP.GetBasinOutlines(Directory, RasterName, simplify_tolerance = 0.5*render_cell)
         else:
-          Basins = LSDP.GetMultipleBasinOutlines(Directory)
+          Basins = LSDP.GetMultipleBasinOutlines(Directory, simplify_tolerance = 0.5*render_cell)
 
         # Now check if you want to mask the basins
         # get the basin IDs to make a discrete colourmap for each ID
@@ -906,11 +1200,16 @@ class MapFigure(object):
             # This will hold the labels. Need to initiate here to ensure it lives outside control statements
             texts = []
 
-            # First get the points
+            # First get the points. For a single raster these come from its geometry
+            # index so the basins are not polygonised again
             Points = {}
             print("The number of basins are: "+str(len(Basins)))
-            for basin_key, basin in Basins.items():
-                Points[basin_key] = Point(basin.representative_point())
+            if not parallel:
+                AllPoints = LSDP.GetPointWithinBasins(Directory, RasterName)
+                Points = {basin_key: AllPoints[basin_key] for basin_key in Basins}
+            else:
+                for basin_key, basin in Basins.items():
+                    Points[basin_key] = Point(basin.representative_point())
             print("The number of points are: "+str(len(Points)))
 
             # Now check if there is a renaming dictionary
@@ -1186,8 +1485,7 @@ class MapFigure(object):
 
         # get the min and the max of the colourbar
         if use_baseraster:
-            vmin = np.nanmin(BaseRaster._RasterArray)
-            vmax = np.nanmax(BaseRaster._RasterArray)
+            vmin, vmax = BaseRaster.get_min_max()
         else:
             print("I'm fixing the ticks, but won't use a base raster, since you told me not to.")
             vmin = min_value
@@ -1334,7 +1632,8 @@ class MapFigure(object):
                        colour_log = False, colour_manual_scale = [],
                        manual_size = 0.5, alpha = 1, minimum_log_scale_cut_off = -10, label_field = "None",
                        font_size = 6, offset = 100, zorder=1, marker = "o", black_contours = False, discrete_colours = False, NColours = 10,scale_in_absolute = False, color_abs =False, unicolor = "blue",
-                       recast_scale_min_max = [], scale_in_abs_after_recasting = False, legend=False, label=""):
+                       recast_scale_min_max = [], scale_in_abs_after_recasting = False, legend=False, label="",
+                       max_scatter_points = 200000, large_point_mode = "rasterized"):
 
         """
         This add point data to the map.
@@ -1369,6 +1668,9 @@ class MapFigure(object):
             color_abs: get the absolute data for scale
             recast_scale_min_max: recast the min and max of the array before scaling
             scale_in_abs_after_recasting: give the abolute value of scaling after recasting the data
+            max_scatter_points (int): If there are more points than this they are drawn using large_point_mode. None to always draw them as vector points.
+            large_point_mode (str): "rasterized" draws the points as a bitmap in vector formats (pdf, svg) so the file doesn't contain millions of symbols.
+                "binned" bins the points into an image at the render resolution (the mean value in each pixel, or the maximum for discrete colours), which is much faster.
 
         Author: SMM, BG
         """
@@ -1393,6 +1695,18 @@ class MapFigure(object):
             northing = thisPointData.QueryData("northing").as_matrix().astype(float)
 
         print("I got the easting and northing")
+        easting = np.asarray(easting, dtype=float)
+        northing = np.asarray(northing, dtype=float)
+        n_points = len(easting)
+        rasterize_points = False
+        bin_points = False
+        if max_scatter_points is not None and n_points > max_scatter_points:
+            if large_point_mode == "binned":
+                print("You have "+str(n_points)+" points so I am going to bin them into an image")
+                bin_points = True
+            else:
+                print("You have "+str(n_points)+" points so I am going to rasterise them")
+                rasterize_points = True
 
         # check if the column for plotting exists
         # BG - 16/01/2018 - Adding some exception management. Sometimes, a list can be returned by QueryData and crash here
@@ -1457,14 +1771,8 @@ class MapFigure(object):
                 print("max is: "+str(max_sd)+ " and min is: "+ str(min_sd))
 
                 # now rescale the data. Always a linear scaling.
-                new_scale = []
                 size_range = max_point_size-min_point_size
-                for datum in scale_data:
-                    frac = (datum-min_sd)/(max_sd-min_sd)
-                    new_size = frac*size_range+min_point_size
-                    new_scale.append(new_size)
-                ns_array = np.asarray(new_scale)
-                point_scale = ns_array
+                point_scale = (np.asarray(scale_data, dtype=float)-min_sd)*(size_range/(max_sd-min_sd))+min_point_size
                 print("I have got a scaled point array,")
         else:
             print("I will not scale your points.")
@@ -1473,12 +1781,26 @@ class MapFigure(object):
 
 
         print("I will plot the points now.")
-        if len(this_data) == 0 or len(this_data) != len(easting):
+        if bin_points:
+            if len(this_data) == 0 or len(this_data) != len(easting):
+                print("I am only plotting the points.")
+                sc = self._add_binned_points(easting, northing, None, _mcolors.ListedColormap([unicolor]), None, "count", alpha, zorder)
+            elif discrete_colours:
+                cNorm  = colors.Normalize(vmin=0, vmax=NColours-1)
+                sc = self._add_binned_points(easting, northing, np.mod(this_data, NColours), this_colourmap, cNorm, "max", alpha, zorder)
+            else:
+                if len(colour_manual_scale) == 2:
+                    cNorm  = _mcolors.Normalize(vmin=colour_manual_scale[0], vmax=colour_manual_scale[1])
+                else:
+                    cNorm = None
+                sc = self._add_binned_points(easting, northing, this_data, this_colourmap, cNorm, "mean", alpha, zorder)
+
+        elif len(this_data) == 0 or len(this_data) != len(easting):
             print("I am only plotting the points.")
             unicolor = unicolor
-            sc = self.ax_list[0].scatter(easting,northing,s=point_scale, c= unicolor,cmap=this_colourmap,edgecolors='none', alpha = alpha,zorder=zorder, marker = marker)
+            sc = self.ax_list[0].scatter(easting,northing,s=point_scale, c= unicolor,cmap=this_colourmap,edgecolors='none', alpha = alpha,zorder=zorder, rasterized = rasterize_points, marker = marker)
             if(black_contours):
-                self.ax_list[0].scatter(easting,northing,s=point_scale,lw = 0.3, edgecolors='k',facecolor = "none", alpha = alpha,zorder=zorder, marker = marker)
+                self.ax_list[0].scatter(easting,northing,s=point_scale,lw = 0.3, edgecolors='k',facecolor = "none", alpha = alpha,zorder=zorder, rasterized = rasterize_points, marker = marker)
 
         else:
             print("I will colour by the points")
@@ -1491,10 +1813,10 @@ class MapFigure(object):
                     #scalarMap.set_array(tps_color)
                     #this_colourmap = scalarMap
                     #sc = self.ax_list[0].scatter(easting,northing,s=point_scale, c=tps_color,cmap=this_colourmap,edgecolors='none', alpha = alpha)
-                    sc = self.ax_list[0].scatter(easting,northing,s=point_scale, c=this_data,cmap=this_colourmap,norm=cNorm,edgecolors='none', alpha = alpha,zorder=zorder, marker = marker)
+                    sc = self.ax_list[0].scatter(easting,northing,s=point_scale, c=this_data,cmap=this_colourmap,norm=cNorm,edgecolors='none', alpha = alpha,zorder=zorder, rasterized = rasterize_points, marker = marker)
                     if(black_contours):
 
-                        self.ax_list[0].scatter(easting,northing,s=point_scale,lw = 0.3,edgecolors='k',facecolor = "none",norm=cNorm, alpha = alpha,zorder=zorder, marker = marker)
+                        self.ax_list[0].scatter(easting,northing,s=point_scale,lw = 0.3,edgecolors='k',facecolor = "none",norm=cNorm, alpha = alpha,zorder=zorder, rasterized = rasterize_points, marker = marker)
 
                 else:
                     print("Your colour_log_manual_scale should be something like [min,max], aborting")
@@ -1508,26 +1830,28 @@ class MapFigure(object):
                     this_cmap = this_colourmap
                     cNorm  = colors.Normalize(vmin=0, vmax=NUM_COLORS-1)
                     plt.cm.ScalarMappable(norm=cNorm, cmap=this_colourmap)
-                    channel_data = [x % NUM_COLORS for x in this_data]
+                    channel_data = np.mod(this_data, NUM_COLORS)
 
-                    sc = self.ax_list[0].scatter(easting,northing,s=point_scale, c=channel_data,cmap=this_colourmap, norm=cNorm, alpha = alpha,zorder=zorder)
+                    sc = self.ax_list[0].scatter(easting,northing,s=point_scale, c=channel_data,cmap=this_colourmap, norm=cNorm, alpha = alpha,zorder=zorder, rasterized = rasterize_points)
                     if(black_contours):
-                        sc = self.ax_list[0].scatter(easting,northing,s=point_scale,lw = 0.3, edgecolors = "k", facecolor = "none", norm=cNorm, alpha = alpha,zorder=zorder)
+                        sc = self.ax_list[0].scatter(easting,northing,s=point_scale,lw = 0.3, edgecolors = "k", facecolor = "none", norm=cNorm, alpha = alpha,zorder=zorder, rasterized = rasterize_points)
 
                 else:
-                    sc = self.ax_list[0].scatter(easting,northing,s=point_scale, c=this_data,cmap=this_colourmap,edgecolors='none', alpha = alpha,zorder=zorder, marker = marker)
+                    sc = self.ax_list[0].scatter(easting,northing,s=point_scale, c=this_data,cmap=this_colourmap,edgecolors='none', alpha = alpha,zorder=zorder, rasterized = rasterize_points, marker = marker)
                     if(black_contours):
-                        sc = self.ax_list[0].scatter(easting,northing,s=point_scale,lw = 0.3, edgecolors='k',facecolor = "none", alpha = alpha,zorder=zorder, marker = marker)
+                        sc = self.ax_list[0].scatter(easting,northing,s=point_scale,lw = 0.3, edgecolors='k',facecolor = "none", alpha = alpha,zorder=zorder, rasterized = rasterize_points, marker = marker)
 
 
         # Setting the labelling
         if(label_field != "None"):
             # print("labelling from this tool is not available yet, Boris is working on it")
-            tg = thisPointData.QueryData(label_field)
-            print(tg)
-            for i in range(len(easting)):
-                print(str(tg[i]))
-                sc =self.ax_list[0].text(easting[i]-offset,northing[i]-offset,str(tg[i]),fontsize = font_size)
+            tg = np.asarray(thisPointData.QueryData(label_field))
+            # Only the points you can see get a label
+            in_view = (easting >= min(this_xlim)) & (easting <= max(this_xlim)) & \
+                      (northing >= min(this_ylim)) & (northing <= max(this_ylim))
+            print("I am labelling "+str(np.count_nonzero(in_view))+" points")
+            for x, y, this_label in zip(easting[in_view]-offset, northing[in_view]-offset, tg[in_view].astype(str)):
+                self.ax_list[0].text(x, y, this_label, fontsize = font_size)
 
         # Annoying but the scatter plot resets the extents so you need to reassert them
         self.ax_list[0].set_xlim(this_xlim)
@@ -1553,6 +1877,64 @@ class MapFigure(object):
             legend_line = mlines.Line2D([],[], color=unicolor, lw=min_point_size, label=label)
             self.legend_handles_list.append(legend_line)
 
+    def _add_binned_points(self, easting, northing, values, cmap, norm, statistic, alpha, zorder):
+        """
+        Draws points as an image by binning them into pixels over the current map extent.
+        The pixels are those of the base raster (points like channel nodes sit on its pixels),
+        or bigger if that would be more than the rasters are rendered at.
+
+        Args:
+            easting (array): the eastings of the points
+            northing (array): the northings of the points
+            values (array): the values of the points, or None if you just want to see where they are
+            cmap (str or colourmap): the colourmap
+            norm (Normalize): the normalisation of the colours, or None to use the range of the data
+            statistic (str): "mean" or "max" of the values in each pixel, or "count" to just show the occupied pixels
+            alpha (float): transparency (between 0 and 1).
+            zorder (int): priority for plotting
+
+        Returns:
+            The image object
+
+        Author: SMM
+        """
+        this_xlim = self.ax_list[0].get_xlim()
+        this_ylim = self.ax_list[0].get_ylim()
+        xmin, xmax = min(this_xlim), max(this_xlim)
+        ymin, ymax = min(this_ylim), max(this_ylim)
+
+        BaseRaster = self._RasterList[0]
+        raster_cell = (BaseRaster.extents[1]-BaseRaster.extents[0])/BaseRaster._RasterData.shape[1]
+        cell = max((xmax-xmin)/self._render_shape[1], (ymax-ymin)/self._render_shape[0], raster_cell)
+        ncols = max(int(round((xmax-xmin)/cell)), 1)
+        nrows = max(int(round((ymax-ymin)/cell)), 1)
+
+        col = np.floor((easting-xmin)*(ncols/(xmax-xmin))).astype(np.int64)
+        row = np.floor((ymax-northing)*(nrows/(ymax-ymin))).astype(np.int64)
+        inside = (col >= 0) & (col < ncols) & (row >= 0) & (row < nrows)
+        if values is not None:
+            values = np.asarray(values, dtype=float)
+            inside &= np.isfinite(values)
+            values = values[inside]
+        pixel = row[inside]*ncols+col[inside]
+
+        counts = np.bincount(pixel, minlength=nrows*ncols)
+        if statistic == "count":
+            image = np.where(counts > 0, 1.0, np.nan)
+        elif statistic == "max":
+            image = np.full(nrows*ncols, -np.inf)
+            np.maximum.at(image, pixel, values)
+            image[counts == 0] = np.nan
+        else:
+            sums = np.bincount(pixel, weights=values, minlength=nrows*ncols)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                image = sums/counts
+        image = image.reshape(nrows, ncols)
+
+        im = self.ax_list[0].imshow(image, cmap, norm=norm, extent=[xmin, xmax, ymin, ymax],
+                                    interpolation="nearest", alpha=alpha, zorder=zorder)
+        return im
+
     def add_line_data(self, ThisLineFile, linestyle = '-', edgecolour = "k", linewidth=0.5, zorder = 1, alpha=1, legend=False, label=""):
         """
         This adds line data from a named shapefile to the map.
@@ -2154,6 +2536,10 @@ class MapFigure(object):
         #self.ax_list[0].set_ylim(self._ymax,self._ymin)
         self.ax_list[0].set_ylim(self._ymin,self._ymax)
 
+        # Now we know how many pixels the map has, draw the rasters from the matching overview
+        self.update_render_resolution(map_axes[2]*fig_size_inches[0]*Fig_dpi,
+                                      map_axes[3]*fig_size_inches[1]*Fig_dpi)
+
         # add the title
         if self.title != "None":
             self.ax_list[0].set_title(self.title)
@@ -12,6 +12,7 @@
 
 """
 
+import os
 import matplotlib
 # Force matplotlib to not use any Xwindows backend.
 matplotlib.use('Agg')
@@ -71,11 +72,16 @@ def SimpleHillshade(DataDirectory,Base_file, cmap = "jet", cbar_loc = "right", s
     BackgroundRasterName = Base_file+"_hs.bil"
     DrapeRasterName = Base_file+".bil"
 
+    # If there is no hillshade raster it is made from the DEM (and kept in the hillshade cache)
+    compute_hillshade = not os.path.isfile(DataDirectory+BackgroundRasterName)
+    if compute_hillshade:
+        BackgroundRasterName = DrapeRasterName
+
     # clear the plot
     plt.clf()
 
     # set up the base image and the map
-    MF = MapFigure(BackgroundRasterName, DataDirectory,coord_type="UTM_km",colourbar_location = cbar_loc)
+    MF = MapFigure(BackgroundRasterName, DataDirectory,coord_type="UTM_km",colourbar_location = cbar_loc, compute_hillshade = compute_hillshade)
     MF.add_drape_image(DrapeRasterName,DataDirectory,colourmap = cmap, alpha = 0.6, colorbarlabel = "Elevation (m)")
 
     # Save the image
@@ -192,11 +198,17 @@ def SimpleHillshadeForAnimation(DataDirectory,Base_file, cmap = "jet", cbar_loc
     BackgroundRasterName = Base_file+"_hs.bil"
     DrapeRasterName = Base_file+".bil"
 
+    # If there is no hillshade raster it is made from the DEM. It is kept in the hillshade
+    # cache so frames that haven't changed aren't hillshaded again
+    compute_hillshade = not os.path.isfile(DataDirectory+BackgroundRasterName)
+    if compute_hillshade:
+        BackgroundRasterName = DrapeRasterName
+
     # clear the plot
     plt.clf()
 
     # set up the base image and the map
-    MF = MapFigure(BackgroundRasterName, DataDirectory,coord_type=coord_type,colourbar_location = cbar_loc)
+    MF = MapFigure(BackgroundRasterName, DataDirectory,coord_type=coord_type,colourbar_location = cbar_loc, compute_hillshade = compute_hillshade)
     MF.add_drape_image(DrapeRasterName,DataDirectory,colourmap = cmap, alpha = 0.6, colorbarlabel = "Elevation (m)",colour_min_max = custom_cbar_min_max)
 
     # Save the image
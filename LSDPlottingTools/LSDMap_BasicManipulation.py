@@ -10,7 +10,8 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import numpy as np
 from . import LSDMap_OSystemTools as LSDOst
 from . import LSDMap_GDALIO as LSDMap_IO
-from pyproj import Proj, transform
+from . import LSDMap_PointTools as LSDMap_PD
+from . import LSDMap_RasterAlgebra as LSDMap_RA
 
 
 def GetUTMEastingNorthing(EPSG_string,latitude,longitude):
@@ -30,9 +31,7 @@ def GetUTMEastingNorthing(EPSG_string,latitude,longitude):
 
     #print "Yo, getting this stuff: "+EPSG_string
     # The lat long are in epsg 4326 which is WGS84
-    inProj = Proj(init='epsg:4326')
-    outProj = Proj(init=EPSG_string)
-    ea,no = transform(inProj,outProj,longitude,latitude)
+    ea,no = LSDMap_PD.TransformCoordinates('epsg:4326',EPSG_string,longitude,latitude)
 
     return ea,no
 
@@ -80,16 +79,9 @@ def SetNoDataBelowThreshold(raster_filename,new_raster_filename, threshold = 0,
 
 
 
-    # read the data
-    rasterArray = LSDMap_IO.ReadRasterArrayBlocks(raster_filename)
-    print("Read the data")
-
-    # set any point on the raster below the threshold as nodata
-    rasterArray[rasterArray <= threshold] = NoDataValue
-    print("Reset raster values")
-
-    # write the data to a new file
-    LSDMap_IO.array2raster(raster_filename,new_raster_filename,rasterArray,driver_name, NoDataValue)
+    # set any point on the raster below the threshold as nodata, a strip at a time
+    raster = LSDMap_RA.LazyRaster(raster_filename)
+    raster.where(raster > threshold).write(new_raster_filename, driver_name, NoDataValue)
     print("Wrote raster")
 #==============================================================================
 
@@ -116,17 +108,12 @@ def SetToConstantValue(raster_filename,new_raster_filename, constant_value, driv
 
     # get the nodata value
     NoDataValue =  LSDMap_IO.getNoDataValue(raster_filename)
+    if NoDataValue is None:
+        NoDataValue = -9999
 
-    # read the data
-    rasterArray = LSDMap_IO.ReadRasterArrayBlocks(raster_filename)
-    print("Read the data")
-
-    # set any nodata to a constant value
-    rasterArray[rasterArray != NoDataValue] = constant_value
-    print("Changed to a constant value")
-
-    # write the data to a new file
-    LSDMap_IO.array2raster(raster_filename,new_raster_filename,rasterArray,driver_name, NoDataValue)
+    # set anything that isn't nodata to a constant value, a strip at a time
+    raster = LSDMap_RA.LazyRaster(raster_filename)
+    raster.apply(lambda values: np.where(np.isnan(values), np.nan, constant_value)).write(new_raster_filename, driver_name, NoDataValue)
     print("Wrote raster")
 
 #==============================================================================
@@ -150,11 +137,34 @@ def GetHillshade(raster_filename,new_raster_filename, azimuth = 315, angle_altit
     """
     # avoid circular import
     from . import LSDMap_BasicPlotting as LSDMBP
-    # get the hillshade
-    hillshade_raster = LSDMBP.Hillshade(raster_filename, azimuth, angle_altitude)
 
-    # write to file
-    LSDMap_IO.array2raster(raster_filename,new_raster_filename,hillshade_raster,driver_name, NoDataValue)
+    if driver_name == "ENVI" and LSDMap_IO.IsENVIRaster(raster_filename):
+        # Map both rasters so the hillshade goes from one file to the other a strip at a time
+        header = LSDMap_IO.ReadENVIHeader(raster_filename)
+        dem = LSDMap_IO.ReadRasterArrayMemmap(raster_filename, mode="r")
+        dem_NDV = header["NoDataValue"] if header["NoDataValue"] is not None else NoDataValue
+        GeoT = header["GeoT"]
+        if GeoT is None:
+            # There is no map info in the header, see if GDAL can find the cell size elsewhere
+            try:
+                GeoT = LSDMap_IO.GetGeoInfo(raster_filename)[3]
+            except Exception:
+                GeoT = None
+        if GeoT is None:
+            print("I couldn't find the cell size of "+raster_filename+", so I'll use 1.")
+            GeoT = (0.0, 1.0, 0.0, 0.0, 0.0, -1.0)
+        writer = LSDMap_RA.RasterWriter(raster_filename, new_raster_filename, driver_name, NoDataValue)
+        LSDMBP.HillshadeArray(dem, (GeoT[1], GeoT[5]), azimuth, angle_altitude,
+                              dem_NDV, out = writer.array)
+        for i in range(0, writer.shape[0], 1024):
+            writer.write(i, writer.array[i:i+1024])
+        writer.close()
+    else:
+        # get the hillshade
+        hillshade_raster = LSDMBP.Hillshade(raster_filename, azimuth, angle_altitude)
+
+        # write to file
+        LSDMap_IO.array2raster(raster_filename,new_raster_filename,hillshade_raster,driver_name, NoDataValue)
 
 
 
@@ -369,12 +379,18 @@ def NanBelowThreshold(rasterArray,threshold):
 def RasterMeanValue(path, file1):
     """This takes the average of a raster.
 
+    Note:
+        This is the mean of the pixels that are not nodata. It used to be the sum of
+        all the pixels (nodata values included) divided by the number of pixels, which
+        was wrong for any raster with nodata in it. For a raster without nodata the
+        two are the same.
+
     Args:
         path (str): The path to the raster
         file1 (str): The name of the file
 
     Returns:
-        mean_value: The mean
+        mean_value: The mean of the pixels that are not nodata (NaN if they all are)
 
     Author: SMM
     """
@@ -384,11 +400,8 @@ def RasterMeanValue(path, file1):
 
     raster_file1 = NewPath+file1
 
-    NPixels = LSDMap_IO.GetNPixelsInRaster(raster_file1)
-
-    Raster1 = LSDMap_IO.ReadRasterArrayBlocks(raster_file1,raster_band=1)
-
-    mean_value = np.sum(Raster1)/float(NPixels)
+    # the mean of the pixels that aren't nodata, a strip at a time
+    mean_value = LSDMap_RA.LazyRaster(raster_file1).mean()
 
     return mean_value
 
@@ -397,13 +410,15 @@ def RasterMeanValue(path, file1):
 # if axis is 0, this is along x axis, if axis is 1, is along y axis
 # otherwise will throw error
 #==============================================================================
-def SimpleSwath(path, file1, axis):
-    """This function averages all the data along one of the directions
+def SimpleSwath(path, file1, axis, block_rows = 1024):
+    """This function averages all the data along one of the directions.
+    The raster is streamed in strips (see SwathStatistics) so it can be larger than your RAM.
 
     Args:
         path (str): The path to the files
         file1 (str): The name of the first raster.
         axis (int): Either 0 (rows) or 1 (cols)
+        block_rows (int): the number of rows read at a time
 
     Returns:
         float: A load of information about the swath.
@@ -424,46 +439,247 @@ def SimpleSwath(path, file1, axis):
 
     raster_file1 = NewPath+file1
 
-    # get some information about the raster
-    NDV, xsize, ysize, GeoT, Projection, DataType = LSDMap_IO.GetGeoInfo(raster_file1)
-
-    print("NDV is: ")
-    print(NDV)
-
-    if NDV == None:
-        NDV = -9999
-        print("No NDV defined")
-
-    Raster1 = LSDMap_IO.ReadRasterArrayBlocks(raster_file1,raster_band=1)
+    swath = SwathStatistics(raster_file1, axis = axis, percentiles = (25, 50, 75), block_rows = block_rows)
 
+    means = swath["mean"]
+    medians = swath["percentiles"][50]
+    std_deviations = swath["std"]
+    twentyfifth_percentile = swath["percentiles"][25]
+    seventyfifth_percentile = swath["percentiles"][75]
 
-    #nan_raster = Raster1[Raster1==NDV]=np.nan
-    #print nan_raster
+    return means,medians,std_deviations,twentyfifth_percentile,seventyfifth_percentile
 
-    #now mask the nodata
-    masked_Raster1  = np.ma.masked_values(Raster1, NDV)
+#==============================================================================
+# A swath engine that streams the raster
+#==============================================================================
+def SwathStatistics(raster_file, axis = None, start = None, end = None, width = None,
+                    bin_width = None, percentiles = (25, 50, 75), n_levels = 256,
+                    value_range = None, refine = True, block_rows = 1024):
+    """Gets the statistics of a raster in bins along a swath, reading the raster a strip
+    of rows at a time so it can be larger than your RAM.
+
+    The swath is either along one of the axes of the raster (axis = 0 gives a value for
+    every column, axis = 1 for every row), or along a line from start to end, of a given
+    width, in any direction. In that case the bins are bin_width long and every pixel
+    whose centre is in the swath goes into the bin it is next to along the line. Only the
+    part of the raster around the swath is read.
+
+    The count, mean, standard deviation, min and max are exact. For the percentiles the
+    first pass counts the values of each bin in a histogram of n_levels levels over
+    value_range. If refine is true a second pass keeps only the values in the levels that
+    hold the percentiles, so the percentiles are exact (the same as np.percentile). This
+    needs memory for the values in those levels, which is a small part of the swath
+    unless most of a bin is in one level (e.g. a flat area). If refine is false the
+    percentiles are interpolated within their level, which is only an estimate.
+    The histograms take n_bins*n_levels*8 bytes.
 
-    means = np.mean(masked_Raster1, axis)
-    medians = np.median(masked_Raster1, axis)
-    std_deviations = np.std(masked_Raster1, axis)
-    twentyfifth_percentile = np.percentile(masked_Raster1, 25, axis)
-    seventyfifth_percentile = np.percentile(masked_Raster1, 75, axis)
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+        axis (int): 0 or 1 for a swath along an axis, None to use start, end and width
+        start (tuple): the (x,y) of the start of the swath line, in map units
+        end (tuple): the (x,y) of the end of the swath line
+        width (float): the full width of the swath
+        bin_width (float): the length of the bins along the swath. Defaults to the cell size.
+        percentiles (list): the percentiles (0 to 100) you want
+        n_levels (int): the number of levels in the histograms used for the percentiles
+        value_range (tuple): the (min, max) the levels are spread over. It doesn't have to be exact.
+            If None it comes from LSDMap_IO.GetApproximateRange, which uses the statistics stored
+            with the raster or its overviews if it has them, and otherwise reads the whole raster
+            (an extra pass).
+        refine (bool): if true, make a second pass so the percentiles are exact
+        block_rows (int): the number of rows read at a time
 
-    # This stuff only works with numpy 1.8 or later, wich we don't have
-    #means = np.nanmean(nan_raster, axis)
-    #medians = np.nanmedian(nan_raster, axis)
-    #std_deviations = np.nanstd(nan_raster, axis)
-    #twentyfifth_percentile = np.nanpercentile(nan_raster, 25, axis)
-    #seventyfifth_percentile = np.nanpercentile(nan_raster, 75, axis)
+    Returns:
+        dict: with numpy arrays (one value per bin) distance, count, mean, std, min, max,
+        and percentiles, a dict of arrays. Bins with no data are NaN.
 
-    #print means
-    #print medians
-    #print std_deviations
-    #print twentyfifth_percentile
-    #print seventyfifth_percentile
+    Author: SMM
+    """
+    NDV, xsize, ysize, GeoT, Projection, DataType = LSDMap_IO.GetGeoInfo(raster_file)
+    x_centres = GeoT[0] + (np.arange(xsize)+0.5)*GeoT[1]
+    row_range = (0, ysize)
+    col_range = (0, xsize)
+
+    if axis is not None:
+        if axis == 0:
+            n_bins = xsize
+            distance = x_centres
+        elif axis == 1:
+            n_bins = ysize
+            distance = GeoT[3] + (np.arange(ysize)+0.5)*GeoT[5]
+        else:
+            raise Exception("The axis of a swath must be 0 or 1.")
+    else:
+        if start is None or end is None or width is None:
+            raise Exception("For a swath that isn't along an axis you need the start, end and width.")
+        x0, y0 = start
+        length = np.hypot(end[0]-x0, end[1]-y0)
+        if length == 0:
+            raise Exception("The start and end of the swath are the same point.")
+        ux = (end[0]-x0)/length
+        uy = (end[1]-y0)/length
+        if bin_width is None:
+            bin_width = abs(GeoT[1])
+        n_bins = int(np.ceil(length/bin_width))
+        distance = (np.arange(n_bins)+0.5)*bin_width
+
+        # Only read the part of the raster around the swath
+        half = 0.5*width
+        corners_x = [x0-uy*half, x0+uy*half, end[0]-uy*half, end[0]+uy*half]
+        corners_y = [y0+ux*half, y0-ux*half, end[1]+ux*half, end[1]-ux*half]
+        cols = (np.array([min(corners_x), max(corners_x)])-GeoT[0])/GeoT[1]
+        rows = (np.array([max(corners_y), min(corners_y)])-GeoT[3])/GeoT[5]
+        col_range = (int(np.clip(np.floor(cols.min()), 0, xsize)), int(np.clip(np.ceil(cols.max())+1, 0, xsize)))
+        row_range = (int(np.clip(np.floor(rows.min()), 0, ysize)), int(np.clip(np.ceil(rows.max())+1, 0, ysize)))
+
+    if value_range is None:
+        value_range = LSDMap_IO.GetApproximateRange(raster_file)
+    lo, hi = float(value_range[0]), float(value_range[1])
+    if not hi > lo:
+        hi = lo+1.0
+    level_width = (hi-lo)/n_levels
+
+    def swath_strips():
+        """Gives the bin, level and value of the pixels of each strip that are in the swath"""
+        for i, strip in LSDMap_IO.ReadRasterStrips(raster_file, block_rows, row_range = row_range, col_range = col_range):
+            these_rows = np.arange(i, i+strip.shape[0])
+            if axis == 0:
+                labels = np.broadcast_to(np.arange(col_range[0], col_range[1]), strip.shape)
+                ok = np.isfinite(strip)
+            elif axis == 1:
+                labels = np.broadcast_to(these_rows[:, None], strip.shape)
+                ok = np.isfinite(strip)
+            else:
+                px = x_centres[col_range[0]:col_range[1]][None, :] - x0
+                py = (GeoT[3] + (these_rows+0.5)*GeoT[5])[:, None] - y0
+                along = px*ux + py*uy
+                across = py*ux - px*uy
+                ok = np.isfinite(strip) & (along >= 0) & (along < length) & (np.abs(across) <= half)
+                labels = np.floor(along/bin_width).astype(np.int64)
+
+            values = strip[ok].astype(np.float64)
+            if values.size == 0:
+                continue
+            labels = np.minimum(labels[ok], n_bins-1)
+            # values outside value_range go in the end levels, which keeps them in order
+            levels = np.clip(np.floor((values-lo)/level_width), 0, n_levels-1).astype(np.int64)
+            yield labels, levels, values
+
+    count = np.zeros(n_bins, dtype=np.int64)
+    total = np.zeros(n_bins)
+    total_sq = np.zeros(n_bins)
+    minimum = np.full(n_bins, np.inf)
+    maximum = np.full(n_bins, -np.inf)
+    hist = np.zeros(n_bins*n_levels, dtype=np.int64)
+
+    for labels, levels, values in swath_strips():
+        count += np.bincount(labels, minlength=n_bins)
+        total += np.bincount(labels, values, minlength=n_bins)
+        total_sq += np.bincount(labels, values*values, minlength=n_bins)
+        np.minimum.at(minimum, labels, values)
+        np.maximum.at(maximum, labels, values)
+
+        # Only count over the part of the histograms this strip touches
+        keys = labels*n_levels+levels
+        first = keys.min()
+        span = keys.max()-first+1
+        if span <= 4*keys.size:
+            hist[first:first+span] += np.bincount(keys-first, minlength=span)
+        else:
+            np.add.at(hist, keys, 1)
+
+    # Now the statistics of each bin
+    empty = count == 0
+    n = np.where(empty, 1, count)
+    mean = total/n
+    std = np.sqrt(np.maximum(total_sq/n - mean*mean, 0.0))
+
+    hist = hist.reshape(n_bins, n_levels)
+    cumulative = np.cumsum(hist, axis=1)
+    all_bins = np.arange(n_bins)
+
+    def find_level(rank):
+        """Gets the level each rank is in, and the number of values below that level"""
+        level = np.minimum((cumulative <= rank[:, None]).sum(axis=1), n_levels-1)
+        below = np.where(level > 0, cumulative[all_bins, level-1], 0)
+        return level, below
+
+    # the ranks as np.percentile: between the values at floor(rank) and the one after
+    ranks = {}
+    for p in percentiles:
+        rank = p/100.0*np.maximum(count-1, 0)
+        lower = np.floor(rank).astype(np.int64)
+        upper = np.minimum(lower+1, np.maximum(count-1, 0))
+        ranks[p] = (rank, lower, upper)
+
+    if refine:
+        # Keep the values in the levels that hold the ranks, and sort them
+        wanted = np.zeros((n_bins, n_levels), dtype=bool)
+        for rank, lower, upper in ranks.values():
+            for r in (lower, upper):
+                wanted[all_bins, find_level(r)[0]] = True
+        kept_keys = []
+        kept_values = []
+        for labels, levels, values in swath_strips():
+            keep = wanted[labels, levels]
+            kept_keys.append(labels[keep]*n_levels+levels[keep])
+            kept_values.append(values[keep])
+        if len(kept_keys) > 0:
+            kept_keys = np.concatenate(kept_keys)
+            kept_values = np.concatenate(kept_values)
+        else:
+            kept_keys = np.zeros(0, dtype=np.int64)
+            kept_values = np.zeros(0)
+        order = np.lexsort((kept_values, kept_keys))
+        kept_keys = kept_keys[order]
+        kept_values = kept_values[order]
+
+        def value_at(r):
+            """Gets the value of rank r (counting from 0) in each bin"""
+            if kept_values.size == 0:
+                # every bin is empty
+                return np.full(n_bins, np.nan)
+            level, below = find_level(r)
+            where = np.searchsorted(kept_keys, all_bins*n_levels+level) + (r-below)
+            return kept_values[np.clip(where, 0, kept_values.size-1)]
+
+    percentile_dict = {}
+    for p in percentiles:
+        rank, lower, upper = ranks[p]
+        if refine:
+            lower_value = value_at(lower)
+            value = lower_value + (rank-lower)*(value_at(upper)-lower_value)
+        else:
+            # interpolate within the level the rank is in
+            level, below = find_level(rank)
+            in_level = np.maximum(hist[all_bins, level], 1)
+            value = lo + (level + (rank-below+0.5)/in_level)*level_width
+            value = np.clip(value, minimum, maximum)
+        value[empty] = np.nan
+        percentile_dict[p] = value
+
+    for vec in (mean, std, minimum, maximum):
+        vec[empty] = np.nan
+
+    return {"distance": distance, "count": count, "mean": mean, "std": std,
+            "min": minimum, "max": maximum, "percentiles": percentile_dict}
+
+def WriteSwathProfile(swath, out_file):
+    """Writes a swath from SwathStatistics in the format of the swath analysis driver
+    (distance mean sd min LQ median UQ max, with -9999 where there is no data), so it
+    can be plotted with LongitudinalSwathAnalysisPlot.
 
+    Args:
+        swath (dict): from SwathStatistics, with the 25, 50 and 75 percentiles
+        out_file (str): the name of the text file
 
-    return means,medians,std_deviations,twentyfifth_percentile,seventyfifth_percentile
+    Author: SMM
+    """
+    columns = [swath["distance"], swath["mean"], swath["std"], swath["min"],
+               swath["percentiles"][25], swath["percentiles"][50], swath["percentiles"][75], swath["max"]]
+    data = np.column_stack(columns)
+    data[:, 1:][np.isnan(data[:, 1:])] = -9999
+    np.savetxt(out_file, data, fmt="%.4f", header="distance mean sd min LQ median UQ max", comments="")
 
 
 #==============================================================================
@@ -494,13 +710,12 @@ def BasicMassBalance(path, file1, file2):
     print("PixelArea is: " + str(PixelArea))
 
     print("The formatted path is: " + NewPath)
-    Raster1 = LSDMap_IO.ReadRasterArrayBlocks(raster_file1,raster_band=1)
-    Raster2 = LSDMap_IO.ReadRasterArrayBlocks(raster_file2,raster_band=1)
 
-    NewRaster = np.subtract(Raster2,Raster1)
+    # the difference is summed a strip at a time, leaving out nodata in either raster
+    linear_dif = (LSDMap_RA.LazyRaster(raster_file2) - LSDMap_RA.LazyRaster(raster_file1)).sum()
 
-    mass_balance = np.sum(NewRaster)*PixelArea
+    mass_balance = linear_dif*PixelArea
 
-    print("linear dif " + str(np.sum(NewRaster)))
+    print("linear dif " + str(linear_dif))
 
     return mass_balance
@@ -7,6 +7,10 @@
 ##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from matplotlib import rcParams
 from .adjust_text import adjust_text
@@ -1393,16 +1397,382 @@ def BasinsOverFancyHillshade(FileName, HSName, BasinName, Basin_csv_name, basin_
 
 
 
+#==============================================================================
+class HillshadeCache(object):
+    """
+    A cache of hillshades on disk, shared between runs. Hillshades are stored as .npy
+    files named after a digest of the DEM and the hillshade parameters, so if either
+    changes a new hillshade is made. Files are touched when they are used and the least
+    recently used ones are deleted when the cache gets bigger than max_bytes.
+
+    You can set the directory with the LSDMT_HILLSHADE_CACHE environment variable.
+
+    Args:
+        directory (str): where the hillshades are kept
+        max_bytes (int): the maximum size of the cache in bytes
+    """
+    def __init__(self, directory = None, max_bytes = 2*1024**3):
+        if directory is None:
+            directory = os.environ.get("LSDMT_HILLSHADE_CACHE",
+                                       os.path.join(os.path.expanduser("~"), ".cache", "LSDMappingTools", "hillshades"))
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, dem_digest, parameters):
+        """Gets the name of the cache file from the DEM digest and the hillshade parameters."""
+        key = hashlib.blake2b(digest_size=20)
+        key.update(dem_digest.encode("ascii"))
+        key.update(repr(tuple(float(p) if p is not None else None for p in parameters)).encode("ascii"))
+        return os.path.join(self.directory, key.hexdigest()+".npy")
+
+    def get(self, dem_digest, parameters, maker):
+        """Returns the cached hillshade, or calls maker() and stores what it returns.
+
+        Args:
+            dem_digest (str): The digest of the DEM, see DEMDigest
+            parameters (list): Everything else the hillshade depends on (azimuth, cell size, etc.)
+            maker (function): called with no arguments if the hillshade is not in the cache
+
+        Returns:
+            The hillshade array
+        """
+        cache_file = self.make_key(dem_digest, parameters)
+        if os.path.isfile(cache_file):
+            try:
+                HSArray = np.load(cache_file)
+                os.utime(cache_file, None)
+                with self._lock:
+                    self.hits += 1
+                return HSArray
+            except (IOError, OSError, ValueError):
+                # Half written or corrupted, make it again
+                pass
+
+        with self._lock:
+            self.misses += 1
+        HSArray = maker()
+
+        # Written to a temporary file first so other processes never see half a file
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            tmp_file = cache_file+"."+str(os.getpid())+"."+str(threading.get_ident())+".tmp"
+            with open(tmp_file, "wb") as f:
+                np.save(f, HSArray)
+            os.replace(tmp_file, cache_file)
+            self._evict()
+        except (IOError, OSError) as e:
+            print("I couldn't write to the hillshade cache in "+self.directory+": "+str(e))
+        return HSArray
+
+    def _files(self):
+        files = []
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(".npy"):
+                    full_name = os.path.join(self.directory, name)
+                    try:
+                        stat = os.stat(full_name)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, full_name))
+        return files
+
+    def _evict(self):
+        # The least recently used files go first
+        files = sorted(self._files())
+        total = sum(size for mtime, size, name in files)
+        for mtime, size, name in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(name)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """Deletes all the hillshades in the cache and resets the counters."""
+        for mtime, size, name in self._files():
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Returns a dict with the hits, misses, number of files and bytes on disk."""
+        files = self._files()
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "directory": self.directory,
+                    "entries": len(files), "bytes": sum(size for mtime, size, name in files),
+                    "max_bytes": self.max_bytes}
+
+# This is shared by all the hillshade functions
+hillshade_cache = HillshadeCache()
+
+def GetHillshadeCacheStats():
+    """Returns the hit/miss counters and disk use of the hillshade cache."""
+    return hillshade_cache.stats()
+
+def ClearHillshadeCache():
+    """Deletes everything in the hillshade cache."""
+    hillshade_cache.clear()
+
+def SetHillshadeCache(directory = None, max_bytes = None):
+    """Sets the directory and/or the maximum size (in bytes) of the hillshade cache.
+
+    Args:
+        directory (str): where the hillshades are kept
+        max_bytes (int): the maximum size of the cache in bytes
+    """
+    if directory is not None:
+        hillshade_cache.directory = directory
+    if max_bytes is not None:
+        hillshade_cache.max_bytes = max_bytes
+        hillshade_cache._evict()
+#==============================================================================
+
+#==============================================================================
+def DEMDigest(array, block_rows = 1024):
+    """Gets a digest of an elevation array, used as the key of the hillshade cache.
+    A read only memory mapped array is identified by its file and where it sits in
+    the file (see MemmapDigest) so nothing is read; any other array is hashed in strips.
+
+    Args:
+        array (numpy.array): The elevation array
+        block_rows (int): The number of rows hashed at a time
+
+    Returns:
+        The digest as a hex string
+    """
+    memmap_digest = MemmapDigest(array)
+    if memmap_digest is not None:
+        return memmap_digest
+
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((array.shape, array.dtype.str)).encode("ascii"))
+    for i in range(0, array.shape[0], block_rows):
+        digest.update(np.ascontiguousarray(array[i:i+block_rows]).data)
+    return digest.hexdigest()
+
+def MemmapDigest(array):
+    """Gets a digest of an array memory mapped read only from a file, without reading it.
+    Slices of a memmap are memmaps too, so the array is followed back to the memmap that
+    owns the file mapping and the digest includes where the array starts in the file.
+    Copy on write ("c") and writable memmaps can differ from the file, so they don't have one.
+
+    Args:
+        array (numpy.array): The elevation array
+
+    Returns:
+        The digest as a hex string, or None if the array isn't a read only memmap
+    """
+    # The root is the array whose base is the mmap itself
+    root = array
+    while isinstance(root, np.ndarray) and isinstance(root.base, np.ndarray):
+        root = root.base
+    if not isinstance(root, np.memmap) or getattr(root, "filename", None) is None \
+       or root.mode != "r" or not os.path.isfile(root.filename):
+        return None
+
+    # The data of the root starts at its offset in the file
+    position = root.offset + array.__array_interface__["data"][0] - root.__array_interface__["data"][0]
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((array.shape, array.dtype.str, position, array.strides)).encode("ascii"))
+    digest.update(DEMFileDigest(root.filename).encode("ascii"))
+    return digest.hexdigest()
+
+def DEMFileDigest(raster_file):
+    """Gets a digest of a raster file from its path, modification time, size and header,
+    without reading the data. The header is the ENVI .hdr if there is one, otherwise the
+    georeferencing and nodata value from GDAL.
+
+    Args:
+        raster_file (str): The name of the raster file with path and extension
+
+    Returns:
+        The digest as a hex string
+    """
+    full_name = os.path.abspath(raster_file)
+    stat = os.stat(full_name)
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((full_name, stat.st_mtime_ns, stat.st_size)).encode("utf-8"))
+    header_name = LSDMap_IO.GetENVIHeaderName(full_name)
+    if header_name is not None:
+        with open(header_name, "rb") as hdr_file:
+            digest.update(hdr_file.read())
+    else:
+        NDV, xsize, ysize, GeoT, Projection, DataType = LSDMap_IO.GetGeoInfo(full_name)
+        digest.update(repr((NDV, xsize, ysize, tuple(GeoT), DataType)).encode("utf-8"))
+        digest.update(Projection.ExportToWkt().encode("utf-8"))
+    return digest.hexdigest()
+#==============================================================================
+
 #==============================================================================
 # Make a simple hillshade plot
-def Hillshade(raster_file, azimuth = 315, angle_altitude = 45, NoDataValue = -9999,z_factor = 1):
-    """Creates a hillshade raster
+def HillshadeArray(array, DataResolution = 1, azimuth = 315, angle_altitude = 45, NoDataValue = -9999,
+                   z_factor = 1, block_rows = 256, n_threads = None, out = None):
+    """Creates a hillshade from an elevation array. This is the hillshade used by
+    LSDTopoTools (Horn's method for the gradients), so it matches the _hs.bil files.
+
+    Note:
+        The array is processed in strips of rows, each with a one row halo, on a pool of
+        threads (numpy releases the GIL so the strips really do run in parallel).
+        All the work is done in float32 with in-place operations, so apart from the
+        output the memory used is a few strips. The array can be a memory mapped raster.
+
+        Nodata pixels (and NaNs) are NaN in the hillshade. Where a neighbour is nodata the
+        central pixel is used in its place, so the edges of the data aren't eaten away.
 
     Args:
-        raster_file (str): The name of the raster file with path and extension.
+        array (numpy.array): The elevation array
+        DataResolution (float or tuple): The cell size, or (x cell size, y cell size)
         azimuth (float): Azimuth of sunlight
         angle_altitude (float): Angle altitude of sun
-        NoDataValue (float): The nodata value of the raster
+        NoDataValue (float): The nodata value of the raster. None if nodata is NaN.
+        z_factor (float): Vertical exaggeration
+        block_rows (int): The number of rows in each strip
+        n_threads (int): The number of threads. Defaults to the number of CPUs.
+        out (numpy.array): Optional float32 array, the same shape as array, to put the hillshade in.
+
+    Returns:
+        HSArray (numpy.array): The hillshade array (float32)
+
+    Author:
+        DAV, SWDG and SMM
+    """
+    try:
+        dx, dy = DataResolution
+    except TypeError:
+        dx = dy = DataResolution
+    dx = float(dx)
+    dy = abs(float(dy))
+
+    nrows, ncols = array.shape
+    if out is None:
+        out = np.empty(array.shape, dtype=np.float32)
+
+    # The cos(azimuth - aspect) term expanded so we don't need any trig on the arrays:
+    # hs = 255*(cos(zenith) + z*sin(zenith)*(-cos(az)*dzdx + sin(az)*dzdy))/sqrt(1+z^2*(dzdx^2+dzdy^2))
+    zenith_rad = np.radians(90. - angle_altitude)
+    azimuth_rad = np.radians((360. - azimuth + 90.) % 360.)
+    cos_zenith = np.float32(np.cos(zenith_rad))
+    x_coeff = np.float32(-np.cos(azimuth_rad)*z_factor*np.sin(zenith_rad)/(8*dx))
+    y_coeff = np.float32(np.sin(azimuth_rad)*z_factor*np.sin(zenith_rad)/(8*dy))
+    z_x = np.float32(z_factor/(8*dx))
+    z_y = np.float32(z_factor/(8*dy))
+
+    # Weights of the neighbours in dz/dx and dz/dy (rows are north to south)
+    neighbours = [(-1,-1,-1,-1), (-1,0,0,-2), (-1,1,1,-1),
+                  (0,-1,-2,0),               (0,1,2,0),
+                  (1,-1,-1,1),  (1,0,0,2),   (1,1,1,1)]
+
+    def hillshade_strip(i):
+        i_end = min(i+block_rows, nrows)
+        n = i_end-i
+
+        # The strip padded by one pixel all round. Off the edge of the raster the edge is repeated.
+        z = np.empty((n+2, ncols+2), dtype=np.float32)
+        top = max(i-1, 0)
+        bottom = min(i_end+1, nrows)
+        z[1+top-i:1+bottom-i, 1:-1] = array[top:bottom]
+        if top == i:
+            z[0, 1:-1] = z[1, 1:-1]
+        if bottom == i_end:
+            z[-1, 1:-1] = z[-2, 1:-1]
+        z[:, 0] = z[:, 1]
+        z[:, -1] = z[:, -2]
+        if NoDataValue is not None:
+            z[z == NoDataValue] = np.nan
+
+        centre = z[1:-1, 1:-1]
+        nodata = np.isnan(z)
+        has_nodata = nodata.any()
+
+        dzdx = np.zeros((n, ncols), dtype=np.float32)
+        dzdy = np.zeros((n, ncols), dtype=np.float32)
+        nb = np.empty((n, ncols), dtype=np.float32)
+        for di, dj, wx, wy in neighbours:
+            nb[:] = z[1+di:n+1+di, 1+dj:ncols+1+dj]
+            if has_nodata:
+                np.copyto(nb, centre, where=nodata[1+di:n+1+di, 1+dj:ncols+1+dj])
+            if wx != 0:
+                if wx == 1:
+                    dzdx += nb
+                elif wx == -1:
+                    dzdx -= nb
+                else:
+                    dzdx += np.float32(wx)*nb
+            if wy != 0:
+                if wy == 1:
+                    dzdy += nb
+                elif wy == -1:
+                    dzdy -= nb
+                else:
+                    dzdy += np.float32(wy)*nb
+
+        # nb becomes the denominator
+        np.multiply(dzdx, z_x, out=nb)
+        np.square(nb, out=nb)
+        hs = out[i:i_end]
+        np.multiply(dzdy, z_y, out=hs)
+        np.square(hs, out=hs)
+        nb += hs
+        nb += 1
+        np.sqrt(nb, out=nb)
+
+        np.multiply(dzdx, x_coeff, out=hs)
+        dzdy *= y_coeff
+        hs += dzdy
+        hs += cos_zenith
+        hs /= nb
+        hs *= 255
+        np.maximum(hs, 0, out=hs)
+        if has_nodata:
+            hs[nodata[1:-1, 1:-1]] = np.nan
+
+    if n_threads is None:
+        n_threads = os.cpu_count() or 1
+    starts = range(0, nrows, block_rows)
+    if n_threads > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            list(pool.map(hillshade_strip, starts))
+    else:
+        for i in starts:
+            hillshade_strip(i)
+
+    return out
+#==============================================================================
+
+#==============================================================================
+def Hillshade(raster_file, azimuth = 315, angle_altitude = 45, NoDataValue = -9999,z_factor = 1, block_rows = 256,
+              n_threads = None, DataResolution = None, use_cache = None):
+    """Creates a hillshade raster. See HillshadeArray for the details.
+
+    Note:
+        ENVI rasters are memory mapped, so the only full size array is the returned hillshade.
+        Hillshades of files and of read only memory mapped arrays are kept in the hillshade
+        cache on disk (see HillshadeCache), so if the DEM and the parameters haven't changed
+        since the last run the hillshade is just loaded. Other arrays would have to be hashed
+        every time, so they are only cached if you ask for it with use_cache = True.
+
+    Args:
+        raster_file (str or numpy.array): The name of the raster file with path and extension, or an elevation array
+        azimuth (float): Azimuth of sunlight
+        angle_altitude (float): Angle altitude of sun
+        NoDataValue (float): The nodata value of the raster. If you pass a file its own nodata value is used.
+        z_factor (float): Vertical exaggeration
+        block_rows (int): The number of rows in each strip
+        n_threads (int): The number of threads. Defaults to the number of CPUs.
+        DataResolution (float): The cell size. If you pass a file it is read from the file, otherwise it defaults to 1.
+        use_cache (bool): True to use the hillshade cache, False not to. The default (None) uses
+            it for files and read only memory mapped arrays.
 
     Returns:
         HSArray (numpy.array): The hillshade array
@@ -1411,49 +1781,66 @@ def Hillshade(raster_file, azimuth = 315, angle_altitude = 45, NoDataValue = -99
         DAV and SWDG
     """
 
-    #print("The raster file is: "+raster_file)
-
     # You have passed a filepath to be read in as a raster
+    dem_digest = None
     if isinstance(raster_file, str):
-      array = LSDMap_IO.ReadRasterArrayBlocks(raster_file,raster_band=1)
+        if LSDMap_IO.IsENVIRaster(raster_file):
+            array = LSDMap_IO.ReadRasterArrayMemmap(raster_file, raster_band=1, mode="r")
+            NoDataValue = LSDMap_IO.ReadENVIHeader(raster_file)["NoDataValue"]
+        else:
+            # nodata is already NaN
+            array = LSDMap_IO.ReadRasterArrayBlocks(raster_file,raster_band=1)
+            NoDataValue = None
+        if DataResolution is None:
+            GeoT = LSDMap_IO.GetGeoInfo(raster_file)[3]
+            DataResolution = (GeoT[1], GeoT[5])
+        if use_cache is not False:
+            # The file is identified by its path, modification time, size and header, so nothing is read
+            dem_digest = DEMFileDigest(raster_file)
+            use_cache = True
 
     # You already have an array and just want the hill shade
     elif isinstance(raster_file, np.ndarray):
-      array = raster_file
+        array = raster_file
+        if DataResolution is None:
+            DataResolution = 1
+        if use_cache is not False:
+            dem_digest = MemmapDigest(array)
+            if use_cache is None:
+                use_cache = dem_digest is not None
     else:
-        print("raster_file must be either a filepath (string) or a numpy array. Try again.")
-
-    # DAV attempting mask nodata vals
-    nodata_mask = array == NoDataValue
-    array[nodata_mask] = np.nan
-
-    x, y = np.gradient(array)
-    slope = np.pi/2. - np.arctan(np.multiply(z_factor,np.sqrt(x*x + y*y)))
-    aspect = np.arctan2(-x, y)
-    azimuthrad = azimuth*np.pi / 180.
-    altituderad = angle_altitude*np.pi / 180.
-
-
-    shaded = np.sin(altituderad) * np.sin(slope)\
-     + np.cos(altituderad) * np.cos(slope)\
-     * np.cos(azimuthrad - aspect)
-
-
-
-    #this_array = 255*(shaded + 1)/2
-    return 255*(shaded + 1)/2
+        raise Exception("raster_file must be either a filepath (string) or a numpy array. Try again.")
+
+    def maker():
+        return HillshadeArray(array, DataResolution, azimuth, angle_altitude, NoDataValue, z_factor,
+                              block_rows = block_rows, n_threads = n_threads)
+
+    if not use_cache:
+        return maker()
+    if dem_digest is None:
+        dem_digest = DEMDigest(array)
+    try:
+        dx, dy = DataResolution
+    except TypeError:
+        dx = dy = DataResolution
+    return hillshade_cache.get(dem_digest, [azimuth, angle_altitude, z_factor, dx, abs(dy), NoDataValue], maker)
 #==============================================================================
 
 
 #==============================================================================
-def SwathPlot(path, filename, axis):
-    """A function that creates a swath in either the x or y direction only.
-       Averages across entire DEM. Exceedingly basic.
+def SwathPlot(path, filename, axis, start = None, end = None, width = None, bin_width = None):
+    """A function that creates a swath in either the x or y direction,
+       averaging across entire DEM, or along a line from start to end.
+       The DEM is streamed (see LSDMap_BM.SwathStatistics) so it can be larger than your RAM.
 
     Args:
         path (str): the path to the raster
         filename (str): the name of the file
-        axis (int): if 0, swath along x-axis, if not swath along y-axis
+        axis (int): if 0, swath along x-axis, if not swath along y-axis. Not used if start and end are given.
+        start (tuple): the (x,y) of the start of a swath along a line
+        end (tuple): the (x,y) of the end of a swath along a line
+        width (float): the full width of a swath along a line
+        bin_width (float): the bin length of a swath along a line, defaults to the cell size
 
     Returns:
         A plot of the swath
@@ -1467,20 +1854,19 @@ def SwathPlot(path, filename, axis):
     FileName = NewPath+filename
 
     # get the data vectors
-    means,medians,std_deviations,twentyfifth_percentile,seventyfifth_percentile = LSDMap_BM.SimpleSwath(path, filename, axis)
+    if start is not None and end is not None:
+        swath = LSDMap_BM.SwathStatistics(FileName, start = start, end = end, width = width, bin_width = bin_width)
+    else:
+        if axis != 0:
+            axis = 1
+        swath = LSDMap_BM.SwathStatistics(FileName, axis = axis)
+    means = swath["mean"]
+    std_deviations = swath["std"]
+    dir_vec = swath["distance"]
 
     print("Means shape is: ")
     print(means.shape)
 
-    x_vec,y_vec = LSDMap_IO.GetLocationVectors(FileName)
-
-
-    print("X shape is: ")
-    print(x_vec.shape)
-
-    print("Y shape is: ")
-    print(y_vec.shape)
-
     import matplotlib.pyplot as plt
 
     # Set up fonts for plots
@@ -1495,11 +1881,6 @@ def SwathPlot(path, filename, axis):
     gs = plt.GridSpec(100,75,bottom=0.1,left=0.1,right=0.9,top=1.0)
     ax = fig.add_subplot(gs[10:100,10:75])
 
-    if axis == 0:
-        dir_vec = x_vec
-    else:
-        dir_vec = y_vec
-
     min_sd = np.subtract(means,std_deviations)
     plus_sd = np.add(means,std_deviations)
 
@@ -1507,7 +1888,7 @@ def SwathPlot(path, filename, axis):
     #ax.fill_between(dir_vec, twentyfifth_percentile, seventyfifth_percentile, facecolor='green', alpha = 0.7, interpolate=True)
     ax.fill_between(dir_vec, min_sd, plus_sd, facecolor='blue', alpha = 0.5, interpolate=True)
 
-    ax.set_xlim(dir_vec[0],dir_vec[-1])
+    ax.set_xlim(min(dir_vec[0],dir_vec[-1]),max(dir_vec[0],dir_vec[-1]))
 
     plt.show()
 #==============================================================================
@@ -70,6 +70,10 @@ def ConvertBasinIndexToJunction(BasinPointData,BasinIndexList):
 def FindSourceInformation(thisPointData):
     """This function finds the source locations, with chi elevation, flow distance, etc.
 
+    The nodes are sorted by source once, so the source (maximum chi) and outlet
+    (minimum chi) nodes of every source are found in a single pass rather than
+    by masking the whole network for each source.
+
     Args:
         thisPointData (LSDMap_PointData) A LSDMap_PointData object that is derived from the Chi_mapping_tool component of *LSDTopoTools*.
 
@@ -81,57 +85,42 @@ def FindSourceInformation(thisPointData):
     """
 
     # Get the chi, m_chi, basin number, and source ID code
-    chi = thisPointData.QueryData('chi')
-    chi = [float(x) for x in chi]
-    elevation = thisPointData.QueryData('elevation')
-    elevation = [float(x) for x in elevation]
-    fdist = thisPointData.QueryData('flow distance')
-    fdist = [float(x) for x in fdist]
-    source = thisPointData.QueryData('source_key')
-    source = [int(x) for x in source]
-    latitude = thisPointData.GetLatitude()
-    longitude = thisPointData.GetLongitude()
-
-
-
-
-    Chi = np.asarray(chi)
-    Elevation = np.asarray(elevation)
-    Fdist = np.asarray(fdist)
-    Source = np.asarray(source)
-    Latitude = np.asarray(latitude)
-    Longitude = np.asarray(longitude)
+    Chi = np.asarray(thisPointData.QueryData('chi'), dtype=np.float64)
+    Elevation = np.asarray(thisPointData.QueryData('elevation'), dtype=np.float64)
+    Fdist = np.asarray(thisPointData.QueryData('flow distance'), dtype=np.float64)
+    Source = np.asarray(thisPointData.QueryData('source_key'), dtype=np.float64).astype(np.int64)
+    Latitude = np.asarray(thisPointData.GetLatitude())
+    Longitude = np.asarray(thisPointData.GetLongitude())
 
     n_sources = Source.max()+1
     print("N sources is: "+str(n_sources))
 
-    # This loops through all the source indices, and then picks out the
-    # Elevation, chi coordinate and flow distance of each node
-    # Then it returns a dictionary containing the elements of the node
+    # Only the source indices from 0 are used
+    nodes = np.flatnonzero(Source >= 0)
+
+    # Sort the nodes by source and then by chi. Ties go to the first node,
+    # so the first node of each source is its maximum (or minimum) chi node
+    max_order = nodes[np.lexsort((nodes, -Chi[nodes], Source[nodes]))]
+    min_order = nodes[np.lexsort((nodes, Chi[nodes], Source[nodes]))]
+    sorted_sources = Source[max_order]
+    first = np.flatnonzero(np.r_[True, sorted_sources[1:] != sorted_sources[:-1]])
+    idx_of_max_chi = max_order[first]
+    idx_of_min_chi = min_order[first]
+    source_keys = sorted_sources[first]
+    chi_length = Chi[idx_of_max_chi]-Chi[idx_of_min_chi]
+
+    # This returns a dictionary containing the Elevation, chi coordinate and
+    # flow distance of the source node of each source
     these_source_nodes = {}
-    for src_idx in range(0,n_sources):
-        m = np.ma.masked_where(Source!=src_idx, Source)
-
-        # Mask the unwanted values
-        maskX = np.ma.masked_where(np.ma.getmask(m), Chi)
-        maskElevation = np.ma.masked_where(np.ma.getmask(m), Elevation)
-        maskFlowDistance = np.ma.masked_where(np.ma.getmask(m), Fdist)
-        maskLatitude = np.ma.masked_where(np.ma.getmask(m), Latitude)
-        maskLongitude= np.ma.masked_where(np.ma.getmask(m), Longitude)
-
-        # get the locations of the source
+    for i,src_idx in enumerate(source_keys.tolist()):
+        node = idx_of_max_chi[i]
         this_dict = {}
-        idx_of_max_FD = maskX.argmax()
-        this_dict["FlowDistance"]=maskFlowDistance[idx_of_max_FD]
-        this_dict["Chi"]=maskX[idx_of_max_FD]
-        this_dict["Elevation"]=maskElevation[idx_of_max_FD]
-        this_dict["Latitude"]=maskLatitude[idx_of_max_FD]
-        this_dict["Longitude"]=maskLongitude[idx_of_max_FD]
-
-        # get the minimum of the source
-        idx_of_min_Chi = maskX.argmin()
-        chi_length = maskX[idx_of_max_FD]-maskX[idx_of_min_Chi]
-        this_dict["SourceLength"]=chi_length
+        this_dict["FlowDistance"]=Fdist[node]
+        this_dict["Chi"]=Chi[node]
+        this_dict["Elevation"]=Elevation[node]
+        this_dict["Latitude"]=Latitude[node]
+        this_dict["Longitude"]=Longitude[node]
+        this_dict["SourceLength"]=chi_length[i]
 
         these_source_nodes[src_idx] = this_dict
 
@@ -150,10 +139,9 @@ def FindShortSourceChannels(these_source_nodes,threshold_length):
 
     Author: SMM
     """
-    long_sources = []
-    for key in these_source_nodes:
-        if these_source_nodes[key]["SourceLength"] > threshold_length:
-            long_sources.append(key)
+    keys = np.fromiter(these_source_nodes.keys(), dtype=np.int64, count=len(these_source_nodes))
+    lengths = np.fromiter((these_source_nodes[key]["SourceLength"] for key in keys.tolist()), dtype=np.float64, count=len(keys))
+    long_sources = keys[lengths > threshold_length].tolist()
 
     return long_sources
 
@@ -14,9 +14,181 @@ import numpy as np
 from osgeo import osr
 from osgeo import ogr
 import os
+import threading
+from collections import OrderedDict
 from os.path import exists
 from osgeo.gdalconst import GA_ReadOnly
 
+#==============================================================================
+class RasterCache(object):
+    """
+    A process wide cache of things read from rasters: arrays, georeferencing and
+    projection strings. Entries are keyed by the absolute path, the modification
+    time and size of the file (and of its ENVI header, if it has one), the band and
+    the kind of thing cached, so if LSDTopoTools rewrites a raster or its header the
+    old entry is never used. Entries for an older version of a file are dropped as
+    soon as the new version is cached.
+
+    The cache is least recently used, with three limits: the bytes of the arrays
+    held in memory, the number of memory mapped arrays (each one holds a file
+    open) and the number of entries. When any of them is exceeded the oldest
+    entries are dropped, whatever they hold.
+
+    Args:
+        max_bytes (int): the memory budget in bytes
+        max_handles (int): the most memory mapped arrays kept open
+        max_entries (int): the most entries of any kind
+    """
+    def __init__(self, max_bytes = 2*1024**3, max_handles = 64, max_entries = 1024):
+        self.max_bytes = max_bytes
+        self.max_handles = max_handles
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._current_bytes = 0
+        self._current_handles = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _sizeof(value):
+        """Returns (bytes, handles): the memory used by the arrays in value and the number of memory maps"""
+        if isinstance(value, (tuple, list)):
+            sizes = [RasterCache._sizeof(v) for v in value]
+            return (sum(s[0] for s in sizes), sum(s[1] for s in sizes))
+        if isinstance(value, np.ndarray):
+            # a slice of a memory map is a memmap too, or has one as its base
+            base = value
+            while isinstance(base, np.ndarray) and not isinstance(base, np.memmap) and base.base is not None:
+                base = base.base
+            if isinstance(base, np.memmap) or isinstance(value, np.memmap):
+                return (0, 1)
+            return (value.nbytes, 0)
+        return (0, 0)
+
+    @staticmethod
+    def _file_stat(FileName):
+        """The mtime (in ns) and size of the file, and of its ENVI header if it has one"""
+        stat = os.stat(FileName)
+        file_stat = (stat.st_mtime_ns, stat.st_size)
+        if os.path.splitext(FileName)[1].lower() != ".hdr":
+            header_name = GetENVIHeaderName(FileName)
+            if header_name is not None:
+                hdr_stat = os.stat(header_name)
+                file_stat = file_stat + (hdr_stat.st_mtime_ns, hdr_stat.st_size)
+        return file_stat
+
+    def make_key(self, FileName, kind, raster_band = 1):
+        """Gets the key for this raster. The mtime (in ns) and size of the file, and of its ENVI header, are part of the key."""
+        full_name = os.path.abspath(FileName)
+        return (full_name, self._file_stat(full_name), raster_band, kind)
+
+    def get(self, FileName, kind, loader, raster_band = 1):
+        """Returns the cached value, or calls loader() and caches what it returns.
+
+        Args:
+            FileName (str): The filename (with path and extension) of the raster.
+            kind (str): What is being cached, e.g. "geoinfo" or "array"
+            loader (function): called with no arguments if the value is not in the cache
+            raster_band (int): the band
+
+        Returns:
+            The cached value. Cached numpy arrays are read only, so take a copy if you want to change them.
+        """
+        if exists(FileName) is False:
+            raise Exception('[Errno 2] No such file or directory: \'' + FileName + '\'')
+
+        key = self.make_key(FileName, kind, raster_band)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+        value = loader()
+        for v in (value if isinstance(value, tuple) else (value,)):
+            if isinstance(v, np.ndarray):
+                v.flags.writeable = False
+
+        size = self._sizeof(value)
+        if size[0] > self.max_bytes:
+            # Too big to keep, just hand it back
+            return value
+
+        with self._lock:
+            # anything cached from an older version of this file can never be used again
+            for old_key in [k for k in self._entries if k[0] == key[0] and k[1] != key[1]]:
+                self._remove(old_key)
+            if key not in self._entries:
+                self._entries[key] = value
+                self._sizes[key] = size
+                self._current_bytes += size[0]
+                self._current_handles += size[1]
+            self._evict()
+        return value
+
+    def _remove(self, key):
+        del self._entries[key]
+        size = self._sizes.pop(key)
+        self._current_bytes -= size[0]
+        self._current_handles -= size[1]
+
+    def _evict(self):
+        # The least recently used entries are dropped until every limit is met
+        while self._entries and (self._current_bytes > self.max_bytes or
+                                 self._current_handles > self.max_handles or
+                                 len(self._entries) > self.max_entries):
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        """Empties the cache and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._current_bytes = 0
+            self._current_handles = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Returns a dict with the hits, misses, number of entries, bytes used and open memory maps."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": len(self._entries),
+                    "bytes": self._current_bytes, "max_bytes": self.max_bytes,
+                    "handles": self._current_handles, "max_handles": self.max_handles,
+                    "max_entries": self.max_entries}
+
+# This is shared by everything in the process
+raster_cache = RasterCache()
+
+def GetRasterCacheStats():
+    """Returns the hit/miss counters, memory use and open memory maps of the shared raster cache."""
+    return raster_cache.stats()
+
+def ClearRasterCache():
+    """Empties the shared raster cache."""
+    raster_cache.clear()
+
+def SetRasterCacheBudget(max_bytes, max_handles = None, max_entries = None):
+    """Sets the limits of the shared raster cache.
+
+    Args:
+        max_bytes (int): the memory budget in bytes
+        max_handles (int): the most memory mapped arrays kept open. None leaves it as it is.
+        max_entries (int): the most entries of any kind. None leaves it as it is.
+    """
+    with raster_cache._lock:
+        raster_cache.max_bytes = max_bytes
+        if max_handles is not None:
+            raster_cache.max_handles = max_handles
+        if max_entries is not None:
+            raster_cache.max_entries = max_entries
+        raster_cache._evict()
+#==============================================================================
+
 #==============================================================================
 def getNoDataValue(rasterfn):
     """This gets the nodata value from the raster
@@ -29,9 +201,8 @@ def getNoDataValue(rasterfn):
 
     Author: SMM
     """
-    raster = gdal.Open(rasterfn)
-    band = raster.GetRasterBand(1)
-    return band.GetNoDataValue()
+    NDV, xsize, ysize, GeoT, Projection, DataType = GetGeoInfo(rasterfn)
+    return NDV
 #==============================================================================
 
 #==============================================================================
@@ -221,8 +392,11 @@ def GetRasterExtent(FileName):
 
     Author: SMM
     """
-    CellSize,XMin,XMax,YMin,YMax = GetUTMMaxMin(FileName)
-    extent = [XMin,XMax,YMin,YMax]
+    def _load():
+        CellSize,XMin,XMax,YMin,YMax = GetUTMMaxMin(FileName)
+        return (XMin,XMax,YMin,YMax)
+
+    extent = list(raster_cache.get(FileName, "extent", _load))
     return extent
 
 #==============================================================================
@@ -249,6 +423,10 @@ def GetGeoInfo(FileName):
     if exists(FileName) is False:
             raise Exception('[Errno 2] No such file or directory: \'' + FileName + '\'')
 
+    return raster_cache.get(FileName, "geoinfo", lambda: _GetGeoInfoGDAL(FileName))
+
+def _GetGeoInfoGDAL(FileName):
+    """Does the work for GetGeoInfo, which caches the result."""
 
     SourceDS = gdal.Open(FileName, gdal.GA_ReadOnly)
     if SourceDS == None:
@@ -282,6 +460,11 @@ def GetUTMEPSG(FileName):
     if exists(FileName) is False:
             raise Exception('[Errno 2] No such file or directory: \'' + FileName + '\'')
 
+    return raster_cache.get(FileName, "epsg", lambda: _GetUTMEPSGGDAL(FileName))
+
+def _GetUTMEPSGGDAL(FileName):
+    """Does the work for GetUTMEPSG, which caches the result."""
+
     # see if the file exists and get the dataset
     SourceDS = gdal.Open(FileName, gdal.GA_ReadOnly)
     if SourceDS == None:
@@ -546,91 +729,940 @@ def ReadRasterArrayBlocks_numpy(raster_file,raster_band=1):
     Author: SMM
     """
 
-    print("I will now use numpy.fromfile to load your raster, I still need to be tested, If something goes wrong switch back to the classic method by switching NFF_opti = False. Classic method = unefficient.")
     if exists(raster_file) is False:
             raise Exception('[Errno 2] No such file or directory: \'' + raster_file + '\'')
 
-    with open(raster_file[:-3]+"hdr","r") as hdr_file:
-        print("I am opening your raster info")
-        no_data_hdr = -9999 # setting the default noData in case there is no value setted in the hdr file
+    # The header is parsed by ReadENVIHeader, which copes with multi-line
+    # fields, byte order and the different interleaves
+    data_array = ReadRasterArrayMemmap(raster_file, raster_band=raster_band, mode="r")
+    NoDataValue = ReadENVIHeader(raster_file)["NoDataValue"]
+    if NoDataValue is None:
+        NoDataValue = -9999
+    print("your data type is "  + str(data_array.dtype)+" and No data value is: " + str(NoDataValue))
+
+    nodata_mask = LazyNoDataMask(data_array, NoDataValue)
+    data_array = MemmapToNaNArray(data_array, nodata_mask, dtype=np.float64)
+
+    return data_array
+#==============================================================================
+
+#==============================================================================
+# ENVI data type codes mapped to numpy dtypes
+#==============================================================================
+ENVI_DTYPES = {1: 'u1', 2: 'i2', 3: 'i4', 4: 'f4', 5: 'f8',
+               12: 'u2', 13: 'u4', 14: 'i8', 15: 'u8'}
+
+def GetENVIHeaderName(raster_file):
+    """This gets the name of the ENVI header associated with a raster. LSDTopoTools writes
+    WA.bil with a WA.hdr, but GDAL also writes WA.bil.hdr, so we check both.
+
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+
+    Return:
+        str: the name of the header file, or None if there isn't one.
+
+    Author: SMM
+    """
+    candidates = [os.path.splitext(raster_file)[0]+".hdr", raster_file+".hdr"]
+    for header_name in candidates:
+        if exists(header_name):
+            return header_name
+    return None
+#==============================================================================
+
+#==============================================================================
+def ReadENVIHeaderFields(raster_file):
+    """This gets the key-value pairs of an ENVI header as strings, without interpreting them.
+    Values wrapped in {} can span several lines; the braces are removed.
+
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster (not the header).
+
+    Return:
+        dict: the values, keyed by the lower case field name (e.g. "map info")
+
+    Author: SMM
+    """
+    header_name = GetENVIHeaderName(raster_file)
+    if header_name is None:
+        raise Exception('[Errno 2] No ENVI header for: \'' + raster_file + '\'')
+
+    # Gather the key-value pairs, joining lines that are in braces
+    fields = {}
+    with open(header_name, "r") as hdr_file:
+        key = None
+        value = ""
         for line in hdr_file:
-            #testing the data type
-            if(line[0:9] == "data type"):
-                info_dtype = line[-2:]
-                info_dtype = int(info_dtype)
+            if key is None:
+                if "=" not in line:
+                    continue
+                key, value = line.split("=", 1)
+                key = " ".join(key.split()).lower()
+                value = value.strip()
             else:
-                if(line[0:8] == "map info"):
-                    info = line[12:-2]
-                    info = info.split(",")
-                    x_min = float(info[3])
-                    y_max = float(info[4])
-                    x_res = float(info[5])
-                    y_res = float(info[6])
-                    utm_zone = int(info[7])
-                    utm_hemisphere = info[8]
-                else:
-                    if(line[0:7] == "samples"):
-                        num_col = line.replace(" ","").split("=")[1]
-                        print("there are " + str(num_col) + " columns")
-                        num_col = int(num_col)
-                    else:
-                        if(line[0:5] == "lines"):
-                            num_lines = line.replace(" ","").split("=")[1]
-                            print("there are " + str(num_lines) + " lines")
-                            num_lines = int(num_lines)
-                        else:
-                            if(line[0:17] == "data ignore value"):
-                                no_data_hdr = line.replace(" ","").split("=")[1]
-                                print("No data value is: " + str(no_data_hdr) )
-                                no_data_hdr = float(no_data_hdr)
-
-
-        #The type of data representation:
-        #1 = Byte: 8-bit unsigned integer
-        #2 = Integer: 16-bit signed integer
-        #3 = Long: 32-bit signed integer
-        #4 = Floating-point: 32-bit single-precision
-        #5 = Double-precision: 64-bit double-precision floating-point
-        #6 = Complex: Real-imaginary pair of single-precision floating-point
-        #9 = Double-precision complex: Real-imaginary pair of double precision floating-point
-        #12 = Unsigned integer: 16-bit
-        #13 = Unsigned long integer: 32-bit
-        #14 = 64-bit long integer (signed)
-        #15 = 64-bit unsigned long integer (unsigned)
-
-    if(info_dtype == 1):
-        data_type = np.dtype('uint8')
+                value = value + line.strip()
+            if value.count("{") > value.count("}"):
+                continue
+            fields[key] = value.strip("{} ")
+            key = None
+    return fields
+
+def ReadENVIHeader(raster_file):
+    """This parses an ENVI header once and returns everything needed to map the
+    binary file without going through GDAL. Values wrapped in {} can span several lines.
+
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster (not the header).
+
+    Return:
+        dict: with the keys
+            * samples, lines, bands: the dimensions of the raster
+            * header_offset: the number of bytes before the data
+            * dtype: a numpy dtype, including the byte order
+            * interleave: bsq, bil or bip
+            * NoDataValue: the data ignore value (or None)
+            * GeoT: the geotransform in GDAL order, if there is a map info line (or None)
+
+    Author: SMM
+    """
+
+    fields = ReadENVIHeaderFields(raster_file)
+
+    header = {}
+    header["samples"] = int(fields["samples"])
+    header["lines"] = int(fields["lines"])
+    header["bands"] = int(fields.get("bands", 1))
+    header["header_offset"] = int(fields.get("header offset", 0))
+    header["interleave"] = fields.get("interleave", "bsq").lower()
+
+    data_type = int(fields["data type"])
+    if data_type not in ENVI_DTYPES:
+        raise Exception("ENVI data type "+str(data_type)+" is not supported.")
+    byte_order = "<" if int(fields.get("byte order", 0)) == 0 else ">"
+    header["dtype"] = np.dtype(byte_order+ENVI_DTYPES[data_type])
+
+    if "data ignore value" in fields:
+        header["NoDataValue"] = float(fields["data ignore value"])
+    else:
+        header["NoDataValue"] = None
+
+    # The map info refers to the pixel given by the reference x,y (1-based) so
+    # we shift it to the top left corner
+    header["GeoT"] = None
+    if "map info" in fields:
+        info = [x.strip() for x in fields["map info"].split(",")]
+        ref_x = float(info[1])
+        ref_y = float(info[2])
+        x_res = float(info[5])
+        y_res = float(info[6])
+        x_min = float(info[3]) - (ref_x-1)*x_res
+        y_max = float(info[4]) + (ref_y-1)*y_res
+        header["GeoT"] = (x_min, x_res, 0.0, y_max, 0.0, -y_res)
+
+    return header
+#==============================================================================
+
+#==============================================================================
+def ReadRasterArrayMemmap(raster_file, raster_band=1, mode="c"):
+    """This maps an ENVI raster (e.g. a .bil from LSDTopoTools) into memory without reading it.
+    The array has the native data type of the file, and pages are only read from disk
+    when they are used, so this works on rasters that are larger than your RAM.
+
+    Note:
+        The default mode is copy-on-write: you can modify the array but the changes are never
+        written to the file, and only the pages you modify use memory.
+
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+        raster_band (int): the band of the raster
+        mode (str): the numpy.memmap mode. "c" is copy on write, "r" is read only.
+
+    Return:
+        np.memmap: A (rows, cols) array backed by the file
+
+    Author: SMM
+    """
+
+    if exists(raster_file) is False:
+            raise Exception('[Errno 2] No such file or directory: \'' + raster_file + '\'')
+
+    header = ReadENVIHeader(raster_file)
+    nrows = header["lines"]
+    ncols = header["samples"]
+    nbands = header["bands"]
+    if raster_band < 1 or raster_band > nbands:
+        raise Exception("Band "+str(raster_band)+" is not in this raster, which has "+str(nbands)+" bands.")
+
+    interleave = header["interleave"]
+    if interleave == "bsq":
+        shape = (nbands, nrows, ncols)
+    elif interleave == "bil":
+        shape = (nrows, nbands, ncols)
+    elif interleave == "bip":
+        shape = (nrows, ncols, nbands)
     else:
-        if(info_dtype == 2):
-            data_type = np.dtype('int16')
+        raise Exception("I don't understand the interleave: "+interleave)
+
+    data = np.memmap(raster_file, dtype=header["dtype"], mode=mode,
+                     offset=header["header_offset"], shape=shape)
+
+    b = raster_band-1
+    if interleave == "bsq":
+        return data[b]
+    elif interleave == "bil":
+        return data[:, b, :]
+    else:
+        return data[:, :, b]
+#==============================================================================
+
+#==============================================================================
+def IsENVIRaster(raster_file):
+    """Checks if a raster can be memory mapped, that is, it is a flat binary with an ENVI header.
+    The .hdr has to start with ENVI and give the samples, lines and a data type we can map:
+    ESRI headers (ncols, nrows, ...) also sit next to .bil and .flt files, and those
+    rasters are left to GDAL.
+
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+
+    Return:
+        bool: True if it can be read with ReadRasterArrayMemmap
+
+    Author: SMM
+    """
+    if os.path.splitext(raster_file)[1].lower() not in [".bil", ".flt", ".bsq", ".bip", ".img", ".dat"]:
+        return False
+    header_name = GetENVIHeaderName(raster_file)
+    if header_name is None:
+        return False
+
+    try:
+        with open(header_name, "r") as hdr_file:
+            if hdr_file.readline().strip() != "ENVI":
+                return False
+        fields = ReadENVIHeaderFields(raster_file)
+        for key in ["samples", "lines", "data type"]:
+            if key not in fields:
+                return False
+        return int(fields["data type"]) in ENVI_DTYPES
+    except (IOError, ValueError, UnicodeDecodeError):
+        return False
+#==============================================================================
+
+#==============================================================================
+class LazyNoDataMask(object):
+    """
+    A nodata mask that is only computed for the part of the raster you ask for.
+    Slicing it (mask[i:j]) compares just that window to the nodata value, so you can
+    work through a memory mapped raster in strips. Calling full() computes and keeps the
+    whole mask (one byte per pixel).
+
+    Args:
+        data_array (np.array): the raster data, usually from ReadRasterArrayMemmap
+        NoDataValue (float): the nodata value. NaNs are always treated as nodata in float rasters.
+
+    Author: SMM
+    """
+    def __init__(self, data_array, NoDataValue):
+        self._data = data_array
+        self.NoDataValue = NoDataValue
+        self._full_mask = None
+
+    @property
+    def shape(self):
+        return self._data.shape
+
+    def _compute(self, values):
+        if np.issubdtype(values.dtype, np.floating):
+            mask = np.isnan(values)
+            if self.NoDataValue is not None:
+                mask |= (values == self.NoDataValue)
+        elif self.NoDataValue is not None:
+            mask = (values == self.NoDataValue)
         else:
-            if(info_dtype == 3):
-                data_type = np.dtype('int32')
-            else:
-                if(info_dtype == 4):
-                    data_type = np.dtype('Float32')
-                else:
-                    if(info_dtype == 5):
-                        data_type = np.dtype('Float64')
-                    else:
-                        if(info_dtype == 12):
-                            data_type = np.dtype('uint16')
-    print("your data type is "  + str(data_type))
-    # Alright now loading and converting the data
-    print("I am now ingesting your raster")
-    data_array = np.fromfile(raster_file,data_type).reshape(num_lines,num_col)
-    if(info_dtype in [1,2,3,12]):
-        data_array = data_array.astype(float)
-    print("I nailed it")
-    x_max = x_min + x_res*num_col
-    y_min = y_max - y_res*num_lines
-    print("I am returning the raster array and info")
-    NoDataValue = no_data_hdr
-    if NoDataValue is not None:
-        data_array[data_array == NoDataValue] = np.nan
+            mask = np.zeros(values.shape, dtype=bool)
+        return mask
+
+    def __getitem__(self, index):
+        if self._full_mask is not None:
+            return self._full_mask[index]
+        return self._compute(np.asarray(self._data[index]))
+
+    def full(self):
+        if self._full_mask is None:
+            self._full_mask = self._compute(np.asarray(self._data))
+        return self._full_mask
+
+    def any(self):
+        return bool(self.full().any())
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.full()
+        return self.full().astype(dtype)
+#==============================================================================
 
+#==============================================================================
+def MemmapToNaNArray(data_array, nodata_mask, dtype=None, block_rows=1024):
+    """Converts raster data to a float array with NaN where there is nodata.
+    This is done in strips of rows so the only large allocation is the output.
 
-    return data_array
+    Args:
+        data_array (np.array): the raster data, usually a np.memmap
+        nodata_mask (LazyNoDataMask): the mask for this data
+        dtype (np.dtype): the output type. Defaults to float64, like the other readers. Pass
+            np.float32 to halve the memory if you only need the values for plotting.
+        block_rows (int): the number of rows converted at a time
+
+    Return:
+        np.array: the float array
+
+    Author: SMM
+    """
+    if dtype is None:
+        dtype = np.float64
+
+    nrows = data_array.shape[0]
+    out = np.empty(data_array.shape, dtype=dtype)
+    for i in range(0, nrows, block_rows):
+        out[i:i+block_rows] = data_array[i:i+block_rows]
+        out[i:i+block_rows][nodata_mask[i:i+block_rows]] = np.nan
+    return out
+#==============================================================================
+
+#==============================================================================
+def ReadRasterStrips(raster_file, block_rows = 1024, raster_band = 1, dtype = None,
+                     row_range = None, col_range = None):
+    """Reads a raster a strip of rows at a time, so a raster of any size can be
+    worked through with the memory of one strip. ENVI rasters are memory mapped,
+    anything else is read through GDAL.
+
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+        block_rows (int): the number of rows in each strip
+        raster_band (int): the band of the raster
+        dtype (np.dtype): the type of the strips. Defaults to float64, which keeps integer rasters
+            (e.g. node or junction indices) exact. Pass np.float32 to halve the memory of each strip.
+        row_range (tuple): (first, last+1) rows to read. None for all of them.
+        col_range (tuple): (first, last+1) columns to read. None for all of them.
+
+    Yields:
+        (int, np.array): the first row of the strip and the strip, with NaN where there is nodata
+
+    Author: SMM
+    """
+    if exists(raster_file) is False:
+            raise Exception('[Errno 2] No such file or directory: \'' + raster_file + '\'')
+
+    if IsENVIRaster(raster_file):
+        data = ReadRasterArrayMemmap(raster_file, raster_band, mode="r")
+        nodata_mask = LazyNoDataMask(data, ReadENVIHeader(raster_file)["NoDataValue"])
+        if dtype is None:
+            dtype = np.float64
+        row_0, row_1 = (0, data.shape[0]) if row_range is None else row_range
+        col_0, col_1 = (0, data.shape[1]) if col_range is None else col_range
+        for i in range(row_0, row_1, block_rows):
+            rows = slice(i, min(i+block_rows, row_1))
+            strip = np.array(data[rows, col_0:col_1], dtype=dtype)
+            strip[nodata_mask[rows, col_0:col_1]] = np.nan
+            yield i, strip
+    else:
+        dataset = gdal.Open(raster_file, GA_ReadOnly)
+        if dataset == None:
+            raise Exception("Unable to read the data file")
+        band = dataset.GetRasterBand(raster_band)
+        NoDataValue = band.GetNoDataValue()
+        row_0, row_1 = (0, band.YSize) if row_range is None else row_range
+        col_0, col_1 = (0, band.XSize) if col_range is None else col_range
+        for i in range(row_0, row_1, block_rows):
+            rows = min(block_rows, row_1-i)
+            values = band.ReadAsArray(col_0, i, col_1-col_0, rows)
+            strip = values.astype(np.float64 if dtype is None else dtype)
+            if NoDataValue is not None:
+                strip[values == NoDataValue] = np.nan
+            yield i, strip
+#==============================================================================
+
+#==============================================================================
+def GetRasterWindow(FileName, extent):
+    """Works out the block of pixels that covers an extent. The window is snapped
+    outwards to whole pixels and clipped to the raster.
+
+    Args:
+        FileName (str): The filename (with path and extension) of the raster.
+        extent (list): [xmin,xmax,ymin,ymax] in map coordinates
+
+    Return:
+        tuple: the window as (xoff, yoff, cols, rows), in the order GDAL's ReadAsArray wants them
+        list: the extent [xmin,xmax,ymin,ymax] of the window
+
+    Author: SMM
+    """
+    NDV, xsize, ysize, GeoT, Projection, DataType = GetGeoInfo(FileName)
+    x_res = GeoT[1]
+    y_res = abs(GeoT[5])
+
+    xoff = max(int(np.floor((extent[0]-GeoT[0])/x_res)), 0)
+    x_end = min(int(np.ceil((extent[1]-GeoT[0])/x_res)), xsize)
+    yoff = max(int(np.floor((GeoT[3]-extent[3])/y_res)), 0)
+    y_end = min(int(np.ceil((GeoT[3]-extent[2])/y_res)), ysize)
+
+    if x_end <= xoff or y_end <= yoff:
+        raise Exception("The extent "+str(extent)+" does not overlap the raster "+FileName)
+
+    window_extent = [GeoT[0]+xoff*x_res, GeoT[0]+x_end*x_res,
+                     GeoT[3]-y_end*y_res, GeoT[3]-yoff*y_res]
+    return (xoff, yoff, x_end-xoff, y_end-yoff), window_extent
+#==============================================================================
+
+#==============================================================================
+def ReadRasterArrayWindow(raster_file, extent, raster_band = 1):
+    """Reads only the part of a raster that covers an extent. ENVI rasters are sliced from
+    the memory map, anything else is read with GDAL's ReadAsArray(xoff, yoff, cols, rows).
+
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+        extent (list): [xmin,xmax,ymin,ymax] in map coordinates
+        raster_band (int): the band
+
+    Return:
+        np.array: the window in the raster's native type
+        float: the nodata value
+        list: the extent [xmin,xmax,ymin,ymax] of the window (snapped to pixels)
+
+    Author: SMM
+    """
+    (xoff, yoff, cols, rows), window_extent = GetRasterWindow(raster_file, extent)
+
+    if IsENVIRaster(raster_file):
+        data_array = ReadRasterArrayMemmap(raster_file, raster_band, mode="r")[yoff:yoff+rows, xoff:xoff+cols]
+        NoDataValue = ReadENVIHeader(raster_file)["NoDataValue"]
+    else:
+        dataset = gdal.Open(raster_file, GA_ReadOnly )
+        if dataset == None:
+            raise Exception("Unable to read the data file")
+        band = dataset.GetRasterBand(raster_band)
+        NoDataValue = band.GetNoDataValue()
+        data_array = band.ReadAsArray(xoff, yoff, cols, rows)
+
+    return data_array, NoDataValue, window_extent
+#==============================================================================
+
+#==============================================================================
+def GetOverviewFactor(raster_shape, target_shape):
+    """Works out the power of two decimation that still has at least as many pixels
+    as the target. E.g. a 40000 column raster drawn 1500 pixels wide gives 16.
+
+    Args:
+        raster_shape (tuple): (rows, cols) of the full raster
+        target_shape (tuple): (rows, cols) of the image you want to draw
+
+    Return:
+        int: the decimation factor (1 means use the full raster)
+
+    Author: SMM
+    """
+    ratio = min(float(raster_shape[0])/max(target_shape[0],1),
+                float(raster_shape[1])/max(target_shape[1],1))
+    factor = 1
+    while factor*2 <= ratio:
+        factor = factor*2
+    return factor
+#==============================================================================
+
+#==============================================================================
+def BlockReduceArray(data_array, factor, resampling = "mean", nodata_mask = None):
+    """Decimates an array by an integer factor. Rows and columns that don't fill
+    a whole block are dropped, so the result covers factor*(rows//factor) rows.
+
+    Args:
+        data_array (np.array): the raster data. Can be a memmap.
+        factor (int): the decimation factor
+        resampling (str): "mean" averages the valid pixels in each block (use this for
+            continuous data like elevation or hillshades), "nearest" takes the centre pixel (use
+            this for categorical data like basins, where an average is meaningless)
+        nodata_mask (LazyNoDataMask): the nodata mask. If None, NaNs are treated as nodata.
+
+    Return:
+        np.array: the decimated float array, NaN where there is nodata
+
+    Author: SMM
+    """
+    nrows = data_array.shape[0]//factor
+    ncols = data_array.shape[1]//factor
+    if nodata_mask is None:
+        nodata_mask = LazyNoDataMask(data_array, None)
+
+    if resampling == "nearest":
+        half = factor//2
+        rows = slice(half, half+nrows*factor, factor)
+        cols = slice(half, half+ncols*factor, factor)
+        out = np.array(data_array[rows, cols], dtype=np.float32)
+        out[nodata_mask[rows, cols]] = np.nan
+        return out
+    elif resampling != "mean":
+        raise ValueError("resampling must be mean or nearest, not "+str(resampling))
+
+    out = np.empty((nrows, ncols), dtype=np.float32)
+    # work in strips so memory mapped data is never all read in at once
+    strip = max(1, 1024//factor)
+    for i in range(0, nrows, strip):
+        i_end = min(i+strip, nrows)
+        r0 = i*factor
+        r1 = i_end*factor
+        block = np.array(data_array[r0:r1, :ncols*factor], dtype=np.float64)
+        valid = ~nodata_mask[r0:r1, :ncols*factor]
+        block[~valid] = 0
+        shape = (i_end-i, factor, ncols, factor)
+        total = block.reshape(shape).sum(axis=(1, 3))
+        count = valid.reshape(shape).sum(axis=(1, 3))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[i:i_end] = np.where(count > 0, total/count, np.nan)
+    return out
+#==============================================================================
+
+#==============================================================================
+def GetOverviewArray(raster_file, factor, resampling = "mean", raster_band = 1, cache_on_disk = True):
+    """Gets a decimated version of a raster for drawing.
+
+    Block mean overviews of ENVI rasters are built once, from the level above, and kept
+    next to the raster as .npz files (e.g. WA_hs.bil.ovr4_mean_b1.npz). They are rebuilt
+    if the raster or its header has changed since. Other formats use the GDAL overviews
+    if there are any. Results are also kept in the shared raster cache.
+
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+        factor (int): the decimation factor, a power of 2
+        resampling (str): "mean" or "nearest", see BlockReduceArray
+        raster_band (int): the band
+        cache_on_disk (bool): If false the .npz overviews are neither read nor written
+
+    Return:
+        np.array: the float overview, NaN where there is nodata
+        list: the extent [xmin,xmax,ymin,ymax] covered by the overview
+
+    Author: SMM
+    """
+    NDV, xsize, ysize, GeoT, Projection, DataType = GetGeoInfo(raster_file)
+    XMin = GeoT[0]
+    YMax = GeoT[3]
+    x_res = GeoT[1]
+    y_res = abs(GeoT[5])
+
+    def _extent(nrows, ncols, f):
+        return [XMin, XMin+ncols*f*x_res, YMax-nrows*f*y_res, YMax]
+
+    if int(factor) != factor or factor < 1 or (int(factor) & (int(factor)-1)) != 0:
+        raise Exception("The overview factor has to be a power of 2 (1, 2, 4, ...), not "+str(factor))
+    factor = int(factor)
+    if factor == 1:
+        return None, _extent(ysize, xsize, 1)
+
+    def _load():
+        if IsENVIRaster(raster_file):
+            return _GetENVIOverview(raster_file, factor, resampling, raster_band, cache_on_disk)
+        return _GetGDALOverview(raster_file, factor, resampling, raster_band)
+
+    overview = raster_cache.get(raster_file, "overview"+str(factor)+"_"+resampling, _load, raster_band)
+
+    # GDAL overviews cover the whole raster, ours drop the partial blocks at the edges
+    if overview.shape[1]*factor > xsize:
+        return overview, _extent(ysize, xsize, 1)
+    return overview, _extent(overview.shape[0], overview.shape[1], factor)
+
+def _GetENVIOverview(raster_file, factor, resampling, raster_band, cache_on_disk):
+    """Builds (or loads) a block reduced overview of an ENVI raster."""
+    data = ReadRasterArrayMemmap(raster_file, raster_band=raster_band, mode="r")
+    mask = LazyNoDataMask(data, ReadENVIHeader(raster_file)["NoDataValue"])
+
+    # nearest sampling just strides through the memory map, so isn't worth storing
+    if resampling == "nearest":
+        return BlockReduceArray(data, factor, "nearest", mask)
+
+    # The overview is stored with the mtime and size of the raster and its header, so
+    # it is remade if either changes (e.g. a new nodata value)
+    ovr_name = raster_file+".ovr"+str(factor)+"_"+resampling+"_b"+str(raster_band)+".npz"
+    source = np.array(RasterCache._file_stat(raster_file), dtype=np.int64)
+    if cache_on_disk and exists(ovr_name):
+        try:
+            with np.load(ovr_name, allow_pickle=False) as stored:
+                if np.array_equal(stored["source"], source):
+                    return stored["overview"]
+        except (IOError, OSError, ValueError, KeyError):
+            print("I couldn't read the overview "+ovr_name+", I'll make it again.")
+
+    # Each level is built from the one above so the full raster is only read once.
+    # Means of means are not weighted by the number of valid pixels, which is fine for drawing.
+    if factor == 2:
+        overview = BlockReduceArray(data, 2, "mean", mask)
+    else:
+        parent = _GetENVIOverview(raster_file, factor//2, resampling, raster_band, cache_on_disk)
+        overview = BlockReduceArray(parent, 2, "mean")
+
+    if cache_on_disk:
+        try:
+            with open(ovr_name, "wb") as ovr_file:
+                np.savez(ovr_file, overview=overview, source=source)
+        except (IOError, OSError):
+            print("I couldn't write the overview "+ovr_name+", it will be recomputed next time.")
+    return overview
+
+def _GetGDALOverview(raster_file, factor, resampling, raster_band):
+    """Reads a GDAL overview that is at least as detailed as the factor, or decimates the full raster."""
+    dataset = gdal.Open(raster_file, GA_ReadOnly)
+    if dataset == None:
+        raise Exception("Unable to read the data file")
+    band = dataset.GetRasterBand(raster_band)
+    NoDataValue = band.GetNoDataValue()
+
+    # Pick the coarsest overview that still has enough pixels
+    best = None
+    for i in range(band.GetOverviewCount()):
+        ovr = band.GetOverview(i)
+        if ovr.XSize >= band.XSize//factor and ovr.YSize >= band.YSize//factor:
+            if best is None or ovr.XSize < best.XSize:
+                best = ovr
+    if best is not None:
+        overview = best.ReadAsArray().astype(np.float32)
+        if NoDataValue is not None:
+            overview[overview == NoDataValue] = np.nan
+        return overview
+
+    data_array = ReadRasterArrayBlocks(raster_file, raster_band)
+    return BlockReduceArray(data_array, factor, resampling)
+#==============================================================================
+
+#==============================================================================
+class RasterStatistics(object):
+    """
+    Statistics of raster values gathered in a single pass. Values are added a strip
+    at a time and two of these can be merged, so the statistics of many rasters
+    can be gathered in parallel and combined at the end.
+
+    The count, min, max, mean and standard deviation are exact. Percentiles come from
+    a sketch that puts each value in a logarithmic bucket, so they are within
+    relative_accuracy of the true value (1% by default) whatever the distribution,
+    using a few kB of memory. If you give a histogram range the histogram is exact,
+    otherwise it is made from the sketch once the min and max are known.
+
+    Args:
+        histogram_bins (int): the number of histogram bins, or None for no histogram
+        histogram_range (tuple): the (min, max) of the histogram. None to use the range of the data.
+        relative_accuracy (float): the relative accuracy of the percentiles
+
+    Author: SMM
+    """
+    def __init__(self, histogram_bins = None, histogram_range = None, relative_accuracy = 0.01):
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self.histogram_bins = histogram_bins
+        self.histogram_range = histogram_range
+        self._hist = None
+        if histogram_bins is not None and histogram_range is not None:
+            self._hist = np.zeros(histogram_bins, dtype=np.int64)
+
+        # The sketch. Values smaller than this (in magnitude) are counted as zero.
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1.0+relative_accuracy)/(1.0-relative_accuracy)
+        self._log_gamma = np.log(self._gamma)
+        self._min_indexable = 1e-9
+        self._positive = {}
+        self._negative = {}
+        self._zeros = 0
+        self._has_sketch = True
+
+    def _add_to_buckets(self, buckets, magnitudes):
+        keys = np.ceil(np.log(magnitudes)/self._log_gamma).astype(np.int64)
+        key_min = keys.min()
+        counts = np.bincount(keys-key_min)
+        for k in np.nonzero(counts)[0]:
+            key = int(k+key_min)
+            buckets[key] = buckets.get(key, 0) + int(counts[k])
+
+    def add(self, values):
+        """Adds values to the statistics. NaNs are ignored.
+
+        Args:
+            values (np.array): the values, of any shape
+        """
+        values = np.asarray(values).ravel()
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+
+        self.count += values.size
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        values64 = values.astype(np.float64)
+        self._sum += float(values64.sum())
+        self._sum_sq += float(np.dot(values64, values64))
+
+        if self._hist is not None:
+            self._hist += np.histogram(values, self.histogram_bins, self.histogram_range)[0]
+
+        positive = values[values > self._min_indexable]
+        negative = -values[values < -self._min_indexable]
+        self._zeros += values.size - positive.size - negative.size
+        if positive.size > 0:
+            self._add_to_buckets(self._positive, positive)
+        if negative.size > 0:
+            self._add_to_buckets(self._negative, negative)
+
+    def add_stored(self, min_value, max_value, mean, std, count):
+        """Adds statistics that are already known (e.g. stored by GDAL) rather than values.
+        After this the percentiles and the histogram can't be computed.
+
+        Args:
+            min_value, max_value, mean, std (float): the statistics
+            count (int): the number of values they came from
+        """
+        self.count += count
+        self.min = min(self.min, float(min_value))
+        self.max = max(self.max, float(max_value))
+        self._sum += mean*count
+        self._sum_sq += (std*std+mean*mean)*count
+        self._has_sketch = False
+
+    def merge(self, other):
+        """Adds the statistics of another RasterStatistics to this one.
+
+        Args:
+            other (RasterStatistics): made with the same histogram and accuracy settings
+        """
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._sum += other._sum
+        self._sum_sq += other._sum_sq
+        if self._hist is not None:
+            self._hist += other._hist
+        for key, c in other._positive.items():
+            self._positive[key] = self._positive.get(key, 0) + c
+        for key, c in other._negative.items():
+            self._negative[key] = self._negative.get(key, 0) + c
+        self._zeros += other._zeros
+        self._has_sketch = self._has_sketch and other._has_sketch
+        return self
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return np.nan
+        return self._sum/self.count
+
+    @property
+    def std(self):
+        if self.count == 0:
+            return np.nan
+        return float(np.sqrt(max(self._sum_sq/self.count - self.mean**2, 0.0)))
+
+    def _sketch_values(self):
+        """The representative value and count of each bucket, in ascending order"""
+        neg_keys = np.array(sorted(self._negative.keys(), reverse=True), dtype=np.float64)
+        pos_keys = np.array(sorted(self._positive.keys()), dtype=np.float64)
+        scale = 2.0/(self._gamma+1.0)
+        values = np.concatenate([-scale*self._gamma**neg_keys, [0.0], scale*self._gamma**pos_keys])
+        counts = np.concatenate([[self._negative[k] for k in sorted(self._negative.keys(), reverse=True)],
+                                 [self._zeros],
+                                 [self._positive[k] for k in sorted(self._positive.keys())]])
+        return np.clip(values, self.min, self.max), counts.astype(np.int64)
+
+    def percentile(self, q):
+        """Gets percentiles of the values (like np.percentile, q is between 0 and 100).
+
+        Args:
+            q (float or list): the percentile(s)
+
+        Returns:
+            float or np.array
+        """
+        if not self._has_sketch:
+            raise Exception("These statistics were read from the raster metadata so they have no percentiles.")
+        if self.count == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        values, counts = self._sketch_values()
+        ranks = np.asarray(q, dtype=np.float64)/100.0*(self.count-1)
+        index = np.searchsorted(np.cumsum(counts), ranks, side="right")
+        result = values[np.minimum(index, len(values)-1)]
+        if np.ndim(q) == 0:
+            return float(result)
+        return result
+
+    def histogram(self):
+        """Gets the histogram.
+
+        Returns:
+            (np.array, np.array): the counts and the bin edges, as from np.histogram
+        """
+        if self.histogram_bins is None:
+            raise Exception("You need to set histogram_bins to get a histogram.")
+        if self._hist is not None:
+            return self._hist.copy(), np.linspace(self.histogram_range[0], self.histogram_range[1], self.histogram_bins+1)
+        if not self._has_sketch:
+            raise Exception("These statistics were read from the raster metadata so they have no histogram.")
+        values, counts = self._sketch_values()
+        return np.histogram(values, self.histogram_bins, (self.min, self.max), weights=counts)
+
+    def result(self, percentiles = None):
+        """Gets the statistics as a dict with the keys count, min, max, mean and std,
+        plus percentiles (a dict) and histogram (counts, edges) if you asked for them.
+
+        Args:
+            percentiles (list): the percentiles you want (0 to 100)
+
+        Returns:
+            dict
+        """
+        stats = {"count": self.count, "min": self.min, "max": self.max,
+                 "mean": self.mean, "std": self.std}
+        if self.count == 0:
+            stats["min"] = np.nan
+            stats["max"] = np.nan
+        if percentiles is not None:
+            stats["percentiles"] = {p: float(v) for p, v in zip(percentiles, self.percentile(list(percentiles)))}
+        if self.histogram_bins is not None:
+            stats["histogram"] = self.histogram()
+        return stats
+
+def _GetStoredStatistics(raster_file, raster_band = 1):
+    """Gets the statistics GDAL has stored for a raster (e.g. in a .aux.xml file) without
+    computing them. Returns (min, max, mean, std, count) or None if there aren't any, if
+    they were computed from overviews or a sample (STATISTICS_APPROXIMATE), or if they
+    don't say how many pixels are valid (without which they can't be merged)."""
+    try:
+        dataset = gdal.Open(raster_file, GA_ReadOnly)
+        band = dataset.GetRasterBand(raster_band)
+        stats = band.GetStatistics(0, 0)
+        valid_percent = band.GetMetadataItem("STATISTICS_VALID_PERCENT")
+        approximate = band.GetMetadataItem("STATISTICS_APPROXIMATE")
+    except Exception:
+        return None
+    if stats is None or valid_percent is None or stats[3] < 0:
+        return None
+    if approximate is not None and str(approximate).upper() in ("YES", "TRUE", "1"):
+        return None
+    count = int(round(float(valid_percent)/100.0*band.XSize*band.YSize))
+    return stats[0], stats[1], stats[2], stats[3], count
+
+def GetApproximateRange(raster_file, raster_band = 1):
+    """Gets the (min, max) of a raster without reading all of it if it can. It uses the
+    statistics GDAL has stored for the raster (even approximate ones), or the overviews
+    if there are any. Otherwise the raster is read a strip at a time with GetRasterStatistics.
+
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+        raster_band (int): the band of the raster
+
+    Return:
+        tuple: the (min, max), which may be a bit inside the true range
+
+    Author: SMM
+    """
+    try:
+        dataset = gdal.Open(raster_file, GA_ReadOnly)
+        band = dataset.GetRasterBand(raster_band)
+        stats = band.GetStatistics(1, 0)
+        if stats is not None and stats[3] >= 0:
+            return stats[0], stats[1]
+        if band.GetOverviewCount() > 0:
+            minmax = band.ComputeRasterMinMax(1)
+            return minmax[0], minmax[1]
+    except Exception:
+        pass
+    raster_stats = GetRasterStatistics(raster_file, raster_band = raster_band)
+    return raster_stats["min"], raster_stats["max"]
+
+def _GetRasterStatisticsObject(raster_file, histogram_bins, histogram_range, use_stored, block_rows, raster_band):
+    """Gets the RasterStatistics of one raster. The result is kept in the raster cache."""
+    def loader():
+        stats = RasterStatistics(histogram_bins, histogram_range)
+        if use_stored:
+            stored = _GetStoredStatistics(raster_file, raster_band)
+            if stored is not None:
+                stats.add_stored(*stored)
+                return stats
+        for i, strip in ReadRasterStrips(raster_file, block_rows, raster_band):
+            stats.add(strip)
+        return stats
+
+    kind = "statistics"+str((histogram_bins, histogram_range, use_stored))
+    return raster_cache.get(raster_file, kind, loader, raster_band)
+
+def GetRasterStatistics(raster_file, percentiles = None, histogram_bins = None, histogram_range = None,
+                        use_stored = True, block_rows = 1024, raster_band = 1):
+    """Gets the statistics of a raster in a single pass over strips of rows, so the
+    raster is never read into memory as a whole. Nodata is ignored. If you don't ask
+    for percentiles or a histogram, the statistics GDAL has stored for the raster
+    are used if there are any.
+
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+        percentiles (list): the percentiles (0 to 100) you want, within 1%. None for none.
+        histogram_bins (int): the number of histogram bins, or None for no histogram
+        histogram_range (tuple): the (min, max) of the histogram. None to use the range of the data.
+        use_stored (bool): If true, use statistics stored by GDAL when they are enough
+        block_rows (int): the number of rows read at a time
+        raster_band (int): the band of the raster
+
+    Return:
+        dict: with count, min, max, mean, std, and percentiles (a dict) and histogram (counts, edges) if you asked for them
+
+    Author: SMM
+    """
+    return GetMultiRasterStatistics([raster_file], percentiles, histogram_bins, histogram_range,
+                                    use_stored, block_rows, raster_band, n_workers = 1)
+
+def GetMultiRasterStatistics(FileList, percentiles = None, histogram_bins = None, histogram_range = None,
+                             use_stored = True, block_rows = 1024, raster_band = 1, n_workers = None):
+    """Gets the statistics of all the values in a set of rasters, e.g. to use one colour
+    scale for all the panels of a figure. The rasters are worked through on a pool of
+    threads, each in a single pass (see GetRasterStatistics), and the results are merged.
+
+    Args:
+        FileList (list): the raster filenames (with path and extension)
+        percentiles (list): the percentiles (0 to 100) you want, within 1%. None for none.
+        histogram_bins (int): the number of histogram bins, or None for no histogram
+        histogram_range (tuple): the (min, max) of the histogram. None to use the range of the data.
+        use_stored (bool): If true, use statistics stored by GDAL when they are enough
+        block_rows (int): the number of rows read at a time
+        raster_band (int): the band of the rasters
+        n_workers (int): the number of rasters read at once. Defaults to the number of CPUs.
+
+    Return:
+        dict: with count, min, max, mean, std, and percentiles (a dict) and histogram (counts, edges) if you asked for them
+
+    Author: SMM
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if len(FileList) == 0:
+        raise Exception("There are no rasters to get statistics from.")
+
+    # Stored statistics have no percentiles or histogram
+    use_stored = use_stored and percentiles is None and histogram_bins is None
+
+    def get_one(raster_file):
+        return _GetRasterStatisticsObject(raster_file, histogram_bins, histogram_range,
+                                          use_stored, block_rows, raster_band)
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = max(1, min(n_workers, len(FileList)))
+    if n_workers == 1:
+        file_stats = [get_one(f) for f in FileList]
+    else:
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            file_stats = list(pool.map(get_one, FileList))
+
+    # the per-file statistics are cached, so merge into a new one
+    stats = RasterStatistics(histogram_bins, histogram_range)
+    for this_stats in file_stats:
+        stats.merge(this_stats)
+    return stats.result(percentiles)
 #==============================================================================
 
 #==============================================================================
@@ -672,162 +1704,139 @@ def array2raster(rasterfn,newRasterfn,array,driver_name = "ENVI", noDataValue =
 #==============================================================================
 
 
-def RasterDifference(RasterFile1, RasterFile2, raster_band=1, OutFileName="Test.outfile", OutFileType="ENVI"):
+def RasterDifference(RasterFile1, RasterFile2, raster_band=1, OutFileName="Test.outfile", OutFileType="ENVI", NoDataValue=-9999):
     """
     Takes two rasters of same size and subtracts second from first,
     e.g. Raster1 - Raster2 = raster_of_difference
-    then writes it out to file
+    then writes it out to file. This is done a strip at a time (see LSDMap_RasterAlgebra),
+    and wherever either raster is nodata the difference is nodata.
     """
+    # avoid circular import
+    from . import LSDMap_RasterAlgebra as LSDMap_RA
 
-    Raster1 = gdal.Open(RasterFile1)
-    Raster2 = gdal.Open(RasterFile2)
-
-    print("RASTER 1: ")
-    print(Raster1.GetGeoTransform())
-    print(Raster1.RasterCount)
-    print(Raster1.GetRasterBand(1).XSize)
-    print(Raster1.GetRasterBand(1).YSize)
-    print(Raster1.GetRasterBand(1).DataType)
-
-    print("RASTER 2: ")
-    print(Raster2.GetGeoTransform())
-    print(Raster2.RasterCount)
-    print(Raster2.GetRasterBand(1).XSize)
-    print(Raster2.GetRasterBand(1).YSize)
-    print(Raster2.GetRasterBand(1).DataType)
-
-    raster_array1 = np.array(Raster1.GetRasterBand(raster_band).ReadAsArray())
-    raster_array2 = np.array(Raster2.GetRasterBand(raster_band).ReadAsArray())
-
-    assert(raster_array1.shape == raster_array2.shape )
-    print("Shapes: ", raster_array1.shape, raster_array2.shape)
-
-    difference_raster_array = raster_array1 - raster_array2
-
-#    import matplotlib.pyplot as plt
-#
-#    plt.imshow(difference_raster_array)
-#
-
-    driver = gdal.GetDriverByName(OutFileType)
-
-    dsOut = driver.Create(OutFileName,
-                          Raster1.GetRasterBand(1).XSize,
-                          Raster1.GetRasterBand(1).YSize,
-                          1,
-                          gdal.GDT_Float32)
-                          #Raster1.GetRasterBand(raster_band).DataType)
-
-
-    gdal_array.CopyDatasetInfo(Raster1,dsOut)
-    bandOut = dsOut.GetRasterBand(1)
-    gdal_array.BandWriteArray(bandOut, difference_raster_array)
+    Raster1 = LSDMap_RA.LazyRaster(RasterFile1, raster_band)
+    Raster2 = LSDMap_RA.LazyRaster(RasterFile2, raster_band)
+    (Raster1 - Raster2).write(OutFileName, OutFileType, NoDataValue)
 
 #==============================================================================
-def PolygoniseRaster(DataDirectory, RasterFile, OutputShapefile='polygons'):
+def PolygoniseRasterToDict(DataDirectory, RasterFile, dissolve = False, simplify_tolerance = 0,
+                           OutputShapefile = None):
     """
-    This function takes in a raster and converts to a polygon shapefile using rasterio
-    from https://gis.stackexchange.com/questions/187877/how-to-polygonize-raster-to-shapely-polygons/187883#187883?newreg=8b1f507529724a8488ce4789ba787363
+    This converts a raster of labels (e.g. the _AllBasins.bil from the chi_mapping_tool)
+    into a dict of shapely polygons without going through a shapefile.
+
+    The raster is traced once with rasterio and the parts of each label are gathered
+    as they come out, so each label is only turned into a shapely object once. Labels
+    made of several disconnected parts are either merged into a MultiPolygon
+    (dissolve = True) or reduced to their largest part (dissolve = False, which is
+    what PolygoniseRaster has always done).
 
     Args:
         DataDirectory (str): the data directory with the basin raster
         RasterFile (str): the name of the raster
-        OutputShapefile (str): the name of the output shapefile WITHOUT EXTENSION. Default = 'polygons'
+        dissolve (bool): If true, all the parts of a label are merged. Otherwise only the largest is kept.
+        simplify_tolerance (float): If > 0, the polygons are simplified to this tolerance (in map units).
+            Half the pixel size of the rendered figure is a good choice: you won't see the difference.
+        OutputShapefile (str): If not None, the polygons are also written to this shapefile (name without directory).
 
     Returns:
         Dictionary where key is the raster value and the value is a shapely polygon
 
-    Author: FJC
+    Author: SMM
     """
-    # import modules
     import rasterio
     from rasterio.features import shapes
-    from shapely.geometry import shape, Polygon, mapping
-    import fiona
-
-    # define the mask
-    #mask = None
-    raster_band = 1
+    from shapely.geometry import shape
+    from shapely.ops import unary_union
 
-    # get raster no data value
-    NDV = getNoDataValue(DataDirectory+RasterFile)
-
-    # load in the raster using rasterio
-    with rasterio.open(DataDirectory+RasterFile) as src:
-        image = src.read(raster_band, masked=False)
-
-        msk = src.read_masks(1)
+    FileName = DataDirectory+RasterFile
+    if exists(FileName) is False:
+            raise Exception('[Errno 2] No such file or directory: \'' + FileName + '\'')
 
-        results = (
-        {'properties': {'raster_val': v}, 'geometry': s}
-        for i, (s, v)
-        in enumerate(
-            shapes(image, mask=msk, transform=src.transform)))
+    with rasterio.open(FileName) as src:
+        image = src.read(1, masked=False)
+        transform = src.transform
+        NDV = src.nodata
 
-    # define shapefile attributes
-    # crs = src.crs.wkt
-    # print (crs)
-    print("Let me grab the coordinate reference system.")
-    crs = GetUTMEPSG(DataDirectory+RasterFile)
-    schema = {'geometry': 'Polygon',
-              'properties': { 'ID': 'float'}}
+    # rasterio can only trace 32 bit types (or smaller)
+    if image.dtype == np.float64:
+        image = image.astype(np.float32)
+    elif image.dtype in (np.int64, np.uint32, np.uint64):
+        image = image.astype(np.int32)
 
+    mask = np.isfinite(image) if image.dtype.kind == "f" else np.ones(image.shape, dtype=bool)
+    if NDV is not None:
+        mask &= (image != NDV)
 
+    # Gather the parts of each label in a single pass
+    parts = {}
+    for geom, value in shapes(image, mask=mask, transform=transform):
+        parts.setdefault(float(value), []).append(shape(geom))
 
-    # This is necessary to filter the basin results
-    geoms = list(results)
-    #print("Geom size is: "+str(len(geoms)))
-    
-    filtered_geoms = {}
-    area_dict = {}
-    for f in geoms:
-        this_shape = Polygon(shape(f['geometry']))
-        this_val = float(f['properties']['raster_val'])
-        #print("ID is: "+str(this_val))
-        this_area = this_shape.area
-        if this_val in filtered_geoms.keys():
-            print("Whoops. Found a repeated ID. Getting rid of the smaller one.")
-            if area_dict[this_val] < this_area:
-                filtered_geoms[this_val] = f
-                area_dict[this_val] = this_area               
-                print("Found a repeated ID. Keeping the one with area of "+str(this_area))
+    PolygonDict = {}
+    n_multi = 0
+    for value, these_parts in parts.items():
+        if len(these_parts) == 1:
+            this_shape = these_parts[0]
+        else:
+            n_multi += 1
+            if dissolve:
+                this_shape = unary_union(these_parts)
             else:
-                print("Keeping the initial ID.")
+                this_shape = max(these_parts, key=lambda p: p.area)
+        if simplify_tolerance > 0:
+            this_shape = this_shape.simplify(simplify_tolerance, preserve_topology=True)
+        PolygonDict[value] = this_shape
+
+    if n_multi > 0:
+        if dissolve:
+            print("I merged the parts of "+str(n_multi)+" labels that were split into several polygons.")
         else:
-            filtered_geoms[this_val] = f
-            area_dict[this_val] = this_area
-    
-    new_geoms = []
-    for key,item in filtered_geoms.items():
-        this_shape = Polygon(shape(item['geometry']))
-        this_val = float(item['properties']['raster_val'])
-        #print("ID is: "+str(this_val)) 
-        this_area = this_shape.area
-        #print("Area is: "+str(this_area))
-        new_geoms.append(item)
-    #print("Geom size is: "+str(len(new_geoms)))
-            
-    # transform results into shapely geometries and write to shapefile using fiona
-    PolygonDict = {}
-    with fiona.open(DataDirectory+OutputShapefile, 'w', crs=crs, driver='ESRI Shapefile', schema=schema) as output:
-        for f in new_geoms:
-            this_shape = Polygon(shape(f['geometry']))
-            this_val = float(f['properties']['raster_val'])
-            print("ID is: "+str(this_val))
-            if this_val != NDV: # remove no data values
-                output.write({'geometry': mapping(this_shape), 'properties':{'ID': this_val}})
-            PolygonDict[this_val] = this_shape
+            print("I found "+str(n_multi)+" labels split into several polygons. I kept the largest part of each.")
+
+    if OutputShapefile is not None:
+        WritePolygonShapefile(PolygonDict, DataDirectory+OutputShapefile, GetUTMEPSG(FileName))
 
     return PolygonDict
 
 #==============================================================================
-def PolygoniseRasterMerge(DataDirectory, RasterFile, OutputShapefile='polygons'):
+def WritePolygonShapefile(PolygonDict, OutputShapefile, crs):
+    """
+    This writes a dict of shapely polygons to an ESRI shapefile using fiona.
+
+    Args:
+        PolygonDict (dict): key is the ID, value is a shapely Polygon or MultiPolygon
+        OutputShapefile (str): the name of the output shapefile, with path
+        crs (str): The coordinate reference system, e.g. an EPSG string
+
+    Author: SMM
+    """
+    import fiona
+    from shapely.geometry import mapping, MultiPolygon
+
+    # fiona wants a single geometry type, so if any label is a MultiPolygon they all become one
+    geom_type = "Polygon"
+    if any(p.geom_type == "MultiPolygon" for p in PolygonDict.values()):
+        geom_type = "MultiPolygon"
+    schema = {'geometry': geom_type,
+              'properties': { 'ID': 'float'}}
+
+    def as_record(this_val, this_shape):
+        if geom_type == "MultiPolygon" and this_shape.geom_type == "Polygon":
+            this_shape = MultiPolygon([this_shape])
+        return {'geometry': mapping(this_shape), 'properties':{'ID': float(this_val)}}
+
+    with fiona.open(OutputShapefile, 'w', crs=crs, driver='ESRI Shapefile', schema=schema) as output:
+        output.writerecords(as_record(this_val, this_shape) for this_val, this_shape in PolygonDict.items())
+
+#==============================================================================
+def PolygoniseRaster(DataDirectory, RasterFile, OutputShapefile='polygons'):
     """
     This function takes in a raster and converts to a polygon shapefile using rasterio
     from https://gis.stackexchange.com/questions/187877/how-to-polygonize-raster-to-shapely-polygons/187883#187883?newreg=8b1f507529724a8488ce4789ba787363
 
-    This version recognises where there are multiple polygons with the same key and merges
-    them to a MultiPolygon using cascaded_union
+    Where a raster value is split into several polygons only the largest is kept.
+    If you only want the polygons use PolygoniseRasterToDict, which doesn't write a shapefile.
 
     Args:
         DataDirectory (str): the data directory with the basin raster
@@ -839,58 +1848,30 @@ def PolygoniseRasterMerge(DataDirectory, RasterFile, OutputShapefile='polygons')
 
     Author: FJC
     """
-    # import modules
-    import rasterio
-    from rasterio.features import shapes
-    from shapely.geometry import shape, Polygon, mapping
-    from shapely.ops import cascaded_union
-    import fiona
-
-    # define the mask
-    #mask = None
-    raster_band = 1
-
-    # get raster no data value
-    NDV = getNoDataValue(DataDirectory+RasterFile)
-
-    # load in the raster using rasterio
-    with rasterio.open(DataDirectory+RasterFile) as src:
-        image = src.read(raster_band, masked=False)
-
-        msk = src.read_masks(1)
-
-        results = (
-        {'properties': {'raster_val': v}, 'geometry': s}
-        for i, (s, v)
-        in enumerate(
-            shapes(image, mask=msk, transform=src.transform)))
-
-    # define shapefile attributes
-    # crs = src.crs.wkt
-    # print (crs)
-    crs = GetUTMEPSG(DataDirectory+RasterFile)
-    schema = {'geometry': 'Polygon',
-              'properties': { 'ID': 'float'}}
+    return PolygoniseRasterToDict(DataDirectory, RasterFile, dissolve = False,
+                                  OutputShapefile = OutputShapefile)
 
+#==============================================================================
+def PolygoniseRasterMerge(DataDirectory, RasterFile, OutputShapefile='polygons'):
+    """
+    This function takes in a raster and converts to a polygon shapefile using rasterio
+    from https://gis.stackexchange.com/questions/187877/how-to-polygonize-raster-to-shapely-polygons/187883#187883?newreg=8b1f507529724a8488ce4789ba787363
 
+    This version recognises where there are multiple polygons with the same key and merges
+    them to a MultiPolygon
 
-    # transform results into shapely geometries and write to shapefile using fiona
-    geoms = list(results)
-    PolygonDict = {}
-    with fiona.open(DataDirectory+OutputShapefile, 'w', crs=crs, driver='ESRI Shapefile', schema=schema) as output:
-        for f in geoms:
-            this_shape = Polygon(shape(f['geometry']))
-            this_val = float(f['properties']['raster_val'])
-            if this_val in PolygonDict:
-                Polygons = [this_shape, PolygonDict[this_val]]
-                this_shape = cascaded_union(Polygons)
-            if this_val != NDV: # remove no data values
-                output.write({'geometry': mapping(this_shape), 'properties':{'ID': this_val}})
-
-            PolygonDict[this_val] = this_shape
+    Args:
+        DataDirectory (str): the data directory with the basin raster
+        RasterFile (str): the name of the raster
+        OutputShapefile (str): the name of the output shapefile WITHOUT EXTENSION. Default = 'polygons'
 
-    return PolygonDict
+    Returns:
+        Dictionary where key is the raster value and the value is a shapely polygon
 
+    Author: FJC
+    """
+    return PolygoniseRasterToDict(DataDirectory, RasterFile, dissolve = True,
+                                  OutputShapefile = OutputShapefile)
 
 def CreateShapefileOfRasterFootprint(DataDirectory, RasterFile):
     """
@@ -564,79 +564,180 @@ def DetermineSc(DataDirectory,FilenamePrefix,PlotDirectory):
     plt.savefig(PlotDirectory+"Determine_Sc.png",dpi=300)
     plt.savefig(PlotDirectory+"Determine_Sc.pdf")
 
-def CalculateEStarRStar(DataDirectory,FilenamePrefix,Basin,Sc=0.71):
+def _EStarRStarFiles(DataDirectory, FilenamePrefix):
+    """
+    Gets the names of the channel and hillslope files read by ReadChannelData and ReadHillslopeData.
 
+    Author: SMM
     """
-    Calculate EStar and RStar here so that you can change the critical slope
-    Calculate for a specific basin.
+    ChannelFile = DataDirectory+FilenamePrefix+'_MChiSegmented.csv'
+    if not os.path.isfile(ChannelFile):
+        ChannelFile = DataDirectory+FilenamePrefix+'_MChiSegmented.geojson'
+    HillslopeFile = DataDirectory+FilenamePrefix+'_HilltopData.csv'
+    return ChannelFile, HillslopeFile
+
+def _BuildEStarRStarTable(DataDirectory, FilenamePrefix, Sc):
+    """
+    Builds the table returned by GetEStarRStarTable.
+
+    Author: SMM
+    """
+    # load the channel and hillslope data
+    ChannelData = ReadChannelData(DataDirectory, FilenamePrefix)
+    HillslopeData = ReadHillslopeData(DataDirectory, FilenamePrefix)
+
+    # the main stem of each basin is the source of its first channel node
+    MainStemKey = ChannelData.groupby('basin_key', sort=False).source_key.transform('first')
+    ChannelData = ChannelData.assign(OnMainStem = (ChannelData.source_key == MainStemKey))
+
+    # channel metrics for every segment of every basin
+    Segments = ChannelData.groupby(['basin_key','segment_number'], sort=False).agg(
+        Ksn = ('m_chi','first'),
+        ChiMedian = ('chi','median'),
+        FlowLength = ('flow_distance','median'),
+        MinFlowDistance = ('flow_distance','min'),
+        MaxFlowDistance = ('flow_distance','max'),
+        MainStem = ('OnMainStem','any')).reset_index()
+    Segments['SegmentLength'] = Segments.MaxFlowDistance-Segments.MinFlowDistance
+    MinimumChi = ChannelData.groupby('basin_key').chi.min()
+    Segments['Chi'] = Segments.ChiMedian-Segments.basin_key.map(MinimumChi)
+
+    # E* and R* quartiles of the traces of every segment
+    Hillslopes = pd.DataFrame({'StreamID': HillslopeData.StreamID.values,
+                               'EStar': (-2.*HillslopeData.Cht*HillslopeData.Lh/Sc).values,
+                               'RStar': (HillslopeData.S/Sc).values})
+    GroupedHillslopes = Hillslopes.groupby('StreamID')
+    Quartiles = GroupedHillslopes[['EStar','RStar']].quantile([0.25,0.5,0.75]).unstack()
+    Quartiles.columns = [Name+{0.25:'Lower',0.5:'Median',0.75:'Upper'}[q] for Name, q in Quartiles.columns]
+    Quartiles['NTraces'] = GroupedHillslopes.size()
+
+    # join the hillslopes to their segments
+    Table = Segments.join(Quartiles, on = Segments.segment_number.astype(float))
+    Table['NTraces'] = Table.NTraces.fillna(0).astype(int)
+
+    return Table[['basin_key','segment_number','MainStem','Chi','ChiMedian','Ksn','FlowLength','SegmentLength',
+                  'EStarMedian','EStarLower','EStarUpper','RStarMedian','RStarLower','RStarUpper','NTraces']]
+
+def GetEStarRStarTable(DataDirectory, FilenamePrefix, Sc=0.71):
+    """
+    Calculates E* and R* for every channel segment of every basin in one go.
+    The hillslope traces are grouped by segment and the quartiles of E* and R*
+    are calculated together, rather than masking the data for each segment.
+    The table is cached against the channel and hillslope files and Sc, so the
+    plotting functions can all call this without rereading the csv files.
 
     Args:
         DataDirectory (str): the data directory
         FilenamePrefix (str): the file name prefix
         Sc (float): The critical slope to use
 
-    returns: pandas data frame with Estar Rstar data and quantiles for hillslopes
-        organised by channel segments for the specified basin
+    Returns:
+        pandas dataframe with a row for each segment, in the order of the channel file.
+        The columns are basin_key, segment_number, MainStem (True if the segment is on the
+        main stem), Chi (the median chi of the segment minus the minimum chi of the basin),
+        ChiMedian, Ksn, FlowLength (the median flow distance), SegmentLength, the
+        quartiles of E* and R* (EStarMedian, EStarLower, EStarUpper, RStarMedian,
+        RStarLower, RStarUpper) and NTraces. Segments without traces have an NTraces
+        of 0 and no E* R* data. Don't change the table in place since it is shared.
 
-    MDH, Septmeber 2017
+    Author: SMM
+    """
+    ChannelFile, HillslopeFile = _EStarRStarFiles(DataDirectory, FilenamePrefix)
+    if not os.path.isfile(ChannelFile):
+        raise Exception("No file named "+DataDirectory+FilenamePrefix+"_MChiSegmented.* found")
+
+    cache = LSDP.LSDMap_IO.raster_cache
+    kind = "estar_rstar"+str(cache.make_key(ChannelFile, "channels")[:3])+"Sc="+str(Sc)
+    return cache.get(HillslopeFile, kind, lambda: _BuildEStarRStarTable(DataDirectory, FilenamePrefix, Sc))
 
+def GetBasinEStarRStar(DataDirectory, FilenamePrefix, Sc=0.71, minimum_traces=1):
     """
+    Gets the median and quartiles of the segment E* and R* medians of each basin.
 
-    # load the channel data
-    ChannelData = ReadChannelData(DataDirectory, FilenamePrefix)
+    Args:
+        DataDirectory (str): the data directory
+        FilenamePrefix (str): the file name prefix
+        Sc (float): The critical slope to use
+        minimum_traces (int): segments with fewer traces than this are left out
 
-    #load the hillslopes data
-    HillslopeData = ReadHillslopeData(DataDirectory, FilenamePrefix)
+    Returns:
+        pandas dataframe indexed by basin_key with the columns EStarMedian, EStarLower,
+        EStarUpper, RStarMedian, RStarLower, RStarUpper, KsnMedian and NSegments
 
-    # isolate basin data
-    BasinChannelData = ChannelData[ChannelData.basin_key == Basin]
+    Author: SMM
+    """
+    Table = GetEStarRStarTable(DataDirectory, FilenamePrefix, Sc)
+    Table = Table[Table.NTraces >= minimum_traces]
 
-    # segments in the hillslope data
-    #Segments = BasinHillslopeData.StreamID.unique()
-    Segments = BasinChannelData.segment_number.unique()
+    Grouped = Table.groupby('basin_key')
+    Quartiles = Grouped[['EStarMedian','RStarMedian']].quantile([0.25,0.5,0.75]).unstack()
+    BasinDF = pd.DataFrame(index = Quartiles.index)
+    for Name in ['EStar','RStar']:
+        BasinDF[Name+'Median'] = Quartiles[(Name+'Median',0.5)]
+        BasinDF[Name+'Lower'] = Quartiles[(Name+'Median',0.25)]
+        BasinDF[Name+'Upper'] = Quartiles[(Name+'Median',0.75)]
+    BasinDF['KsnMedian'] = Grouped.Ksn.median()
+    BasinDF['NSegments'] = Grouped.size()
 
-    # For each segment get the MChi value and collect dimensionless hillslope data
-    # record the number of traces in each segment inbto a new dataframe
-    Data = pd.DataFrame(columns=['SegmentNo','MChi','FlowLength','SegmentLength','EStar','EStarLower','EStarUpper','RStar','RStarLower','RStarUpper','NTraces'])
+    return BasinDF
 
-    # Loop through the segments
-    for i in range(0,len(Segments)):
+def GetEStarRStarPlotData(Table, Basins, mainstem_only=False, minimum_traces=1):
+    """
+    Gets the E* R* data of some basins from the table of GetEStarRStarTable in the
+    form used by the plotting functions.
 
-        #Get segment hillslope data
-        SegmentHillslopeData = HillslopeData[HillslopeData.StreamID == float(Segments[i])]
+    Args:
+        Table (pandas dataframe): from GetEStarRStarTable
+        Basins (int list): the basin keys
+        mainstem_only (bool): If true, only keep the segments on the main stem
+        minimum_traces (int): segments with fewer traces than this are left out
 
-        #Get segment channel data and calculate flow length
-        SegmentChannelData = BasinChannelData[BasinChannelData.segment_number == Segments[i]]
+    Returns:
+        pandas dataframe with the columns Chi, Ksn, EStarMedian, EStarLower, EStarUpper,
+        RStarMedian, RStarLower, RStarUpper and NTraces
 
-        #channels
-        MChi = SegmentChannelData.m_chi.unique()[0]
-        TempFL = SegmentChannelData.flow_distance
-        FlowLength = np.median(TempFL)
-        SegmentLength = np.max(TempFL)-np.min(TempFL)
+    Author: SMM
+    """
+    Mask = Table.basin_key.isin(Basins) & (Table.NTraces >= minimum_traces)
+    if mainstem_only:
+        Mask = Mask & Table.MainStem
+    PlotDF = Table.loc[Mask, ['Chi','Ksn','EStarMedian','EStarLower','EStarUpper',
+                              'RStarMedian','RStarLower','RStarUpper','NTraces']]
+    return PlotDF.reset_index(drop=True)
 
-        #hillslopes
-        TempEs = (-2.*SegmentHillslopeData.Cht*SegmentHillslopeData.Lh)/Sc
-        TempRs = SegmentHillslopeData.S/Sc
+def CalculateEStarRStar(DataDirectory,FilenamePrefix,Basin,Sc=0.71):
 
+    """
+    Calculate EStar and RStar here so that you can change the critical slope
+    Calculate for a specific basin. This is taken from the table of GetEStarRStarTable.
 
-        #get the stats to plot
-        EStar = TempEs.quantile(0.5)
-        EStarUpper = TempEs.quantile(0.75)
-        EStarLower = TempEs.quantile(0.25)
-        RStar = TempRs.quantile(0.5)
-        RStarUpper = TempRs.quantile(0.75)
-        RStarLower = TempRs.quantile(0.25)
+    Args:
+        DataDirectory (str): the data directory
+        FilenamePrefix (str): the file name prefix
+        Sc (float): The critical slope to use
 
-        NTraces = SegmentHillslopeData.size
+    returns: pandas data frame with Estar Rstar data and quantiles for hillslopes
+        organised by channel segments for the specified basin
 
-        #add to data frame
-        Data.loc[i] = [Segments[i],MChi,FlowLength,SegmentLength,EStar,EStarLower,EStarUpper,RStar,RStarLower,RStarUpper,NTraces]
+    MDH, Septmeber 2017
 
-    # remove rows with no data (i.e. no hillslope traces)
-    Data = Data.dropna(0,'any')
+    """
+    Table = GetEStarRStarTable(DataDirectory, FilenamePrefix, Sc)
+
+    # isolate basin data, removing segments with no hillslope traces
+    BasinTable = Table[(Table.basin_key == Basin) & (Table.NTraces > 0)]
 
-    # only keep segments with more than 50 hillslope traces
-    #Data = Data[Data.NTraces > 50]
+    Data = pd.DataFrame({'SegmentNo': BasinTable.segment_number.values,
+                         'MChi': BasinTable.Ksn.values,
+                         'FlowLength': BasinTable.FlowLength.values,
+                         'SegmentLength': BasinTable.SegmentLength.values,
+                         'EStar': BasinTable.EStarMedian.values,
+                         'EStarLower': BasinTable.EStarLower.values,
+                         'EStarUpper': BasinTable.EStarUpper.values,
+                         'RStar': BasinTable.RStarMedian.values,
+                         'RStarLower': BasinTable.RStarLower.values,
+                         'RStarUpper': BasinTable.RStarUpper.values,
+                         'NTraces': BasinTable.NTraces.values})
 
     return Data
 
@@ -1101,30 +1202,16 @@ def PlotEStarRStarWithinBasin(DataDirectory, FilenamePrefix, PlotDirectory, Basi
     import math
 
     print("Plotting the E* R* curves for basin "+str(BasinID))
-    # load the channel data
-    ChannelData = ReadChannelData(DataDirectory, FilenamePrefix)
+    # get the E* R* data of the segments of this basin
+    Table = GetEStarRStarTable(DataDirectory, FilenamePrefix, Sc)
+    BasinTable = Table[(Table.basin_key == BasinID) & (Table.NTraces > minimum_traces)]
 
-    # load the hillslopes data
-    HillslopeData = ReadHillslopeData(DataDirectory, FilenamePrefix)
+    # keep track of how many data points you have
+    total_data_points = len(BasinTable)
 
-    # isolate basin data
-    BasinChannelData = ChannelData[ChannelData.basin_key == BasinID]
-    BasinJunctions = HillslopeData.BasinID.unique()
-    BasinHillslopeData = HillslopeData[HillslopeData.BasinID == BasinJunctions[BasinID]]
-    MinimumDistance = BasinChannelData.flow_distance.min()
-    MaximumDistance = BasinChannelData.flow_distance.max()
-    MaximumMChi = BasinChannelData.m_chi.max()
-
-    # how many segments are we dealing with?
-    Segments = BasinChannelData.segment_number.unique()
-
-    # try to figure out the source key
-    mainstem_source_key = BasinChannelData.source_key.iloc[0]
-    print("The mainstem source key is: " +str(mainstem_source_key))
-
-    # separate into main stem and trib data
-    MainStemChannelData = BasinChannelData[BasinChannelData.source_key == mainstem_source_key]
-    MainStemSegments = MainStemChannelData.segment_number.unique()
+    if plot_mainstem_only:
+        print("I am only going to plot the main stem data.")
+        BasinTable = BasinTable[BasinTable.MainStem]
 
     # set up the figure
     Fig = CreateFigure()
@@ -1133,98 +1220,18 @@ def PlotEStarRStarWithinBasin(DataDirectory, FilenamePrefix, PlotDirectory, Basi
     #choose colormap
     ColourMap = cm.viridis
 
+    # Get distances, chi values and k_sn
+    AllDist = BasinTable.FlowLength.values/1000
+    AllChi = BasinTable.ChiMedian.values
+    AllKsn = BasinTable.Ksn.values
 
-    CalcEsMed = []
-    CalcEsLQ = []
-    CalcEsUQ = []
-
-    CalcRsMed = []
-    CalcRsLQ = []
-    CalcRsUQ = []
-
-    AllDist = []
-    AllChi = []
-    AllKsn = []
-
-    EsLowErr = []
-    EsUpErr = []
-    RsLowErr = []
-    RsUpErr = []
-
-    if plot_mainstem_only:
-        print("I am only going to plot the main stem data.")
-
-    total_data_points = 0
-
-    for i in range (0, len(Segments)):
-        SegmentHillslopeData = BasinHillslopeData[BasinHillslopeData.StreamID == Segments[i]]
-        SegmentChannelData = BasinChannelData[BasinChannelData.segment_number == Segments[i]]
-
-        # Get the number of traces
-        N_traces = len(SegmentHillslopeData["i"].tolist())
-
-        if N_traces > minimum_traces:
-
-            # keep track of how many data points you have
-            total_data_points = total_data_points+1
-
-            # Calculate E* R*
-            if plot_mainstem_only:
-                if Segments[i] in MainStemSegments:
-                    EStar = -2*SegmentHillslopeData.Cht*SegmentHillslopeData.Lh/Sc
-                    RStar = SegmentHillslopeData.S/Sc
-
-                    # Get distances and chi values
-                    AllDist.append(SegmentChannelData.flow_distance.median()/1000)
-                    AllChi.append(SegmentChannelData.chi.median())
-
-                    # Now get the k_sn
-                    AllKsn.append(SegmentChannelData.m_chi.unique()[0])
-
-                    # Get the medians and the quartiles.
-                    CalcEsMed.append(EStar.median())
-                    CalcEsLQ.append(EStar.quantile(0.25))
-                    CalcEsUQ.append(EStar.quantile(0.75))
-
-                    EsLowErr.append(EStar.median()-EStar.quantile(0.25))
-                    EsUpErr.append(EStar.quantile(0.75)-EStar.median())
-
-                    CalcRsMed.append(RStar.median())
-                    CalcRsLQ.append(RStar.quantile(0.25))
-                    CalcRsUQ.append(RStar.quantile(0.75))
-
-                    RsLowErr.append(RStar.median()-RStar.quantile(0.25))
-                    RsUpErr.append(RStar.quantile(0.75)-RStar.median())
-
-            else:
-                EStar = -2*SegmentHillslopeData.Cht*SegmentHillslopeData.Lh/Sc
-                RStar = SegmentHillslopeData.S/Sc
-
-                # Get distances and chi values
-                AllDist.append(SegmentChannelData.flow_distance.median()/1000)
-                AllChi.append(SegmentChannelData.chi.median())
-
-                # Now get the k_sn
-                AllKsn.append(SegmentChannelData.m_chi.unique()[0])
-                #print("Segment m_chi is: "+ str(SegmentChannelData.m_chi.unique()[0]))
-
-                # Get the medians and the quartiles.
-                CalcEsMed.append(EStar.median())
-                CalcEsLQ.append(EStar.quantile(0.25))
-                CalcEsUQ.append(EStar.quantile(0.75))
-
-                EsLowErr.append(EStar.median()-EStar.quantile(0.25))
-                EsUpErr.append(EStar.quantile(0.75)-EStar.median())
-
-                CalcRsMed.append(RStar.median())
-                CalcRsLQ.append(RStar.quantile(0.25))
-                CalcRsUQ.append(RStar.quantile(0.75))
-
-                RsLowErr.append(RStar.median()-RStar.quantile(0.25))
-                RsUpErr.append(RStar.quantile(0.75)-RStar.median())
-
-                #print("Rs: "+str(RStar.quantile(0.25))+","+str(RStar.median())+","+str(RStar.quantile(0.75)))
-
+    # Get the medians and the quartiles.
+    CalcEsMed = BasinTable.EStarMedian.values
+    CalcRsMed = BasinTable.RStarMedian.values
+    EsLowErr = CalcEsMed-BasinTable.EStarLower.values
+    EsUpErr = BasinTable.EStarUpper.values-CalcEsMed
+    RsLowErr = CalcRsMed-BasinTable.RStarLower.values
+    RsUpErr = BasinTable.RStarUpper.values-CalcRsMed
 
     plt.loglog()
     PlotEStarRStarTheoretical()
@@ -1556,18 +1563,19 @@ def PlotEStarRStarBasins(DataDirectory, FilenamePrefix, PlotDirectory, Sc = 0.8)
     MinMChi = df.mchi_median.min()
     MaxMChi = df.mchi_median.max()
 
-    for basin_key in basins:
-        Data = CalculateEStarRStar(DataDirectory,FilenamePrefix,basin_key, Sc=Sc)
+    # the E* R* of all the basins, calculated once
+    BasinEsRs = GetBasinEStarRStar(DataDirectory, FilenamePrefix, Sc)
 
+    for basin_key in basins:
         # colour code by basin number
         #colour = float(basin_key)/float(NoBasins)
         colour = df.mchi_median[df.basin_keys == basin_key].values[0]
-        EStarMedian = Data.EStar.median()
-        RStarMedian = Data.RStar.median()
-        EStar_lower_err = np.percentile(Data.EStar.as_matrix(), 25)
-        EStar_upper_err = np.percentile(Data.EStar.as_matrix(), 75)
-        RStar_lower_err = np.percentile(Data.RStar.as_matrix(), 25)
-        RStar_upper_err = np.percentile(Data.RStar.as_matrix(), 75)
+        EStarMedian = BasinEsRs.EStarMedian[basin_key]
+        RStarMedian = BasinEsRs.RStarMedian[basin_key]
+        EStar_lower_err = BasinEsRs.EStarLower[basin_key]
+        EStar_upper_err = BasinEsRs.EStarUpper[basin_key]
+        RStar_lower_err = BasinEsRs.RStarLower[basin_key]
+        RStar_upper_err = BasinEsRs.RStarUpper[basin_key]
 
         cNorm  = colors.Normalize(vmin=MinMChi, vmax=MaxMChi)
         plt.cm.ScalarMappable(norm=cNorm, cmap=ColourMap)
@@ -2150,8 +2158,8 @@ def PlotChiProfileHillslopeData(DataDirectory, FilenamePrefix, PlotDirectory, Ba
     else:
         print("You are plotting chi-elevation rather than chi-k_sn")
 
-    #Load hillslope metrics data
-    HillslopesDF = ReadHillslopeData(DataDirectory, FilenamePrefix)
+    # Get the E* R* data of all the segments
+    EsRsTable = GetEStarRStarTable(DataDirectory, FilenamePrefix, Sc)
 
     # Read in the raw channel data
     ChannelsDF = ReadChannelData(DataDirectory, FilenamePrefix)
@@ -2173,10 +2181,7 @@ def PlotChiProfileHillslopeData(DataDirectory, FilenamePrefix, PlotDirectory, Ba
         MaximumMChi = BasinChannelData.m_chi.max()
         MinKsn = BasinChannelData.m_chi.min()
         MaxKsn = BasinChannelData.m_chi.max()
-
-        # how many segments are we dealing with?
-        Segments = BasinChannelData.segment_number.unique()
-
+        PlotMaxKsn = int(math.ceil(MaxKsn / 10.0)) * 10
 
         # try to figure out the source key
         mainstem_source_key = BasinChannelData.source_key.iloc[0]
@@ -2195,115 +2200,28 @@ def PlotChiProfileHillslopeData(DataDirectory, FilenamePrefix, PlotDirectory, Ba
         #choose colormap
         ColourMap = cm.viridis
 
-        # create new dataframe for plotting
-        PlotDF = pd.DataFrame(columns=['Chi','Ksn','EStarMedian','EStarLower',
-                     'EStarUpper','RStarMedian','RStarLower','RStarUpper','NTraces'])
-
-        # Get the data columns for plotting
-        for i, Segment in np.ndenumerate(Segments):
-
-
-            if mainstem_only:
-                if Segments[i] in MainStemSegments:
-                    # get metrics to plot
-                    if PlotKsn:
-                        KKsn = BasinChannelData.m_chi[BasinChannelData.segment_number == Segment]
-
-                    Ksn = BasinChannelData.m_chi[BasinChannelData.segment_number == Segment].unique()[0]
-                    Chi = BasinChannelData.chi[BasinChannelData.segment_number == Segment]
-                    Elevation = BasinChannelData.elevation[BasinChannelData.segment_number == Segment]
-
-                    #print("Sizes are:")
-                    #print("Ksn: "+str(Ksn.size))
-                    #print("Chi: "+str(Chi.size))
-                    #print("Elevation: "+str(Elevation.size))
+        # plot the profile of each segment
+        for Segment, SegmentChannelData in BasinChannelData.groupby('segment_number', sort=False):
 
-                    #normalise chi by outlet chi
-                    Chi = Chi-MinimumChi
+            if mainstem_only and Segment not in MainStemSegments:
+                continue
 
-                    # plot the chi data
-                    Colour = (Ksn-MinKsn)/(MaxKsn-MinKsn)
+            # get metrics to plot
+            Ksn = SegmentChannelData.m_chi.iloc[0]
 
-                    PlotMaxKsn = int(math.ceil(MaxKsn / 10.0)) * 10
+            #normalise chi by outlet chi
+            Chi = SegmentChannelData.chi-MinimumChi
 
-                    if PlotKsn:
-                        ax1.scatter(Chi,KKsn,marker='o', edgecolors='none', lw=0.5, c=[1.0,0.0,0.0], s=20, zorder=20)
-                    else:
-                        ax1.plot(Chi,Elevation,'-', lw=1.5,c=ColourMap(Colour), zorder=10)
-
-                    # get hillslope data
-                    SegmentHillslopeData = HillslopesDF[HillslopesDF.StreamID == Segment]
-                    NTraces = len(SegmentHillslopeData["i"].tolist())
-
-                    if NTraces<minimum_traces:
-                        continue
-
-                    # Calculate E* R*
-                    EStar = -2*SegmentHillslopeData.Cht*SegmentHillslopeData.Lh/Sc
-                    RStar = SegmentHillslopeData.S/Sc
-
-                    EStarMedian = EStar.median()
-                    EStarLower = EStar.quantile(0.25)
-                    EStarUpper = EStar.quantile(0.75)
-
-                    RStarMedian = RStar.median()
-                    RStarLower = RStar.quantile(0.25)
-                    RStarUpper = RStar.quantile(0.75)
-
-                    # add to plot dataframe
-                    PlotDF.loc[i]  = [Chi.median(),Ksn,EStarMedian,EStarLower, EStarUpper, RStarMedian, RStarLower, RStarUpper,NTraces]
+            # plot the chi data
+            Colour = (Ksn-MinKsn)/(MaxKsn-MinKsn)
 
+            if PlotKsn:
+                ax1.scatter(Chi,SegmentChannelData.m_chi,marker='o', edgecolors='none', lw=0.5, c=[1.0,0.0,0.0], s=20, zorder=20)
             else:
-                # get metrics to plot
-                if PlotKsn:
-                    KKsn = BasinChannelData.m_chi[BasinChannelData.segment_number == Segment]
-
-                Ksn = BasinChannelData.m_chi[BasinChannelData.segment_number == Segment].unique()[0]
-                Chi = BasinChannelData.chi[BasinChannelData.segment_number == Segment]
-                Elevation = BasinChannelData.elevation[BasinChannelData.segment_number == Segment]
-
-                #print("Sizes are:")
-                #print("Ksn: "+str(Ksn.size))
-                #print("Chi: "+str(Chi.size))
-                #print("Elevation: "+str(Elevation.size))
-
-                #normalise chi by outlet chi
-                Chi = Chi-MinimumChi
-
-                # plot the chi data
-                Colour = (Ksn-MinKsn)/(MaxKsn-MinKsn)
-
-                PlotMaxKsn = int(math.ceil(MaxKsn / 10.0)) * 10
-
-                if PlotKsn:
-                    ax1.scatter(Chi,KKsn,marker='o', edgecolors='none',lw=0.5, c=[1.0,0.0,0.0], s=20, zorder=20)
-                else:
-                    ax1.plot(Chi,Elevation,'-', lw=1.5,c=ColourMap(Colour), zorder=10)
-
-                # get hillslope data
-                SegmentHillslopeData = HillslopesDF[HillslopesDF.StreamID == Segment]
-                NTraces = len(SegmentHillslopeData["i"].tolist())
-
-                if NTraces<minimum_traces:
-                    continue
+                ax1.plot(Chi,SegmentChannelData.elevation,'-', lw=1.5,c=ColourMap(Colour), zorder=10)
 
-                # Calculate E* R*
-                EStar = -2*SegmentHillslopeData.Cht*SegmentHillslopeData.Lh/Sc
-                RStar = SegmentHillslopeData.S/Sc
-
-                EStarMedian = EStar.median()
-                EStarLower = EStar.quantile(0.25)
-                EStarUpper = EStar.quantile(0.75)
-
-                RStarMedian = RStar.median()
-                RStarLower = RStar.quantile(0.25)
-                RStarUpper = RStar.quantile(0.75)
-
-                # add to plot dataframe
-                PlotDF.loc[i]  = [Chi.median(),Ksn,EStarMedian,EStarLower, EStarUpper, RStarMedian, RStarLower, RStarUpper,NTraces]
-
-        # reset indices
-        PlotDF = PlotDF.reset_index(drop=True)
+        # get the E* R* data for plotting
+        PlotDF = GetEStarRStarPlotData(EsRsTable, [key], mainstem_only, minimum_traces)
 
         # Zip errors for plotting
         Es_max_err = PlotDF.EStarUpper.values-PlotDF.EStarMedian
@@ -2414,11 +2332,8 @@ def PlotCatchmentKsnEsRs(DataDirectory, FilenamePrefix,PlotDirectory, Basins = [
 
     """
 
-    #Load hillslope metrics data
-    HillslopesDF = ReadHillslopeData(DataDirectory, FilenamePrefix)
-
-    # Read in the raw channel data
-    ChannelsDF = ReadChannelData(DataDirectory, FilenamePrefix)
+    # Get the E* R* data of all the segments
+    EsRsTable = GetEStarRStarTable(DataDirectory, FilenamePrefix, Sc)
 
     # Basins list and keys
     BasinsDict = np.loadtxt(DataDirectory+FilenamePrefix+'_junctions.list',dtype=int)
@@ -2430,13 +2345,6 @@ def PlotCatchmentKsnEsRs(DataDirectory, FilenamePrefix,PlotDirectory, Basins = [
         Basin = BasinsDict[key]
         print(key, Basin)
 
-        # isolate basin data
-        BasinChannelData = ChannelsDF[ChannelsDF.basin_key == key]
-        MinimumChi = BasinChannelData.chi.min()
-
-        # how many segments are we dealing with?
-        Segments = BasinChannelData.segment_number.unique()
-
         # setup the figure
         Fig = CreateFigure(FigSizeFormat="EPSL")
         ax1 = Fig.add_axes([0.1,0.1,0.8,0.5])
@@ -2445,85 +2353,8 @@ def PlotCatchmentKsnEsRs(DataDirectory, FilenamePrefix,PlotDirectory, Basins = [
         #choose colormap
         ColourMap = cm.viridis
 
-        # create new dataframe for plotting
-        PlotDF = pd.DataFrame(columns=['Chi','Ksn','EStarMedian','EStarLower',
-                    'EStarUpper','RStarMedian','RStarLower','RStarUpper','NTraces'])
-
-        # try to figure out the source key
-        mainstem_source_key = BasinChannelData.source_key.iloc[0]
-        print("The mainstem source key is: " +str(mainstem_source_key))
-
-        # separate into main stem and trib data
-        MainStemChannelData = BasinChannelData[BasinChannelData.source_key == mainstem_source_key]
-        MainStemSegments = MainStemChannelData.segment_number.unique()
-
-        # Get the data columns for plotting
-        for i, Segment in np.ndenumerate(Segments):
-
-            # A rather stupid way to ensure only mainstem but I don't have time to make this pythonic (SMM)
-            if mainstem_only:
-                if Segments[i] in MainStemSegments:
-                    # get metrics to plot
-                    Ksn = BasinChannelData.m_chi[BasinChannelData.segment_number == Segment].unique()[0]
-                    Chi = BasinChannelData.chi[BasinChannelData.segment_number == Segment].median()
-
-                    #normalise chi by outlet chi
-                    Chi = Chi-MinimumChi
-
-                    # get hillslope data
-                    SegmentHillslopeData = HillslopesDF[HillslopesDF.StreamID == Segment]
-                    NTraces = len(SegmentHillslopeData)
-
-                    if NTraces<minimum_traces:
-                        continue
-
-                    # Calculate E* R*
-                    EStar = -2*SegmentHillslopeData.Cht*SegmentHillslopeData.Lh/Sc
-                    RStar = SegmentHillslopeData.S/Sc
-
-                    EStarMedian = EStar.median()
-                    EStarLower = EStar.quantile(0.25)
-                    EStarUpper = EStar.quantile(0.75)
-
-                    RStarMedian = RStar.median()
-                    RStarLower = RStar.quantile(0.25)
-                    RStarUpper = RStar.quantile(0.75)
-
-                    # add to plot dataframe
-                    PlotDF.loc[i]  = [Chi,Ksn,EStarMedian,EStarLower, EStarUpper, RStarMedian, RStarLower, RStarUpper,NTraces]
-
-            else:
-                # get metrics to plot
-                Ksn = BasinChannelData.m_chi[BasinChannelData.segment_number == Segment].unique()[0]
-                Chi = BasinChannelData.chi[BasinChannelData.segment_number == Segment].median()
-
-                #normalise chi by outlet chi
-                Chi = Chi-MinimumChi
-
-                # get hillslope data
-                SegmentHillslopeData = HillslopesDF[HillslopesDF.StreamID == Segment]
-                NTraces = len(SegmentHillslopeData)
-
-                if NTraces<minimum_traces:
-                    continue
-
-                # Calculate E* R*
-                EStar = -2*SegmentHillslopeData.Cht*SegmentHillslopeData.Lh/Sc
-                RStar = SegmentHillslopeData.S/Sc
-
-                EStarMedian = EStar.median()
-                EStarLower = EStar.quantile(0.25)
-                EStarUpper = EStar.quantile(0.75)
-
-                RStarMedian = RStar.median()
-                RStarLower = RStar.quantile(0.25)
-                RStarUpper = RStar.quantile(0.75)
-
-                # add to plot dataframe
-                PlotDF.loc[i]  = [Chi,Ksn,EStarMedian,EStarLower, EStarUpper, RStarMedian, RStarLower, RStarUpper,NTraces]
-
-        # reset indices
-        PlotDF = PlotDF.reset_index(drop=True)
+        # get the data for plotting
+        PlotDF = GetEStarRStarPlotData(EsRsTable, [key], mainstem_only, minimum_traces)
 
         # Zip errors for plotting
         Es_max_err = PlotDF.EStarUpper.values-PlotDF.EStarMedian
@@ -2609,11 +2440,8 @@ def PlotStackedEsRsFxnChi(DataDirectory, FilenamePrefix,PlotDirectory, Basins =
 
     """
 
-    #Load hillslope metrics data
-    HillslopesDF = ReadHillslopeData(DataDirectory, FilenamePrefix)
-
-    # Read in the raw channel data
-    ChannelsDF = ReadChannelData(DataDirectory, FilenamePrefix)
+    # Get the E* R* data of all the segments
+    EsRsTable = GetEStarRStarTable(DataDirectory, FilenamePrefix, Sc)
 
     # Basins list and keys
     BasinsDict = np.loadtxt(DataDirectory+FilenamePrefix+'_junctions.list',dtype=int)
@@ -2628,66 +2456,8 @@ def PlotStackedEsRsFxnChi(DataDirectory, FilenamePrefix,PlotDirectory, Basins =
         Basin = BasinsDict[key]
         print(key, Basin)
 
-        # isolate basin data
-        BasinChannelData = ChannelsDF[ChannelsDF.basin_key == key]
-        MinimumChi = BasinChannelData.chi.min()
-
-        # how many segments are we dealing with?
-        Segments = BasinChannelData.segment_number.unique()
-
-
-
-        # create new dataframe for plotting
-        PlotDF = pd.DataFrame(columns=['Chi','Ksn','EStarMedian','EStarLower',
-                    'EStarUpper','RStarMedian','RStarLower','RStarUpper','NTraces'])
-
-
-        # try to figure out the source key
-        mainstem_source_key = BasinChannelData.source_key.iloc[0]
-        print("The mainstem source key is: " +str(mainstem_source_key))
-
-        # separate into main stem and trib data
-        MainStemChannelData = BasinChannelData[BasinChannelData.source_key == mainstem_source_key]
-        MainStemSegments = MainStemChannelData.segment_number.unique()
-
-        # Get the data columns for plotting
-        for i, Segment in np.ndenumerate(Segments):
-
-            if mainstem_only:
-                print("I am not gonna do a thing.")
-            else:
-
-
-                # get hillslope data
-                SegmentHillslopeData = HillslopesDF[HillslopesDF.StreamID == Segment]
-                NTraces = len(SegmentHillslopeData)
-
-                if NTraces>0:
-
-                    # get metrics to plot
-                    Ksn = BasinChannelData.m_chi[BasinChannelData.segment_number == Segment].unique()[0]
-                    Chi = BasinChannelData.chi[BasinChannelData.segment_number == Segment].median()
-
-                    #normalise chi by outlet chi
-                    Chi = Chi-MinimumChi
-
-                    # Calculate E* R*
-                    EStar = -2*SegmentHillslopeData.Cht*SegmentHillslopeData.Lh/Sc
-                    RStar = SegmentHillslopeData.S/Sc
-
-                    EStarMedian = EStar.median()
-                    EStarLower = EStar.quantile(0.25)
-                    EStarUpper = EStar.quantile(0.75)
-
-                    RStarMedian = RStar.median()
-                    RStarLower = RStar.quantile(0.25)
-                    RStarUpper = RStar.quantile(0.75)
-
-                    # add to plot dataframe
-                    PlotDF.loc[i]  = [Chi,Ksn,EStarMedian,EStarLower, EStarUpper, RStarMedian, RStarLower, RStarUpper,NTraces]
-
-            # reset indices
-            PlotDF = PlotDF.reset_index(drop=True)
+        # get the segments with hillslope data
+        PlotDF = GetEStarRStarPlotData(EsRsTable, [key], mainstem_only, 1)
 
         # Zip errors for plotting
         Es_max_err = PlotDF.EStarUpper.values-PlotDF.EStarMedian
@@ -2832,12 +2602,8 @@ def GetClusteredDataPlotDict(DataDirectory, FilenamePrefix, Sc = 0.71, mainstem_
         BasinsCluster = combined_list
 
 
-    #Load hillslope metrics data
-    HillslopesDF = ReadHillslopeData(DataDirectory, FilenamePrefix)
-
-    # Read in the raw channel data
-    ChannelsDF = ReadChannelData(DataDirectory, FilenamePrefix)
-
+    # Get the E* R* data of all the segments
+    EsRsTable = GetEStarRStarTable(DataDirectory, FilenamePrefix, Sc)
 
     # Create a dictionary for storing the plotting data
     PlotDataDict = {}
@@ -2846,97 +2612,8 @@ def GetClusteredDataPlotDict(DataDirectory, FilenamePrefix, Sc = 0.71, mainstem_
         print("This cluster has the following basins:")
         print(Basins)
 
-        # create new dataframe for plotting
-        PlotDF = pd.DataFrame(columns=['Chi','Ksn','EStarMedian','EStarLower',
-                        'EStarUpper','RStarMedian','RStarLower','RStarUpper','NTraces'])
-
-        # loop through basins
-        #for key, Basin in np.ndenumerate(Basins):
-        for key in Basins:
-            # print basin to screen
-            Basin = BasinsDict[key]
-            #print(key, Basin)
-
-            # isolate basin data
-            BasinChannelData = ChannelsDF[ChannelsDF.basin_key == key]
-            MinimumChi = BasinChannelData.chi.min()
-
-            # how many segments are we dealing with?
-            Segments = BasinChannelData.segment_number.unique()
-
-            # try to figure out the source key
-            mainstem_source_key = BasinChannelData.source_key.iloc[0]
-            #print("The mainstem source key is: " +str(mainstem_source_key))
-
-            # separate into main stem and trib data
-            MainStemChannelData = BasinChannelData[BasinChannelData.source_key == mainstem_source_key]
-            MainStemSegments = MainStemChannelData.segment_number.unique()
-
-            # Get the data columns for plotting
-            for i, Segment in np.ndenumerate(Segments):
-
-                if mainstem_only:
-                    if Segment in MainStemSegments:
-                        # get hillslope data
-                        SegmentHillslopeData = HillslopesDF[HillslopesDF.StreamID == Segment]
-                        NTraces = len(SegmentHillslopeData)
-
-                        if NTraces>20:
-
-                            # get metrics to plot
-                            Ksn = BasinChannelData.m_chi[BasinChannelData.segment_number == Segment].unique()[0]
-                            Chi = BasinChannelData.chi[BasinChannelData.segment_number == Segment].median()
-                            BasinKey = BasinChannelData.basin_key[BasinChannelData.segment_number == Segment].median()
-
-                            #normalise chi by outlet chi
-                            Chi = Chi-MinimumChi
-
-                            # Calculate E* R*
-                            EStar = -2*SegmentHillslopeData.Cht*SegmentHillslopeData.Lh/Sc
-                            RStar = SegmentHillslopeData.S/Sc
-
-                            EStarMedian = EStar.median()
-                            EStarLower = EStar.quantile(0.25)
-                            EStarUpper = EStar.quantile(0.75)
-
-                            RStarMedian = RStar.median()
-                            RStarLower = RStar.quantile(0.25)
-                            RStarUpper = RStar.quantile(0.75)
-
-                            # add to plot dataframe
-                            PlotDF.loc[i]  = [Chi,Ksn,EStarMedian,EStarLower, EStarUpper, RStarMedian, RStarLower, RStarUpper,NTraces]
-                else:
-
-                    # get hillslope data
-                    SegmentHillslopeData = HillslopesDF[HillslopesDF.StreamID == Segment]
-                    NTraces = len(SegmentHillslopeData)
-
-                    if NTraces>20:
-
-                        # get metrics to plot
-                        Ksn = BasinChannelData.m_chi[BasinChannelData.segment_number == Segment].unique()[0]
-                        Chi = BasinChannelData.chi[BasinChannelData.segment_number == Segment].median()
-
-                        #normalise chi by outlet chi
-                        Chi = Chi-MinimumChi
-
-                        # Calculate E* R*
-                        EStar = -2*SegmentHillslopeData.Cht*SegmentHillslopeData.Lh/Sc
-                        RStar = SegmentHillslopeData.S/Sc
-
-                        EStarMedian = EStar.median()
-                        EStarLower = EStar.quantile(0.25)
-                        EStarUpper = EStar.quantile(0.75)
-
-                        RStarMedian = RStar.median()
-                        RStarLower = RStar.quantile(0.25)
-                        RStarUpper = RStar.quantile(0.75)
-
-                        # add to plot dataframe
-                        PlotDF.loc[i]  = [Chi,Ksn,EStarMedian,EStarLower, EStarUpper, RStarMedian, RStarLower, RStarUpper,NTraces]
-
-        # reset indices
-        PlotDF = PlotDF.reset_index(drop=True)
+        # get the segments of these basins with more than 20 traces
+        PlotDF = GetEStarRStarPlotData(EsRsTable, list(Basins), mainstem_only, 21)
 
         print("The cluster index is: "+str(cluster_index))
         PlotDataDict[cluster_index] = PlotDF
@@ -64,19 +64,20 @@ class KP_plotting(object):
         # Loading the attributes
         self.fpath = fpath # the path of your file : /home/your/path/
         self.fprefix = fprefix # the common prefix of all your files
+        self._group_index = {} # the rows of each basin/source in each table, built when first needed
 
         # Loading the files
 
         print("Loading the knickpoint-related files")
         
         try:
-            self.df_river = Helper.ReadMChiSegCSV(self.fpath, self.fprefix, type = "knickpoint") # Contains the river info
             self.df_rivraw = Helper.ReadMChiSegCSV(self.fpath, self.fprefix, type = "knickpoint") # Contains the river info (will not be thinned by your selection choices)
+            self.df_river = self.df_rivraw # Contains the river info. This is the same table until the selection below is applied to it
             self.df_kp_raw = Helper.ReadKnickpointCSV(self.fpath, self.fprefix, ftype = "raw") # Contains the raw knickpint info (before TVD or else) -> Debugging purposes
             self.df_kp = Helper.ReadKnickpointCSV(self.fpath, self.fprefix) # Contains the knickpoint location and informations
             self.df_SK = Helper.readSKKPstats(self.fpath, self.fprefix) # Contains few metrics per river keys
-            self.df_kp_ksn = self.df_kp[self.df_kp["delta_ksn"] != 0]
-            self.df_kp_stepped = self.df_kp[self.df_kp["delta_segelev"] > 0]
+            self.df_kp_ksn = self.df_kp[self.df_kp["delta_ksn"] != 0].copy()
+            self.df_kp_stepped = self.df_kp[self.df_kp["delta_segelev"] > 0].copy()
 
         except IOError:
             print("I didnae find your knickpoint related files make sure that:")
@@ -99,24 +100,23 @@ class KP_plotting(object):
             print("I am selecting your knickpoints")
             # This selection process is a bit messy, but really efficient with pandas!
             print(cut_off_val)
-            self.df_kp = self.df_kp[((self.df_kp["delta_ksn"] <= cut_off_val[0]) | (self.df_kp["delta_ksn"] >= cut_off_val[1])) | ((self.df_kp["delta_segelev"] <= cut_off_val[2]) | (self.df_kp["delta_segelev"] >= cut_off_val[3]))]
-            self.df_kp_ksn = self.df_kp[((self.df_kp["delta_ksn"] <= cut_off_val[0]) | (self.df_kp["delta_ksn"] >= cut_off_val[1]))]
-            self.df_kp_stepped = self.df_kp[((self.df_kp["delta_segelev"] <= cut_off_val[2]) | (self.df_kp["delta_segelev"] >= cut_off_val[3]))]
+            self.df_kp = self.df_kp[((self.df_kp["delta_ksn"] <= cut_off_val[0]) | (self.df_kp["delta_ksn"] >= cut_off_val[1])) | ((self.df_kp["delta_segelev"] <= cut_off_val[2]) | (self.df_kp["delta_segelev"] >= cut_off_val[3]))].copy()
+            self.df_kp_ksn = self.df_kp[((self.df_kp["delta_ksn"] <= cut_off_val[0]) | (self.df_kp["delta_ksn"] >= cut_off_val[1]))].copy()
+            self.df_kp_stepped = self.df_kp[((self.df_kp["delta_segelev"] <= cut_off_val[2]) | (self.df_kp["delta_segelev"] >= cut_off_val[3]))].copy()
         
 
         # Selection of Basins and sources
+        # Each criterion narrows down the selected basin and source keys, and all the tables are thinned once at the end
+        selected_basins = None
+        selected_sources = None
         if(basin_key == []):
             print("All the basins are selected:")
             print(self.df_SK["basin_key"].unique().tolist())
         else:
             print("You selected the following basins:")
             print(basin_key)
-            self.df_river = self.df_river[self.df_river["basin_key"].isin(basin_key)]
-            self.df_kp_raw = self.df_kp_raw[self.df_kp_raw["basin_key"].isin(basin_key)]
-            self.df_kp = self.df_kp[self.df_kp["basin_key"].isin(basin_key)]
+            selected_basins = set(basin_key)
             self.df_SK = self.df_SK[self.df_SK["basin_key"].isin(basin_key)]
-            self.df_kp_ksn = self.df_kp_ksn[self.df_kp_ksn["basin_key"].isin(basin_key)]
-            self.df_kp_stepped = self.df_kp_stepped[self.df_kp_stepped["basin_key"].isin(basin_key)]
 
 
         if(source_key == [] and min_length == 0):
@@ -126,42 +126,36 @@ class KP_plotting(object):
             print("Let me remove the river smaller than " +str(min_length))
             self.df_SK = self.df_SK[self.df_SK["length"]>min_length]
             source_key = self.df_SK["source_key"].unique()
-            self.df_river = self.df_river[self.df_river["source_key"].isin(source_key)]
-            self.df_kp_raw = self.df_kp_raw[self.df_kp_raw["source_key"].isin(source_key)]
-            self.df_kp = self.df_kp[self.df_kp["source_key"].isin(source_key)]
-            self.df_SK = self.df_SK[self.df_SK["source_key"].isin(source_key)]
-            self.df_kp_ksn = self.df_kp_ksn[self.df_kp_ksn["source_key"].isin(source_key)]
-            self.df_kp_stepped = self.df_kp_stepped[self.df_kp_stepped["source_key"].isin(source_key)]
+            selected_sources = self._narrow_keys(selected_sources, source_key)
             print("You selected the following Sources: ")
             print(source_key)
 
         else:
             print("You selected the following Sources: ")
             print(source_key)
-            self.df_river = self.df_river[self.df_river["source_key"].isin(source_key)]
-            self.df_kp_raw = self.df_kp_raw[self.df_kp_raw["source_key"].isin(source_key)]
-            self.df_kp = self.df_kp[self.df_kp["source_key"].isin(source_key)]
+            selected_sources = self._narrow_keys(selected_sources, source_key)
             self.df_SK = self.df_SK[self.df_SK["source_key"].isin(source_key)]
-            self.df_kp_ksn = self.df_kp_ksn[self.df_kp_ksn["source_key"].isin(source_key)]
-            self.df_kp_stepped = self.df_kp_stepped[self.df_kp_stepped["source_key"].isin(source_key)]
 
         if(main_stem):
             print("Wait, you just want the main stem, let me deal with that")
-            source_key = []
-            for bas in self.df_SK["basin_key"].unique():
-                TSK = self.df_SK[self.df_SK["basin_key"] == bas]
-                ts = TSK["source_key"][TSK["length"] == TSK["length"].max()].values[0]
-                source_key.append(ts)
-
-            self.df_river = self.df_river[self.df_river["source_key"].isin(source_key)]
-            self.df_kp_raw = self.df_kp_raw[self.df_kp_raw["source_key"].isin(source_key)]
-            self.df_kp = self.df_kp[self.df_kp["source_key"].isin(source_key)]
+            # the longest source of each basin (the first one if there is a tie)
+            longest = self.df_SK.groupby("basin_key", sort = False)["length"].idxmax()
+            source_key = self.df_SK["source_key"].loc[longest.values].tolist()
+
+            selected_sources = self._narrow_keys(selected_sources, source_key)
             self.df_SK = self.df_SK[self.df_SK["source_key"].isin(source_key)]
-            self.df_kp_ksn = self.df_kp_ksn[self.df_kp_ksn["source_key"].isin(source_key)]
-            self.df_kp_stepped = self.df_kp_stepped[self.df_kp_stepped["source_key"].isin(source_key)]
             print("final source_keys are: ")
             print(source_key)
 
+        # Now thinning the tables. The selected river is taken from the raw one, which is left as it is
+        self.df_river = self._select_keys(self.df_rivraw, selected_basins, selected_sources)
+        if(self.df_river is self.df_rivraw):
+            self.df_river = self.df_rivraw.copy()
+        self.df_kp_raw = self._select_keys(self.df_kp_raw, selected_basins, selected_sources)
+        self.df_kp = self._select_keys(self.df_kp, selected_basins, selected_sources)
+        self.df_kp_ksn = self._select_keys(self.df_kp_ksn, selected_basins, selected_sources)
+        self.df_kp_stepped = self._select_keys(self.df_kp_stepped, selected_basins, selected_sources)
+
 
         #### Now dealing with the size of knickpoints on map/profile.
         # By default I am setting the minimum size to the 1st quartile and the maximum to the 3rd quartile
@@ -181,8 +175,7 @@ class KP_plotting(object):
         self.df_kp_ksn["size_kp"] = pd.Series(data = self.df_kp_ksn["delta_ksn"].abs(), index = self.df_kp_ksn.index)
 
         ## Recasting the knickpoints into a range (everything below a threshold will have the same minimum value and above another thrshold another maximum value)
-        self.df_kp_ksn["size_kp"][self.df_kp_ksn["delta_ksn"].abs() <= size_kp[0]] = size_kp[0]
-        self.df_kp_ksn["size_kp"][self.df_kp_ksn["delta_ksn"].abs() >= size_kp[2]] = size_kp[2]
+        self.df_kp_ksn["size_kp"] = self.df_kp_ksn["size_kp"].clip(lower = size_kp[0], upper = size_kp[2])
 
         ## Applying a coeff
         # self.df_kp_ksn["size_kp"] += 0.01
@@ -197,8 +190,7 @@ class KP_plotting(object):
 
         # Same the general dataset
         self.df_kp["size_kp"] = pd.Series(data = self.df_kp["delta_ksn"].abs(), index = self.df_kp.index)
-        self.df_kp["size_kp"][self.df_kp["delta_ksn"].abs() <= size_kp[0]] = size_kp[0]
-        self.df_kp["size_kp"][self.df_kp["delta_ksn"].abs() >= size_kp[2]] = size_kp[2]
+        self.df_kp["size_kp"] = self.df_kp["size_kp"].clip(lower = size_kp[0], upper = size_kp[2])
         # self.df_kp["size_kp"] += 0.01
         self.df_kp["size_kp"] = self.df_kp["size_kp"]/self.df_kp["size_kp"].max()
         self.df_kp["size_kp"] = self.df_kp["size_kp"] - self.df_kp["size_kp"].min() +minsize
@@ -210,7 +202,7 @@ class KP_plotting(object):
 
         ## Recasting the knickpoints into a range (everything below a threshold will have the same minimum value and above another thrshold another maximum value)
         # self.df_kp_stepped["size_kp_step"][self.df_kp_stepped["delta_segelev"].abs() <= size_kp[1]] = size_kp[1]
-        self.df_kp_stepped["size_kp_step"][self.df_kp_stepped["delta_segelev"].abs() >= size_kp[3]] = size_kp[3]
+        self.df_kp_stepped["size_kp_step"] = self.df_kp_stepped["size_kp_step"].clip(upper = size_kp[3])
         ## Applying a coeff
         # self.df_kp_stepped["size_kp_step"] += 0.01
         self.df_kp_stepped["size_kp_step"] = self.df_kp_stepped["size_kp_step"]/self.df_kp_stepped["size_kp_step"].max()
@@ -220,7 +212,7 @@ class KP_plotting(object):
         # Same the general dataset
         self.df_kp["size_kp_step"] = pd.Series(data = self.df_kp["delta_segelev"].abs(), index = self.df_kp.index)
         # self.df_kp["size_kp_step"][self.df_kp["delta_segelev"].abs() <= size_kp[1]] = size_kp[1]
-        self.df_kp["size_kp_step"][self.df_kp["delta_segelev"].abs() >= size_kp[3]] = size_kp[3]
+        self.df_kp["size_kp_step"] = self.df_kp["size_kp_step"].clip(upper = size_kp[3])
         # self.df_kp["size_kp_step"] += 0.01
         self.df_kp["size_kp_step"] =self.df_kp["size_kp_step"]/self.df_kp["size_kp_step"].max()
         self.df_kp["size_kp_step"] = self.df_kp["size_kp_step"] - self.df_kp["size_kp_step"].min() + minsize
@@ -229,7 +221,7 @@ class KP_plotting(object):
 
 
         # Just getting rid of few NoData
-        self.df_river["m_chi"][self.df_river["m_chi"] == -9999] = 0
+        self.df_river.loc[self.df_river["m_chi"] == -9999, "m_chi"] = 0
         print("Min dksn: %s - max dksn: %s - min dseg: %s - max dseg: %s" %(self.df_kp["delta_ksn"].min(),self.df_kp["delta_ksn"].max(),self.df_kp["delta_segelev"].min(), self.df_kp["delta_segelev"].max()))
         print("After all the thinning process, it remains %s dksn knickpoints, and %s dsegelev knickpoints" %(self.df_kp_ksn.shape[0],self.df_kp_stepped.shape[0]))
         print("Done now")
@@ -326,25 +318,73 @@ class KP_plotting(object):
         """
             Normalise the elevation to the outlet of the basin in a relative way (outlet = 0 and elevation = old elevation - outlet elevation) or
             absolute way: outlet = 0 and maximum elevation = 1 
+            The minimum (and maximum) of each basin are taken from the river table in one groupby and mapped onto every table.
         """
+        # the tables to normalise. The river and raw river can be the same table, it must only be normalised once
+        tables = []
+        for name in ["df_river", "df_rivraw", "df_kp_raw", "df_kp", "df_kp_ksn", "df_kp_stepped"]:
+            if(not any(getattr(self, name) is getattr(self, other) for other in tables)):
+                tables.append(name)
+
+        basins = self.df_SK["basin_key"].unique()
+        norm_elev = self.df_river.groupby("basin_key")["elevation"].min()
+        norm_elev = norm_elev[norm_elev.index.isin(basins)]
+        for name in tables:
+            df = getattr(self, name)
+            df["elevation"] = df["elevation"] - df["basin_key"].map(norm_elev).fillna(0).values
+
+        if(method == "absolute"):
+            norm_elev = self.df_river.groupby("basin_key")["elevation"].max()
+            norm_elev = norm_elev[norm_elev.index.isin(basins)]
+            for name in tables:
+                df = getattr(self, name)
+                df["elevation"] = df["elevation"] / df["basin_key"].map(norm_elev).fillna(1).values
+
+    @staticmethod
+    def _narrow_keys(selected, keys):
+        """
+            Returns the keys that are both in the current selection and in keys. A selection of None means that everything is selected.
+        """
+        keys = set(pd.Series(keys).tolist())
+        if(selected is None):
+            return keys
+        return selected & keys
 
-        for bas in self.df_SK["basin_key"].unique():
-            norm_elev = self.df_river["elevation"][self.df_river["basin_key"] == bas].min()
-            self.df_river["elevation"][self.df_river["basin_key"] == bas] -= norm_elev
-            self.df_rivraw["elevation"][self.df_rivraw["basin_key"] == bas] -= norm_elev 
-            self.df_kp_raw["elevation"][self.df_kp_raw["basin_key"] == bas] -= norm_elev 
-            self.df_kp["elevation"][self.df_kp["basin_key"] == bas] -= norm_elev 
-            self.df_kp_ksn["elevation"][self.df_kp_ksn["basin_key"] == bas] -= norm_elev 
-            self.df_kp_stepped["elevation"][self.df_kp_stepped["basin_key"] == bas] -= norm_elev 
-            if(method == "absolute"):
-                norm_elev = self.df_river["elevation"][self.df_river["basin_key"] == bas].max()
-                self.df_river["elevation"][self.df_river["basin_key"] == bas] /= norm_elev
-                self.df_rivraw["elevation"][self.df_rivraw["basin_key"] == bas] /= norm_elev 
-                self.df_kp_raw["elevation"][self.df_kp_raw["basin_key"] == bas] /= norm_elev 
-                self.df_kp["elevation"][self.df_kp["basin_key"] == bas] /= norm_elev 
-                self.df_kp_ksn["elevation"][self.df_kp_ksn["basin_key"] == bas] /= norm_elev 
-                self.df_kp_stepped["elevation"][self.df_kp_stepped["basin_key"] == bas] /= norm_elev 
-
+    @staticmethod
+    def _select_keys(df, basins, sources):
+        """
+            Returns the rows of a table that are in the selected basins and sources, with a single mask. None selects everything.
+        """
+        if(basins is None and sources is None):
+            return df
+        mask = np.ones(df.shape[0], dtype = bool)
+        if(basins is not None):
+            mask &= df["basin_key"].isin(list(basins)).values
+        if(sources is not None):
+            mask &= df["source_key"].isin(list(sources)).values
+        # a copy, so the size columns can be added to it later
+        return df.loc[mask].copy()
+
+    def get_group(self, table, binning, key):
+        """
+            Returns the rows of one of the tables (e.g. "df_kp") for a single basin or source.
+            The rows of every group are indexed the first time a table is asked for, so looping
+            over all the sources does not scan the whole table each time. If the table has been
+            replaced since, the index is made again (and the old table is let go).
+            param:
+                table (str): the name of one of the tables of this object, e.g. "df_kp"
+                binning (str): "source_key" or "basin_key"
+                key: the basin or source key
+            author: B.G - 2017/2018
+        """
+        df = getattr(self, table)
+        index_key = (table, binning)
+        if(index_key not in self._group_index or self._group_index[index_key][0] is not df):
+            self._group_index[index_key] = (df, df.groupby(binning, sort = False).indices)
+        rows = self._group_index[index_key][1].get(key)
+        if(rows is None):
+            return df.iloc[0:0]
+        return df.iloc[rows]
 
 
 
@@ -442,11 +482,11 @@ class KP_plotting(object):
         for sources in self.df_SK["source_key"].unique():
 
             # Select the data
-            this_df_SK = self.df_SK[self.df_SK["source_key"] == sources]
-            this_df_kp = self.df_kp[self.df_kp["source_key"] == sources]
+            this_df_SK = self.get_group("df_SK", "source_key", sources)
+            this_df_kp = self.get_group("df_kp", "source_key", sources)
             this_df_kp = this_df_kp[this_df_kp["out"] == 1]
-            this_df_kp_raw = self.df_kp_raw[self.df_kp_raw["source_key"] == sources]
-            this_df_river = self.df_river[self.df_river["source_key"] == sources]
+            this_df_kp_raw = self.get_group("df_kp_raw", "source_key", sources)
+            this_df_river = self.get_group("df_river", "source_key", sources)
 
             
             # Create a figure with required dimensions
@@ -540,15 +580,15 @@ class KP_plotting(object):
         for sources in self.df_SK[binning].unique():
 
             # Select the data
-            this_df_SK = self.df_SK[self.df_SK[binning] == sources]
-            this_df_kp_ksn = self.df_kp_ksn[self.df_kp_ksn[binning] == sources]
-            this_df_kp_stepped = self.df_kp_stepped[self.df_kp_stepped[binning] == sources]
+            this_df_SK = self.get_group("df_SK", binning, sources)
+            this_df_kp_ksn = self.get_group("df_kp_ksn", binning, sources)
+            this_df_kp_stepped = self.get_group("df_kp_stepped", binning, sources)
             this_df_dksn_pos = this_df_kp_ksn[this_df_kp_ksn["sign"] == 1]
             this_df_dksn_neg = this_df_kp_ksn[this_df_kp_ksn["sign"] == -1]
             this_df_dsegelev_pos = this_df_kp_stepped[this_df_kp_stepped["delta_segelev"]> 0]
 
-            this_df_kp_raw = self.df_kp_raw[self.df_kp_raw[binning] == sources]
-            this_df_river = self.df_river[self.df_river[binning] == sources]
+            this_df_kp_raw = self.get_group("df_kp_raw", binning, sources)
+            this_df_river = self.get_group("df_river", binning, sources)
 
             # Dealing with the knickpoint offset
 
@@ -662,15 +702,15 @@ class KP_plotting(object):
         for sources in self.df_SK[binning].unique():
 
             # Select the data
-            this_df_SK = self.df_SK[self.df_SK[binning] == sources]
-            this_df_kp_ksn = self.df_kp_ksn[self.df_kp_ksn[binning] == sources]
-            this_df_kp_stepped = self.df_kp_stepped[self.df_kp_stepped[binning] == sources]
+            this_df_SK = self.get_group("df_SK", binning, sources)
+            this_df_kp_ksn = self.get_group("df_kp_ksn", binning, sources)
+            this_df_kp_stepped = self.get_group("df_kp_stepped", binning, sources)
             this_df_dksn_pos = this_df_kp_ksn[this_df_kp_ksn["sign"] == 1]
             this_df_dksn_neg = this_df_kp_ksn[this_df_kp_ksn["sign"] == -1]
             this_df_dsegelev_pos = this_df_kp_stepped[this_df_kp_stepped["delta_segelev"]> 0]
 
-            this_df_kp_raw = self.df_kp_raw[self.df_kp_raw[binning] == sources]
-            this_df_river = self.df_river[self.df_river[binning] == sources]
+            this_df_kp_raw = self.get_group("df_kp_raw", binning, sources)
+            this_df_river = self.get_group("df_river", binning, sources)
 
             if(this_df_kp_ksn.shape[0]> 0 or this_df_dsegelev_pos.shape[0] > 0):
                 # Create a figure with required dimensions
@@ -1099,9 +1139,10 @@ class KP_plotting(object):
         n_data = []
 
         for bing in self.df_kp[binning].unique():
-            if(self.df_kp["delta_ksn"][self.df_kp[binning] == bing].shape[0]>0):
-                data_to_plot.append(self.df_kp["delta_ksn"][self.df_kp[binning] == bing].values)
-                data_name.append(str(bing) + "\nn = "+str(self.df_kp["delta_ksn"][self.df_kp[binning] == bing].shape[0]))
+            this_dksn = self.get_group("df_kp", binning, bing)["delta_ksn"]
+            if(this_dksn.shape[0]>0):
+                data_to_plot.append(this_dksn.values)
+                data_name.append(str(bing) + "\nn = "+str(this_dksn.shape[0]))
                 #n_data.append(self.df_kp["delta_ksn"][self.df_kp[binning] == bing].shape[0])
 
 
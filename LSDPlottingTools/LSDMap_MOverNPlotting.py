@@ -25,6 +25,7 @@ from matplotlib import colors
 import math
 import os
 import subprocess
+import time
 from matplotlib import cm
 #from shapely.geometry import Polygon
 from LSDMapFigure import PlottingHelpers as Helper
@@ -67,6 +68,130 @@ def makefigure(size_format = "EPSL", aspect_ratio=16./9.):
 
     return fig
 
+#=============================================================================
+# FIGURE SCHEDULER
+# The per basin (and per m/n) figures are rendered on a pool of processes.
+# Each process loads the data it needs once and then renders its share of
+# the figures.
+#=============================================================================
+# The data loaded by the initializer of each worker
+_figure_worker_data = None
+
+# The default number of figure processes. Every process holds its own copy of
+# the data, so more than a few of them use a lot of memory for little gain.
+DEFAULT_FIGURE_WORKERS = 4
+
+def _InitFigureWorker(load_function, load_args):
+    """
+    Initializes a figure worker: makes sure the backend is headless and loads
+    the shared data once.
+
+    Args:
+        load_function (function): returns the data shared by all the figures, or None
+        load_args (tuple): the arguments for load_function
+
+    Author: SMM
+    """
+    global _figure_worker_data
+    matplotlib.use('Agg')
+    if load_function is None:
+        _figure_worker_data = None
+    else:
+        _figure_worker_data = load_function(*load_args)
+
+def _RenderFigureTask(render_function, task):
+    """
+    Renders one figure with the data of this worker and times it.
+
+    Args:
+        render_function (function): called as render_function(shared_data, task), returns the figure filename
+        task (tuple): the figure to make
+
+    Returns:
+        The figure filename and the number of seconds it took
+
+    Author: SMM
+    """
+    start_time = time.time()
+    fname = render_function(_figure_worker_data, task)
+    return fname, time.time()-start_time
+
+def RunFigureTasks(render_function, tasks, load_function=None, load_args=(), n_workers=None, progress_hook=None):
+    """
+    This renders a list of figures on a pool of processes using the Agg backend.
+    Each process calls load_function once to get the data shared by the figures
+    (so the csv files are read once per process rather than once per figure)
+    and then renders the figures it is given.
+
+    Args:
+        render_function (function): a module level function called as render_function(shared_data, task)
+        that makes and saves one figure and returns its filename
+        tasks (list): the figures to make, one element for each figure
+        load_function (function): a module level function that returns the shared data. If None the shared data is None.
+        load_args (tuple): the arguments for load_function
+        n_workers (int): the number of processes. Each process loads its own copy of the shared data,
+        so the peak memory is about n_workers times that of one process. Defaults to
+        DEFAULT_FIGURE_WORKERS (4) or the number of CPUs if that is smaller. If 1 the figures are made in this process.
+        progress_hook (function): if not None, called as progress_hook(n_done, n_figures, fname, seconds)
+        after each figure, where seconds is the time taken by that figure. Otherwise the timings are printed.
+
+    Returns:
+        A list with the (filename, seconds) of each figure, in the order of the tasks
+
+    Author: SMM
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    timings = [None]*len(tasks)
+    if len(tasks) == 0:
+        return timings
+
+    if n_workers is None:
+        n_workers = min(DEFAULT_FIGURE_WORKERS, os.cpu_count() or 1)
+    n_workers = max(1, min(n_workers, len(tasks)))
+
+    def report(n_done, i):
+        fname, seconds = timings[i]
+        if progress_hook is not None:
+            progress_hook(n_done, len(tasks), fname, seconds)
+        else:
+            print("Figure "+str(n_done)+" of "+str(len(tasks))+": "+str(fname)+" took "+'%.2f'%seconds+" s")
+
+    start_time = time.time()
+    if n_workers == 1:
+        _InitFigureWorker(load_function, load_args)
+        try:
+            for i, task in enumerate(tasks):
+                timings[i] = _RenderFigureTask(render_function, task)
+                report(i+1, i)
+        finally:
+            _InitFigureWorker(None, ())
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_InitFigureWorker,
+                                 initargs=(load_function, load_args)) as pool:
+            futures = {pool.submit(_RenderFigureTask, render_function, task): i for i, task in enumerate(tasks)}
+            for n_done, future in enumerate(as_completed(futures)):
+                i = futures[future]
+                timings[i] = future.result()
+                report(n_done+1, i)
+
+    print("Made "+str(len(tasks))+" figures in "+'%.2f'%(time.time()-start_time)+" s using "+str(n_workers)+" processes")
+    return timings
+
+def _GroupByBasin(DF):
+    """
+    Splits a dataframe into a dict of dataframes, one for each basin.
+
+    Args:
+        DF: pandas dataframe with a basin_key column
+
+    Returns:
+        dict where the key is the basin key and the value is the dataframe of that basin
+
+    Author: SMM
+    """
+    return {int(basin_key): BasinDF for basin_key, BasinDF in DF.groupby('basin_key', sort=False)}
+
 #=============================================================================
 #=============================================================================
 # ANALYSIS FUNCTIONS
@@ -548,6 +673,121 @@ def CompareMOverNEstimatesAllMethods(DataDirectory, fname_prefix, basin_list=[0]
     OutDF.to_csv(outname,index=False)
 
 
+def _MOverNString(m_over_n):
+    """
+    Converts an m/n value into the string used in the fullstats filenames
+    (e.g. 0.2 becomes '0.2' and 0.25 becomes '0.25').
+
+    Args:
+        m_over_n (float): m/n value.
+
+    Returns:
+        The m/n string
+
+    Author: SMM
+    """
+    movern_str = '%.2f'%m_over_n
+    if movern_str.endswith('0'):
+        movern_str = movern_str[:-1]
+    return movern_str
+
+def ReadFullStatsMLEArrays(DataDirectory, fname_prefix, movern_strs, basin_list=None, parallel=False):
+    """
+    This reads the fullstats files a single time and packs them into dense
+    arrays. For each basin you get an array of MLE values and an array of
+    RMSE values, where the rows are the m/n values and the columns are the
+    tributaries (in the order they appear in the fullstats files).
+    The outlier removal then works on these arrays in memory rather than
+    rereading the csv files for every m/n value and removal step.
+
+    Args:
+        DataDirectory (str): the data directory with the m/n csv files
+        fname_prefix (str): The prefix for the m/n csv files
+        movern_strs (list): the m/n strings, as used in the fullstats filenames
+        basin_list (list): the basins you want. None for all of them.
+        parallel (bool): If true the fullstats csvs of a parallel run are appended
+
+    Returns:
+        MLE_arrays (dict): The key is the basin number and the value is a dict with
+        the keys "MLE" and "RMSE" (arrays of shape n_movern x n_tributaries) and
+        "test_source_key" (the source key of each tributary)
+
+    Author: SMM
+    """
+    columns = ['basin_key','test_source_key','MLE','RMSE']
+    n_movern = len(movern_strs)
+    if basin_list is not None:
+        basin_list = set(int(basin) for basin in basin_list)
+    MLE_arrays = {}
+
+    for i,m_over_n in enumerate(movern_strs):
+        print("This_m_over_n is: "+str(m_over_n))
+
+        #load the file
+        if not parallel:
+            FullStatsDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,m_over_n,columns=columns)
+        else:
+            FullStatsDF = Helper.AppendFullStatsCSVs(DataDirectory,m_over_n,fname_prefix)
+
+        basin_keys = FullStatsDF['basin_key'].values
+        MLE_values = FullStatsDF['MLE'].values.astype(np.float64)
+        RMSE_values = FullStatsDF['RMSE'].values.astype(np.float64)
+        source_keys = FullStatsDF['test_source_key'].values
+
+        # group the rows by basin, keeping the order of the tributaries
+        for basin, rows in FullStatsDF.groupby('basin_key', sort=False).indices.items():
+            basin = int(basin)
+            if basin_list is not None and basin not in basin_list:
+                continue
+            if basin not in MLE_arrays:
+                MLE_arrays[basin] = {"MLE": np.full((n_movern,len(rows)),np.nan),
+                                     "RMSE": np.full((n_movern,len(rows)),np.nan),
+                                     "test_source_key": source_keys[rows]}
+            elif MLE_arrays[basin]["MLE"].shape[1] != len(rows):
+                raise Exception("Basin "+str(basin)+" has a different number of tributaries in the m/n = "+str(m_over_n)+" fullstats file.")
+            MLE_arrays[basin]["MLE"][i] = MLE_values[rows]
+            MLE_arrays[basin]["RMSE"][i] = RMSE_values[rows]
+
+    return MLE_arrays
+
+def LogMLEAfterRemovals(MLE_array, remove_list_index):
+    """
+    This gets the log of the total MLE of a basin for every m/n value
+    and every step of removing tributaries in one go. The removal steps are
+    cumulative, so a tributary removed at step k stays removed for all later steps.
+    The total MLE is the product of the tributary MLEs, here done as a sum of logs
+    over an m/n x removal step x tributary array so it doesn't underflow.
+
+    Args:
+        MLE_array (array): The MLE values, of shape n_movern x n_tributaries (a single
+        row is also fine)
+        remove_list_index (list of lists): This contains information about what tributaries to remove
+
+    Returns:
+        log_MLEs (array): log of the total MLE, of shape n_movern x (n_steps+1).
+        The first column has no tributaries removed.
+
+    Author: SMM
+    """
+    MLE_array = np.atleast_2d(np.asarray(MLE_array,dtype=np.float64))
+    n_tribs = MLE_array.shape[1]
+    n_steps = len(remove_list_index)
+
+    # the step at which each tributary gets removed
+    removal_step = np.full(n_tribs,n_steps+1)
+    for step,stuff_to_remove in enumerate(remove_list_index):
+        stuff_to_remove = np.asarray(stuff_to_remove,dtype=int)
+        removal_step[stuff_to_remove] = np.minimum(removal_step[stuff_to_remove],step+1)
+
+    # keep[s,t] is true if tributary t is still in at step s
+    keep = np.arange(n_steps+1)[:,np.newaxis] < removal_step[np.newaxis,:]
+
+    with np.errstate(divide='ignore'):
+        log_MLE = np.log(MLE_array)
+    log_MLEs = np.where(keep[np.newaxis,:,:],log_MLE[:,np.newaxis,:],0.0).sum(axis=2)
+
+    return log_MLEs
+
 def CheckMLEOutliers(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.2, d_movern=0.1, n_movern=7, parallel=False):
     """
     This function uses the fullstats files to search for outliers in the
@@ -601,100 +841,53 @@ def CheckMLEOutliers(DataDirectory, fname_prefix, basin_list=[0], start_movern=0
     print("d theta is: "+str(d_movern))
     print("n theta is: "+str(n_movern))
     end_movern = float(start_movern)+float(d_movern)*(float(n_movern)-1)
-    print("end theta is: "+str(end_movern))                                                  
+    print("end theta is: "+str(end_movern))
     m_over_n_values = np.linspace(start_movern,end_movern,n_movern)
-    movern_strs = []
-    for movern in m_over_n_values:
-        movern_str = '%.2f'%movern
-        if movern_str.endswith('0'):
-            movern_str = movern_str[:-1]
-            movern_strs.append(movern_str)
-
-    # we open the first file just so that we can get a counter list
-    print ("PARALLEL = ", parallel)
-    if not parallel:
-        FirstDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,movern_strs[0])
-    else:
-        FirstDF = Helper.AppendFullStatsCSVs(DataDirectory,movern_strs[0],fname_prefix)
-
-    # get the number of basins
-    basin_keys = list(FirstDF['basin_key'])
-    basin_keys = [float(x) for x in basin_keys]
+    movern_strs = [_MOverNString(movern) for movern in m_over_n_values]
 
-    # get the list of basins
+    # read all the fullstats files once. If no basins are given we keep all of them
+    print ("PARALLEL = ", parallel)
     if basin_list == []:
         print("You didn't give me a list of basins, so I'll just run the analysis on all of them!")
-        basin_list = basin_keys
-        basin_set = set(basin_list)
-        basin_list = list(basin_set)
-        basin_list = [int(i) for i in basin_list]
+        MLE_arrays = ReadFullStatsMLEArrays(DataDirectory, fname_prefix, movern_strs, parallel=parallel)
+        basin_list = sorted(MLE_arrays.keys())
+    else:
+        MLE_arrays = ReadFullStatsMLEArrays(DataDirectory, fname_prefix, movern_strs, basin_list, parallel=parallel)
 
     # make a data object that will hold the counters
     Outlier_counter = {}
-    # loop through the basins
-    for basin in basin_list:
-        # mask the data so you only get the correct basin
-        FirstDF_basin = FirstDF[FirstDF['basin_key'] == basin]
-
-        trib_values = list(FirstDF_basin['test_source_key'])
-        n_nodes = len(trib_values)
-        # make the counter with zeros
-        this_counter = np.zeros(n_nodes)
-        Outlier_counter[basin] = this_counter
-
-    # Now we loop through all the files, calculating the outliers
-    for m_over_n in movern_strs:
-
-        print("This_m_over_n is: "+m_over_n)
-
-        #load the file
-        if not parallel:
-            FullStatsDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,m_over_n)
-        else:
-            FullStatsDF = Helper.AppendFullStatsCSVs(DataDirectory,m_over_n,fname_prefix)
 
+    # loop through the basins, calculating the outliers for each m/n value
+    for basin in basin_list:
+        if int(basin) not in MLE_arrays:
+            print("I didn't find basin "+str(basin)+" in the fullstats files.")
+            Outlier_counter[basin] = np.zeros(0)
+            continue
 
-        # loop through the basins
-        for basin in basin_list:
-
-            # mask the data so you only get the correct basin
-            FullStatsDF_basin = FullStatsDF[FullStatsDF['basin_key'] == basin]
+        MLE_array = MLE_arrays[int(basin)]["MLE"]
+        RMSE_array = MLE_arrays[int(basin)]["RMSE"]
 
-            # extract the relevant data
-            MLE_values = list(FullStatsDF_basin['MLE'])
-            RMSE_values = list(FullStatsDF_basin['RMSE'])
-            trib_values = list(FullStatsDF_basin['test_source_key'])
-            print ('N values: '+str(len(MLE_values))+' '+str(len(RMSE_values))+' '+str(len(trib_values)))
+        # make the counter with zeros
+        this_counter = np.zeros(MLE_array.shape[1])
 
-            # now get the outliers
-            MLE_array = np.asarray(MLE_values)
-            RMSE_array = np.asarray(RMSE_values)
+        for i in range(len(movern_strs)):
 
             # Get the outliers using the MAD-based outlier function
-            RMSE_outliers = LSDP.lsdstatsutilities.is_outlier(RMSE_array)
-            MLE_outliers = LSDP.lsdstatsutilities.is_outlier(RMSE_array)
+            RMSE_outliers = LSDP.lsdstatsutilities.is_outlier(RMSE_array[i])
+            MLE_outliers = LSDP.lsdstatsutilities.is_outlier(RMSE_array[i])
 
-            # now check each of the outlier arrays to see if e need to flip the array
-            RMSE_index_min = np.argmin(RMSE_array)
-            #RMSE_min = np.min(RMSE_array)
+            # if the min RMSE is an outlier, flip the outlier vector
+            if (RMSE_outliers[np.argmin(RMSE_array[i])]):
+                RMSE_outliers = ~RMSE_outliers
 
             # if the max MLE is an outlier, flip the outlier vector
-            if (RMSE_outliers[RMSE_index_min]):
-                RMSE_outliers = [not i for i in RMSE_outliers]
-
-            MLE_index_max = np.argmax(MLE_array)
-
-            # if the max MLE is an outlier, flip the outlier vector
-            if (MLE_outliers[MLE_index_max]):
-                MLE_outliers = [not i for i in MLE_outliers]
-
-            # turn the outliers vector into an integer
-            int_Outlier = [int(i) for i in MLE_outliers]
-            #print("Integer outliers are: ")
-            #print(int_Outlier)
+            if (MLE_outliers[np.argmax(MLE_array[i])]):
+                MLE_outliers = ~MLE_outliers
 
             # add this outlier counter to the outlier dict
-            Outlier_counter[basin] = Outlier_counter[basin]+int_Outlier
+            this_counter = this_counter+MLE_outliers.astype(int)
+
+        Outlier_counter[basin] = this_counter
 
     # Now try to calculate MLE by removing outliers
 
@@ -706,13 +899,18 @@ def CheckMLEOutliers(DataDirectory, fname_prefix, basin_list=[0], start_movern=0
     removed_sources_dict = {}
     MLEs_dict = {}
     for basin_number in basin_list:
+        if int(basin_number) in MLE_arrays:
+            MLE_array = MLE_arrays[int(basin_number)]["MLE"]
+        else:
+            MLE_array = np.zeros((n_movern,0))
         remove_list_index,movern_of_max_MLE,MLEs = Iteratively_recalculate_MLE_removing_outliers_for_basin(Outlier_counter,
                                                                                 DataDirectory,
                                                                                 fname_prefix,
                                                                                 basin_number,
                                                                                 start_movern,
                                                                                 d_movern,
-                                                                                n_movern, parallel)
+                                                                                n_movern, parallel,
+                                                                                MLE_array=MLE_array)
         best_fit_movern_dict[basin_number] = movern_of_max_MLE
         removed_sources_dict[basin_number] = remove_list_index
         MLEs_dict[basin_number] = MLEs
@@ -722,7 +920,7 @@ def CheckMLEOutliers(DataDirectory, fname_prefix, basin_list=[0], start_movern=0
 
     return Outlier_counter, removed_sources_dict, best_fit_movern_dict, MLEs_dict
 
-def Iteratively_recalculate_MLE_removing_outliers_for_basin(Outlier_counter, DataDirectory, fname_prefix, basin_number, start_movern=0.2, d_movern=0.1, n_movern=7, parallel=False):
+def Iteratively_recalculate_MLE_removing_outliers_for_basin(Outlier_counter, DataDirectory, fname_prefix, basin_number, start_movern=0.2, d_movern=0.1, n_movern=7, parallel=False, MLE_array=None):
     """
     This function drives the calculations for removing outliers incrementally
     from the MLE calculations. This is specific to a basin.
@@ -737,6 +935,8 @@ def Iteratively_recalculate_MLE_removing_outliers_for_basin(Outlier_counter, Dat
         start_movern (float): the starting m/n value. Default is 0.2
         d_movern (float): the increment between the m/n values. Default is 0.1
         n_movern (float): the number of m/n values analysed. Default is 7.
+        MLE_array (array): The MLE values of this basin (n_movern x n_tributaries) from
+        ReadFullStatsMLEArrays. If None these are read from the fullstats files.
 
     Returns:
         remove_list_index (list of list): This is the sequence of tributaries that will be removed
@@ -826,7 +1026,8 @@ def Iteratively_recalculate_MLE_removing_outliers_for_basin(Outlier_counter, Dat
                                                                              DataDirectory,
                                                                              fname_prefix,
                                                                              basin_number,
-                                                                             remove_list_index, parallel)
+                                                                             remove_list_index, parallel,
+                                                                             MLE_array=MLE_array)
 
     # Returns the remove_list_index, which is a list where each element
     # is a list of tributaries removed in an iteration,
@@ -837,7 +1038,8 @@ def Iteratively_recalculate_MLE_removing_outliers_for_basin(Outlier_counter, Dat
 
 def Calculate_movern_after_iteratively_removing_outliers(movern_list, DataDirectory,
                                                          fname_prefix, basin_number,
-                                                         remove_list_index, parallel=False):
+                                                         remove_list_index, parallel=False,
+                                                         MLE_array=None):
     """
     This function takes the remove list index, which contains information about
     the sequence of tributaries to be removed, and then recalculates MLE by incrementally
@@ -849,6 +1051,8 @@ def Calculate_movern_after_iteratively_removing_outliers(movern_list, DataDirect
         fname_prefix (str): The prefix for the m/n csv files
         basin_number (int): The basin you want
         remove_list_index (list of lists): This contains information about what tributaries to remove
+        MLE_array (array): The MLE values of this basin (n_movern x n_tributaries) from
+        ReadFullStatsMLEArrays. If None these are read from the fullstats files.
 
     Returns:
         movern_of_max_MLE (list): A list containing the m/n values of the basin after outlying
@@ -859,29 +1063,23 @@ def Calculate_movern_after_iteratively_removing_outliers(movern_list, DataDirect
 
     Author: SMM
     """
-    # Loop through m over n values and recalculate MLE values after removing
-    # the outlying data
-    All_MLE = []
-    for m_over_n in movern_list:
-        movern_str = '%.2f'%m_over_n     # need to convert to a string here so files are read correctly. FJC 16/02/18
-        if movern_str.endswith('0'):
-            movern_str = movern_str[:-1]
-    #    print movern_str
-
-        MLE_vals = RecalculateTotalMLEWithRemoveList(DataDirectory, fname_prefix,
-                                                     movern_str,basin_number, remove_list_index, parallel)
-        All_MLE.append(MLE_vals)
-
-
-    MLEs = np.asarray(All_MLE)
-    index_of_maximums = np.argmax(MLEs,0)
+    # get the MLE values of every m/n value in one go
+    if MLE_array is None:
+        movern_strs = [_MOverNString(m_over_n) for m_over_n in movern_list]
+        MLE_arrays = ReadFullStatsMLEArrays(DataDirectory, fname_prefix, movern_strs, [basin_number], parallel)
+        if int(basin_number) in MLE_arrays:
+            MLE_array = MLE_arrays[int(basin_number)]["MLE"]
+        else:
+            MLE_array = np.zeros((len(movern_list),0))
 
-    movern_of_max_MLE = []
-    for index in index_of_maximums:
-        movern_of_max_MLE.append(movern_list[index])
+    # recalculate MLE values after removing the outlying data.
+    # The maximum is picked on the log values since the products can underflow
+    log_MLEs = LogMLEAfterRemovals(MLE_array, remove_list_index)
+    MLEs = np.exp(log_MLEs)
+    index_of_maximums = np.argmax(log_MLEs,0)
 
     # This is required because linspace gives floating point errors
-    movern_of_max_MLE = np.around(movern_of_max_MLE,4)
+    movern_of_max_MLE = np.around(np.asarray(movern_list)[index_of_maximums],4)
 
     print("The MLEs for no removal are: ")
     print(MLEs[:,0])
@@ -908,43 +1106,13 @@ def RecalculateTotalMLEWithRemoveList(DataDirectory, fname_prefix,
 
     Author: SMM
     """
-    #load the file
-    if not parallel:
-        FullStatsDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,movern)
+    MLE_arrays = ReadFullStatsMLEArrays(DataDirectory, fname_prefix, [movern], [basin_number], parallel)
+    if int(basin_number) in MLE_arrays:
+        MLE_array = MLE_arrays[int(basin_number)]["MLE"]
     else:
-        FullStatsDF = Helper.AppendFullStatsCSVs(DataDirectory,movern,fname_prefix)
-
-    # mask the data so you only get the correct basin
-    FullStatsDF_basin = FullStatsDF[FullStatsDF['basin_key'] == basin_number]
-
-    # extract the relevant data
-    MLE_values = list(FullStatsDF_basin['MLE'])
-    #trib_values = list(FullStatsDF_basin['test_source_key'])
-
-    # get the MLE_values as an array
-    MLE_values = np.asarray(MLE_values)
-
-    #print("The total MLE is: ")
-    #print(np.prod(MLE_values))
-
-    MLE_vals = []
-    MLE_vals.append(np.prod(MLE_values))
-
-    # now loop through the remove list
-    remove_list = []
-    for stuff_to_remove in remove_list_index:
-        this_MLE = MLE_values
+        MLE_array = np.zeros((1,0))
 
-        # need to extend the remove list with these tribs
-        remove_list.extend(stuff_to_remove)
-
-        # now set the MLE of the removed tribs to 1
-        for idx in remove_list:
-            this_MLE[idx] = 1
-
-        #print("\n REMOVING; The total MLE is: ")
-        #print(np.prod(this_MLE))
-        MLE_vals.append(np.prod(this_MLE))
+    MLE_vals = list(np.exp(LogMLEAfterRemovals(MLE_array, remove_list_index)[0]))
 
     return MLE_vals
 
@@ -1173,8 +1341,143 @@ def MakePlotsWithMLEStats(DataDirectory, fname_prefix, basin_list = [0],
             plt.savefig(newFilename,format=FigFormat,dpi=300)
             ax.cla()
 
+def _LoadChiProfileData(DataDirectory, fname_prefix, parallel=False, movern_strs=[]):
+    """
+    Loads the data used by the chi profile figures: the chi profiles and, for each
+    m/n string in movern_strs, the fullstats file. Everything is split by basin.
+    This is called once in each figure worker.
+
+    Args:
+        DataDirectory (str): the data directory with the m/n csv files
+        fname_prefix (str): The prefix for the m/n csv files
+        parallel (bool): If true the csvs of a parallel run are appended
+        movern_strs (list): the m/n strings of the fullstats files you want
+
+    Returns:
+        dict with "profiles" (the chi profiles of each basin) and "fullstats"
+        (for each m/n string, the fullstats of each basin)
+
+    Author: SMM
+    """
+    if not parallel:
+        ProfileDF = Helper.ReadChiProfileCSV(DataDirectory, fname_prefix)
+    else:
+        ProfileDF = Helper.AppendMovernCSV(DataDirectory, fname_prefix)
+
+    FullStats = {}
+    for movern_str in movern_strs:
+        if not parallel:
+            FullStatsDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,movern_str)
+        else:
+            FullStatsDF = Helper.AppendFullStatsCSVs(DataDirectory,movern_str,fname_prefix)
+        FullStats[movern_str] = _GroupByBasin(FullStatsDF)
+
+    return {"profiles": _GroupByBasin(ProfileDF), "fullstats": FullStats}
+
+def _RenderChiPlotMLE(data, task):
+    """
+    Makes the chi-elevation plot of one basin and one m/n coloured by MLE.
+    See MakeChiPlotsMLE.
+
+    Args:
+        data (dict): from _LoadChiProfileData
+        task (tuple): (basin_key, m_over_n, movern_str, best_fit_movern, MLE_directory, size_format, FigFormat)
+
+    Returns:
+        The figure filename
+
+    Author: FJC
+    """
+    from matplotlib.ticker import FormatStrFormatter
+
+    basin_key, m_over_n, movern_str, best_fit_movern, MLE_directory, size_format, FigFormat = task
+    print("This basin key is: "+str(basin_key)+" and this m/n is: "+movern_str)
+
+    # make a figure
+    fig = makefigure(size_format)
+
+    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=1.0,top=1.0)
+    ax = fig.add_subplot(gs[10:95,5:80])
+    #colorbar axis
+    ax2 = fig.add_subplot(gs[10:95,82:85])
+
+    # get the data frames for this basin
+    ProfileDF_basin = data["profiles"][basin_key]
+    FullStatsDF_basin = data["fullstats"][movern_str][basin_key]
+
+    # get the data frame for the main stem
+    ProfileDF_MS = ProfileDF_basin[ProfileDF_basin['source_key'] == FullStatsDF_basin.iloc[0]['reference_source_key']]
+
+    # get the data frame for the tributaries
+    ProfileDF_basin = ProfileDF_basin[ProfileDF_basin['source_key'] != FullStatsDF_basin.iloc[0]['reference_source_key']]
+    # merge with the full data to get the MLE for the tributaries
+    ProfileDF_tribs = ProfileDF_basin.merge(FullStatsDF_basin, left_on = "source_key", right_on = "test_source_key")
+
+    # get the chi and elevation data for the main stem
+    movern_key = 'm_over_n = %s' % movern_str
+    MainStemX = list(ProfileDF_MS[movern_key])
+    MainStemElevation = list(ProfileDF_MS['elevation'])
+
+    # get the chi, elevation, and MLE for the tributaries
+    TributariesX = list(ProfileDF_tribs[movern_key])
+    TributariesElevation = list(ProfileDF_tribs['elevation'])
+    TributariesMLE = list(ProfileDF_tribs['MLE'])
+
+    # get the colourmap to colour channels by the MLE value
+    MLE_array = np.asarray(TributariesMLE)
+    this_cmap = plt.cm.coolwarm
+    cNorm  = colors.Normalize(vmin=np.min(MLE_array), vmax=np.max(MLE_array))
+
+    # now plot the data with a colourmap
+    sc = ax.scatter(TributariesX,TributariesElevation,c=TributariesMLE,cmap=this_cmap, norm=cNorm, s=2.5, edgecolors='none')
+    ax.plot(MainStemX,MainStemElevation,lw=2, c='k')
+
+    # some formatting of the figure
+    ax.spines['top'].set_linewidth(1)
+    ax.spines['left'].set_linewidth(1)
+    ax.spines['right'].set_linewidth(1)
+    ax.spines['bottom'].set_linewidth(1)
+
+    # make the lables
+    ax.set_xlabel(r"$\chi$ (m)")
+    ax.set_ylabel("Elevation (m)")
+
+    # label with the basin and m/n
+    title_string = "Basin "+str(basin_key)+", "+ r"$\theta$ = "+movern_str
+    if best_fit_movern == m_over_n:
+        ax.text(0.05, 0.95, title_string,
+                verticalalignment='top', horizontalalignment='left',
+                transform=ax.transAxes,
+                color='red', fontsize=10)
+    else:
+        ax.text(0.05, 0.95, title_string,
+                verticalalignment='top', horizontalalignment='left',
+                transform=ax.transAxes,
+                color='black', fontsize=10)
+
+    # add the colorbar
+    colorbarlabel = "$MLE$"
+    cbar = plt.colorbar(sc,cmap=this_cmap,spacing='uniform', orientation='vertical',cax=ax2)
+    cbar.set_label(colorbarlabel, fontsize=10)
+    ax2.set_ylabel(colorbarlabel, fontname='Liberation Sans', fontsize=10)
+    ax2.yaxis.set_major_formatter(FormatStrFormatter('%.2f'))
+
+    #save the plot
+    newFilename = MLE_directory+"MLE_profiles"+str(basin_key)+"_"+movern_str+"."+str(FigFormat)
+
+    # This gets all the ticks, and pads them away from the axis so that the corners don't overlap
+    ax.tick_params(axis='both', width=1, pad = 2)
+    for tick in ax.xaxis.get_major_ticks():
+        tick.set_pad(2)
+
+    plt.savefig(newFilename,format=FigFormat,dpi=300)
+    plt.close(fig)
+
+    return newFilename
+
 def MakeChiPlotsMLE(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.2, d_movern=0.1, n_movern=7,
-                    size_format='ESURF', FigFormat='png', animate=False, keep_pngs=False, parallel=False):
+                    size_format='ESURF', FigFormat='png', animate=False, keep_pngs=False, parallel=False,
+                    n_workers=None, progress_hook=None):
     """
     This function makes chi-elevation plots for each basin and each value of m/n
     where the channels are coloured by the MLE value compared to the main stem.
@@ -1192,39 +1495,23 @@ def MakeChiPlotsMLE(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.
         FigFormat (str): The format of the figure. Usually 'png' or 'pdf'. If "show" then it calls the matplotlib show() command.
         animate (bool): If this is true then it creates a movie of the chi-elevation plots coloured by MLE.
         keep_pngs (bool): If this is false and the animation flag is true, then the pngs are deleted and just the video is kept.
+        n_workers (int): the number of processes making figures. Defaults to 4 or the number of CPUs if fewer, see RunFigureTasks.
+        progress_hook (function): called after each figure, see RunFigureTasks
 
     Returns:
-        Plot of each m/n value for each basin.
+        Plot of each m/n value for each basin, and a list with the (filename, seconds) of each figure.
 
     Author: FJC
     """
-    from matplotlib.ticker import FormatStrFormatter
-
     # check if a directory exists for the chi plots. If not then make it.
     MLE_directory = DataDirectory+'chi_plots/'
     if not os.path.isdir(MLE_directory):
         os.makedirs(MLE_directory)
 
-    # Set up fonts for plots
-    label_size = 10
-    rcParams['font.family'] = 'sans-serif'
-    rcParams['font.sans-serif'] = ['Liberation Sans']
-    rcParams['font.size'] = label_size
-
-    # make a figure
-    fig = makefigure(size_format)
-
-    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=1.0,top=1.0)
-    ax = fig.add_subplot(gs[10:95,5:80])
-    #colorbar axis
-    ax2 = fig.add_subplot(gs[10:95,82:85])
-
-    # read in the csv files
+    # read in the basin stats
     if not parallel:
-        ProfileDF = Helper.ReadChiProfileCSV(DataDirectory, fname_prefix)
         BasinStatsDF = Helper.ReadBasinStatsCSV(DataDirectory, fname_prefix)
     else:
-        ProfileDF = Helper.AppendMovernCSV(DataDirectory, fname_prefix)
         BasinStatsDF = Helper.AppendBasinCSVs(DataDirectory, fname_prefix)
 
     # get the number of basins
@@ -1243,122 +1530,111 @@ def MakeChiPlotsMLE(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.
     # best fit moverns
     best_fit_moverns = SimpleMaxMLECheck(BasinStatsDF)
 
-    for m_over_n in m_over_n_values:
-        # read in the full stats file
-
-        #Stupid floating point representation issues
-        movern_str = "%.2f" % round(m_over_n,2)
-        if movern_str.endswith('0'):
-            movern_str = movern_str[:-1]
-
-        print("This m/n is: "+movern_str)
-        if not parallel:
-            FullStatsDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,movern_str)
-        else:
-            FullStatsDF = Helper.AppendFullStatsCSVs(DataDirectory,movern_str,fname_prefix)
-
-        # loop through all the basins in the basin list
+    # one figure for each m/n and basin
+    #Stupid floating point representation issues
+    movern_strs = [_MOverNString(round(m_over_n,2)) for m_over_n in m_over_n_values]
+    tasks = []
+    for m_over_n, movern_str in zip(m_over_n_values, movern_strs):
         for basin_key in basin_list:
-            print("This basin key is: "+str(basin_key))
-
-            # mask the data frames for this basin
-            ProfileDF_basin = ProfileDF[ProfileDF['basin_key'] == basin_key]
-            FullStatsDF_basin = FullStatsDF[FullStatsDF['basin_key'] == basin_key]
+            tasks.append((basin_key, m_over_n, movern_str, best_fit_moverns[basin_key],
+                          MLE_directory, size_format, FigFormat))
 
-            #print FullStatsDF_basin
-            print ("Getting the reference_source_key")
+    timings = RunFigureTasks(_RenderChiPlotMLE, tasks, _LoadChiProfileData,
+                             (DataDirectory, fname_prefix, parallel, movern_strs),
+                             n_workers=n_workers, progress_hook=progress_hook)
 
-            print(FullStatsDF_basin.iloc[0]['reference_source_key'])
-
-            # get the data frame for the main stem
-            ProfileDF_MS = ProfileDF_basin[ProfileDF_basin['source_key'] == FullStatsDF_basin.iloc[0]['reference_source_key']]
-
-            # get the data frame for the tributaries
-            ProfileDF_basin = ProfileDF_basin[ProfileDF_basin['source_key'] != FullStatsDF_basin.iloc[0]['reference_source_key']]
-            # merge with the full data to get the MLE for the tributaries
-            ProfileDF_tribs = ProfileDF_basin.merge(FullStatsDF_basin, left_on = "source_key", right_on = "test_source_key")
+    if animate:
+        # animate the pngs using ffmpeg
+        system_call = "ffmpeg -framerate 3 -pattern_type glob -i '"+MLE_directory+"MLE_profiles*.png' -y -vcodec libx264 -s 1230x566 -pix_fmt yuv420p "+MLE_directory+"MLE_profiles.mp4"
+        print (system_call)
+        subprocess.call(system_call, shell=True)
+        # delete the pngs if you want
+        if not keep_pngs:
+            system_call = "rm "+MLE_directory+"MLE_profiles*.png"
+            subprocess.call(system_call, shell=True)
 
-            # get the chi and elevation data for the main stem
-            movern_key = 'm_over_n = %s' % movern_str
-            MainStemX = list(ProfileDF_MS[movern_key])
-            MainStemElevation = list(ProfileDF_MS['elevation'])
+    return timings
 
-            # get the chi, elevation, and MLE for the tributaries
-            TributariesX = list(ProfileDF_tribs[movern_key])
-            TributariesElevation = list(ProfileDF_tribs['elevation'])
-            TributariesMLE = list(ProfileDF_tribs['MLE'])
+def _RenderChiPlotChi(data, task):
+    """
+    Makes the chi-elevation plot of one basin and one m/n, highlighting the
+    best fit concavity. See MakeChiPlotsChi.
 
-            # get the colourmap to colour channels by the MLE value
-            #NUM_COLORS = len(MLE)
-            MLE_array = np.asarray(TributariesMLE)
-            this_cmap = plt.cm.coolwarm
-            cNorm  = colors.Normalize(vmin=np.min(MLE_array), vmax=np.max(MLE_array))
-            plt.cm.ScalarMappable(norm=cNorm, cmap=this_cmap)
+    Args:
+        data (dict): from _LoadChiProfileData
+        task (tuple): (basin_key, movern_str, this_is_bf_concavity, MLE_directory, size_format, FigFormat)
 
-            # now plot the data with a colourmap
-            sc = ax.scatter(TributariesX,TributariesElevation,c=TributariesMLE,cmap=this_cmap, norm=cNorm, s=2.5, edgecolors='none')
-            ax.plot(MainStemX,MainStemElevation,lw=2, c='k')
+    Returns:
+        The figure filename
 
-            # some formatting of the figure
-            ax.spines['top'].set_linewidth(1)
-            ax.spines['left'].set_linewidth(1)
-            ax.spines['right'].set_linewidth(1)
-            ax.spines['bottom'].set_linewidth(1)
+    Author: SMM, from FJC code
+    """
+    basin_key, movern_str, this_is_bf_concavity, MLE_directory, size_format, FigFormat = task
+    print("This basin key is: "+str(basin_key)+" and this concavity is: "+movern_str)
 
-            # make the lables
-            ax.set_xlabel("$\chi$ (m)")
-            ax.set_ylabel("Elevation (m)")
+    # make a figure
+    fig = makefigure(size_format)
 
-            # the best fit m/n
-            best_fit_movern = best_fit_moverns[basin_key]
+    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=1.0,top=1.0)
+    ax = fig.add_subplot(gs[10:95,5:90])
 
-            # label with the basin and m/n
-            title_string = "Basin "+str(basin_key)+", "+ r"$\theta$ = "+movern_str
-            if best_fit_movern == m_over_n:
-                ax.text(0.05, 0.95, title_string,
-                        verticalalignment='top', horizontalalignment='left',
-                        transform=ax.transAxes,
-                        color='red', fontsize=10)
-            else:
-                ax.text(0.05, 0.95, title_string,
-                        verticalalignment='top', horizontalalignment='left',
-                        transform=ax.transAxes,
-                        color='black', fontsize=10)
+    # get the data frame for this basin
+    ProfileDF_basin = data["profiles"][basin_key]
 
-            # add the colorbar
-            colorbarlabel = "$MLE$"
-            cbar = plt.colorbar(sc,cmap=this_cmap,spacing='uniform', orientation='vertical',cax=ax2)
-            cbar.set_label(colorbarlabel, fontsize=10)
-            ax2.set_ylabel(colorbarlabel, fontname='Liberation Sans', fontsize=10)
-            ax2.yaxis.set_major_formatter(FormatStrFormatter('%.2f'))
+    # get the chi and elevation data
+    movern_key = 'm_over_n = %s' % movern_str
+    X = list(ProfileDF_basin[movern_key])
+    Elevation = list(ProfileDF_basin['elevation'])
 
-            #save the plot
-            newFilename = MLE_directory+"MLE_profiles"+str(basin_key)+"_"+movern_str+"."+str(FigFormat)
+    # now plot the data
+    if this_is_bf_concavity:
+        ax.scatter(X,Elevation,c='r', s=2.5, edgecolors='none')
+    else:
+        ax.scatter(X,Elevation,c='k', s=2.5, edgecolors='none')
+
+    # some formatting of the figure
+    ax.spines['top'].set_linewidth(1)
+    ax.spines['left'].set_linewidth(1)
+    ax.spines['right'].set_linewidth(1)
+    ax.spines['bottom'].set_linewidth(1)
+
+    # make the lables
+    ax.set_xlabel(r"$\chi$ (m)")
+    ax.set_ylabel("Elevation (m)")
+
+    # label with the basin and m/n
+    title_string = "Basin "+str(basin_key)+", "+ r"$\theta$ = "+movern_str
+    if this_is_bf_concavity:
+        ax.text(0.05, 0.95, title_string,
+                verticalalignment='top', horizontalalignment='left',
+                transform=ax.transAxes,
+                color='red', fontsize=10)
+        ax.text(0.05, 0.85, "Best fit concavity",
+                verticalalignment='top', horizontalalignment='left',
+                transform=ax.transAxes,
+                color='red', fontsize=10)
+    else:
+        ax.text(0.05, 0.95, title_string,
+                verticalalignment='top', horizontalalignment='left',
+                transform=ax.transAxes,
+                color='black', fontsize=10)
 
-            # This gets all the ticks, and pads them away from the axis so that the corners don't overlap
-            ax.tick_params(axis='both', width=1, pad = 2)
-            for tick in ax.xaxis.get_major_ticks():
-                tick.set_pad(2)
+    #save the plot
+    newFilename = MLE_directory+"chi_profiles"+str(basin_key)+"_"+movern_str+"."+str(FigFormat)
 
-            plt.savefig(newFilename,format=FigFormat,dpi=300)
-            ax.cla()
-            ax2.cla()
+    # This gets all the ticks, and pads them away from the axis so that the corners don't overlap
+    ax.tick_params(axis='both', width=1, pad = 2)
+    for tick in ax.xaxis.get_major_ticks():
+        tick.set_pad(2)
 
-    if animate:
-        # animate the pngs using ffmpeg
-        system_call = "ffmpeg -framerate 3 -pattern_type glob -i '"+MLE_directory+"MLE_profiles*.png' -y -vcodec libx264 -s 1230x566 -pix_fmt yuv420p "+MLE_directory+"MLE_profiles.mp4"
-        print (system_call)
-        subprocess.call(system_call, shell=True)
-        # delete the pngs if you want
-        if not keep_pngs:
-            system_call = "rm "+MLE_directory+"MLE_profiles*.png"
-            subprocess.call(system_call, shell=True)
+    plt.savefig(newFilename,format=FigFormat,dpi=300)
     plt.close(fig)
 
-    
-    
+    return newFilename
+
 def MakeChiPlotsChi(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.2, d_movern=0.1, n_movern=7,
-                    size_format='ESURF', FigFormat='png', animate=False, keep_pngs=False, parallel=False):
+                    size_format='ESURF', FigFormat='png', animate=False, keep_pngs=False, parallel=False,
+                    n_workers=None, progress_hook=None):
     """
     This function makes chi-elevation plots for each basin and each value of m/n
     where the channels are coloured by the chi value compared to the main stem.
@@ -1376,166 +1652,55 @@ def MakeChiPlotsChi(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.
         FigFormat (str): The format of the figure. Usually 'png' or 'pdf'. If "show" then it calls the matplotlib show() command.
         animate (bool): If this is true then it creates a movie of the chi-elevation plots coloured by MLE.
         keep_pngs (bool): If this is false and the animation flag is true, then the pngs are deleted and just the video is kept.
+        n_workers (int): the number of processes making figures. Defaults to 4 or the number of CPUs if fewer, see RunFigureTasks.
+        progress_hook (function): called after each figure, see RunFigureTasks
 
     Returns:
-        Plot of each m/n value for each basin.
+        Plot of each m/n value for each basin, and a list with the (filename, seconds) of each figure.
 
     Author: SMM, from FJC code
     """
-    from matplotlib.ticker import FormatStrFormatter
-
     # check if a directory exists for the chi plots. If not then make it.
     MLE_directory = DataDirectory+'chi_plots/'
     if not os.path.isdir(MLE_directory):
-        os.makedirs(MLE_directory)
-
-    # Set up fonts for plots
-    label_size = 10
-    rcParams['font.family'] = 'sans-serif'
-    rcParams['font.sans-serif'] = ['Liberation Sans']
-    rcParams['font.size'] = label_size
-
-    # make a figure
-    fig = makefigure(size_format)
-
-    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=1.0,top=1.0)
-    ax = fig.add_subplot(gs[10:95,5:90])
-    
-    #colorbar axis
-    #ax2 = fig.add_subplot(gs[10:95,82:85])
-
-    # read in the csv files
-    if not parallel:
-        ProfileDF = Helper.ReadChiProfileCSV(DataDirectory, fname_prefix)
-        DisorderDF = Helper.ReadDisorderUncertCSV(DataDirectory, fname_prefix)
-    else:
-        ProfileDF = Helper.AppendMovernCSV(DataDirectory, fname_prefix)
-        DisorderDF = Helper.AppendDisorderCSV(DataDirectory, fname_prefix)
-    best_fit_moverns = DisorderDF['median'].tolist()
-    
-    # get the number of basins
-    basin_keys = list(DisorderDF['basin_key'])
-    basin_keys = [int(x) for x in basin_keys]
-    
-    MOverNDict = dict(zip(basin_keys,best_fit_moverns))
-
-    # get the list of basins
-    if basin_list == []:
-        print("You didn't give me a list of basins, so I'll just run the analysis on all of them!")
-        basin_list = basin_keys
-
-    # loop through each m over n value
-    end_movern = float(start_movern)+float(d_movern)*(float(n_movern)-1)
-    m_over_n_values = np.linspace(start_movern,end_movern,n_movern)
-
-    for m_over_n in m_over_n_values:
-        # read in the full stats file
-
-        #Stupid floating point representation issues
-        movern_str = "%.2f" % round(m_over_n,2)
-        if movern_str.endswith('0'):
-            movern_str = movern_str[:-1]
-
-        print("This concavity is: "+movern_str)
-
-        # loop through all the basins in the basin list
-        for basin_key in basin_list:
-            print("This basin key is: "+str(basin_key))
-            #print("The best fit concavity is:")
-            #print(MOverNDict[basin_key])
-            
-            # Format the best fit concavity string
-            bf_movernstr = "%.2f" % round(MOverNDict[basin_key],2)
-            if bf_movernstr.endswith('0'):
-                bf_movernstr = bf_movernstr[:-1]
-                
-            #print("This concavity is:")
-            #print(movern_str)
-            #print("Best fit concavity in string format is:")
-            #print(bf_movernstr)
-            
-            this_is_bf_concavity = False
-            if (movern_str == bf_movernstr):
-                #print("==================================")
-                #print("This is the best fitting concavity")
-                #print("==================================")
-                this_is_bf_concavity = True
-                
-            # mask the data frames for this basin
-            ProfileDF_basin = ProfileDF[ProfileDF['basin_key'] == basin_key]
-
-            # get the chi and elevation data for the main stem
-            movern_key = 'm_over_n = %s' % movern_str
-            X = list(ProfileDF_basin[movern_key])
-            Elevation = list(ProfileDF_basin['elevation'])
-
-            # get the colourmap to colour channels by the MLE value
-            #NUM_COLORS = len(MLE)
-            MLE_array = np.asarray(X)
-            this_cmap = plt.cm.coolwarm
-            cNorm  = colors.Normalize(vmin=np.min(X), vmax=np.max(X))
-            plt.cm.ScalarMappable(norm=cNorm, cmap=this_cmap)
-
-            # now plot the data with a colourmap
-            if this_is_bf_concavity:
-                sc = ax.scatter(X,Elevation,c='r', s=2.5, edgecolors='none')
-                #sc = ax.scatter(X,Elevation,c=X,cmap=this_cmap, norm=cNorm, s=2.5, edgecolors='none')
-            else:
-                sc = ax.scatter(X,Elevation,c='k', s=2.5, edgecolors='none')
-                #sc = ax.scatter(X,Elevation,c=X,cmap=this_cmap, norm=cNorm, s=2.5, edgecolors='none')
-                
-            
-
-            # some formatting of the figure
-            ax.spines['top'].set_linewidth(1)
-            ax.spines['left'].set_linewidth(1)
-            ax.spines['right'].set_linewidth(1)
-            ax.spines['bottom'].set_linewidth(1)
-
-            # make the lables
-            ax.set_xlabel("$\chi$ (m)")
-            ax.set_ylabel("Elevation (m)")
-
-            # the best fit m/n
-            best_fit_movern = best_fit_moverns[basin_key]
-            
-            #print("The best fit concavity is: "+str(best_fit_movern))
-
-            # label with the basin and m/n
-            title_string = "Basin "+str(basin_key)+", "+ r"$\theta$ = "+movern_str
-            if this_is_bf_concavity:
-                ax.text(0.05, 0.95, title_string,
-                        verticalalignment='top', horizontalalignment='left',
-                        transform=ax.transAxes,
-                        color='red', fontsize=10)
-                ax.text(0.05, 0.85, "Best fit concavity",
-                        verticalalignment='top', horizontalalignment='left',
-                        transform=ax.transAxes,
-                        color='red', fontsize=10)
-            else:
-                ax.text(0.05, 0.95, title_string,
-                        verticalalignment='top', horizontalalignment='left',
-                        transform=ax.transAxes,
-                        color='black', fontsize=10)
+        os.makedirs(MLE_directory)
 
-            # add the colorbar
-            #colorbarlabel = "$\chi$ (m)"
-            #cbar = plt.colorbar(sc,cmap=this_cmap,spacing='uniform', orientation='vertical',cax=ax2)
-            #cbar.set_label(colorbarlabel, fontsize=10)
-            #ax2.set_ylabel(colorbarlabel, fontname='Liberation Sans', fontsize=10)
-            #ax2.yaxis.set_major_formatter(FormatStrFormatter('%.2f'))
+    # read in the disorder csv
+    if not parallel:
+        DisorderDF = Helper.ReadDisorderUncertCSV(DataDirectory, fname_prefix)
+    else:
+        DisorderDF = Helper.AppendDisorderCSV(DataDirectory, fname_prefix)
+    best_fit_moverns = DisorderDF['median'].tolist()
 
-            #save the plot
-            newFilename = MLE_directory+"chi_profiles"+str(basin_key)+"_"+movern_str+"."+str(FigFormat)
+    # get the number of basins
+    basin_keys = list(DisorderDF['basin_key'])
+    basin_keys = [int(x) for x in basin_keys]
 
-            # This gets all the ticks, and pads them away from the axis so that the corners don't overlap
-            ax.tick_params(axis='both', width=1, pad = 2)
-            for tick in ax.xaxis.get_major_ticks():
-                tick.set_pad(2)
+    MOverNDict = dict(zip(basin_keys,best_fit_moverns))
 
-            plt.savefig(newFilename,format=FigFormat,dpi=300)
-            ax.cla()
-            #ax2.cla()
+    # get the list of basins
+    if basin_list == []:
+        print("You didn't give me a list of basins, so I'll just run the analysis on all of them!")
+        basin_list = basin_keys
+
+    # loop through each m over n value
+    end_movern = float(start_movern)+float(d_movern)*(float(n_movern)-1)
+    m_over_n_values = np.linspace(start_movern,end_movern,n_movern)
+
+    # one figure for each m/n and basin
+    tasks = []
+    for m_over_n in m_over_n_values:
+        #Stupid floating point representation issues
+        movern_str = _MOverNString(round(m_over_n,2))
+        for basin_key in basin_list:
+            # Format the best fit concavity string
+            bf_movernstr = _MOverNString(round(MOverNDict[basin_key],2))
+            this_is_bf_concavity = (movern_str == bf_movernstr)
+            tasks.append((basin_key, movern_str, this_is_bf_concavity, MLE_directory, size_format, FigFormat))
+
+    timings = RunFigureTasks(_RenderChiPlotChi, tasks, _LoadChiProfileData,
+                             (DataDirectory, fname_prefix, parallel),
+                             n_workers=n_workers, progress_hook=progress_hook)
 
     if animate:
         # animate the pngs using ffmpeg
@@ -1546,9 +1711,9 @@ def MakeChiPlotsChi(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.
         if not keep_pngs:
             system_call = "rm "+MLE_directory+"chi_profiles*.png"
             subprocess.call(system_call, shell=True)
-    plt.close(fig)    
-    
-    
+
+    return timings
+
 def MakeChiPlotsColouredByK(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.2, d_movern=0.1, n_movern=7,size_format='ESURF', FigFormat='png', animate=False, keep_pngs=False, parallel=False):
     """
     This function makes chi-elevation plots for each basin and each value of m/n
@@ -1944,32 +2109,24 @@ def MakeChiPlotsColouredByLith(DataDirectory, fname_prefix, basin_list=[0], star
     plt.close(fig)
 
 
-def PlotProfilesRemovingOutliers(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.2, d_movern=0.1, n_movern=7, size_format = "geomorphology", FigFormat="png", parallel=False):
+def _RenderProfileRemovingOutliers(data, task):
     """
-    This function is used to plot the chi profiles as they have outliers removed.
-    It calls thefunction CheckMLEOutliers, which you should read to get details
-    on how outliers are calculated and removed
+    Makes the chi profile plot of one basin after one step of removing the
+    outlying tributaries. See PlotProfilesRemovingOutliers.
 
     Args:
-        DataDirectory (str): the data directory with the m/n csv files
-        fname_prefix (str): The prefix for the m/n csv files
-        basin_list: a list of the basins to make the plots for. If an empty list is passed then
-        all the basins will be analysed. Default = basin 0.
-        start_movern (float): the starting m/n value. Default is 0.2
-        d_movern (float): the increment between the m/n values. Default is 0.1
-        n_movern (float): the number of m/n values analysed. Default is 7.
+        data (dict): from _LoadChiProfileData
+        task (tuple): (basin_number, idx, best_fit_movern, removed_sources_list, DataDirectory, size_format, FigFormat)
+        where removed_sources_list has the indices of all the tributaries removed up to this step
 
     Returns:
-        Plots of chi profiles with basins removed
+        The figure filename
 
     Author: SMM
     """
-
-    # Set up fonts for plots
-    label_size = 10
-    rcParams['font.family'] = 'sans-serif'
-    rcParams['font.sans-serif'] = ['Liberation Sans']
-    rcParams['font.size'] = label_size
+    basin_number, idx, best_fit_movern, removed_sources_list, DataDirectory, size_format, FigFormat = task
+    movern_str = _MOverNString(best_fit_movern)
+    print("The best fit m/n is: "+ movern_str+" and the index is "+str(idx))
 
     # make a figure
     fig = makefigure(size_format)
@@ -1979,178 +2136,236 @@ def PlotProfilesRemovingOutliers(DataDirectory, fname_prefix, basin_list=[0], st
     #colorbar axis
     ax2 = fig.add_subplot(gs[10:95,82:85])
 
-    # we open the first file just so that we can get a counter list
-    if not parallel:
-        FirstDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,start_movern)
-    else:
-        FirstDF = Helper.AppendFullStatsCSVs(DataDirectory,start_movern,fname_prefix)
+    # get the data frames for this basin. The fullstats file is used
+    # to colour tribs as well as get the source numbers from
+    # the outlier list
+    ProfileDF_basin = data["profiles"][basin_number]
+    FullStatsDF_basin = data["fullstats"][movern_str][basin_number]
 
-    # get the number of basins
-    basin_keys = list(FirstDF['basin_key'])
-    basin_keys = [float(x) for x in basin_keys]
+    # extract the relevant data
+    trib_values = list(FullStatsDF_basin['test_source_key'])
+    ref_values = list(FullStatsDF_basin['reference_source_key'])
 
-    # get the list of basins
-    if basin_list == []:
-        print("You didn't give me a list of basins, so I'll just run the analysis on all of them!")
-        basin_list = basin_keys
-        basin_set = set(basin_list)
-        basin_list = list(basin_set)
-        basin_list = [int(i) for i in basin_list]
+    # now you need to get the actual source numbers by indexing into the source list
+    the_removed_sources = [trib_values[source_index] for source_index in removed_sources_list]
 
-    # First we get all the information about outliers, m/n values and MLE
-    # values from the CheckMLEOutliers function
-    Outlier_counter, removed_sources_dict, best_fit_movern_dict, MLEs_dict = CheckMLEOutliers(DataDirectory, fname_prefix, basin_list, start_movern, d_movern, n_movern, parallel=parallel)
+    print("The main stem is: ")
+    print( ref_values[0])
 
-    # Now get the chi profiles of all the basins and channels
-    # Load from file and put into a pandas data frame
-    if not parallel:
-        ProfileDF = Helper.ReadChiProfileCSV(DataDirectory,fname_prefix)
-    else:
-        ProfileDF = Helper.AppendMovernCSV(DataDirectory,fname_prefix)
+    print("The removed tribs are: ")
+    print(the_removed_sources)
 
-    # now we need to get a plot for each basin, showing the incremental removal of outlying tribs
-    for basin_number in basin_list:
+    # get the data frame for the main stem
+    # It does this because the main stem source is always the 0 element in the trib_values list
+    ProfileDF_MS = ProfileDF_basin[ProfileDF_basin['source_key'] == ref_values[0]]
 
-        # Get the removed sources indices and the MLEs for this particular basin
-        these_removed_sources = removed_sources_dict[basin_number]
-        these_MLEs = MLEs_dict[basin_number]
+    # get the data frame for the tributaries
+    ProfileDF_basin = ProfileDF_basin[ProfileDF_basin['source_key'] != ref_values[0]]
 
-        # loop through the best fit moverns
-        # each value represents the MLE for a given number of removed outlying tributaries
-        removed_sources_list = []
-        for idx,best_fit_movern in enumerate(best_fit_movern_dict[basin_number]):
+    # now split the tributaries into exluded and non excluded tribs
+    ProfileDF_outliers = ProfileDF_basin[ProfileDF_basin.source_key.isin(the_removed_sources)]
+    ProfileDF_kept = ProfileDF_basin[~ProfileDF_basin.source_key.isin(the_removed_sources)]
 
-            print("The best fit m/n is: "+ str(best_fit_movern)+" and the index is "+str(idx))
+    # merge with the full data to get the MLE for the tributaries
+    ProfileDF_trib_outliers = ProfileDF_outliers.merge(FullStatsDF_basin, left_on = "source_key", right_on = "test_source_key")
+    ProfileDF_trib_kept = ProfileDF_kept.merge(FullStatsDF_basin, left_on = "source_key", right_on = "test_source_key")
 
-            # mask the data frames for this basin
-            ProfileDF_basin = ProfileDF[ProfileDF['basin_key'] == basin_number]
+    # get the chi and elevation data for the main stem
+    movern_key = 'm_over_n = %s' % movern_str
+    MainStemX = list(ProfileDF_MS[movern_key])
+    MainStemElevation = list(ProfileDF_MS['elevation'])
 
-            # We also need to get the fullstats MLE file. This will be used
-            # to colour tribs as well as get the source numbers from
-            # the outlier list
-            if not parallel:
-                FullStatsDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,best_fit_movern)
-            else:
-                FullStatsDF = Helper.AppendFullStatsCSVs(DataDirectory,best_fit_movern,fname_prefix)
+    # get the chi, elevation, and MLE for the tributaries
+    TributariesX_outliers = list(ProfileDF_trib_outliers[movern_key])
+    TributariesElevation_outliers = list(ProfileDF_trib_outliers['elevation'])
 
-            # mask the data so you only get the correct basin
-            FullStatsDF_basin = FullStatsDF[FullStatsDF['basin_key'] == basin_number]
+    TributariesX_kept = list(ProfileDF_trib_kept[movern_key])
+    TributariesElevation_kept = list(ProfileDF_trib_kept['elevation'])
+    TributariesMLE_kept = list(ProfileDF_trib_kept['MLE'])
 
-            # extract the relevant data
-            #MLE_values = list(FullStatsDF_basin['MLE'])
-            #RMSE_values = list(FullStatsDF_basin['RMSE'])
-            trib_values = list(FullStatsDF_basin['test_source_key'])
-            ref_values = list(FullStatsDF_basin['reference_source_key'])
+    # get the colourmap to colour channels by the MLE value
+    MLE_array = np.asarray(TributariesMLE_kept)
+    this_cmap = plt.cm.Reds
+    cNorm  = colors.Normalize(vmin=np.min(MLE_array), vmax=np.max(MLE_array))
 
-            # Now get the excluded tributaries for this iteration
-            #removed_MLE = these_MLEs[idx]
+    # now plot the data with a colourmap
+    sc = ax.scatter(TributariesX_kept,TributariesElevation_kept,c=TributariesMLE_kept,cmap=this_cmap, norm=cNorm, s=2.5, edgecolors='none')
 
-            # Note that index 0 is the basin with no removed tributaries.
-            if idx != 0:
-                removed_sources_list.extend(these_removed_sources[idx-1])
+    # Add the outliers if the basin has them
+    if(len(removed_sources_list)>0):
+        ax.scatter(TributariesX_outliers,TributariesElevation_outliers,c="b", s=2.5, edgecolors='none', alpha = 0.3)
 
-            # now you need to get the actual source numbers by indexing into the source list
-            the_removed_sources = []
-            for source_index in removed_sources_list:
-                the_removed_sources.append( trib_values[source_index]  )
+    ax.plot(MainStemX,MainStemElevation,lw=2, c='k')
 
-            print("The main stem is: ")
-            print( ref_values[0])
+    # some formatting of the figure
+    ax.spines['top'].set_linewidth(1)
+    ax.spines['left'].set_linewidth(1)
+    ax.spines['right'].set_linewidth(1)
+    ax.spines['bottom'].set_linewidth(1)
 
-            print("The removed tribs are: ")
-            print(the_removed_sources)
+    # make the lables
+    ax.set_xlabel(r"$\chi$ (m)")
+    ax.set_ylabel("Elevation (m)")
 
+    # label with the basin and m/n
+    title_string = "Basin "+str(basin_number)+", best fit "+r'$\theta$' + " = "+movern_str
+    ax.text(0.05, 0.95, title_string,
+            verticalalignment='top', horizontalalignment='left',
+            transform=ax.transAxes,
+            color='black', fontsize=10)
 
+    # add the colorbar
+    colorbarlabel = "$MLE$"
+    cbar = plt.colorbar(sc,cmap=this_cmap,spacing='uniform', orientation='vertical',cax=ax2)
+    cbar.set_label(colorbarlabel, fontsize=10)
+    ax2.set_ylabel(colorbarlabel, fontname='Liberation Sans', fontsize=10)
 
-            # get the data frame for the main stem
-            # It does this because the main stem source is always the 0 element in the trib_values list
-            ProfileDF_MS = ProfileDF_basin[ProfileDF_basin['source_key'] == ref_values[0]]
+    #save the plot
+    newFilename = DataDirectory+"MLE_profiles"+str(basin_number)+"_"+str(best_fit_movern)+"_removed_"+str(idx)+"."+str(FigFormat)
 
-            # get the data frame for the tributaries
-            ProfileDF_basin = ProfileDF_basin[ProfileDF_basin['source_key'] != ref_values[0]]
+    # This gets all the ticks, and pads them away from the axis so that the corners don't overlap
+    ax.tick_params(axis='both', width=1, pad = 2)
+    for tick in ax.xaxis.get_major_ticks():
+        tick.set_pad(2)
 
-            # now split the tributaries into exluded and non excluded tribs
-            #ProfileDF_outliers = ProfileDF_basin.filter(items=removed_sources_list)
-            #ProfileDF_kept = ProfileDF_basin.filter(items=removed_sources_list)
-            ProfileDF_outliers = ProfileDF_basin[ProfileDF_basin.source_key.isin(the_removed_sources)]
-            ProfileDF_kept = ProfileDF_basin[~ProfileDF_basin.source_key.isin(the_removed_sources)]
+    plt.savefig(newFilename,format=FigFormat,dpi=300)
+    plt.close(fig)
 
-            #ProfileDF_basin = ProfileDF_basin[ProfileDF_basin.source_key.isin(removed_sources_list)]
-            #ProfileDF_basin = ProfileDF_basin[ProfileDF_basin.source_key.isin([2,3,4])]
-            #print(ProfileDF_basin)
+    return newFilename
 
-            # merge with the full data to get the MLE for the tributaries
-            ProfileDF_trib_outliers = ProfileDF_outliers.merge(FullStatsDF_basin, left_on = "source_key", right_on = "test_source_key")
-            ProfileDF_trib_kept = ProfileDF_kept.merge(FullStatsDF_basin, left_on = "source_key", right_on = "test_source_key")
+def PlotProfilesRemovingOutliers(DataDirectory, fname_prefix, basin_list=[0], start_movern=0.2, d_movern=0.1, n_movern=7, size_format = "geomorphology", FigFormat="png", parallel=False,
+                                 n_workers=None, progress_hook=None):
+    """
+    This function is used to plot the chi profiles as they have outliers removed.
+    It calls thefunction CheckMLEOutliers, which you should read to get details
+    on how outliers are calculated and removed
 
-            # get the chi and elevation data for the main stem
-            movern_key = 'm_over_n = %s' %(str(best_fit_movern))
-            MainStemX = list(ProfileDF_MS[movern_key])
-            MainStemElevation = list(ProfileDF_MS['elevation'])
+    Args:
+        DataDirectory (str): the data directory with the m/n csv files
+        fname_prefix (str): The prefix for the m/n csv files
+        basin_list: a list of the basins to make the plots for. If an empty list is passed then
+        all the basins will be analysed. Default = basin 0.
+        start_movern (float): the starting m/n value. Default is 0.2
+        d_movern (float): the increment between the m/n values. Default is 0.1
+        n_movern (float): the number of m/n values analysed. Default is 7.
+        n_workers (int): the number of processes making figures. Defaults to 4 or the number of CPUs if fewer, see RunFigureTasks.
+        progress_hook (function): called after each figure, see RunFigureTasks
 
-            # get the chi, elevation, and MLE for the tributaries
-            TributariesX_outliers = list(ProfileDF_trib_outliers[movern_key])
-            TributariesElevation_outliers = list(ProfileDF_trib_outliers['elevation'])
-            #TributariesMLE_outliers = list(ProfileDF_trib_outliers['MLE'])
+    Returns:
+        Plots of chi profiles with basins removed, and a list with the (filename, seconds) of each figure.
 
-            TributariesX_kept = list(ProfileDF_trib_kept[movern_key])
-            TributariesElevation_kept = list(ProfileDF_trib_kept['elevation'])
-            TributariesMLE_kept = list(ProfileDF_trib_kept['MLE'])
+    Author: SMM
+    """
+    # First we get all the information about outliers, m/n values and MLE
+    # values from the CheckMLEOutliers function. If the basin list is empty this does all the basins.
+    Outlier_counter, removed_sources_dict, best_fit_movern_dict, MLEs_dict = CheckMLEOutliers(DataDirectory, fname_prefix, basin_list, start_movern, d_movern, n_movern, parallel=parallel)
+    basin_list = list(best_fit_movern_dict.keys())
 
-            # now reset the
+    # now we need a plot for each basin, showing the incremental removal of outlying tribs
+    # each best fit m/n is for a given number of removed outlying tributaries
+    tasks = []
+    for basin_number in basin_list:
+        these_removed_sources = removed_sources_dict[basin_number]
+        removed_sources_list = []
+        for idx,best_fit_movern in enumerate(best_fit_movern_dict[basin_number]):
+            # Note that index 0 is the basin with no removed tributaries.
+            if idx != 0:
+                removed_sources_list.extend(int(i) for i in these_removed_sources[idx-1])
+            tasks.append((basin_number, idx, float(best_fit_movern), list(removed_sources_list),
+                          DataDirectory, size_format, FigFormat))
 
-            # get the colourmap to colour channels by the MLE value
-            #NUM_COLORS = len(MLE)
-            MLE_array = np.asarray(TributariesMLE_kept)
-            this_cmap = plt.cm.Reds
-            cNorm  = colors.Normalize(vmin=np.min(MLE_array), vmax=np.max(MLE_array))
-            plt.cm.ScalarMappable(norm=cNorm, cmap=this_cmap)
+    # the workers only need the fullstats files of the best fit m/n values
+    movern_strs = sorted(set(_MOverNString(task[2]) for task in tasks))
 
-            # now plot the data with a colourmap
-            sc = ax.scatter(TributariesX_kept,TributariesElevation_kept,c=TributariesMLE_kept,cmap=this_cmap, norm=cNorm, s=2.5, edgecolors='none')
+    return RunFigureTasks(_RenderProfileRemovingOutliers, tasks, _LoadChiProfileData,
+                          (DataDirectory, fname_prefix, parallel, movern_strs),
+                          n_workers=n_workers, progress_hook=progress_hook)
 
-            # Add the outliers if the basin has them
-            if(len(removed_sources_list)>0):
-                ax.scatter(TributariesX_outliers,TributariesElevation_outliers,c="b", norm=cNorm, s=2.5, edgecolors='none', alpha = 0.3)
+def _RenderMLEWithMOverN(data, task):
+    """
+    Makes the plot of the MLE against m/n for one basin. See PlotMLEWithMOverN.
 
-            ax.plot(MainStemX,MainStemElevation,lw=2, c='k')
+    Args:
+        data: not used, this figure only needs what is in the task
+        task (tuple): (basin_number, basin_MLEs, best_fit_moverns, m_over_n_values, start_movern, d_movern, MLE_directory, size_format, FigFormat)
 
-            # some formatting of the figure
-            ax.spines['top'].set_linewidth(1)
-            ax.spines['left'].set_linewidth(1)
-            ax.spines['right'].set_linewidth(1)
-            ax.spines['bottom'].set_linewidth(1)
+    Returns:
+        The figure filename
 
-            # make the lables
-            ax.set_xlabel("$\chi$ (m)")
-            ax.set_ylabel("Elevation (m)")
+    Author: FJC
+    """
+    import matplotlib.patches as patches
 
-            # label with the basin and m/n
-            title_string = "Basin "+str(basin_number)+", best fit "+r'$\theta$' + " = str(best_fit_movern)"
-            ax.text(0.05, 0.95, title_string,
-                    verticalalignment='top', horizontalalignment='left',
-                    transform=ax.transAxes,
-                    color='black', fontsize=10)
+    basin_number, basin_MLEs, best_fit_moverns, m_over_n_values, start_movern, d_movern, MLE_directory, size_format, FigFormat = task
+    print ("This basin is: " +str(basin_number))
 
-            # add the colorbar
-            colorbarlabel = "$MLE$"
-            cbar = plt.colorbar(sc,cmap=this_cmap,spacing='uniform', orientation='vertical',cax=ax2)
-            cbar.set_label(colorbarlabel, fontsize=10)
-            ax2.set_ylabel(colorbarlabel, fontname='Liberation Sans', fontsize=10)
+    # make a figure
+    fig = makefigure(size_format)
 
-            #save the plot
-            newFilename = DataDirectory+"MLE_profiles"+str(basin_number)+"_"+str(best_fit_movern)+"_removed_"+str(idx)+".png"
+    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=0.85,top=0.9)
+    ax = fig.add_subplot(gs[5:100,10:95])
 
-            # This gets all the ticks, and pads them away from the axis so that the corners don't overlap
-            ax.tick_params(axis='both', width=1, pad = 2)
-            for tick in ax.xaxis.get_major_ticks():
-                tick.set_pad(2)
+    # get the MLE of the best fit m over n with no removed tributaries
+    best_fit_movern = best_fit_moverns[0]
+    # get the index in the MLE list
+    idx = int(round((best_fit_movern - start_movern)/d_movern,0))
+    best_fit_MLE = basin_MLEs[idx][0]
+    print ("The best fit MLE is: "+str(best_fit_MLE)+", where "+ r'$\theta$'  ' = '+str(best_fit_movern))
+
+    # get the ratio of the MLEs to the best fit
+    ratio_MLEs = [x/best_fit_MLE for x in basin_MLEs[:,0]]
+
+    # plot the data
+    ax.scatter(m_over_n_values,ratio_MLEs, label = str(0), c='k', s=5, zorder=100)
+    ax.plot(m_over_n_values,ratio_MLEs, c='0.75', ls="--")
+
+    # get the limits for the arrow
+    max_MLE = max(ratio_MLEs)
+    min_MLE = min(ratio_MLEs)
+    dy = (max_MLE-min_MLE)/8
+    spacing = 1.5
+    # add arrow at best fit m/n
+    ax.add_patch(
+        patches.Arrow(
+            best_fit_movern, #x
+            max_MLE-(dy*spacing), #y
+            0, #dx
+            dy, #dy
+            width = 0.05,
+            facecolor = 'r',
+            edgecolor = 'r')
+        )
+    ax.text(best_fit_movern-0.09, max_MLE-1.5*(dy*spacing), "Best-fit " + r"$\theta$ = "+str(best_fit_movern),fontsize=8, color="r")
 
-            plt.savefig(newFilename,format=FigFormat,dpi=300)
-            ax.cla()
-            ax2.cla()
+    # set the axes labels
+    ax.set_xlabel(r'$\theta$')
+    ax.set_ylabel('MLE')
+
+    # set the ylim
+    ax.set_ylim(min_MLE,max_MLE+(dy*spacing))
+
+    # some formatting of the figure
+    ax.spines['top'].set_linewidth(1)
+    ax.spines['left'].set_linewidth(1)
+    ax.spines['right'].set_linewidth(1)
+    ax.spines['bottom'].set_linewidth(1)
+
+    #save the plot
+    newFilename = MLE_directory+"MLE_fxn_movern_"+str(basin_number)+"."+FigFormat
+
+    # This gets all the ticks, and pads them away from the axis so that the corners don't overlap
+    ax.tick_params(axis='both', width=1, pad = 2)
+    for tick in ax.xaxis.get_major_ticks():
+        tick.set_pad(2)
+    ax.xaxis.set_major_locator(ticker.MultipleLocator(base=0.1))
+
+    plt.savefig(newFilename,format=FigFormat,dpi=300)
+    plt.close(fig)
+
+    return newFilename
 
-def PlotMLEWithMOverN(DataDirectory, fname_prefix, basin_list = [0], size_format='ESURF', FigFormat='png', start_movern=0.2, d_movern = 0.1, n_movern = 7, parallel=False):
+def PlotMLEWithMOverN(DataDirectory, fname_prefix, basin_list = [0], size_format='ESURF', FigFormat='png', start_movern=0.2, d_movern = 0.1, n_movern = 7, parallel=False,
+                      n_workers=None, progress_hook=None):
     """
     This function makes a plot of the MLE values for each m/n showing how the MLE values change
     as you remove the tributaries.
@@ -2165,176 +2380,33 @@ def PlotMLEWithMOverN(DataDirectory, fname_prefix, basin_list = [0], size_format
         start_movern (float): the starting m/n value. Default is 0.2
         d_movern (float): the increment between the m/n values. Default is 0.1
         n_movern (float): the number of m/n values analysed. Default is 7.
+        n_workers (int): the number of processes making figures. Defaults to 4 or the number of CPUs if fewer, see RunFigureTasks.
+        progress_hook (function): called after each figure, see RunFigureTasks
 
     Returns:
-        Plots of MLE values for each m/n
+        Plots of MLE values for each m/n, and a list with the (filename, seconds) of each figure.
 
     Author: FJC
     """
-    from cycler import cycler
-    from matplotlib import lines
-    import matplotlib.patches as patches
-
     # check if a directory exists for the MLE plots. If not then make it.
     MLE_directory = DataDirectory+'MLE_plots/'
     if not os.path.isdir(MLE_directory):
         os.makedirs(MLE_directory)
 
-    # Set up fonts for plots
-    label_size = 10
-    rcParams['font.family'] = 'sans-serif'
-    rcParams['font.sans-serif'] = ['Liberation Sans']
-    rcParams['font.size'] = label_size
-
-    # set colours for tributaries
-    # plt.rc('axes', prop_cycle=(cycler('color', ['k', '0.5', '0.5', '0.5', '0.5']) +
-    #                        cycler('linestyle', ['-', '--', ':', '-.', '--'])))
-
-    # make a figure
-    fig = makefigure(size_format)
-
-
-    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=0.85,top=0.9)
-    ax = fig.add_subplot(gs[5:100,10:95])
-
-    # we open the first file just so that we can get a counter list
-    if not parallel:
-        FirstDF = Helper.ReadFullStatsCSV(DataDirectory,fname_prefix,start_movern)
-    else:
-        FirstDF = Helper.AppendFullStatsCSVs(DataDirectory,start_movern,fname_prefix)
-
     # get the list of m over n values
     end_movern = start_movern+d_movern*(n_movern-1)
     m_over_n_values = np.linspace(start_movern,end_movern,n_movern)
 
-    # get the number of basins
-    basin_keys = list(FirstDF['basin_key'])
-    basin_keys = [float(x) for x in basin_keys]
-
-    # get the list of basins
-    if basin_list == []:
-        print("You didn't give me a list of basins, so I'll just run the analysis on all of them!")
-        basin_list = basin_keys
-        basin_set = set(basin_list)
-        basin_list = list(basin_set)
-        basin_list = [int(i) for i in basin_list]
-
     # First we get all the information about outliers, m/n values and MLE
-    # values from the CheckMLEOutliers function
+    # values from the CheckMLEOutliers function. If the basin list is empty this does all the basins.
     Outlier_counter, removed_sources_dict, best_fit_movern_dict, MLEs_dict = CheckMLEOutliers(DataDirectory, fname_prefix, basin_list, start_movern, d_movern, n_movern, parallel=parallel)
+    basin_list = list(best_fit_movern_dict.keys())
 
-    # Now get the chi profiles of all the basins and channels
-    # Load from file and put into a pandas data frame
-    if not parallel:
-        ProfileDF = Helper.ReadChiProfileCSV(DataDirectory,fname_prefix)
-    else:
-        ProfileDF = Helper.AppendMovernCSV(DataDirectory,fname_prefix)
-
-    # get list of line styles for plotting. This is hacky but not sure how else to do this.
-    ls = lines.lineStyles.keys()
-    ls = ls[3:]
-    ls = ls + ls
+    # everything the figures need is in the tasks, so the workers don't load anything
+    tasks = [(basin_number, MLEs_dict[basin_number], best_fit_movern_dict[basin_number], m_over_n_values,
+              start_movern, d_movern, MLE_directory, size_format, FigFormat) for basin_number in basin_list]
 
-    # loop through each basin and each number of removed tributaries
-    for basin_number in basin_list:
-
-        print ("This basin is: " +str(basin_number))
-
-        # Get the removed sources indices and the MLEs for this particular basin
-        basin_removed_sources = removed_sources_dict[basin_number]
-        n_removed_sources = len(basin_removed_sources)
-        basin_MLEs = MLEs_dict[basin_number]
-
-        # get the best fit m over ns for this basin
-        best_fit_moverns = best_fit_movern_dict[basin_number]
-        print (best_fit_moverns)
-
-        # colours for each iteration
-        #colours = np.linspace(0.9,0.2,len(n_removed_sources)+1)
-
-
-        # loop through the number of removed tributaires and get the MLE for each m/n for each iteration
-        for i in range(n_removed_sources+1):
-
-            # get the MLE of the best fit m over n
-            best_fit_movern = best_fit_moverns[i]
-            # get the index in the MLE list
-            idx = int(round((best_fit_movern - start_movern)/d_movern,0))
-            print (idx)
-            best_fit_MLE = basin_MLEs[idx][i]
-            print ("The best fit MLE is: "+str(best_fit_MLE)+", where "+ r'$\theta$'  ' = '+str(best_fit_movern))
-
-            # get the MLEs for this iteration
-            these_MLEs = basin_MLEs[:,i]
-
-            # get the ratio of these MLEs to the best fit
-            ratio_MLEs = [x/best_fit_MLE for x in these_MLEs]
-
-            # no removed tributaries
-            if i == 0:
-                # plot the data
-                ax.scatter(m_over_n_values,ratio_MLEs, label = str(i), c='k', s=5, zorder=100)
-                ax.plot(m_over_n_values,ratio_MLEs, c='0.75', ls="--")
-
-                # get the limits for the arrow
-                max_MLE = max(ratio_MLEs)
-                min_MLE = min(ratio_MLEs)
-                dy = (max_MLE-min_MLE)/8
-                spacing = 1.5
-                # add arrow at best fit m/n
-                ax.add_patch(
-                    patches.Arrow(
-                        best_fit_movern, #x
-                        max_MLE-(dy*spacing), #y
-                        0, #dx
-                        dy, #dy
-                        width = 0.05,
-                        facecolor = 'r',
-                        edgecolor = 'r')
-                    )
-                ax.text(best_fit_movern-0.09, max_MLE-1.5*(dy*spacing), "Best-fit " + r"$\theta$ = "+str(best_fit_movern),fontsize=8, color="r")
-            #remove tribs
-            #else:
-                # plot the data
-                #ax.scatter(m_over_n_values,ratio_MLEs, label = str(i), s=5, c=colours[i]) # different linestyle for each iteration?
-
-        # set the axes labels
-        ax.set_xlabel(r'$\theta$')
-        ax.set_ylabel('MLE')
-
-        # set the ylim
-        ax.set_ylim(min_MLE,max_MLE+(dy*spacing))
-
-        # add the legend
-        #ax.legend(loc='right', bbox_to_anchor=(1.25,0.5), title = 'Iterations', frameon=False)
-
-        # some formatting of the figure
-        ax.spines['top'].set_linewidth(1)
-        ax.spines['left'].set_linewidth(1)
-        ax.spines['right'].set_linewidth(1)
-        ax.spines['bottom'].set_linewidth(1)
-
-        # label with the basin and m/n
-        best_fit_movern = best_fit_movern_dict[basin_number][0]
-        #title_string = "Basin "+str(basin_number)+"; Best fit $m/n$: "+str(best_fit_movern)
-        #ax.set_title(title_string)
-        # ax.text(0, 1.1, title_string,
-        #     verticalalignment='top', horizontalalignment='left',
-        #     transform=ax.transAxes,
-        #     color='red', fontsize=10)
-
-        #save the plot
-        newFilename = MLE_directory+"MLE_fxn_movern_"+str(basin_number)+"."+FigFormat
-
-        # This gets all the ticks, and pads them away from the axis so that the corners don't overlap
-        ax.tick_params(axis='both', width=1, pad = 2)
-        for tick in ax.xaxis.get_major_ticks():
-            tick.set_pad(2)
-        ax.xaxis.set_major_locator(ticker.MultipleLocator(base=0.1))
-
-        plt.savefig(newFilename,format=FigFormat,dpi=300)
-        ax.cla()
-    plt.close(fig)
+    return RunFigureTasks(_RenderMLEWithMOverN, tasks, n_workers=n_workers, progress_hook=progress_hook)
 
 def MakeMOverNSummaryPlot(DataDirectory, fname_prefix, basin_list=[], start_movern=0.2, d_movern=0.1, n_movern=7,
                           size_format='ESURF', FigFormat='png',
@@ -3550,7 +3622,77 @@ def plot_MCMC_analysis(DataDirectory,fname_prefix,basin_list=[],FigFormat='png',
         plt.savefig(ImageName, format=FigFormat, dpi=300)
         ax.cla()
 
-def PlotMCPointsUncertainty(DataDirectory,fname_prefix, basin_list=[0], FigFormat='png',size_format='ESURF', start_movern=0.2,d_movern=0.1,n_movern=7,parallel=False):
+def _RenderMCPointsUncertainty(data, task):
+    """
+    Makes the plot of the MC points uncertainty of one basin. See PlotMCPointsUncertainty.
+
+    Args:
+        data: not used, this figure only needs what is in the task
+        task (tuple): (basin_key, all_moverns, Medians, FirstQs, ThirdQs, threshold, min_movern, max_movern,
+        best_fit_movern, ImageName, size_format, FigFormat)
+
+    Returns:
+        The figure filename
+
+    Author: FJC
+    """
+    import matplotlib.patches as patches
+
+    (basin_key, all_moverns, Medians, FirstQs, ThirdQs, threshold, min_movern, max_movern,
+     best_fit_movern, ImageName, size_format, FigFormat) = task
+    print ("This basin is: "+str(basin_key))
+
+    # make a figure
+    fig = makefigure(size_format)
+
+    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=0.85,top=0.9)
+    ax = fig.add_subplot(gs[5:100,10:95])
+
+    #plot the median and quartiles
+    ax.plot(all_moverns,Medians,c="k",lw=1,zorder=2)
+    ax.plot(all_moverns,FirstQs,c="k", lw=0.5, ls="--",zorder=2)
+    ax.plot(all_moverns,ThirdQs,c="k", lw=0.5, ls="--",zorder=2)
+    ax.fill_between(all_moverns, FirstQs, ThirdQs, color="0.8",alpha=0.75,zorder=1)
+
+    #add a line for the threshold
+    threshold_MLEs = np.full((len(all_moverns),),threshold)
+    ax.plot(all_moverns,threshold_MLEs,c='r',zorder=3, ls="--",lw=1)
+
+    # add shaded background over range of m/n values
+    ax.axvspan(min_movern,max_movern, alpha=0.1, color='red',zorder=0.2)
+
+    # get the limits for the arrow
+    max_MLE = max(Medians)
+    min_MLE = min(FirstQs)
+    dy = (max_MLE-min_MLE)/8
+    spacing = 1.5
+    # add arrow at best fit m/n
+    ax.add_patch(
+        patches.Arrow(
+            best_fit_movern, #x
+            max_MLE-(dy*spacing), #y
+            0, #dx
+            dy, #dy
+            width = 0.05,
+            facecolor = 'k',
+            edgecolor = 'k')
+        )
+    ax.text(best_fit_movern-0.075, max_MLE-1.5*(dy*spacing), "Best-fit "+r"$\theta$",fontsize=8)
+
+    # set the axes labels
+    ax.set_xlabel(r'$\theta$')
+    ax.set_ylabel('MLE')
+    ax.set_xlim(all_moverns[0],all_moverns[-1])
+    ax.set_ylim(min(FirstQs),max(ThirdQs)+0.0005)
+
+    # save the figure
+    plt.savefig(ImageName, format=FigFormat, dpi=300)
+    plt.close(fig)
+
+    return ImageName
+
+def PlotMCPointsUncertainty(DataDirectory,fname_prefix, basin_list=[0], FigFormat='png',size_format='ESURF', start_movern=0.2,d_movern=0.1,n_movern=7,parallel=False,
+                            n_workers=None, progress_hook=None):
     """
     This function makes a plot showing the range in m/n calculated
     using the MC points analysis. Makes a separate plot for each basin.
@@ -3561,15 +3703,15 @@ def PlotMCPointsUncertainty(DataDirectory,fname_prefix, basin_list=[0], FigForma
         basin_list: list of basins to be analysed. If empty then will analyse all of them.
         FigFormat (str): The format of the figure. Usually 'png' or 'pdf'. If "show" then it calls the matplotlib show() command.
         size_format (str): Can be "big" (16 inches wide), "geomorphology" (6.25 inches wide), or "ESURF" (4.92 inches wide) (defualt esurf).
+        n_workers (int): the number of processes making figures. Defaults to 4 or the number of CPUs if fewer, see RunFigureTasks.
+        progress_hook (function): called after each figure, see RunFigureTasks
 
     Returns:
-        plot of uncertainty in m/n
+        plot of uncertainty in m/n, and a list with the (filename, seconds) of each figure.
 
     Author:
         FJC
     """
-    import matplotlib.patches as patches
-
     # check if a directory exists for the chi plots. If not then make it.
     points_directory = DataDirectory+'MC_points_plots/'
     if not os.path.isdir(points_directory):
@@ -3581,7 +3723,7 @@ def PlotMCPointsUncertainty(DataDirectory,fname_prefix, basin_list=[0], FigForma
     else:
         basin_df = Helper.AppendBasinInfoCSVs(DataDirectory,fname_prefix)
 
-    basin_keys = basin_df['basin_key']
+    basin_keys = list(basin_df['basin_key'])
 
     if basin_list == []:
         print ("You didn't give me a basin list so I'm going to plot all of them!")
@@ -3597,19 +3739,6 @@ def PlotMCPointsUncertainty(DataDirectory,fname_prefix, basin_list=[0], FigForma
 
     UncertaintyDF = GetMOverNRangeMCPoints(PointsChiBasinDF,start_movern,d_movern,n_movern)
 
-    # set up the plot
-    # Set up fonts for plots
-    label_size = 10
-    rcParams['font.family'] = 'sans-serif'
-    rcParams['font.sans-serif'] = ['Liberation Sans']
-    rcParams['font.size'] = label_size
-
-    # make a figure
-    fig = makefigure(size_format)
-
-    gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=0.85,top=0.9)
-    ax = fig.add_subplot(gs[5:100,10:95])
-
     if not parallel:
         BasinStatsDF = Helper.ReadBasinStatsCSV(DataDirectory,fname_prefix)
     else:
@@ -3617,12 +3746,16 @@ def PlotMCPointsUncertainty(DataDirectory,fname_prefix, basin_list=[0], FigForma
     # best fit moverns
     best_fit_moverns = SimpleMaxMLECheck(BasinStatsDF)
 
-    for basin_key in basin_keys:
-        ThisBasinDF = PointsChiBasinDF[PointsChiBasinDF['basin_key'] == basin_key]
+    # get the m/ns tested
+    end_movern = start_movern+d_movern*(n_movern-1)
+    all_moverns = np.linspace(start_movern,end_movern,n_movern)
 
-        # get the m/ns tested
-        end_movern = start_movern+d_movern*(n_movern-1)
-        all_moverns = np.linspace(start_movern,end_movern,n_movern)
+    # the figures only need a few values from each basin, so these go in the tasks
+    PointsByBasin = _GroupByBasin(PointsChiBasinDF)
+    UncertaintyByBasin = _GroupByBasin(UncertaintyDF)
+    tasks = []
+    for basin_key in basin_list:
+        ThisBasinDF = PointsByBasin[int(basin_key)]
 
         # get the median m/ns for this basin
         Medians = (ThisBasinDF.filter(regex='median')).values.tolist()[-1]
@@ -3630,59 +3763,17 @@ def PlotMCPointsUncertainty(DataDirectory,fname_prefix, basin_list=[0], FigForma
         ThirdQs = (ThisBasinDF.filter(regex='TQ')).values.tolist()[-1]
 
         # now get the threshold value
-        ThisUncertaintyDF = UncertaintyDF[UncertaintyDF['basin_key'] == basin_key]
+        ThisUncertaintyDF = UncertaintyByBasin[int(basin_key)]
         print (ThisUncertaintyDF)
-
-        #plot the median and quartiles
-        ax.plot(all_moverns,Medians,c="k",lw=1,zorder=2)
-        ax.plot(all_moverns,FirstQs,c="k", lw=0.5, ls="--",zorder=2)
-        ax.plot(all_moverns,ThirdQs,c="k", lw=0.5, ls="--",zorder=2)
-        ax.fill_between(all_moverns, FirstQs, ThirdQs, color="0.8",alpha=0.75,zorder=1)
-
-        #add a line for the threshold
         threshold = ThisUncertaintyDF.iloc[0]['FirstQ_threshold']
         min_movern = ThisUncertaintyDF.iloc[0]['Min_MOverNs']
         max_movern = ThisUncertaintyDF.iloc[0]['Max_MOverNs']
-        threshold_moverns = np.linspace(min_movern,max_movern, 4)
-        threshold_MLEs = np.full((n_movern,),threshold)
-        ax.plot(all_moverns,threshold_MLEs,c='r',zorder=3, ls="--",lw=1)
-
-        # add shaded background over range of m/n values
-        ax.axvspan(min_movern,max_movern, alpha=0.1, color='red',zorder=0.2)
-
-        # add arrow at best fit m/n
-        # get the limits for the arrow
-        max_MLE = max(Medians)
-        min_MLE = min(FirstQs)
-        dy = (max_MLE-min_MLE)/8
-        spacing = 1.5
-        # add arrow at best fit m/n
-        ax.add_patch(
-            patches.Arrow(
-                best_fit_moverns[basin_key], #x
-                max_MLE-(dy*spacing), #y
-                0, #dx
-                dy, #dy
-                width = 0.05,
-                facecolor = 'k',
-                edgecolor = 'k')
-            )
-        ax.text(best_fit_moverns[basin_key]-0.075, max_MLE-1.5*(dy*spacing), "Best-fit "+r"$\theta$",fontsize=8)
-
-        # set the axes labels
-        ax.set_xlabel(r'$\theta$')
-        ax.set_ylabel('MLE')
-        #ax.set_title('Basin '+str(basin_key))
-        ax.set_xlim(start_movern,end_movern)
-        ax.set_ylim(min(FirstQs),max(ThirdQs)+0.0005)
 
-        # save the figure
         ImageName = points_directory+fname_prefix+'_MC_points' +str(basin_key)+'.'+FigFormat
-        plt.savefig(ImageName, format=FigFormat, dpi=300)
-        ax.cla()
+        tasks.append((basin_key, all_moverns, Medians, FirstQs, ThirdQs, threshold, min_movern, max_movern,
+                      best_fit_moverns[basin_key], ImageName, size_format, FigFormat))
 
-    fig.clf()
-    plt.close(fig)
+    return RunFigureTasks(_RenderMCPointsUncertainty, tasks, n_workers=n_workers, progress_hook=progress_hook)
 
 #=============================================================================
 # SENSITIVITY FUNCTIONS
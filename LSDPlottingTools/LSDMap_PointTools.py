@@ -15,7 +15,65 @@ import os
 import glob
 import pandas
 import numpy as np
+import threading
 from pyproj import Proj, transform
+try:
+    from pyproj import Transformer
+except ImportError:
+    # pyproj < 2.1
+    Transformer = None
+
+
+#==============================================================================
+# Building a projection is slow, so there is one transformer for each pair of
+# coordinate systems and it is shared by everything in the process
+#==============================================================================
+_transformers = {}
+_transformers_lock = threading.Lock()
+
+def GetCoordinateTransformer(source_EPSG_string, target_EPSG_string):
+    """Gets a function that converts coordinates from one coordinate system to another.
+    The transformers are cached so they are only built once for each pair.
+
+    Args:
+        source_EPSG_string (str): The EPSG code of the coordinates you have, e.g. "epsg:4326" for WGS84 latitude and longitude
+        target_EPSG_string (str): The EPSG code of the coordinates you want, e.g. "epsg:32630"
+
+    Returns:
+        A function that takes x and y (longitude and latitude for geographic coordinates) as arrays
+        or floats and returns the transformed x and y.
+
+    Author: SMM
+    """
+    key = (source_EPSG_string.lower().strip(), target_EPSG_string.lower().strip())
+    with _transformers_lock:
+        if key not in _transformers:
+            if Transformer is not None:
+                _transformers[key] = Transformer.from_crs(key[0], key[1], always_xy=True).transform
+            else:
+                inProj = Proj(init=key[0])
+                outProj = Proj(init=key[1])
+                _transformers[key] = lambda x, y: transform(inProj, outProj, x, y)
+        return _transformers[key]
+
+def TransformCoordinates(source_EPSG_string, target_EPSG_string, x, y):
+    """Converts arrays of coordinates from one coordinate system to another in one go.
+
+    Args:
+        source_EPSG_string (str): The EPSG code of the coordinates you have, e.g. "epsg:4326"
+        target_EPSG_string (str): The EPSG code of the coordinates you want
+        x (float or array): The x coordinates (longitude for geographic coordinates)
+        y (float or array): The y coordinates (latitude for geographic coordinates)
+
+    Returns:
+        The transformed x and y as numpy arrays (floats if you gave it floats)
+
+    Author: SMM
+    """
+    transformer = GetCoordinateTransformer(source_EPSG_string, target_EPSG_string)
+    if np.isscalar(x) and np.isscalar(y):
+        return transformer(x, y)
+    return transformer(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
 
 
 #==============================================================================
@@ -99,6 +157,9 @@ class LSDMap_PointData(object):
 
         Author: SMM
         """
+        # Projected coordinates are kept here so they are only computed once (see GetUTMEastingNorthing)
+        self._projected_coordinates = {}
+
         if(data_type == "csv"):
             # This gets the filename without the .csv
             file_prefix = LSDOst.GetFilePrefix(FileName)
@@ -378,85 +439,63 @@ class LSDMap_PointData(object):
                 this_list = self.PointData[data_name].tolist()
                 return this_list
 
+    def _projected(self, EPSG_string, key, source, latitude_getter, longitude_getter):
+        """Projects latitude and longitude to EPSG_string, or returns the coordinates projected earlier.
+        They are reused as long as source (the latitude, or the data, they came from) is the same object,
+        so thinning the data, which replaces them, means they are projected again.
+
+        Author: SMM
+        """
+        key = (EPSG_string.lower().strip(),)+key
+        if key in self._projected_coordinates:
+            cached_source, easting, northing = self._projected_coordinates[key]
+            if cached_source is source:
+                return easting.copy(), northing.copy()
+
+        easting, northing = TransformCoordinates("epsg:4326", EPSG_string, longitude_getter(), latitude_getter())
+        easting = np.asarray(easting, dtype=float)
+        northing = np.asarray(northing, dtype=float)
+        self._projected_coordinates[key] = (source, easting, northing)
+        return easting.copy(), northing.copy()
+
     def GetUTMEastingNorthing(self,EPSG_string):
-        """Returns two lists: the latitude and longitude converted to northing and easting.
+        """Returns two arrays: the latitude and longitude converted to northing and easting.
+        The result is kept, so plotting the same points again doesn't reproject them.
 
         Args:
-            PrintToScreen (bool): If true, prints to screen.
             EPSG_string (str): The EPSG code of the UTM coordinates you want (326XX) with zone XX is for north, 327XX is for south.
 
         Return:
-            float: Two lists containing easting and northing
+            float: Two arrays containing easting and northing
 
         Author: SMM
         """
         print("Yo, getting this stuff: "+EPSG_string)
         # The lat long are in epsg 4326 which is WGS84
-        inProj = Proj(init='epsg:4326')
-        outProj = Proj(init=EPSG_string)
-        #this_Lat = self.Latitude[0]
-        #this_Lon = self.Longitude[0]
-
-        #print("The latitude is: ")
-        #print(self.Latitude)
-        
-        #print("Now the lat is")
-        #print(self.Latitude.values)
-        #print(this_Lon)
-
-        easting =[]
-        northing = []
-        if(self.PANDEX == True):
-            # Adding exception management, depending on your version of the different packages you may have to add the .values or not
-            try:
-                easting,northing = transform(inProj,outProj,self.Longitude.values,self.Latitude.values)
-            except AttributeError:
-                easting,northing = transform(inProj,outProj,self.Longitude,self.Latitude)
-        else:
-            for idx, Lon in enumerate(self.Longitude):
-                Lat = self.Latitude[idx]
-                ea,no = transform(inProj,outProj,Lon,Lat)
-                easting.append(ea)
-                northing.append(no)
-
-        return easting,northing
+        return self._projected(EPSG_string, ("latitude","longitude"), self.Latitude,
+                               lambda: np.asarray(self.Latitude, dtype=float),
+                               lambda: np.asarray(self.Longitude, dtype=float))
 
     def GetUTMEastingNorthingFromQuery(self,EPSG_string,Latitude_string,Longitude_string):
-        """Returns two lists: the latitude and longitude converted to northing and easting. But you can define the columns if there are more than one latitude and longitude columns.
+        """Returns two arrays: the latitude and longitude converted to northing and easting. But you can define the columns if there are more than one latitude and longitude columns.
 
         Note:
             This is used mainly if there are multple lat-long coordinates in the csv file. For example when you have basin centroids and basin outlets in the same file.
         Args:
-            PrintToScreen (bool): If true, prints to screen.
             EPSG_string (str): The EPSG code of the UTM coordinates you want (326XX) with zone XX is for north, 327XX is for south.
             Latitude_string (str): The name of the latitude column you want
             Longitude_string (str): The name of the longitude column you want.
 
         Return:
-            float: Two lists containing easting and northing
+            float: Two arrays containing easting and northing
 
         Author: SMM
         """
         print("Yo, getting this stuff: "+EPSG_string)
         # The lat long are in epsg 4326 which is WGS84
-        inProj = Proj(init='epsg:4326')
-        outProj = Proj(init=EPSG_string)
-
-
-        this_Lat = self.QueryData(Latitude_string)
-        this_Lon = self.QueryData(Longitude_string)
-
-
-        easting =[]
-        northing = []
-
-        for idx, Lon in enumerate(this_Lon):
-            Lat = this_Lat[idx]
-            ea,no = transform(inProj,outProj,Lon,Lat)
-            easting.append(ea)
-            northing.append(no)
-
-        return easting,northing
+        return self._projected(EPSG_string, (Latitude_string, Longitude_string), self.PointData,
+                               lambda: np.asarray(self.QueryData(Latitude_string), dtype=float),
+                               lambda: np.asarray(self.QueryData(Longitude_string), dtype=float))
 
 
 
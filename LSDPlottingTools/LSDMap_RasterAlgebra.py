@@ -0,0 +1,384 @@
+## LSDMap_RasterAlgebra.py
+##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+## A small lazy raster algebra engine. Expressions on rasters are built up
+## with the usual operators and only evaluated when they are written or
+## reduced, a strip of rows at a time, so chained operations never make
+## intermediate rasters and the rasters can be larger than your RAM.
+##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+## SMM
+## 18/10/2026
+##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+from __future__ import absolute_import, division, print_function
+
+import os
+import numpy as np
+from . import LSDMap_GDALIO as LSDMap_IO
+
+#==============================================================================
+class RasterExpression(object):
+    """
+    A lazy expression of one or more rasters. Make one with LazyRaster and combine
+    them with +, -, *, /, **, comparisons, abs, where and apply, e.g.
+
+        dod = LazyRaster("DEM_2016.bil") - LazyRaster("DEM_2010.bil")
+        erosion = dod.where(dod < -0.1)
+        print(erosion.sum())
+        erosion.write("Erosion.bil")
+
+    Nothing is read until the expression is written or reduced. Then all the rasters
+    are read together a strip of rows at a time and the whole expression is evaluated
+    on each strip. Nodata is NaN: it propagates through arithmetic and comparisons,
+    and is ignored by the reductions. The rasters must all be on the same grid.
+
+    Author: SMM
+    """
+    def __init__(self, func = None, args = (), raster_file = None, raster_band = 1):
+        self._func = func
+        self._args = args
+        self.raster_file = raster_file
+        self.raster_band = raster_band
+
+    #--------------------------------------------------------------------------
+    # Building expressions
+    #--------------------------------------------------------------------------
+    def apply(self, func, *others):
+        """Makes an expression that calls func on the strips of this and any other
+        expressions (or numbers), e.g. raster.apply(np.sqrt).
+
+        Args:
+            func (function): takes numpy arrays and returns an array of the same shape
+            others: other RasterExpressions or numbers, passed to func after this one
+
+        Returns:
+            RasterExpression
+        """
+        return RasterExpression(func, (self,)+others)
+
+    def where(self, condition, other = np.nan):
+        """Keeps this raster where the condition is true and nodata is not involved,
+        and uses other everywhere else (by default, nodata).
+
+        Args:
+            condition (RasterExpression): e.g. raster > 0
+            other (float or RasterExpression): the value where the condition is false
+
+        Returns:
+            RasterExpression
+        """
+        def _where(values, cond, other_values):
+            return np.where(cond > 0, values, other_values)
+        return RasterExpression(_where, (self, condition, other))
+
+    def _binary(self, func, other, reverse = False):
+        if reverse:
+            return RasterExpression(func, (other, self))
+        return RasterExpression(func, (self, other))
+
+    def __add__(self, other): return self._binary(np.add, other)
+    def __radd__(self, other): return self._binary(np.add, other, True)
+    def __sub__(self, other): return self._binary(np.subtract, other)
+    def __rsub__(self, other): return self._binary(np.subtract, other, True)
+    def __mul__(self, other): return self._binary(np.multiply, other)
+    def __rmul__(self, other): return self._binary(np.multiply, other, True)
+    def __truediv__(self, other): return self._binary(np.true_divide, other)
+    def __rtruediv__(self, other): return self._binary(np.true_divide, other, True)
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+    def __pow__(self, other): return self._binary(np.power, other)
+    def __neg__(self): return RasterExpression(np.negative, (self,))
+    def __abs__(self): return RasterExpression(np.abs, (self,))
+
+    # Comparisons give 1 or 0, and nodata where either side is nodata
+    def __lt__(self, other): return self._binary(_Comparison(np.less), other)
+    def __le__(self, other): return self._binary(_Comparison(np.less_equal), other)
+    def __gt__(self, other): return self._binary(_Comparison(np.greater), other)
+    def __ge__(self, other): return self._binary(_Comparison(np.greater_equal), other)
+    def __eq__(self, other): return self._binary(_Comparison(np.equal), other)
+    def __ne__(self, other): return self._binary(_Comparison(np.not_equal), other)
+    __hash__ = object.__hash__
+
+    #--------------------------------------------------------------------------
+    # Evaluating expressions
+    #--------------------------------------------------------------------------
+    def _sources(self):
+        """The rasters in the expression, each once"""
+        sources = []
+        seen = set()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if not isinstance(node, RasterExpression) or id(node) in seen:
+                continue
+            seen.add(id(node))
+            if node._func is None:
+                sources.append(node)
+            else:
+                stack.extend(node._args)
+        return sources
+
+    def _evaluate(self, strips, memo):
+        if id(self) in memo:
+            return memo[id(self)]
+        if self._func is None:
+            values = strips[id(self)]
+        else:
+            args = [a._evaluate(strips, memo) if isinstance(a, RasterExpression) else a for a in self._args]
+            values = self._func(*args)
+        memo[id(self)] = values
+        return values
+
+    def GetGeoInfo(self):
+        """Gets the GetGeoInfo of the first raster in the expression, after checking all the rasters are on the same grid."""
+        sources = self._sources()
+        if len(sources) == 0:
+            raise Exception("This expression has no rasters in it.")
+        infos = [LSDMap_IO.GetGeoInfo(s.raster_file) for s in sources]
+        NDV, xsize, ysize, GeoT, Projection, DataType = infos[0]
+        for s, info in zip(sources[1:], infos[1:]):
+            if info[1] != xsize or info[2] != ysize or not np.allclose(info[3], GeoT):
+                raise Exception("The raster "+s.raster_file+" is not on the same grid as "+sources[0].raster_file)
+        return infos[0]
+
+    def strips(self, block_rows = 1024):
+        """Evaluates the expression a strip of rows at a time.
+
+        Args:
+            block_rows (int): the number of rows in each strip
+
+        Yields:
+            (int, np.array): the first row of the strip and the values, with NaN for nodata
+        """
+        NDV, xsize, ysize, GeoT, Projection, DataType = self.GetGeoInfo()
+        sources = self._sources()
+        readers = [LSDMap_IO.ReadRasterStrips(s.raster_file, block_rows, s.raster_band) for s in sources]
+        for parts in zip(*readers):
+            row = parts[0][0]
+            strips = dict((id(s), strip) for s, (i, strip) in zip(sources, parts))
+            values = self._evaluate(strips, {})
+            yield row, np.broadcast_to(values, parts[0][1].shape)
+
+    def to_array(self, block_rows = 1024):
+        """Evaluates the whole expression into a float32 array, with NaN for nodata."""
+        NDV, xsize, ysize, GeoT, Projection, DataType = self.GetGeoInfo()
+        out = np.empty((ysize, xsize), dtype=np.float32)
+        for row, values in self.strips(block_rows):
+            out[row:row+values.shape[0]] = values
+        return out
+
+    def summary(self, block_rows = 1024):
+        """Gets the count, sum, mean, min and max of the expression (ignoring nodata) in a single pass.
+
+        Returns:
+            dict
+        """
+        count = 0
+        total = 0.0
+        minimum = np.inf
+        maximum = -np.inf
+        for row, values in self.strips(block_rows):
+            values = values[np.isfinite(values)]
+            if values.size == 0:
+                continue
+            count += values.size
+            total += float(values.sum(dtype=np.float64))
+            minimum = min(minimum, float(values.min()))
+            maximum = max(maximum, float(values.max()))
+        if count == 0:
+            return {"count": 0, "sum": 0.0, "mean": np.nan, "min": np.nan, "max": np.nan}
+        return {"count": count, "sum": total, "mean": total/count, "min": minimum, "max": maximum}
+
+    def sum(self, block_rows = 1024):
+        """The sum of the expression, ignoring nodata"""
+        return self.summary(block_rows)["sum"]
+
+    def mean(self, block_rows = 1024):
+        """The mean of the expression, ignoring nodata"""
+        return self.summary(block_rows)["mean"]
+
+    def count(self, block_rows = 1024):
+        """The number of pixels of the expression that are not nodata"""
+        return self.summary(block_rows)["count"]
+
+    def statistics(self, percentiles = None, histogram_bins = None, histogram_range = None, block_rows = 1024):
+        """Gets the statistics of the expression in a single pass (see LSDMap_IO.RasterStatistics).
+
+        Returns:
+            dict: with count, min, max, mean, std, and percentiles and histogram if you asked for them
+        """
+        stats = LSDMap_IO.RasterStatistics(histogram_bins, histogram_range)
+        for row, values in self.strips(block_rows):
+            stats.add(values)
+        return stats.result(percentiles)
+
+    def write(self, new_raster_filename, driver_name = "ENVI", NoDataValue = -9999, block_rows = 1024):
+        """Writes the expression to a float32 raster a strip at a time, with the
+        georeferencing of the first raster in the expression.
+
+        Args:
+            new_raster_filename (str): The name of the raster to be written, with path and extension
+            driver_name (str): The raster format (see gdal documentation for options. LSDTopoTools used "ENVI" format.)
+            NoDataValue (float): The nodata value of the new raster
+            block_rows (int): the number of rows evaluated at a time
+        """
+        writer = RasterWriter(self._sources()[0].raster_file, new_raster_filename, driver_name, NoDataValue)
+        for row, values in self.strips(block_rows):
+            writer.write(row, values)
+        writer.close()
+
+class _Comparison(object):
+    """A comparison that gives 1 or 0 as floats, and NaN where either side is NaN"""
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, a, b):
+        result = self.func(a, b).astype(np.float32)
+        nodata = np.isnan(a) | np.isnan(b)
+        if np.any(nodata):
+            result = np.where(nodata, np.nan, result)
+        return result
+
+def LazyRaster(raster_file, raster_band = 1):
+    """Makes a RasterExpression from a raster. Nothing is read until the expression is used.
+
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+        raster_band (int): the band of the raster
+
+    Returns:
+        RasterExpression
+
+    Author: SMM
+    """
+    if os.path.exists(raster_file) is False:
+            raise Exception('[Errno 2] No such file or directory: \'' + raster_file + '\'')
+    return RasterExpression(raster_file = raster_file, raster_band = raster_band)
+#==============================================================================
+
+#==============================================================================
+# ENVI names of the datums GDAL uses most
+_ENVI_DATUMS = [("WGS84", "WGS-84"), ("WGS1984", "WGS-84"), ("WORLDGEODETICSYSTEM1984", "WGS-84"),
+                ("NAD83", "North America 1983"), ("NORTHAMERICAN1983", "North America 1983"), ("NORTHAMERICANDATUM1983", "North America 1983"),
+                ("NAD27", "North America 1927"), ("NORTHAMERICAN1927", "North America 1927"), ("NORTHAMERICANDATUM1927", "North America 1927")]
+
+def _ENVIMapInfo(GeoT, Projection):
+    """Makes the map info of an ENVI header (without the braces) from a geotransform
+    and an osr.SpatialReference. UTM and lat/lon on a datum ENVI knows get their
+    ENVI names, anything else gets the name of its projection (GDAL reads the
+    projection from the coordinate system string anyway)."""
+    corner = ", ".join(["1", "1", str(GeoT[0]), str(GeoT[3]), str(GeoT[1]), str(-GeoT[5])])
+
+    datum = None
+    name = None
+    try:
+        datum_name = "".join(c for c in str(Projection.GetAttrValue("DATUM")).upper() if c.isalnum())
+        for key, envi_name in _ENVI_DATUMS:
+            if key in datum_name:
+                datum = envi_name
+                break
+        if Projection.IsProjected():
+            name = Projection.GetAttrValue("PROJCS")
+            zone = Projection.GetUTMZone()
+            if zone != 0 and datum is not None:
+                hemisphere = "North" if zone > 0 else "South"
+                return "UTM, "+corner+", "+str(abs(zone))+", "+hemisphere+", "+datum+", units=Meters"
+        elif Projection.IsGeographic():
+            name = Projection.GetAttrValue("GEOGCS")
+            if datum is not None:
+                return "Geographic Lat/Lon, "+corner+", "+datum+", units=Degrees"
+    except Exception:
+        pass
+
+    if not name:
+        name = "Arbitrary"
+    # commas and braces would break the header
+    name = name.replace(",", " ").replace("{", "(").replace("}", ")")
+    return name+", "+corner
+
+class RasterWriter(object):
+    """
+    Writes a single band float32 raster a strip of rows at a time, with the
+    size and georeferencing of a template raster. ENVI rasters are written
+    directly (through a memory map) with the map info and coordinate system of
+    the template, which are made from its geotransform and projection if it isn't
+    an ENVI raster; other formats go through GDAL. NaNs are written as the nodata value.
+
+    Args:
+        template_raster (str): a raster with the grid of the new one
+        new_raster_filename (str): The name of the raster to be written, with path and extension
+        driver_name (str): The raster format (see gdal documentation for options. LSDTopoTools used "ENVI" format.)
+        NoDataValue (float): The nodata value
+
+    Author: SMM
+    """
+    def __init__(self, template_raster, new_raster_filename, driver_name = "ENVI", NoDataValue = -9999):
+        NDV, xsize, ysize, GeoT, Projection, DataType = LSDMap_IO.GetGeoInfo(template_raster)
+        self.shape = (ysize, xsize)
+        self.NoDataValue = NoDataValue
+        self.filename = new_raster_filename
+        self._band = None
+        self._dataset = None
+
+        if driver_name == "ENVI":
+            self._write_envi_header(template_raster, GeoT, Projection)
+            self.array = np.memmap(new_raster_filename, dtype="<f4", mode="w+", shape=self.shape)
+        else:
+            driver = LSDMap_IO.gdal.GetDriverByName(driver_name)
+            self._dataset = driver.Create(new_raster_filename, xsize, ysize, 1, LSDMap_IO.gdal.GDT_Float32)
+            self._dataset.SetGeoTransform(GeoT)
+            self._dataset.SetProjection(Projection.ExportToWkt())
+            self._band = self._dataset.GetRasterBand(1)
+            self._band.SetNoDataValue(NoDataValue)
+            self.array = None
+
+    def _write_envi_header(self, template_raster, GeoT, Projection):
+        ysize, xsize = self.shape
+        fields = {}
+        if LSDMap_IO.IsENVIRaster(template_raster):
+            fields = LSDMap_IO.ReadENVIHeaderFields(template_raster)
+        try:
+            wkt = Projection.ExportToWkt()
+        except Exception:
+            wkt = ""
+        lines = ["ENVI",
+                 "description = {"+os.path.basename(self.filename)+"}",
+                 "samples = "+str(xsize),
+                 "lines   = "+str(ysize),
+                 "bands   = 1",
+                 "header offset = 0",
+                 "file type = ENVI Standard",
+                 "data type = 4",
+                 "interleave = bsq",
+                 "byte order = 0"]
+        if "map info" in fields:
+            lines.append("map info = {"+fields["map info"]+"}")
+        else:
+            lines.append("map info = {"+_ENVIMapInfo(GeoT, Projection)+"}")
+        if "coordinate system string" in fields:
+            lines.append("coordinate system string = {"+fields["coordinate system string"]+"}")
+        elif wkt:
+            lines.append("coordinate system string = {"+wkt+"}")
+        if "projection info" in fields:
+            lines.append("projection info = {"+fields["projection info"]+"}")
+        lines.append("data ignore value = "+str(self.NoDataValue))
+        with open(os.path.splitext(self.filename)[0]+".hdr", "w") as hdr_file:
+            hdr_file.write("\n".join(lines)+"\n")
+
+    def write(self, row, values):
+        """Writes a strip of rows, starting at row"""
+        values = np.where(np.isnan(values), self.NoDataValue, values).astype(np.float32)
+        if self.array is not None:
+            self.array[row:row+values.shape[0]] = values
+        else:
+            self._band.WriteArray(values, 0, int(row))
+
+    def close(self):
+        """Flushes the raster to disk"""
+        if self.array is not None:
+            self.array.flush()
+            del self.array
+            self.array = None
+        if self._band is not None:
+            self._band.FlushCache()
+            self._band = None
+            self._dataset = None
+#==============================================================================
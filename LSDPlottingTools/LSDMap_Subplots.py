@@ -309,39 +309,21 @@ def flood_maps_with_shapefile(DataDirectory):
 
 def findmaxval_multirasters(FileList):
     """
-    Loops through a list or array of rasters (np arrays)
+    Loops through a list or array of rasters
     and finds the maximum single value in the set of arrays.
+    The rasters are streamed (see LSDMap_IO.GetMultiRasterStatistics)
+    so they are never read into memory.
     """
-    overall_max_val = 0
-
-    for i in range (len(FileList)):
-
-        raster_as_array = LSDMap_IO.ReadRasterArrayBlocks(FileList[i])
-        this_max_val = np.nanmax(raster_as_array)
-
-        if this_max_val > overall_max_val:
-            overall_max_val = this_max_val
-            print(overall_max_val)
-
-    return overall_max_val
+    return LSDMap_IO.GetMultiRasterStatistics(FileList)["max"]
 
 def findminval_multirasters(FileList):
     """
-    Loops through a list or array of rasters (np arrays)
+    Loops through a list or array of rasters
     and finds the minimum single value in the set of arrays.
+    The rasters are streamed (see LSDMap_IO.GetMultiRasterStatistics)
+    so they are never read into memory.
     """
-    overall_min_val = 0
-
-    for i in range (len(FileList)):
-
-        raster_as_array = LSDMap_IO.ReadRasterArrayBlocks(FileList[i])
-        this_min_val = np.nanmin(raster_as_array)
-
-        if this_min_val > overall_min_val:
-            overall_min_val = this_min_val
-            print(overall_min_val)
-
-    return overall_min_val
+    return LSDMap_IO.GetMultiRasterStatistics(FileList)["min"]
 
 
 def MultiDrapeFloodMaps(DataDir, ElevationRaster, DrapeRasterWild, cmap,
@@ -422,16 +404,17 @@ def MultiDrapeFloodMaps(DataDir, ElevationRaster, DrapeRasterWild, cmap,
     all plots when teh imshow is done later.
     """
 
-    try:
-        print("Calculating max drape raster value by scanning rasters...")
-        max_water_depth = findmaxval_multirasters(FPFiles)
-        drape_max = max_water_depth
+    if drape_max is None:
+        try:
+            print("Calculating max drape raster value by scanning rasters...")
+            max_water_depth = findmaxval_multirasters(FPFiles)
+            drape_max = max_water_depth
 
-    except:
-        print("Something went wrong trying to obtain the max value in \
-                your drape raster file list.")
-    finally:
-        print("The drape(s) max value is set to: ", drape_max)
+        except:
+            print("Something went wrong trying to obtain the max value in \
+                    your drape raster file list.")
+        finally:
+            print("The drape(s) max value is set to: ", drape_max)
 
 
     #im = mpimg.AxesImage()
@@ -567,28 +550,21 @@ def MultiDrapeErodeDiffMaps(DataDir, ElevationRaster, DrapeRasterWild, cmap,
     You need this to normalize the colourscale accross
     all plots when teh imshow is done later.
     """
-    if drape_max_threshold is None:
+    # One pass over the rasters gets both the min and the max
+    if drape_max_threshold is None or drape_min_threshold is None:
         try:
-            print("Calculating max drape raster value by scanning rasters...")
-            max_water_depth = findmaxval_multirasters(FPFiles)
-            drape_max_threshold = max_water_depth
+            print("Calculating min and max drape raster values by scanning rasters...")
+            drape_stats = LSDMap_IO.GetMultiRasterStatistics(FPFiles)
+            if drape_max_threshold is None:
+                drape_max_threshold = drape_stats["max"]
+            if drape_min_threshold is None:
+                drape_min_threshold = drape_stats["min"]
 
         except ValueError:
-            print("Something went wrong trying to obtain the max value in \
+            print("Something went wrong trying to obtain the min and max values in \
                     your drape raster file list.")
         finally:
             print("The drape(s) max value is set to: ", drape_max_threshold)
-
-    if drape_min_threshold is None:
-        try:
-            print("Calculating min drape raster value by scanning rasters...")
-            min_water_depth = findminval_multirasters(FPFiles)
-            drape_min_threshold = min_water_depth
-
-        except ValueError:
-            print("Something went wrong trying to obtain the min value in \
-                    your drape raster file list.")
-        finally:
             print("The drape(s) min value is set to: ", drape_min_threshold)
 
 
@@ -14,7 +14,7 @@ from LSDPlottingTools import colours
 import matplotlib.cm as cm
 from matplotlib import rcParams
 from matplotlib import colors as colors
-from LSDPlottingTools import LSDMap_GDALIO as IO
+from LSDPlottingTools import statsutilities as SUT
 from LSDMapFigure import PlottingHelpers as H
 from shapely.geometry import shape, Polygon, Point, LineString
 import fiona
@@ -69,6 +69,54 @@ def CreateFigure(FigSizeFormat="default", AspectRatio=16./9.):
 # Functions to analyse the terrace info
 #---------------------------------------------------------------------------------------------#
 
+def JoinTerracePointsToShapes(terrace_df, shapes, distance=None):
+    """
+    This finds which of the digitised shapes each terrace pixel belongs to, using
+    a spatial index of the shapes so every pixel is tested against the nearby shapes
+    only. Pixels are either inside a polygon, or (if distance is given) closer than
+    distance to a line. A pixel that matches several shapes is kept once for each.
+
+    Args:
+        terrace_df (pandas dataframe): the terrace pixels, with X and Y columns
+        shapes (dict): the shapely shapes with their IDs as keys, from
+        read_terrace_shapefile or read_terrace_centrelines
+        distance (float): if None the pixels must be inside the shapes, otherwise
+        they must be closer than this to the shapes
+
+    Returns: the matching rows of the terrace df, in the same order, with the
+    TerraceID set to the ID of the shape
+
+    Author: FJC
+    """
+    import shapely
+    from shapely.strtree import STRtree
+
+    IDs = np.asarray(list(shapes.keys()))
+    Shapes = np.asarray(list(shapes.values()), dtype=object)
+    if len(Shapes) == 0:
+        new_df = terrace_df.iloc[0:0].copy()
+        new_df['TerraceID'] = IDs
+        return new_df
+
+    tree = STRtree(Shapes)
+    Points = shapely.points(terrace_df['X'].values, terrace_df['Y'].values)
+
+    if distance is None:
+        point_index, shape_index = tree.query(Points, predicate='within')
+    else:
+        # the index gives the pairs within the distance, we want them strictly closer
+        point_index, shape_index = tree.query(Points, predicate='dwithin', distance=distance)
+        closer = shapely.distance(Points[point_index], Shapes[shape_index]) < distance
+        point_index = point_index[closer]
+        shape_index = shape_index[closer]
+
+    # keep the order of the pixels, then the order of the shapes
+    order = np.lexsort((shape_index, point_index))
+    new_df = terrace_df.iloc[point_index[order]].copy()
+    new_df['TerraceID'] = IDs[shape_index[order]]
+
+    return new_df
+
 def SelectTerracesFromShapefile(DataDirectory,shapefile_name,fname_prefix):
     """
     This function takes in a shapefile of digitised terraces and
@@ -91,22 +139,9 @@ def SelectTerracesFromShapefile(DataDirectory,shapefile_name,fname_prefix):
     # now get the shapefile with the digitised terraces
     digitised_terraces = H.read_terrace_shapefile(DataDirectory,shapefile_name)
 
-    # for each point in the df, need to check if it is in one of the polygons. This will probably be slow.
-
-    # set up the new terrace df
-    new_df = pd.DataFrame()
-
-    print ("Filtering points by shapefile, this might take a while...")
-
-    for idx, row in terrace_df.iterrows():
-        this_point = Point(row['X'], row['Y'])
-        #print this_point
-        # check if this point is in one of the polygons
-        for id, polygon in digitised_terraces.items():
-            if polygon.contains(this_point):
-                # this point is within this terrace, keep it and assign a new ID number
-                row['TerraceID'] = id
-                new_df = new_df.append(row)
+    # keep the points in the polygons, with the ID of the polygon
+    print ("Filtering points by shapefile...")
+    new_df = JoinTerracePointsToShapes(terrace_df, digitised_terraces)
 
     OutDF_name = "_terrace_info_shapefiles.csv"
     OutDF_name = DataDirectory+fname_prefix+OutDF_name
@@ -133,22 +168,9 @@ def SelectTerracePointsFromCentrelines(DataDirectory,shapefile_name,fname_prefix
     # now get the shapefile with the digitised terraces
     centrelines = H.read_terrace_centrelines(DataDirectory,shapefile_name)
 
-    # for each point in the df, need to check if it is in one of the polygons. This will probably be slow.
-
-    # set up the new terrace df
-    new_df = pd.DataFrame()
-
-    print ("Filtering points by shapefile, this might take a while...")
-
-    for idx, row in terrace_df.iterrows():
-        this_point = Point(row['X'], row['Y'])
-        #print this_point
-        # check if this point is in one of the polygons
-        for id, line in centrelines.items():
-            if line.distance(this_point) < distance:
-                # this point is within this terrace, keep it and assign a new ID number
-                row['TerraceID'] = id
-                new_df = new_df.append(row)
+    # keep the points near the centrelines, with the ID of the centreline
+    print ("Filtering points by shapefile...")
+    new_df = JoinTerracePointsToShapes(terrace_df, centrelines, distance=distance)
 
     OutDF_name = "_terrace_info_centrelines.csv"
     OutDF_name = DataDirectory+fname_prefix+OutDF_name
@@ -217,8 +239,10 @@ def write_dip_and_dipdir_to_csv(DataDirectory,fname_prefix, digitised_terraces=F
 def get_terrace_dip_and_dipdir(terrace_df):
     """
     This function takes the initial terrace dataframe and calculates the dip and
-    strike of the terrace surfaces. Fits a polynomial surface to the distribution
+    strike of the terrace surfaces. Fits a plane to the distribution
     of terrace elevations and then gets the dip and dip directions of this surface.
+    All of the terraces are fitted at once: the least-squares sums are collected
+    for each terrace ID and the normal equations of every plane are solved together.
 
     Args:
         terrace_df: pandas dataframe with the terrace info
@@ -228,83 +252,68 @@ def get_terrace_dip_and_dipdir(terrace_df):
 
     Author: AW and FJC
     """
-    from scipy import linalg
-    import math
-    from mpl_toolkits.mplot3d import Axes3D
-
-    # get the unique terrace IDs
-    terraceIDs = terrace_df.TerraceID.unique()
-    print (terraceIDs)
-
-    dips = []
-    dip_dirs = []
-    strikes = []
-    XbarTerraces = []
-    YbarTerraces = []
-
-    # get the info for each terrace ID
-    for terraceID in terraceIDs:
-        _terrace_subset = (terrace_df.TerraceID.values == terraceID)
-        _x = terrace_df['DistAlongBaseline'].values[_terrace_subset]
-        _y = terrace_df['DistToBaseline'].values[_terrace_subset]
-        _z = terrace_df['Elevation'].values[_terrace_subset]
-        _X = terrace_df['X'].values[_terrace_subset]
-        _Y = terrace_df['Y'].values[_terrace_subset]
-
-        # fit a plane to these points
-        # form: Z = C[0]*X + C[1]*Y + C[2]
-        _XY = np.vstack((_X, _Y, np.ones(len(_Y)))).transpose()
-        C,_,_,_ = linalg.lstsq(_XY, _z)
-
-        # going to get the dip and dip direction using the unit normal vector
-        # to the plane.
-        a = -C[0]
-        b = -C[1]
-        c = 1
-        n_vec = np.array([a,b,c])
-        print (n_vec)
-        # n vector projected onto the xy plane (multiply n_vec by (1,1,0))
-        n_xy = np.array([a,b,0])
-
-        #print n_vec
-
+    # get the unique terrace IDs, in the order they appear
+    codes, terraceIDs = pd.factorize(terrace_df['TerraceID'].values)
+    n_terraces = len(terraceIDs)
+    print ("Fitting planes to "+str(n_terraces)+" terraces")
+
+    valid = codes >= 0
+    codes = codes[valid]
+    _X = terrace_df['X'].values[valid].astype(np.float64)
+    _Y = terrace_df['Y'].values[valid].astype(np.float64)
+    _z = terrace_df['Elevation'].values[valid].astype(np.float64)
+
+    # get the mean x and y of each terrace. These are also used to centre the
+    # coordinates so the sums don't lose precision with big UTM coordinates
+    n_pixels = np.bincount(codes, minlength=n_terraces).astype(np.float64)
+    XbarTerraces = np.bincount(codes, weights=_X, minlength=n_terraces)/n_pixels
+    YbarTerraces = np.bincount(codes, weights=_Y, minlength=n_terraces)/n_pixels
+    zbar = np.bincount(codes, weights=_z, minlength=n_terraces)/n_pixels
+    dX = _X - XbarTerraces[codes]
+    dY = _Y - YbarTerraces[codes]
+    dz = _z - zbar[codes]
+
+    # fit a plane to the points of each terrace
+    # form: Z = C[0]*X + C[1]*Y + C[2]
+    # with centred coordinates the intercept drops out of the normal equations
+    # and we only need the 2x2 moment matrix and the right hand side of each terrace
+    Sxx = np.bincount(codes, weights=dX*dX, minlength=n_terraces)
+    Sxy = np.bincount(codes, weights=dX*dY, minlength=n_terraces)
+    Syy = np.bincount(codes, weights=dY*dY, minlength=n_terraces)
+    Sxz = np.bincount(codes, weights=dX*dz, minlength=n_terraces)
+    Syz = np.bincount(codes, weights=dY*dz, minlength=n_terraces)
+    A = np.stack((np.stack((Sxx, Sxy), axis=-1), np.stack((Sxy, Syy), axis=-1)), axis=-2)
+    rhs = np.stack((Sxz, Syz), axis=-1)[..., np.newaxis]
+    # the pseudo-inverse gives the least-squares solution even for terraces
+    # whose pixels are all in a line
+    C = np.matmul(np.linalg.pinv(A), rhs)[..., 0]
+
+    # going to get the dip and dip direction using the unit normal vector
+    # to the plane, n = (a,b,1), and its projection onto the xy plane, (a,b,0)
+    a = -C[:,0]
+    b = -C[:,1]
+    norm_xy = np.hypot(a, b)
+    norm_vec = np.sqrt(a*a + b*b + 1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
         # now get the dip = angle between n_vec and n_xy. angle between 2 vectors:
         # cos theta = (alpha . beta) / (|alpha| |beta|)
-        # This gives the dip in radians
-        dip = np.arccos((np.dot(n_vec,n_xy))/(np.linalg.norm(n_vec)*np.linalg.norm(n_xy)))
-        # convert to degrees
-        dip = 90 - math.degrees(dip)
+        dip = np.arccos(np.clip((norm_xy*norm_xy)/(norm_vec*norm_xy), -1, 1))
+        dip = 90 - np.degrees(dip)
 
         # get the dip direction = angle between n_proj and the due north vector y = (0,1,0)
-        y_vec = np.array([0,1,0])
-        theta = np.arccos((np.dot(n_xy,y_vec))/(np.linalg.norm(n_xy)*np.linalg.norm(y_vec)))
-        theta = math.degrees(theta)
-        print ("Theta", theta)
-
-        # work out strike depending on orientation
-        if a > 0 and b > 0: # x is positive so dip dir is just theta
-            strike = 270 + theta
-        elif a < 0:
-            strike = 270 - theta
-        elif a > 0 and b < 0: # x is negative so dip dir is 180+theta?
-            strike = theta - 90
-
-        # now get the dip dir using the right hand rule
-        dip_dir = strike+90
-        if dip_dir > 359:
-            dip_dir = dip_dir - 360
-
-        dips.append(dip)
-        dip_dirs.append(dip_dir)
-        strikes.append(strike)
-
-        # get the mean x and y for plotting
-        XbarTerraces.append(np.mean(_X))
-        YbarTerraces.append(np.mean(_Y))
-
-    outarray = np.vstack((XbarTerraces, YbarTerraces, dips, dip_dirs, strikes)).transpose()
+        theta = np.degrees(np.arccos(np.clip(b/norm_xy, -1, 1)))
+
+    # work out strike depending on orientation
+    strikes = np.where(a <= 0, 270 - theta, np.where(b >= 0, 270 + theta, theta - 90))
+
+    # now get the dip dir using the right hand rule
+    dip_dirs = strikes+90
+    dip_dirs = np.where(dip_dirs > 359, dip_dirs - 360, dip_dirs)
+
+    outarray = np.vstack((XbarTerraces, YbarTerraces, dip, dip_dirs, strikes)).transpose()
     _column_names = ('X', 'Y', 'dip', 'dip_azimuth', 'strike')
-    _index = np.arange(len(dips))+1
+    _index = np.arange(n_terraces)+1
     output_pd = pd.DataFrame(data = outarray, index=_index, columns=_column_names)
     return output_pd
 
@@ -322,6 +331,9 @@ def get_terrace_areas(terrace_df, fname_prefix):
 
     Author: FJC
     """
+    # GDAL is only needed here, so the rest of the module works without it
+    from LSDPlottingTools import LSDMap_GDALIO as IO
+
     # get unique IDs
     terraceIDs = terrace_df.terraceID.unique()
 
@@ -701,7 +713,8 @@ def MakeTerraceHeatMap(DataDirectory,fname_prefix, mchi_fname, prec=100, bw_meth
     """
     Function to make a heat map of the terrace pixels using Gaussian KDE.
     see https://docs.scipy.org/doc/scipy-0.14.0/reference/generated/scipy.stats.gaussian_kde.html
-    for more details.
+    for more details. The density is binned onto the grid and convolved with the kernel
+    (see statsutilities.binned_gaussian_kde) so a finer prec is cheap.
 
     Args:
         DataDirectory(str): the data directory
@@ -714,8 +727,6 @@ def MakeTerraceHeatMap(DataDirectory,fname_prefix, mchi_fname, prec=100, bw_meth
 
     FJC 26/03/18
     """
-    import scipy.stats as st
-
     # check if a directory exists for the chi plots. If not then make it.
     T_directory = DataDirectory+'terrace_plots/'
     if not os.path.isdir(T_directory):
@@ -744,16 +755,16 @@ def MakeTerraceHeatMap(DataDirectory,fname_prefix, mchi_fname, prec=100, bw_meth
     ymin = 0
     ymax = terrace_df["Elevation"].max()
 
-    ## formatting the data in a meshgrid
-    X,Y = np.meshgrid(np.linspace(0,xmax,num = prec),np.linspace(0,ymax, num = prec))
-    positions = np.vstack([X.ravel(), Y.ravel()[::-1]]) # inverted Y to get the axis in the bottom left
+    ## the nodes of the grid for the density
+    x_nodes = np.linspace(0,xmax,num = prec)
+    y_nodes = np.linspace(0,ymax,num = prec)
     values = np.vstack([flow_dist, terrace_df['Elevation']])
     if len(values) == 0:
         print("You don't have any terraces, I'm going to quit now.")
     else:
         # get the kernel density estimation
-        KDE = st.gaussian_kde(values, bw_method = bw_method)
-        Z = np.reshape(KDE(positions).T,X.shape)
+        Z = SUT.binned_gaussian_kde(values, [x_nodes, y_nodes], bw_method = bw_method)
+        Z = Z.T[::-1,:] # inverted Y to get the axis in the bottom left
 
         # plot the density on the profile
         cmap = cm.gist_heat_r
@@ -796,7 +807,8 @@ def MakeTerraceHeatMapNormalised(DataDirectory,fname_prefix, mchi_fname, prec=10
     Function to make a heat map of the terrace pixels using Gaussian KDE. Pixels are normalised based on
     elevation of closest channel pixel.
     see https://docs.scipy.org/doc/scipy-0.14.0/reference/generated/scipy.stats.gaussian_kde.html
-    for more details.
+    for more details. The density is binned onto the grid and convolved with the kernel
+    (see statsutilities.binned_gaussian_kde) so a finer prec is cheap.
 
     Args:
         DataDirectory(str): the data directory
@@ -810,8 +822,6 @@ def MakeTerraceHeatMapNormalised(DataDirectory,fname_prefix, mchi_fname, prec=10
 
     FJC 26/03/18
     """
-    import scipy.stats as st
-
     # check if a directory exists for the chi plots. If not then make it.
     T_directory = DataDirectory+'terrace_plots/'
     if not os.path.isdir(T_directory):
@@ -840,12 +850,12 @@ def MakeTerraceHeatMapNormalised(DataDirectory,fname_prefix, mchi_fname, prec=10
     ymin = 0
     ymax = terrace_df["ChannelRelief"].max()
 
-    ## formatting the data in a meshgrid
-    X,Y = np.meshgrid(np.linspace(0,xmax,num = prec),np.linspace(0,ymax, num = prec))
-    positions = np.vstack([X.ravel(), Y.ravel()[::-1]]) # inverted Y to get the axis in the bottom left
+    ## the nodes of the grid for the density
+    x_nodes = np.linspace(0,xmax,num = prec)
+    y_nodes = np.linspace(0,ymax,num = prec)
     values = np.vstack([flow_dist, terrace_df["ChannelRelief"]])
-    KDE = st.gaussian_kde(values, bw_method = bw_method)
-    Z = np.reshape(KDE(positions).T,X.shape)
+    Z = SUT.binned_gaussian_kde(values, [x_nodes, y_nodes], bw_method = bw_method)
+    Z = Z.T[::-1,:] # inverted Y to get the axis in the bottom left
     #Z = np.ma.masked_where(Z < 0.00000000001, Z)
 
     # try a 2d hist
@@ -10,6 +10,8 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import numpy as np
 from . import LSDMap_GDALIO as LSDMap_IO
 from shapely.geometry import Point, Polygon
+from shapely import wkb
+from shapely.strtree import STRtree
 import os
 from os.path import exists
 from osgeo import ogr, osr
@@ -22,7 +24,190 @@ from LSDMapFigure import PlottingHelpers as Helper
 # BASIN FUNCTIONS
 # These functions do various operations on basin polygons
 #=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
-def GetBasinOutlines(DataDirectory, basins_fname):
+class BasinGeometryIndex(object):
+	"""
+	This holds the geometry of every basin in a basin raster: the polygons, their
+	centroids, representative points (guaranteed to be inside the basin), areas and
+	a spatial index. It is built once per raster and saved next to it
+	(as <raster>.lsdcache.basins.npz), so the raster is only polygonised again when
+	LSDTopoTools rewrites it. The file only holds plain arrays (the polygons are WKB)
+	and is read without allowing pickles.
+
+	Use GetBasinGeometryIndex to get one: it also keeps the index in memory.
+
+	Args:
+		DataDirectory (str): the data directory with the basin raster
+		basins_fname (str): the basin raster
+		use_cache (bool): If false, the cache on disk is neither read nor written
+
+	Author: SMM
+	"""
+	def __init__(self, DataDirectory, basins_fname, use_cache = True):
+		self.FileName = DataDirectory+basins_fname
+		if exists(self.FileName) is False:
+			raise Exception('[Errno 2] No such file or directory: \'' + self.FileName + '\'')
+
+		source = _BasinIndexSource(self.FileName)
+		cache_fname = _BasinIndexCacheName(self.FileName)
+
+		cached = False
+		if use_cache and os.path.isfile(cache_fname):
+			try:
+				with np.load(cache_fname, allow_pickle = False) as cache:
+					if np.array_equal(cache["source"], source):
+						keys = cache["keys"].tolist()
+						# The WKB of all the polygons one after the other
+						wkb_bytes = cache["polygons"].tobytes()
+						ends = cache["polygon_ends"]
+						polygons = [wkb.loads(wkb_bytes[start:end]) for start, end in zip(np.r_[0, ends[:-1]], ends)]
+						centroids = [Point(xy) for xy in cache["centroids"]]
+						points = [Point(xy) for xy in cache["representative_points"]]
+						areas = cache["areas"].tolist()
+						cached = True
+			except Exception as e:
+				print("I couldn't read the basin cache of "+self.FileName+", I'll make it again: "+str(e))
+				cached = False
+
+		if not cached:
+			BasinDict = LSDMap_IO.PolygoniseRasterToDict(DataDirectory, basins_fname)
+			keys = list(BasinDict.keys())
+			polygons = [BasinDict[key] for key in keys]
+			centroids = [Point(p.centroid) for p in polygons]
+			points = [Point(p.representative_point()) for p in polygons]
+			areas = [p.area for p in polygons]
+
+			if use_cache:
+				wkbs = [p.wkb for p in polygons]
+				tmp_fname = cache_fname+"."+str(os.getpid())+".tmp"
+				try:
+					with open(tmp_fname, "wb") as f:
+						np.savez(f, source = source,
+						         keys = np.array(keys, dtype = np.float64),
+						         polygons = np.frombuffer(b"".join(wkbs), dtype = np.uint8),
+						         polygon_ends = np.cumsum([len(g) for g in wkbs], dtype = np.int64),
+						         centroids = np.array([(p.x, p.y) for p in centroids], dtype = np.float64).reshape(-1, 2),
+						         representative_points = np.array([(p.x, p.y) for p in points], dtype = np.float64).reshape(-1, 2),
+						         areas = np.array(areas, dtype = np.float64))
+					os.replace(tmp_fname, cache_fname)
+				except Exception as e:
+					print("I couldn't write the basin cache of "+self.FileName+": "+str(e))
+					if os.path.isfile(tmp_fname):
+						os.remove(tmp_fname)
+
+		self.keys = keys
+		self.polygons = dict(zip(keys, polygons))
+		self.centroids = dict(zip(keys, centroids))
+		self.representative_points = dict(zip(keys, points))
+		self.areas = dict(zip(keys, areas))
+		self._tree = None
+
+	def __len__(self):
+		return len(self.keys)
+
+	@property
+	def tree(self):
+		"""An STRtree of the basin polygons, built the first time it is used."""
+		if self._tree is None:
+			self._tree = STRtree([self.polygons[key] for key in self.keys])
+		return self._tree
+
+	def GetOutlines(self, simplify_tolerance = 0):
+		"""
+		Returns a new dict of the basin polygons, so you can change it without changing the index.
+
+		Args:
+			simplify_tolerance (float): If > 0 the outlines are simplified to this tolerance (in map units)
+
+		Author: SMM
+		"""
+		if simplify_tolerance > 0:
+			return {key: p.simplify(simplify_tolerance, preserve_topology=True) for key, p in self.polygons.items()}
+		return dict(self.polygons)
+
+	def query(self, geometry, predicate = "intersects"):
+		"""
+		Gets the keys of the basins that touch a shapely geometry.
+
+		Args:
+			geometry (shapely geometry): e.g. a point or a polygon
+			predicate (str): the test between the basin and the geometry, e.g. "intersects" or "contains"
+
+		Returns:
+			list of basin keys
+
+		Author: SMM
+		"""
+		hits = self.tree.query(geometry)
+		# shapely 2 gives back indices, older versions give back the geometries
+		if len(hits) > 0 and not isinstance(hits[0], (int, np.integer)):
+			index_of = {id(self.polygons[key]): i for i, key in enumerate(self.keys)}
+			hits = [index_of[id(h)] for h in hits]
+		keys = [self.keys[i] for i in sorted(hits)]
+		return [key for key in keys if getattr(self.polygons[key], predicate)(geometry)]
+
+def _BasinIndexSource(FileName):
+	"""The modification times and sizes of a basin raster and its header, which the cached index must match"""
+	return np.array(LSDMap_IO.RasterCache._file_stat(FileName), dtype = np.int64)
+
+def _BasinIndexCacheName(FileName):
+	"""The name of the file the index of a basin raster is saved in"""
+	return FileName+".lsdcache.basins.npz"
+
+def BasinGeometryIndexIsCached(DataDirectory, basins_fname):
+	"""
+	Checks if the index of a basin raster is saved on disk and is up to date with the raster.
+	Only the stamp of the raster in the cache file is read.
+
+	Args:
+		DataDirectory (str): the data directory with the basin raster
+		basins_fname (str): the basin raster
+
+	Returns:
+		bool
+
+	Author: SMM
+	"""
+	FileName = DataDirectory+basins_fname
+	cache_fname = _BasinIndexCacheName(FileName)
+	if not os.path.isfile(cache_fname):
+		return False
+	try:
+		with np.load(cache_fname, allow_pickle = False) as cache:
+			return np.array_equal(cache["source"], _BasinIndexSource(FileName))
+	except Exception:
+		return False
+
+def _BuildBasinGeometryIndex(task):
+	"""
+	Builds the index of one basin raster. This is the work done on each
+	process by GetMultipleBasinOutlines.
+
+	Author: SMM
+	"""
+	DataDirectory, basins_fname = task
+	return BasinGeometryIndex(DataDirectory, basins_fname)
+
+def GetBasinGeometryIndex(DataDirectory, basins_fname, use_cache = True):
+	"""
+	Gets the BasinGeometryIndex of a basin raster. The index is kept in memory
+	(until the raster changes), so calling this repeatedly is free.
+
+	Args:
+		DataDirectory (str): the data directory with the basin raster
+		basins_fname (str): the basin raster
+		use_cache (bool): If false, the index is built from the raster
+
+	Returns:
+		BasinGeometryIndex
+
+	Author: SMM
+	"""
+	if not use_cache:
+		return BasinGeometryIndex(DataDirectory, basins_fname, use_cache = False)
+	return LSDMap_IO.raster_cache.get(DataDirectory+basins_fname, "basin_index",
+	                                  lambda: BasinGeometryIndex(DataDirectory, basins_fname))
+
+def GetBasinOutlines(DataDirectory, basins_fname, simplify_tolerance = 0, write_shapefile = False):
 	"""
 	This function takes in the raster of basins and gets a dict of basin polygons,
 	where the key is the basin key and the value is a shapely polygon of the basin.
@@ -34,56 +219,108 @@ def GetBasinOutlines(DataDirectory, basins_fname):
 	Args:
 		DataDirectory (str): the data directory with the basin raster
 		basins_fname (str): the basin raster
+		simplify_tolerance (float): If > 0 the outlines are simplified to this tolerance (in map units)
+		write_shapefile (bool): If true the outlines are also written to a shapefile with the same prefix as the raster
 
 	Returns:
 		list of shapely polygons with the basins
 
 	Author: FJC
 	"""
-	# read in the basins raster
-	this_fname = basins_fname.split('.')
-	print(basins_fname)
-	OutputShapefile = this_fname[0]+'.shp'
+	# the polygons come from the (cached) geometry index of the raster
+	BasinDict = GetBasinGeometryIndex(DataDirectory, basins_fname).GetOutlines(simplify_tolerance)
 
-	# polygonise the raster
-	BasinDict = LSDMap_IO.PolygoniseRaster(DataDirectory, basins_fname, OutputShapefile)
+	if write_shapefile:
+		this_fname = basins_fname.split('.')
+		OutputShapefile = DataDirectory+this_fname[0]+'.shp'
+		LSDMap_IO.WritePolygonShapefile(BasinDict, OutputShapefile, LSDMap_IO.GetUTMEPSG(DataDirectory+basins_fname))
 	return BasinDict
 
-def GetMultipleBasinOutlines(DataDirectory):
-  """
+def GetMultipleBasinOutlines(DataDirectory, n_workers = None, use_processes = True,
+                             progress_hook = None, simplify_tolerance = 0):
+	"""
 	This function takes in multiple rasters of basins and gets a dict of basin polygons,
 	where the key is the basin key derived from the file name and the value is a shapely polygon of the basin.
 
+	The rasters (basin<junction>_AllBasins.bil, from the parallel chi_mapping_tool) whose
+	geometry index is not already cached are polygonised at the same time on a pool of
+	processes. The rest are read from their cache.
+
 	IMPORTANT: In this case the "basin key" is usually the junction number:
 		this function will use the raster values as keys and in general
 		the basin rasters are output based on junction indices rather than keys
 
 	Args:
 		DataDirectory (str): the data directory with the basin raster
+		n_workers (int): the number of rasters polygonised at once. Defaults to the number of CPUs.
+		use_processes (bool): if true use processes, otherwise threads (which share the GIL)
+		progress_hook (function): if not None, called as progress_hook(n_done, n_files, fname, seconds) after each raster is polygonised
+		simplify_tolerance (float): If > 0 the outlines are simplified to this tolerance (in map units)
 
 	Returns:
 		list of shapely polygons with the basins
 
 	Author: MDH
 	"""
-  # get a list of basins and declare the dictionary to populate
-  basin_dict = Helper.MapBasinsToKeys(DataDirectory)
-  BasinsDict = {}
-
-  #loop across the basins
-  for outlet_jn, basin_key in basin_dict.iteritems():
-    this_fname = "basin"+str(outlet_jn)+"_AllBasins.bil"
-
-    TempBasins = GetBasinOutlines(DataDirectory,this_fname)
-
-    for temp_outlet, temp_basin_key in TempBasins.iteritems():
-      if len(TempBasins) > 1:
-        print("WARNING: MULTIPLE BASINS IN basin #", outlet_jn)
-      TempBasins[int(outlet_jn)] = TempBasins.pop(temp_outlet)
-
-    BasinsDict.update(TempBasins)
-
-  return BasinsDict
+	import time
+	from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+	# get a list of basins and the names of their rasters
+	basin_dict = Helper.MapBasinsToKeys(DataDirectory)
+	fnames = {}
+	for outlet_jn in basin_dict:
+		this_fname = "basin"+str(outlet_jn)+"_AllBasins.bil"
+		if exists(DataDirectory+this_fname):
+			fnames[outlet_jn] = this_fname
+		else:
+			print("WARNING: I can't find the raster of basin #"+str(outlet_jn))
+
+	# Only the rasters without an up to date cache need polygonising
+	to_build = [(DataDirectory, this_fname) for this_fname in fnames.values()
+	            if not BasinGeometryIndexIsCached(DataDirectory, this_fname)]
+
+	if n_workers is None:
+		n_workers = os.cpu_count() or 1
+	n_workers = max(1, min(n_workers, len(to_build)))
+
+	start_time = time.time()
+	if len(to_build) > 0:
+		print("I need to polygonise "+str(len(to_build))+" of "+str(len(fnames))+" basin rasters.")
+	if n_workers == 1:
+		for n_done, task in enumerate(to_build):
+			GetBasinGeometryIndex(*task)
+			if progress_hook is not None:
+				progress_hook(n_done+1, len(to_build), task[1], time.time()-start_time)
+	elif len(to_build) > 0:
+		if use_processes:
+			Executor = ProcessPoolExecutor
+		else:
+			Executor = ThreadPoolExecutor
+		with Executor(max_workers=n_workers) as pool:
+			futures = {pool.submit(_BuildBasinGeometryIndex, task): task for task in to_build}
+			for n_done, future in enumerate(as_completed(futures)):
+				task = futures[future]
+				index = future.result()
+				# keep the index in memory so it isn't read back from disk
+				LSDMap_IO.raster_cache.get(DataDirectory+task[1], "basin_index", lambda: index)
+				if progress_hook is not None:
+					progress_hook(n_done+1, len(to_build), task[1], time.time()-start_time)
+
+	# Merge the basins, keyed by the outlet junction of their raster
+	BasinsDict = {}
+	for outlet_jn, this_fname in fnames.items():
+		index = GetBasinGeometryIndex(DataDirectory, this_fname)
+		if len(index) == 0:
+			continue
+		if len(index) > 1:
+			print("WARNING: MULTIPLE BASINS IN basin #"+str(outlet_jn)+", I'll use the largest.")
+		largest = max(index.keys, key=lambda key: index.areas[key])
+		basin = index.polygons[largest]
+		if simplify_tolerance > 0:
+			basin = basin.simplify(simplify_tolerance, preserve_topology=True)
+		BasinsDict[int(outlet_jn)] = basin
+
+	return BasinsDict
 
 def GetBasinCentroids(DataDirectory, basins_fname):
 	"""
@@ -103,15 +340,8 @@ def GetBasinCentroids(DataDirectory, basins_fname):
 
 	Author: FJC
 	"""
-	# get the basin polygons
-	BasinDict = GetBasinOutlines(DataDirectory, basins_fname)
-
-	# get the centroids
-	CentroidDict = {}
-	for basin_key, basin in BasinDict.iteritems():
-		CentroidDict[basin_key] = Point(basin.centroid)
-
-	return CentroidDict
+	# the centroids are stored in the geometry index
+	return dict(GetBasinGeometryIndex(DataDirectory, basins_fname).centroids)
 
 def GetPointWithinBasins(DataDirectory,basins_fname):
 	"""
@@ -132,15 +362,8 @@ def GetPointWithinBasins(DataDirectory,basins_fname):
 
 	Author: FJC
 	"""
-	# get the basin polygons
-	BasinDict = GetBasinOutlines(DataDirectory, basins_fname)
-
-	# get the centroids
-	PointDict = {}
-	for basin_key, basin in BasinDict.items():
-		PointDict[basin_key] = Point(basin.representative_point())
-
-	return PointDict
+	# the representative points are stored in the geometry index
+	return dict(GetBasinGeometryIndex(DataDirectory, basins_fname).representative_points)
 
 def GetPointsWithinMultipleBasins(DataDirectory,basins_fname):
   """
@@ -163,17 +386,13 @@ def GetPointsWithinMultipleBasins(DataDirectory,basins_fname):
   """
   # get the basin polygons
   BasinDict = GetMultipleBasinOutlines(DataDirectory)
-  print("BASIN DICT IS")
-  print(BasinDict)
+  print("The number of basins are: "+str(len(BasinDict)))
 
   # get the centroids
   PointDict = {}
-  for basin_key, basin in BasinDict.iteritems():
+  for basin_key, basin in BasinDict.items():
     PointDict[basin_key] = Point(basin.representative_point())
 
-  print("POINT DICT IS")
-  print(PointDict)
-
   return PointDict
 
 def GetPointWithinBasinsBuffered(DataDirectory,basins_fname, basin_list = [], buffer_frac=0.1):
@@ -202,11 +421,11 @@ def GetPointWithinBasinsBuffered(DataDirectory,basins_fname, basin_list = [], bu
 	Author: FJC
 	"""
 	# get the basin polygons
-	BasinDict = GetBasinOutlines(DataDirectory, basins_fname)
+	BasinDict = GetBasinGeometryIndex(DataDirectory, basins_fname).polygons
 
 	# buffer and get the centre of the buffered polygons
 	PointDict = {}
-	for basin_key, basin in BasinDict.iteritems():
+	for basin_key, basin in BasinDict.items():
 		# get the x and y lengths of the basin and append to list
 		print("This basin key is: "+str(basin_key))
 		lengths = []
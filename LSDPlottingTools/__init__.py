@@ -18,6 +18,7 @@ from .LSDMap_OSystemTools import *
 from .LSDMap_PlottingDriver import *
 from .LSDMap_VectorTools import *
 from .LSDMap_SwathPlotting import *
+from .LSDMap_RasterAlgebra import *
 from .adjust_text import *
 
 from . import colours as lsdcolours
@@ -8,9 +8,11 @@ ID algorithm, or in the Channel, using the channel network and measuring along
 this line. The mean, max, and total area wil be able to be calculated.)
 """
 
-import LSDMap_GDALIO as lsdgdal
+try:
+    from . import LSDMap_GDALIO as lsdgdal
+except ImportError:
+    import LSDMap_GDALIO as lsdgdal
 import numpy as _np
-import matplotlib.pyplot as plt
 import glob
 import os
 import re
@@ -28,7 +30,7 @@ def calculate_waterinundation_area(raster, cellsize, threshold):
     """Note: this will probably need some sort of threshold as Caesar maps 
     out very small water depths and so could give huge 'inundation' areas."""
     total_cells = _np.count_nonzero(raster > threshold)
-    area = DX * DX * total_cells  # metres
+    area = cellsize * cellsize * total_cells  # metres
     
     print("Inundation area is: ", area, " metres square")
     return area
@@ -95,79 +97,147 @@ def natural_key(string_):
     """
     return [int(s) if s.isdigit() else s for s in re.split(r'(\d+)', string_)]
 
+def read_mask_raster(mask):
+    """Gets a mask raster as an array. If it is a filename, ENVI rasters are
+    memory mapped so only the strips that are used are read from disk."""
+    if isinstance(mask, str):
+        if lsdgdal.IsENVIRaster(mask):
+            return lsdgdal.ReadRasterArrayMemmap(mask, mode="r")
+        return lsdgdal.ReadRasterArrayBlocks(mask)
+    return _np.asarray(mask)
+
+def inundation_metrics(water_raster_file, cellsize, floodplain_mask, channel_mask,
+                       area_threshold=0.02, block_rows=1024):
+    """Calculates all the inundation metrics of one water depth raster in a
+    single pass over strips of rows, so the raster is never read as a whole.
+    Nodata is ignored.
+
+    Args:
+        water_raster_file (str): the water depth raster
+        cellsize (float): the cell size in metres
+        floodplain_mask (array): True on the floodplain
+        channel_mask (array): True in the main channel
+        area_threshold (float): depths above this count as inundated
+        block_rows (int): the number of rows read at a time
+
+    Returns:
+        (inundation area, mean depth, mean floodplain depth, mean main channel depth)
+    """
+    n_valid = 0
+    n_wet = 0
+    depth_sum = 0.0
+    fp_n = 0
+    fp_sum = 0.0
+    ch_n = 0
+    ch_sum = 0.0
+
+    for i, strip in lsdgdal.ReadRasterStrips(water_raster_file, block_rows):
+        valid = _np.isfinite(strip)
+        depths = _np.where(valid, strip, 0)
+        fp = valid & floodplain_mask[i:i+strip.shape[0]]
+        ch = valid & channel_mask[i:i+strip.shape[0]]
+
+        n_valid += _np.count_nonzero(valid)
+        n_wet += _np.count_nonzero(depths > area_threshold)
+        depth_sum += float(depths.sum(dtype=_np.float64))
+        fp_n += _np.count_nonzero(fp)
+        fp_sum += float(depths[fp].sum(dtype=_np.float64))
+        ch_n += _np.count_nonzero(ch)
+        ch_sum += float(depths[ch].sum(dtype=_np.float64))
+
+    def mean(total, n):
+        return total/n if n > 0 else _np.nan
+
+    return (cellsize * cellsize * n_wet, mean(depth_sum, n_valid),
+            mean(fp_sum, fp_n), mean(ch_sum, ch_n))
+
 def simulation_inundation_timeseries(glob_wildcard, floodplain_mask, stream_mask,
                                      threshold=0,
-                                     savefilename="inundation_metrics.txt"):
-    """Creates a timeseries of a given inundation metric. 
-    
-    Options should be:
+                                     savefilename="inundation_metrics.txt",
+                                     area_threshold=0.02, channel_stream_order=5,
+                                     cellsize=None, n_workers=None, block_rows=1024):
+    """Creates a timeseries of the inundation metrics:
         Inundation Area (Entire catchment)
         Mean Water Depth (Entire catchment)
         Mean Water Depth (Floodplain only)
         Mean Water Depth (Channel)
-    """
-    # Create an empty array with the correct number of columns
-    data_array = _np.empty((0,5), dtype=_np.float32)
-    print("Data array shape: ", data_array.shape)
-
-    for water_raster_file in sorted(glob.glob(glob_wildcard), key=natural_key):
-        print(water_raster_file)
-        water_raster = lsdgdal.ReadRasterArrayBlocks(water_raster_file)
-        
-        timestep_row = [] # Empty list to store elements of the row
-        cur_timestep = timestep_string_from_filename(water_raster_file) # get the current timestep by parsing the filename
-
-        # Inundation area
-        this_inundation_area = calculate_waterinundation_area(water_raster, DX, 0.02)
-        this_mean_catchment_waterdepth = calculate_mean_waterdepth(water_raster)
-        this_mean_floodplain_waterdepth = floodplain_mean_depth(water_raster, floodplain_mask)
-        this_mean_mainchannel_waterdepth = main_channel_mean_depth(water_raster, floodplain_mask, stream_mask)
-        
-        # Append each value to the current row list object
-        timestep_row.append([cur_timestep,
-                             this_inundation_area,
-                             this_mean_catchment_waterdepth,
-                             this_mean_floodplain_waterdepth,
-                             this_mean_mainchannel_waterdepth])
-        # Convert the list into a numpy array
-        timestep_row = _np.asarray(timestep_row, dtype=_np.float32)
-        
-        # Now append (stack) that row onto the bottom of the array (axis=0)
-        data_array = _np.append(data_array, timestep_row, axis=0)
-    
-    print(data_array)
-    print(data_array.shape)
-    
-    with open(savefilename,'wb') as f:
-        _np.savetxt(f, data_array, fmt='%i %f %f %f %f')
-
 
+    Each water depth raster is read once, in strips, and the rasters are worked
+    through on a pool of threads. Rows are written to savefilename as soon as
+    they (and all the timesteps before them) are done, so a long series can be
+    followed while it runs and what is done survives if it is stopped.
+
+    Args:
+        glob_wildcard (str): the wildcard of the water depth rasters, e.g. "WaterDepths*.asc"
+        floodplain_mask (array or str): the floodplain raster (floodplain is 1), or its filename
+        stream_mask (array or str): the stream order raster, or its filename
+        threshold (float): not used, kept for old scripts
+        savefilename (str): the text file the timeseries is written to
+        area_threshold (float): depths above this count as inundated
+        channel_stream_order (int): the stream order of the main channel
+        cellsize (float): the cell size in metres. Defaults to that of the first water raster.
+        n_workers (int): the number of rasters read at once. Defaults to the number of CPUs.
+        block_rows (int): the number of rows read at a time
+
+    Returns:
+        numpy array with a row for each timestep: timestep and the four metrics
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    water_raster_files = sorted(glob.glob(glob_wildcard), key=natural_key)
+    n_files = len(water_raster_files)
+    print("Number of water depth rasters: ", n_files)
+    data_array = _np.empty((n_files, 5), dtype=_np.float32)
+    if n_files == 0:
+        return data_array
+
+    if cellsize is None:
+        cellsize = lsdgdal.GetUTMMaxMin(water_raster_files[0])[0]
+
+    # The masks are only compared once
+    floodplain_mask = read_mask_raster(floodplain_mask) == 1
+    channel_mask = read_mask_raster(stream_mask) == channel_stream_order
+
+    def get_metrics(water_raster_file):
+        return inundation_metrics(water_raster_file, cellsize, floodplain_mask,
+                                  channel_mask, area_threshold, block_rows)
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = max(1, min(n_workers, n_files))
+
+    with open(savefilename, 'w') as f, ThreadPoolExecutor(max_workers=n_workers) as pool:
+        # map gives the results back in timestep order
+        for i, metrics in enumerate(pool.map(get_metrics, water_raster_files)):
+            cur_timestep = timestep_string_from_filename(water_raster_files[i])
+            data_array[i] = (int(cur_timestep),) + metrics
+            f.write("%i %f %f %f %f\n" % tuple(data_array[i]))
+            f.flush()
 
-    
-"""Get your rasters into arrays"""    
-water_raster_wildcard = "/run/media/dav/SHETLAND/ModelRuns/Ryedale_storms/Gridded/Hydro/WaterDepths*.asc"
-water_raster_file = "/mnt/SCRATCH/Analyses/HydrogeomorphPaper/peak_flood_maps/ryedale/WaterDepths2880_GRID_TLIM.asc"
-#raster_file = "/run/media/dav/SHETLAND/Analyses/HydrogeomorphPaper/peak_flood_maps/boscastle/peak_flood/WaterDepths2400_GRID_HYDRO.asc"
-floodplain_file = "/mnt/SCRATCH/Analyses/ChannelMaskAnalysis/floodplain_ryedale/RyedaleElevations_FP.bil"
-stream_raster_file = "/mnt/SCRATCH/Analyses/ChannelMaskAnalysis/floodplain_ryedale/RyedaleElevations_SO.bil"
-
-water_raster = lsdgdal.ReadRasterArrayBlocks(water_raster_file)
-
-floodplain_mask = lsdgdal.ReadRasterArrayBlocks(floodplain_file)
-stream_mask = lsdgdal.ReadRasterArrayBlocks(stream_raster_file)
-#print(stream_mask)
-
-DX = lsdgdal.GetUTMMaxMin(water_raster_file)[0]   # I never realised you could do this!
-print(DX)
-
-"""Calculate the depths and areas"""
-#calculate_mean_waterdepth(water_raster)
-#calcualte_max_waterdepth(water_raster)
-#calculate_waterinundation_area(water_raster, DX, 0.02)
-#floodplain_mean_depth(water_raster, floodplain_mask)
-#main_channel_mean_depth(water_raster, floodplain_mask, stream_mask)
-
-"""Make the timeseries file"""
-simulation_inundation_timeseries(water_raster_wildcard, floodplain_mask,
-                                 stream_mask,
-                                 savefilename="ryedale_inundation_GRIDDED_HYDRO.txt")
+    print(data_array.shape)
+    return data_array
+
+
+if __name__ == "__main__":
+    """Get your rasters into arrays"""
+    water_raster_wildcard = "/run/media/dav/SHETLAND/ModelRuns/Ryedale_storms/Gridded/Hydro/WaterDepths*.asc"
+    water_raster_file = "/mnt/SCRATCH/Analyses/HydrogeomorphPaper/peak_flood_maps/ryedale/WaterDepths2880_GRID_TLIM.asc"
+    #raster_file = "/run/media/dav/SHETLAND/Analyses/HydrogeomorphPaper/peak_flood_maps/boscastle/peak_flood/WaterDepths2400_GRID_HYDRO.asc"
+    floodplain_file = "/mnt/SCRATCH/Analyses/ChannelMaskAnalysis/floodplain_ryedale/RyedaleElevations_FP.bil"
+    stream_raster_file = "/mnt/SCRATCH/Analyses/ChannelMaskAnalysis/floodplain_ryedale/RyedaleElevations_SO.bil"
+
+    DX = lsdgdal.GetUTMMaxMin(water_raster_file)[0]   # I never realised you could do this!
+    print(DX)
+
+    """Calculate the depths and areas"""
+    #water_raster = lsdgdal.ReadRasterArrayBlocks(water_raster_file)
+    #calculate_mean_waterdepth(water_raster)
+    #calcualte_max_waterdepth(water_raster)
+    #calculate_waterinundation_area(water_raster, DX, 0.02)
+    #floodplain_mean_depth(water_raster, floodplain_mask)
+    #main_channel_mean_depth(water_raster, floodplain_mask, stream_mask)
+
+    """Make the timeseries file"""
+    simulation_inundation_timeseries(water_raster_wildcard, floodplain_file,
+                                     stream_raster_file, cellsize=DX,
+                                     savefilename="ryedale_inundation_GRIDDED_HYDRO.txt")
@@ -11,7 +11,7 @@ from matplotlib import pyplot as plt
 from pandas import (DataFrame, Series)
 from pandas.core.dtypes.common import is_number
 from pandas.core.groupby import DataFrameGroupBy
-from scipy.stats import gaussian_kde
+from LSDPlottingTools.statsutilities import binned_gaussian_kde
 from warnings import warn
 from matplotlib import ticker
 
@@ -263,8 +263,9 @@ def plot_density(ax, x_range, v, kind="kde", bw_method=None,
         return
 
     if kind == "kde":
-        gkde = gaussian_kde(v, bw_method=bw_method)
-        y = gkde.evaluate(x_range)
+        # x_range is normally evenly spaced, so bin the values rather than
+        # evaluating every kernel at every x
+        y = binned_gaussian_kde(v, x_range, bw_method=bw_method)
     elif kind == "counts":
         y, bin_edges = np.histogram(v, bins=bins, range=(min(x_range), max(x_range)))
         # np.histogram returns the edges of the bins.
@@ -3,31 +3,29 @@
 """
 Created on Sat Feb 11 11:40:41 2017
 
+The LSDRaster style hillshade now lives in LSDMap_BasicPlotting.HillshadeArray.
+This is kept so old scripts still work.
+
 @author: dav
 """
 
-import LSDPlottingTools.LSDMap_GDALIO as lsdio
-
-import numpy as np
-import scipy as sp
-
+import LSDPlottingTools.LSDMap_BasicPlotting as LSDMap_BP
 
-Zenith = 45
-Azimuth = 315
-ZFactor = 1
 
-Directory = "/mnt/SCRATCH/Analyses/HydrogeomorphPaper/erode_diff/test_raster_diff_func/"
-BackgroundRasterName = "BoscastleElevations0.asc"
+def Hillshade_Smooth(RasterData, altitude, azimuth, z_factor, DataResolution = 1, NoDataValue = -9999):
+    """Plots a Hillshade a la LSDRaster
 
-File = Directory + BackgroundRasterName
+    Args:
+        RasterData (numpy.array): The elevation array
+        altitude (float): Angle altitude of sun
+        azimuth (float): Azimuth of sunlight
+        z_factor (float): Vertical exaggeration
+        DataResolution (float): The cell size
+        NoDataValue (float): The nodata value of the raster
 
-RasterData = lsdio.ReadRasterArrayBlocks(File)
+    Returns:
+        The hillshade array
 
-def Hillshade_Smooth(RasterData, altitude, azimuth, z_factor):
-    """Plots a Hillshade a la LSDRaster"""
-    
-    zenith_rad = sp.deg2rad(altitude)
-    azimuth_rad = sp.deg2rad(azimuth)
-    
-    
-    
\ No newline at end of file
+    Author: DAV
+    """
+    return LSDMap_BP.HillshadeArray(RasterData, DataResolution, azimuth, altitude, NoDataValue, z_factor)
@@ -130,6 +130,136 @@ def get_outlier_from_KernelDensityStuff(df, column = "", binning = "", threshold
 
 
 
+def _regular_grid_spacing(axis):
+    """
+    Returns the spacing of an evenly spaced axis, or None if the axis has fewer
+    than two points or is not evenly spaced.
+
+    Author: FJC
+    """
+    axis = np.asarray(axis, dtype=np.float64)
+    if axis.ndim != 1 or len(axis) < 2:
+        return None
+    steps = np.diff(axis)
+    delta = (axis[-1]-axis[0])/(len(axis)-1)
+    if delta <= 0 or not np.allclose(steps, delta, rtol=1e-6, atol=0):
+        return None
+    return delta
+
+
+def binned_gaussian_kde(values, grid, bw_method=None, weights=None, truncate=4.0, max_cells=10000000):
+    """
+    Evaluates a gaussian kernel density estimate of the values on a regular grid.
+    This gives the same density as scipy.stats.gaussian_kde evaluated at every grid
+    node, but rather than summing the kernels of every point at every node the
+    points are linearly binned onto the grid and the bins are convolved with the
+    kernel using an FFT. This takes O(N + M log M) rather than O(N M) for N points
+    and M grid nodes.
+
+    If the kernel is narrow compared to the grid spacing the points are binned onto
+    a finer grid that contains the requested nodes, so that the result stays close
+    to the exact one. Kernels are truncated at truncate standard deviations.
+
+    Args:
+        values (array): the data, either a 1D array or a (dimensions, points) array as used by gaussian_kde
+        grid (list): the evenly spaced coordinates of the grid along each dimension. For 1D data this can also be a single array.
+        bw_method: the bandwidth method, as for gaussian_kde: "scott", "silverman", a scalar or a callable
+        weights (array): optional weights of the points
+        truncate (float): the kernel is cut off at this many standard deviations
+        max_cells (int): if the binning grid would be bigger than this (the kernel is huge compared with the grid)
+        the density is evaluated directly instead
+
+    Returns:
+        An array of the density with one axis per dimension, i.e. density[i,j] is the density at (grid[0][i], grid[1][j])
+
+    Author: FJC
+    """
+    from scipy.stats import gaussian_kde
+    from scipy.signal import fftconvolve
+    import itertools
+
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    n_dims = values.shape[0]
+    if n_dims == 1 and np.ndim(grid[0]) == 0:
+        grid = [grid]
+    grid = [np.asarray(axis, dtype=np.float64) for axis in grid]
+    if len(grid) != n_dims:
+        raise Exception("The grid has "+str(len(grid))+" axes but the data has "+str(n_dims)+" dimensions")
+    shape = tuple(len(axis) for axis in grid)
+
+    # this gets the bandwidth in exactly the same way as the direct estimate
+    KDE = gaussian_kde(values, bw_method=bw_method, weights=weights)
+
+    def evaluate_directly():
+        nodes = np.meshgrid(*grid, indexing='ij')
+        positions = np.vstack([node.ravel() for node in nodes])
+        return KDE(positions).reshape(shape)
+
+    deltas = [_regular_grid_spacing(axis) for axis in grid]
+    if any(delta is None for delta in deltas):
+        print("The grid is not evenly spaced so I'll evaluate the density at every node.")
+        return evaluate_directly()
+
+    # refine the grid until there are a few nodes per kernel standard deviation
+    sigmas = np.sqrt(np.diag(KDE.covariance))
+    refine = [max(1, int(np.ceil(4.0*delta/sigma))) if sigma > 0 else 1 for delta, sigma in zip(deltas, sigmas)]
+    fine_deltas = [delta/r for delta, r in zip(deltas, refine)]
+    # the number of cells the kernel reaches either side of a node, which is also
+    # the padding needed so points just off the grid still contribute
+    half_widths = [int(np.ceil(truncate*sigma/delta)) for sigma, delta in zip(sigmas, fine_deltas)]
+    padded_shape = tuple((n-1)*r + 1 + 2*L for n, r, L in zip(shape, refine, half_widths))
+    if np.prod(padded_shape, dtype=np.float64) > max_cells:
+        return evaluate_directly()
+
+    # linearly bin the weights onto the padded grid
+    if weights is None:
+        point_weights = np.full(values.shape[1], 1.0/values.shape[1])
+    else:
+        point_weights = np.asarray(weights, dtype=np.float64)
+        point_weights = point_weights/point_weights.sum()
+    lower_index = []
+    fractions = []
+    inside = np.ones(values.shape[1], dtype=bool)
+    for d in range(n_dims):
+        position = (values[d] - grid[d][0])/fine_deltas[d] + half_widths[d]
+        index = np.clip(np.floor(position), 0, padded_shape[d]-2).astype(np.int64)
+        fraction = position - index
+        inside &= (fraction >= 0) & (fraction <= 1)
+        lower_index.append(index)
+        fractions.append(fraction)
+    lower_index = [index[inside] for index in lower_index]
+    fractions = [fraction[inside] for fraction in fractions]
+    point_weights = point_weights[inside]
+
+    n_cells = int(np.prod(padded_shape))
+    binned = np.zeros(n_cells)
+    for corner in itertools.product((0, 1), repeat=n_dims):
+        corner_weights = point_weights.copy()
+        corner_index = []
+        for d, offset in enumerate(corner):
+            corner_weights *= fractions[d] if offset else (1 - fractions[d])
+            corner_index.append(lower_index[d] + offset)
+        flat_index = np.ravel_multi_index(tuple(corner_index), padded_shape)
+        binned += np.bincount(flat_index, weights=corner_weights, minlength=n_cells)
+    binned = binned.reshape(padded_shape)
+
+    # the kernel on the offsets of the fine grid
+    offsets = np.meshgrid(*[np.arange(-L, L+1)*delta for L, delta in zip(half_widths, fine_deltas)], indexing='ij')
+    offsets = np.stack(offsets, axis=-1)
+    inv_cov = np.linalg.inv(KDE.covariance)
+    mahalanobis = np.einsum('...i,ij,...j->...', offsets, inv_cov, offsets)
+    norm = np.sqrt(np.linalg.det(2*np.pi*KDE.covariance))
+    kernel = np.exp(-0.5*mahalanobis)/norm
+
+    density = fftconvolve(binned, kernel, mode='same')
+
+    # pick out the requested nodes
+    index = tuple(slice(L, L + (n-1)*r + 1, r) for n, r, L in zip(shape, refine, half_widths))
+    density = density[index]
+    # the FFT leaves tiny negative values where there are no points
+    return np.clip(density, 0, None)
+
+
 def add_outlier_column_to_PD(df, column = "none", threshold = "none"):
 
     """
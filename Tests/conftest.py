@@ -0,0 +1,101 @@
+"""
+Shared setup for the pytest tests of LSDMappingTools.
+
+We don't install mapping tools directly, so the directory above this one is
+added to the path. Most of LSDPlottingTools needs GDAL and the package
+__init__ imports all of it, so if GDAL is missing the package is set up
+without running its __init__. The modules that don't need GDAL can then still
+be tested, and the tests that do need it ask for one of the fixtures below
+and are skipped.
+
+Author: SMM
+
+Date 18/10/2026
+"""
+
+import importlib.util
+import os
+import shutil
+import sys
+import types
+
+import numpy as np
+import pytest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+LSDMT_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, LSDMT_DIR)
+
+HAVE_GDAL = importlib.util.find_spec("osgeo") is not None
+
+if not HAVE_GDAL and "LSDPlottingTools" not in sys.modules:
+    _package = types.ModuleType("LSDPlottingTools")
+    _package.__path__ = [os.path.join(LSDMT_DIR, "LSDPlottingTools")]
+    sys.modules["LSDPlottingTools"] = _package
+
+
+#==============================================================================
+# The modules that need GDAL
+#==============================================================================
+@pytest.fixture
+def LSDMap_IO():
+    pytest.importorskip("osgeo")
+    from LSDPlottingTools import LSDMap_GDALIO
+    return LSDMap_GDALIO
+
+
+@pytest.fixture
+def LSDMap_RA(LSDMap_IO):
+    from LSDPlottingTools import LSDMap_RasterAlgebra
+    return LSDMap_RasterAlgebra
+
+
+@pytest.fixture
+def LSDMap_BM(LSDMap_IO):
+    from LSDPlottingTools import LSDMap_BasicManipulation
+    return LSDMap_BasicManipulation
+
+
+@pytest.fixture
+def LSDMap_BP(LSDMap_IO):
+    from LSDPlottingTools import LSDMap_BasicPlotting
+    return LSDMap_BasicPlotting
+
+
+@pytest.fixture
+def LSDMap_VT(LSDMap_IO):
+    from LSDPlottingTools import LSDMap_VectorTools
+    return LSDMap_VectorTools
+
+
+#==============================================================================
+# Test data
+#==============================================================================
+@pytest.fixture
+def read_eager(LSDMap_IO):
+    """Reads a whole raster as float64 with NaN for nodata, the slow way"""
+    def read(raster_file):
+        NDV = LSDMap_IO.GetGeoInfo(raster_file)[0]
+        array = np.array(LSDMap_IO.ReadRasterArrayBlocks(raster_file), dtype=np.float64)
+        if NDV is not None:
+            array[array == NDV] = np.nan
+        return array
+    return read
+
+
+@pytest.fixture
+def dem_copy(tmp_path):
+    """A copy of the test DEM that can be changed"""
+    for ext in (".bil", ".hdr"):
+        shutil.copy(os.path.join(TEST_DIR, "WA"+ext), str(tmp_path / ("WA"+ext)))
+    return str(tmp_path / "WA.bil")
+
+
+@pytest.fixture
+def hillshade_cache(LSDMap_BP, tmp_path):
+    """Points the hillshade cache at an empty directory for one test"""
+    directory = LSDMap_BP.hillshade_cache.directory
+    LSDMap_BP.SetHillshadeCache(str(tmp_path / "hillshades"))
+    LSDMap_BP.ClearHillshadeCache()
+    yield LSDMap_BP.hillshade_cache
+    LSDMap_BP.SetHillshadeCache(directory)
@@ -0,0 +1,208 @@
+"""
+Checks the raster readers in LSDMap_GDALIO (memory mapping, strips, overviews,
+statistics and the raster cache) against reading the whole raster through GDAL.
+
+Run with: pytest Tests
+
+Author: SMM
+
+Date 18/10/2026
+"""
+
+import os
+import shutil
+import warnings
+
+import numpy as np
+import pytest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+DEM = os.path.join(TEST_DIR, "WA.bil")
+
+
+def write_esri_flt(tmp_path):
+    """A copy of the DEM as a .flt with the ESRI header LSDTopoTools writes"""
+    flt_file = str(tmp_path / "WA.flt")
+    shutil.copy(DEM, flt_file)
+    with open(str(tmp_path / "WA.hdr"), "w") as hdr_file:
+        hdr_file.write("ncols 483\nnrows 643\nxllcorner 527347\nyllcorner 6187779\n"
+                       "cellsize 5\nNODATA_value -9999\nbyteorder LSBFIRST\n")
+    return flt_file
+
+
+#==============================================================================
+# Memory mapped ENVI rasters
+#==============================================================================
+def test_is_envi_raster(LSDMap_IO, tmp_path):
+    assert LSDMap_IO.IsENVIRaster(DEM)
+    assert not LSDMap_IO.IsENVIRaster(os.path.join(TEST_DIR, "WA_chi_data_map.csv"))
+    assert not LSDMap_IO.IsENVIRaster(write_esri_flt(tmp_path))
+
+    # an ENVI header without the size isn't enough
+    shutil.copy(DEM, str(tmp_path / "broken.bil"))
+    with open(str(tmp_path / "broken.hdr"), "w") as hdr_file:
+        hdr_file.write("ENVI\ndata type = 4\n")
+    assert not LSDMap_IO.IsENVIRaster(str(tmp_path / "broken.bil"))
+
+
+def test_esri_flt_goes_through_gdal(LSDMap_IO, tmp_path):
+    flt_file = write_esri_flt(tmp_path)
+    strips = np.vstack([strip for i, strip in LSDMap_IO.ReadRasterStrips(flt_file, 200)])
+    expected = np.array(LSDMap_IO.ReadRasterArrayBlocks(DEM), dtype=np.float64)
+    expected[expected == -9999] = np.nan
+    np.testing.assert_array_equal(strips, expected)
+
+
+def test_memmap_matches_gdal(LSDMap_IO, read_eager):
+    data = LSDMap_IO.ReadRasterArrayMemmap(DEM)
+    np.testing.assert_array_equal(np.asarray(data), LSDMap_IO.ReadRasterArrayBlocks(DEM))
+
+    mask = LSDMap_IO.LazyNoDataMask(data, LSDMap_IO.ReadENVIHeader(DEM)["NoDataValue"])
+    np.testing.assert_array_equal(mask[100:200], np.isnan(read_eager(DEM))[100:200])
+
+    values = LSDMap_IO.MemmapToNaNArray(data, mask, block_rows = 100)
+    assert values.dtype == np.float64
+    np.testing.assert_array_equal(values, read_eager(DEM))
+
+
+#==============================================================================
+# The raster cache
+#==============================================================================
+def test_cache_reloads_when_the_header_changes(LSDMap_IO, dem_copy):
+    cache = LSDMap_IO.RasterCache()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return LSDMap_IO.ReadENVIHeader(dem_copy)["NoDataValue"]
+
+    assert cache.get(dem_copy, "ndv", loader) == -9999
+    assert cache.get(dem_copy, "ndv", loader) == -9999
+    assert len(loads) == 1
+
+    hdr_file = os.path.splitext(dem_copy)[0]+".hdr"
+    with open(hdr_file) as f:
+        header = f.read()
+    with open(hdr_file, "w") as f:
+        f.write(header.replace("data ignore value = -9999", "data ignore value = -99999"))
+    assert cache.get(dem_copy, "ndv", loader) == -99999
+    assert len(loads) == 2
+    assert cache.stats()["entries"] == 1
+
+
+def test_cache_evicts_the_oldest_entries(LSDMap_IO):
+    cache = LSDMap_IO.RasterCache(max_bytes = 10000, max_entries = 3)
+    for kind in ["a", "b", "c", "d"]:
+        cache.get(DEM, kind, lambda: np.zeros(100))
+    assert cache.stats()["entries"] == 3
+    loads = []
+    cache.get(DEM, "a", lambda: loads.append(1) or np.zeros(100))
+    assert len(loads) == 1
+
+    cache.get(DEM, "big", lambda: np.zeros(5000))
+    assert cache.stats()["bytes"] <= 10000
+
+
+def test_cache_counts_memory_maps_as_handles(LSDMap_IO):
+    cache = LSDMap_IO.RasterCache(max_handles = 2)
+    for kind in ["a", "b", "c"]:
+        cache.get(DEM, kind, lambda: LSDMap_IO.ReadRasterArrayMemmap(DEM)[10:20])
+    stats = cache.stats()
+    assert stats["handles"] == 2
+    assert stats["entries"] == 2
+
+
+#==============================================================================
+# Overviews
+#==============================================================================
+def block_mean(array, factor):
+    """The mean of the valid pixels in each factor x factor block"""
+    nrows = array.shape[0]//factor
+    ncols = array.shape[1]//factor
+    blocks = array[:nrows*factor, :ncols*factor].reshape(nrows, factor, ncols, factor)
+    with warnings.catch_warnings():
+        # blocks that are all nodata
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmean(blocks, axis=(1, 3))
+
+
+def test_overviews_are_block_means(LSDMap_IO, read_eager, dem_copy):
+    LSDMap_IO.ClearRasterCache()
+    a = read_eager(dem_copy)
+    overview, extent = LSDMap_IO.GetOverviewArray(dem_copy, 2)
+    np.testing.assert_allclose(overview, block_mean(a, 2), rtol=1e-6, equal_nan=True)
+
+    # the next level is made from this one
+    overview, extent = LSDMap_IO.GetOverviewArray(dem_copy, 4)
+    np.testing.assert_allclose(overview, block_mean(block_mean(a, 2), 2), rtol=1e-6, equal_nan=True)
+    assert os.path.isfile(dem_copy+".ovr4_mean_b1.npz")
+
+
+@pytest.mark.parametrize("factor", [0, 3, 6, 2.5])
+def test_overview_factor_must_be_a_power_of_two(LSDMap_IO, factor):
+    with pytest.raises(Exception, match="power of 2"):
+        LSDMap_IO.GetOverviewArray(DEM, factor)
+
+
+def test_overviews_on_disk_follow_the_header(LSDMap_IO, read_eager, dem_copy):
+    LSDMap_IO.ClearRasterCache()
+    LSDMap_IO.GetOverviewArray(dem_copy, 2)
+
+    # a new nodata value makes a new overview
+    a = read_eager(dem_copy)
+    new_nodata = float(np.nanmin(a))
+    hdr_file = os.path.splitext(dem_copy)[0]+".hdr"
+    with open(hdr_file) as f:
+        header = f.read()
+    with open(hdr_file, "w") as f:
+        f.write(header.replace("data ignore value = -9999", "data ignore value = "+repr(new_nodata)))
+    LSDMap_IO.ClearRasterCache()
+    overview, extent = LSDMap_IO.GetOverviewArray(dem_copy, 2)
+    a[a == new_nodata] = np.nan
+    np.testing.assert_allclose(overview, block_mean(a, 2), rtol=1e-6, equal_nan=True)
+
+
+def test_overviews_on_disk_are_ignored_without_the_disk_cache(LSDMap_IO, read_eager, dem_copy):
+    LSDMap_IO.ClearRasterCache()
+    LSDMap_IO.GetOverviewArray(dem_copy, 2)
+    ovr_name = dem_copy+".ovr2_mean_b1.npz"
+    with np.load(ovr_name) as stored:
+        source = stored["source"]
+        bogus = np.zeros_like(stored["overview"])
+    with open(ovr_name, "wb") as ovr_file:
+        np.savez(ovr_file, overview=bogus, source=source)
+
+    LSDMap_IO.ClearRasterCache()
+    overview, extent = LSDMap_IO.GetOverviewArray(dem_copy, 2, cache_on_disk = False)
+    np.testing.assert_allclose(overview, block_mean(read_eager(dem_copy), 2), rtol=1e-6, equal_nan=True)
+
+
+#==============================================================================
+# Strips and statistics
+#==============================================================================
+def test_strips_cover_the_raster(LSDMap_IO, read_eager):
+    strips = list(LSDMap_IO.ReadRasterStrips(DEM, 100))
+    assert [row for row, strip in strips] == list(range(0, 643, 100))
+    assert all(strip.dtype == np.float64 for row, strip in strips)
+    np.testing.assert_array_equal(np.vstack([strip for row, strip in strips]), read_eager(DEM))
+
+    strips = list(LSDMap_IO.ReadRasterStrips(DEM, 100, dtype=np.float32))
+    assert all(strip.dtype == np.float32 for row, strip in strips)
+
+
+def test_streaming_statistics(LSDMap_IO, read_eager):
+    a = read_eager(DEM)
+    valid = a[np.isfinite(a)]
+    # the histogram is only exact if you give its range
+    stats = LSDMap_IO.GetRasterStatistics(DEM, percentiles=[10, 50, 90], histogram_bins=20,
+                                          histogram_range=(0, 1000), use_stored=False, block_rows=70)
+    assert stats["count"] == valid.size
+    assert stats["min"] == valid.min()
+    assert stats["max"] == valid.max()
+    assert stats["mean"] == pytest.approx(valid.mean())
+    assert stats["std"] == pytest.approx(valid.std())
+    for p in (10, 50, 90):
+        assert stats["percentiles"][p] == pytest.approx(np.percentile(valid, p), rel=0.01)
+    counts, edges = stats["histogram"]
+    assert counts.sum() == valid.size
+    np.testing.assert_array_equal(counts, np.histogram(valid, bins=edges)[0])
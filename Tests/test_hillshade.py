@@ -0,0 +1,64 @@
+"""
+Checks the hillshade cache in LSDMap_BasicPlotting: which arrays are cached, and
+that a cached hillshade is never returned for a different DEM.
+
+Run with: pytest Tests
+
+Author: SMM
+
+Date 18/10/2026
+"""
+
+import os
+
+import numpy as np
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+DEM = os.path.join(TEST_DIR, "WA.bil")
+
+
+def hillshade_of(LSDMap_BP, array):
+    """The hillshade made without the cache"""
+    return LSDMap_BP.HillshadeArray(array, 1, NoDataValue = -9999)
+
+
+def test_memmap_windows_have_their_own_hillshades(LSDMap_IO, LSDMap_BP, hillshade_cache):
+    m = LSDMap_IO.ReadRasterArrayMemmap(DEM, mode="r")
+    first = m[0:100, 0:100]
+    second = m[300:400, 300:400]
+    assert LSDMap_BP.DEMDigest(first) != LSDMap_BP.DEMDigest(second)
+    assert LSDMap_BP.DEMDigest(first) == LSDMap_BP.DEMDigest(m[0:100, 0:100])
+
+    hs_first = LSDMap_BP.Hillshade(first)
+    hs_second = LSDMap_BP.Hillshade(second)
+    np.testing.assert_array_equal(hs_first, hillshade_of(LSDMap_BP, first))
+    np.testing.assert_array_equal(hs_second, hillshade_of(LSDMap_BP, second))
+
+    # read only memmaps are cached without being asked
+    np.testing.assert_array_equal(LSDMap_BP.Hillshade(m[300:400, 300:400]), hs_second)
+    stats = LSDMap_BP.GetHillshadeCacheStats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 2)
+
+
+def test_copy_on_write_memmaps_are_hashed(LSDMap_IO, LSDMap_BP, hillshade_cache):
+    m = LSDMap_IO.ReadRasterArrayMemmap(DEM, mode="c")
+    assert LSDMap_BP.MemmapDigest(m) is None
+
+    before = LSDMap_BP.Hillshade(m, use_cache = True)
+    m[100:200, 100:200] += 50
+    after = LSDMap_BP.Hillshade(m, use_cache = True)
+    np.testing.assert_array_equal(after, hillshade_of(LSDMap_BP, m))
+    assert not np.array_equal(before, after, equal_nan=True)
+    assert LSDMap_BP.GetHillshadeCacheStats()["hits"] == 0
+
+
+def test_arrays_are_not_cached_unless_asked(LSDMap_IO, LSDMap_BP, hillshade_cache):
+    array = np.array(LSDMap_IO.ReadRasterArrayMemmap(DEM, mode="r"))
+    LSDMap_BP.Hillshade(array)
+    stats = LSDMap_BP.GetHillshadeCacheStats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (0, 0, 0)
+
+    LSDMap_BP.Hillshade(array, use_cache = True)
+    LSDMap_BP.Hillshade(array, use_cache = True)
+    stats = LSDMap_BP.GetHillshadeCacheStats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
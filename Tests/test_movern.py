@@ -0,0 +1,79 @@
+"""
+Checks the MLE of basins after tributaries are removed, in LSDMap_MOverNPlotting,
+against the original loop that sets the MLE of removed tributaries to 1 and
+multiplies.
+
+Run with: pytest Tests
+
+Author: SMM
+
+Date 18/10/2026
+"""
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def LSDMap_MOverN(LSDMap_IO):
+    # joyplot, which this imports, uses private pandas functions that newer pandas doesn't have
+    try:
+        from LSDPlottingTools import LSDMap_MOverNPlotting
+    except ImportError as e:
+        pytest.skip("LSDMap_MOverNPlotting can't be imported: "+str(e))
+    return LSDMap_MOverNPlotting
+
+
+def mle_after_removals(MLE_array, remove_list_index):
+    """The total MLE after each removal step, done the old way"""
+    MLEs = np.empty((MLE_array.shape[0], len(remove_list_index)+1))
+    for i, MLE_row in enumerate(MLE_array):
+        this_MLE = np.array(MLE_row, dtype=np.float64)
+        MLEs[i, 0] = np.prod(this_MLE)
+        for step, stuff_to_remove in enumerate(remove_list_index):
+            this_MLE[stuff_to_remove] = 1
+            MLEs[i, step+1] = np.prod(this_MLE)
+    return MLEs
+
+
+@pytest.fixture
+def MLE_array():
+    rng = np.random.RandomState(0)
+    MLE_array = rng.uniform(0.2, 1.0, size=(7, 6))
+    MLE_array[2, 4] = 0
+    return MLE_array
+
+
+# A tributary removed twice, and an empty step
+REMOVE_LIST_INDEX = [[3], [1, 3], [], [0, 4]]
+
+
+def test_log_MLE_after_removals(LSDMap_MOverN, MLE_array):
+    log_MLEs = LSDMap_MOverN.LogMLEAfterRemovals(MLE_array, REMOVE_LIST_INDEX)
+    assert log_MLEs.shape == (7, 5)
+    np.testing.assert_allclose(np.exp(log_MLEs), mle_after_removals(MLE_array, REMOVE_LIST_INDEX),
+                               rtol=1e-12)
+
+    # a single m/n value
+    log_MLEs = LSDMap_MOverN.LogMLEAfterRemovals(MLE_array[0], REMOVE_LIST_INDEX)
+    np.testing.assert_allclose(np.exp(log_MLEs), mle_after_removals(MLE_array[:1], REMOVE_LIST_INDEX),
+                               rtol=1e-12)
+
+
+def test_log_MLE_does_not_underflow(LSDMap_MOverN):
+    # The product of 2000 MLEs of 1e-3 is 0 in double precision
+    MLE_array = np.full((3, 2000), 1e-3)
+    MLE_array[1] = 2e-3
+    log_MLEs = LSDMap_MOverN.LogMLEAfterRemovals(MLE_array, [[0]])
+    assert np.all(np.isfinite(log_MLEs))
+    assert np.argmax(log_MLEs[:, 0]) == 1
+
+
+def test_movern_after_removing_outliers(LSDMap_MOverN, MLE_array):
+    movern_list = np.linspace(0.2, 0.8, 7)
+    movern_of_max_MLE, MLEs = LSDMap_MOverN.Calculate_movern_after_iteratively_removing_outliers(
+        movern_list, "", "nofile", 0, REMOVE_LIST_INDEX, MLE_array=MLE_array)
+
+    expected = mle_after_removals(MLE_array, REMOVE_LIST_INDEX)
+    np.testing.assert_allclose(MLEs, expected, rtol=1e-12)
+    np.testing.assert_array_equal(movern_of_max_MLE, np.around(movern_list[np.argmax(expected, 0)], 4))
@@ -0,0 +1,85 @@
+"""
+Checks the lazy raster algebra engine (LSDMap_RasterAlgebra) against numpy on
+the whole arrays: fused expressions, nodata, and the headers it writes.
+
+Run with: pytest Tests
+
+Author: SMM
+
+Date 18/10/2026
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+DEM = os.path.join(TEST_DIR, "WA.bil")
+HILLSHADE = os.path.join(TEST_DIR, "WA_hs.bil")
+
+
+def test_fused_expression_matches_eager(LSDMap_RA, read_eager, tmp_path):
+    dem = LSDMap_RA.LazyRaster(DEM)
+    hs = LSDMap_RA.LazyRaster(HILLSHADE)
+    expression = abs((dem - 2*hs)/3.0) + dem**0.5
+    out_file = str(tmp_path / "fused.bil")
+    expression.write(out_file, block_rows = 100)
+
+    a = read_eager(DEM)
+    b = read_eager(HILLSHADE)
+    with np.errstate(invalid="ignore"):
+        expected = np.abs((a - 2*b)/3.0) + a**0.5
+    result = read_eager(out_file)
+
+    np.testing.assert_array_equal(np.isnan(result), np.isnan(expected))
+    np.testing.assert_allclose(result, expected.astype(np.float32), rtol=1e-6, equal_nan=True)
+    np.testing.assert_allclose(expression.to_array(block_rows = 64), expected, rtol=1e-6, equal_nan=True)
+
+
+def test_nodata_propagates_through_comparisons_and_where(LSDMap_RA, read_eager):
+    a = read_eager(DEM)
+    threshold = np.nanmedian(a)
+    dem = LSDMap_RA.LazyRaster(DEM)
+    high = dem.where(dem > threshold)
+    result = high.to_array(block_rows = 50)
+
+    expected = np.where(a > threshold, a, np.nan)
+    np.testing.assert_allclose(result, expected, equal_nan=True)
+    summary = high.summary(block_rows = 50)
+    assert summary["count"] == np.count_nonzero(np.isfinite(expected))
+    assert summary["mean"] == pytest.approx(np.nanmean(expected))
+
+    flags = (dem > threshold).to_array()
+    assert np.all(np.isnan(flags[np.isnan(a)]))
+
+
+def test_raster_mean_value_ignores_nodata(LSDMap_BM, read_eager):
+    assert LSDMap_BM.RasterMeanValue(TEST_DIR, "WA.bil") == pytest.approx(np.nanmean(read_eager(DEM)))
+
+
+def test_written_header_keeps_the_georeferencing(LSDMap_IO, LSDMap_RA, tmp_path):
+    out_file = str(tmp_path / "copy.bil")
+    (LSDMap_RA.LazyRaster(DEM)*1).write(out_file)
+
+    template = LSDMap_IO.ReadENVIHeaderFields(DEM)
+    written = LSDMap_IO.ReadENVIHeaderFields(out_file)
+    assert written["map info"] == template["map info"]
+    assert written["coordinate system string"] == template["coordinate system string"]
+    np.testing.assert_allclose(LSDMap_IO.GetGeoInfo(out_file)[3], LSDMap_IO.GetGeoInfo(DEM)[3])
+
+
+def test_header_from_a_geotiff_template(LSDMap_IO, LSDMap_RA, read_eager, tmp_path):
+    tif_file = str(tmp_path / "WA.tif")
+    LSDMap_RA.LazyRaster(DEM).write(tif_file, driver_name = "GTiff")
+    out_file = str(tmp_path / "from_tif.bil")
+    LSDMap_RA.LazyRaster(tif_file).write(out_file)
+
+    written = LSDMap_IO.ReadENVIHeaderFields(out_file)
+    map_info = [part.strip() for part in written["map info"].split(",")]
+    assert map_info[0] == "UTM"
+    assert map_info[7:10] == ["30", "North", "WGS-84"]
+    assert "coordinate system string" in written
+    assert LSDMap_IO.GetUTMEPSG(out_file) == LSDMap_IO.GetUTMEPSG(DEM)
+    np.testing.assert_allclose(LSDMap_IO.GetGeoInfo(out_file)[3], LSDMap_IO.GetGeoInfo(DEM)[3])
+    np.testing.assert_allclose(read_eager(out_file), read_eager(DEM), rtol=1e-6, equal_nan=True)
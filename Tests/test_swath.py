@@ -0,0 +1,58 @@
+"""
+Checks the streamed swath statistics in LSDMap_BasicManipulation against numpy
+on the whole raster.
+
+Run with: pytest Tests
+
+Author: SMM
+
+Date 18/10/2026
+"""
+
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+DEM = os.path.join(TEST_DIR, "WA.bil")
+
+
+def nan_statistics(a, axis, percentiles):
+    """The statistics numpy gives, with NaN where a bin has no data"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return {"count": np.sum(np.isfinite(a), axis=axis),
+                "mean": np.nanmean(a, axis=axis),
+                "std": np.nanstd(a, axis=axis),
+                "min": np.nanmin(a, axis=axis),
+                "max": np.nanmax(a, axis=axis),
+                "percentiles": {p: np.nanpercentile(a, p, axis=axis) for p in percentiles}}
+
+
+@pytest.mark.parametrize("axis", [0, 1])
+def test_swath_along_an_axis(LSDMap_BM, read_eager, axis):
+    percentiles = (0, 25, 50, 75, 100)
+    swath = LSDMap_BM.SwathStatistics(DEM, axis=axis, percentiles=percentiles, block_rows=90)
+    expected = nan_statistics(read_eager(DEM), axis, percentiles)
+
+    np.testing.assert_array_equal(swath["count"], expected["count"])
+    np.testing.assert_allclose(swath["mean"], expected["mean"], rtol=1e-9, equal_nan=True)
+    np.testing.assert_allclose(swath["std"], expected["std"], rtol=1e-6, atol=1e-6, equal_nan=True)
+    np.testing.assert_array_equal(swath["min"], expected["min"])
+    np.testing.assert_array_equal(swath["max"], expected["max"])
+    for p in percentiles:
+        np.testing.assert_allclose(swath["percentiles"][p], expected["percentiles"][p],
+                                   rtol=1e-12, equal_nan=True)
+
+
+def test_unrefined_percentiles_are_within_a_level(LSDMap_BM, read_eager):
+    value_range = (0, 1000)
+    n_levels = 256
+    swath = LSDMap_BM.SwathStatistics(DEM, axis=0, percentiles=(50,), n_levels=n_levels,
+                                      value_range=value_range, refine=False)
+    expected = nan_statistics(read_eager(DEM), 0, (50,))
+    level = (value_range[1]-value_range[0])/n_levels
+    np.testing.assert_allclose(swath["percentiles"][50], expected["percentiles"][50],
+                               atol=level, equal_nan=True)
@@ -0,0 +1,76 @@
+"""
+Checks the terrace plane fits in LSDMap_TerracePlotting against numpy least
+squares, and the binned KDE used for the terrace heat maps against scipy.
+None of this needs GDAL.
+
+Run with: pytest Tests
+
+Author: SMM
+
+Date 18/10/2026
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import gaussian_kde
+
+
+@pytest.fixture
+def LSDMap_TP():
+    from LSDPlottingTools import LSDMap_TerracePlotting
+    return LSDMap_TerracePlotting
+
+
+@pytest.fixture
+def SUT():
+    from LSDPlottingTools import statsutilities
+    return statsutilities
+
+
+# Z = C0*X + C1*Y + C2 for each terrace
+PLANES = {1: (0.01, -0.02, 100), 2: (-0.05, 0, 50), 3: (0, 0.03, 10)}
+
+
+def test_terrace_planes(LSDMap_TP):
+    rng = np.random.RandomState(0)
+    frames = []
+    for terraceID, (C0, C1, C2) in PLANES.items():
+        X = 500000+rng.uniform(0, 1000, 200)
+        Y = 6000000+rng.uniform(0, 1000, 200)
+        # centred so the intercept doesn't overwhelm the slopes
+        z = C0*(X-500000) + C1*(Y-6000000) + C2 + rng.normal(0, 0.1, 200)
+        frames.append(pd.DataFrame({"TerraceID": terraceID, "X": X, "Y": Y, "Elevation": z}))
+    terrace_df = pd.concat(frames, ignore_index=True)
+
+    dips = LSDMap_TP.get_terrace_dip_and_dipdir(terrace_df)
+    assert len(dips) == len(PLANES)
+    for row, terraceID in enumerate(PLANES):
+        this_terrace = terrace_df[terrace_df["TerraceID"] == terraceID]
+        A = np.column_stack((this_terrace["X"], this_terrace["Y"], np.ones(len(this_terrace))))
+        C = np.linalg.lstsq(A, this_terrace["Elevation"].values, rcond=None)[0]
+        assert dips["dip"].iloc[row] == pytest.approx(np.degrees(np.arctan(np.hypot(C[0], C[1]))), abs=1e-6)
+        assert dips["X"].iloc[row] == pytest.approx(this_terrace["X"].mean())
+        assert dips["Y"].iloc[row] == pytest.approx(this_terrace["Y"].mean())
+
+
+def test_binned_kde_1d(SUT):
+    rng = np.random.RandomState(0)
+    values = np.concatenate((rng.normal(0, 1, 3000), rng.normal(4, 0.5, 1000)))
+    grid = np.linspace(-4, 7, 301)
+    density = SUT.binned_gaussian_kde(values, grid)
+    exact = gaussian_kde(values)(grid)
+    assert density.shape == grid.shape
+    assert np.max(np.abs(density-exact)) < 0.01*exact.max()
+
+
+def test_binned_kde_2d(SUT):
+    rng = np.random.RandomState(1)
+    values = np.vstack((rng.normal(0, 1, 2000), rng.normal(10, 3, 2000)))
+    x_nodes = np.linspace(-4, 4, 81)
+    y_nodes = np.linspace(-2, 22, 61)
+    density = SUT.binned_gaussian_kde(values, [x_nodes, y_nodes])
+    X, Y = np.meshgrid(x_nodes, y_nodes, indexing="ij")
+    exact = gaussian_kde(values)(np.vstack((X.ravel(), Y.ravel()))).reshape(X.shape)
+    assert density.shape == (81, 61)
+    assert np.max(np.abs(density-exact)) < 0.01*exact.max()
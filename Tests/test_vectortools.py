@@ -0,0 +1,64 @@
+"""
+Checks the basin index in LSDMap_VectorTools and the copy of it saved next to
+the basin raster.
+
+Run with: pytest Tests
+
+Author: SMM
+
+Date 18/10/2026
+"""
+
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def basins_dir(tmp_path):
+    """A directory with a copy of the test basin raster"""
+    for ext in (".bil", ".hdr"):
+        shutil.copy(os.path.join(TEST_DIR, "WA_AllBasins"+ext), str(tmp_path / ("WA_AllBasins"+ext)))
+    return str(tmp_path)+os.sep
+
+
+def test_basin_index_is_read_back_from_disk(LSDMap_VT, basins_dir):
+    built = LSDMap_VT.BasinGeometryIndex(basins_dir, "WA_AllBasins.bil")
+    cache_fname = basins_dir+"WA_AllBasins.bil.lsdcache.basins.npz"
+    assert os.path.isfile(cache_fname)
+    assert LSDMap_VT.BasinGeometryIndexIsCached(basins_dir, "WA_AllBasins.bil")
+
+    # Plain arrays only, so it loads without pickles
+    with np.load(cache_fname, allow_pickle = False) as cache:
+        assert all(cache[name].dtype != object for name in cache.files)
+
+    loaded = LSDMap_VT.BasinGeometryIndex(basins_dir, "WA_AllBasins.bil")
+    assert len(loaded) > 0
+    assert loaded.keys == built.keys
+    for key in built.keys:
+        assert loaded.polygons[key].equals_exact(built.polygons[key], 0)
+        assert loaded.centroids[key].equals(built.centroids[key])
+        assert loaded.representative_points[key].equals(built.representative_points[key])
+        assert loaded.areas[key] == built.areas[key]
+
+
+def test_basin_index_follows_the_raster(LSDMap_VT, basins_dir):
+    LSDMap_VT.BasinGeometryIndex(basins_dir, "WA_AllBasins.bil")
+    hdr_fname = basins_dir+"WA_AllBasins.hdr"
+    with open(hdr_fname, "a") as f:
+        f.write("\n")
+    assert not LSDMap_VT.BasinGeometryIndexIsCached(basins_dir, "WA_AllBasins.bil")
+
+
+def test_broken_basin_cache_is_made_again(LSDMap_VT, basins_dir):
+    cache_fname = basins_dir+"WA_AllBasins.bil.lsdcache.basins.npz"
+    with open(cache_fname, "wb") as f:
+        f.write(b"not an npz")
+    assert not LSDMap_VT.BasinGeometryIndexIsCached(basins_dir, "WA_AllBasins.bil")
+    index = LSDMap_VT.BasinGeometryIndex(basins_dir, "WA_AllBasins.bil")
+    assert len(index) > 0
+    assert LSDMap_VT.BasinGeometryIndexIsCached(basins_dir, "WA_AllBasins.bil")